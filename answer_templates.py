@@ -0,0 +1,212 @@
+"""
+Answer Templates für XORA Chatbot.
+Beantwortet einfache Anzahl- und Listenfragen direkt aus dem Abfrageergebnis,
+anhand der "answer_template"-Einträge in query_patterns.json. Der zweite
+LLM-Aufruf wird nur noch benötigt, wenn die Frage Schlussfolgerungen erfordert.
+
+{count} stammt aus der Aggregatspalte "count_field" des Templates (z.B.
+total_leads_in_selected_period). Ohne sie zählt die Zeilenzahl, die durch das
+LIMIT der Abfrage begrenzt ist; wurde das Limit erreicht, antwortet das LLM.
+"""
+import json
+import logging
+import re
+import threading
+from typing import Dict, Any, Optional
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG,
+                   format='%(asctime)s %(levelname)s:%(name)s:%(message)s',
+                   datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+# Fragen mit diesen Begriffen brauchen eine Auswertung durch das LLM
+REASONING_PATTERNS = re.compile(
+    r'\b(warum|wieso|weshalb|vergleich\w*|analys\w*|trend\w*|entwicklung|'
+    r'erklär\w*|bewert\w*|empfehl\w*|besser|schlechter|am meisten|am wenigsten|'
+    r'durchschnitt\w*|prozent\w*|verhältnis|auffällig\w*|why|compare|explain)\b',
+    re.IGNORECASE
+)
+COUNT_PATTERNS = re.compile(r'\b(wie ?viele?|anzahl|how many|zahl der)\b', re.IGNORECASE)
+LIST_PATTERNS = re.compile(r'\b(welche[rsn]?|liste|auflisten|zeig\w*|nenn\w*|wer|list|show)\b', re.IGNORECASE)
+ISO_DATE = re.compile(r'^(\d{4})-(\d{2})-(\d{2})')
+
+DEFAULT_MAX_ROWS = 10
+
+# Antwort, wenn eine Abfrage wegen Zeitüberschreitung abgebrochen wurde
+TIMEOUT_ANSWER = ("Die Datenabfrage hat länger als {seconds} Sekunden gedauert und wurde abgebrochen. "
+                  "Bitte grenzen Sie den Zeitraum ein oder versuchen Sie es in ein paar Minuten noch einmal.")
+
+# Rückfrage, wenn der Kundenname nur phonetisch/per Trigramm gefunden wurde
+NAME_CLARIFICATION = "Einen Kunden \"{name}\" habe ich nicht gefunden. Meinten Sie {candidates}?"
+
+# Trefferquote der Templates
+_template_stats = {"hits": 0, "misses": 0, "by_pattern": {}}
+_stats_lock = threading.Lock()
+
+
+class _SafeContext(dict):
+    """Liefert für fehlende Platzhalter 'N/A' statt eines KeyError."""
+    def __missing__(self, key):
+        return "N/A"
+
+
+def classify_question(user_message: str) -> str:
+    """
+    Ordnet eine Frage grob ein.
+
+    Args:
+        user_message: Die Frage des Benutzers
+
+    Returns:
+        "reasoning", "count", "list" oder "other"
+    """
+    if REASONING_PATTERNS.search(user_message):
+        return "reasoning"
+    if COUNT_PATTERNS.search(user_message):
+        return "count"
+    if LIST_PATTERNS.search(user_message):
+        return "list"
+    return "other"
+
+
+def _format_value(value: Any) -> Any:
+    """Formatiert ISO-Datumswerte als DD.MM.YYYY, andere Werte bleiben unverändert."""
+    if isinstance(value, str):
+        match = ISO_DATE.match(value)
+        if match:
+            return f"{match.group(3)}.{match.group(2)}.{match.group(1)}"
+    if value is None:
+        return "N/A"
+    return value
+
+
+def _context_for_row(row: Dict[str, Any], count: int) -> _SafeContext:
+    context = _SafeContext({key: _format_value(value) for key, value in row.items()})
+    context["count"] = count
+    return context
+
+
+def _record(function_name: str, hit: bool) -> None:
+    with _stats_lock:
+        _template_stats["hits" if hit else "misses"] += 1
+        pattern_stats = _template_stats["by_pattern"].setdefault(function_name, {"hits": 0, "misses": 0})
+        pattern_stats["hits" if hit else "misses"] += 1
+        total = _template_stats["hits"] + _template_stats["misses"]
+        hit_rate = _template_stats["hits"] / total
+    logger.info(f"Answer-Template {function_name}: {'Treffer' if hit else 'LLM'} "
+                f"(Trefferquote gesamt {hit_rate:.0%} bei {total} Antworten)")
+
+
+def get_template_stats() -> Dict[str, Any]:
+    """
+    Liefert die Trefferquote der Answer-Templates.
+
+    Returns:
+        Dictionary mit hits, misses, hit_rate und Werten pro Abfragemuster
+    """
+    with _stats_lock:
+        stats = json.loads(json.dumps(_template_stats))
+    total = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / total, 3) if total else 0.0
+    return stats
+
+
+def _get_answer_template(function_name: str) -> Optional[Dict[str, Any]]:
+    try:
+        from bigquery_functions import load_query_patterns_cached
+        return load_query_patterns_cached().get(function_name, {}).get("answer_template")
+    except Exception as e:
+        logger.warning(f"Answer-Template für {function_name} nicht ladbar: {e}")
+        return None
+
+
+def _timeout_answer(tool_result: str) -> Optional[str]:
+    """Formuliert die Antwort auf einen abgebrochenen BigQuery-Job (status "timeout")."""
+    try:
+        data = json.loads(tool_result)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(data, dict) or data.get("status") != "timeout":
+        return None
+    return TIMEOUT_ANSWER.format(seconds=f"{data.get('timeout_seconds') or 0:g}")
+
+
+def _name_clarification(tool_result: str) -> Optional[str]:
+    """Rückfrage mit ähnlichen Kundennamen, wenn die Abfrage über den Namen nichts fand."""
+    try:
+        data = json.loads(tool_result)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(data, dict) or data.get("status") != "success" or data.get("data"):
+        return None
+    name_match = data.get("name_match") or {}
+    candidates = name_match.get("candidates")
+    if not candidates:
+        return None
+    if len(candidates) == 1:
+        liste = candidates[0]
+    else:
+        liste = ", ".join(candidates[:-1]) + " oder " + candidates[-1]
+    return NAME_CLARIFICATION.format(name=name_match.get("name", ""), candidates=liste)
+
+
+def render_template_answer(user_message: str, function_name: str, tool_result: str) -> Optional[str]:
+    """
+    Versucht, eine Frage direkt per Template aus dem Abfrageergebnis zu beantworten.
+
+    Args:
+        user_message: Die Frage des Benutzers
+        function_name: Name des ausgeführten Abfragemusters
+        tool_result: JSON-String aus handle_function_call
+
+    Returns:
+        Fertige Antwort oder None, wenn das LLM antworten soll
+    """
+    timeout_answer = _timeout_answer(tool_result)
+    if timeout_answer:
+        return timeout_answer
+
+    clarification = _name_clarification(tool_result)
+    if clarification:
+        return clarification
+
+    template = _get_answer_template(function_name)
+    if not template:
+        return None
+
+    answer = None
+    try:
+        data = json.loads(tool_result)
+        question_type = classify_question(user_message)
+        if data.get("status") == "success" and question_type != "reasoning":
+            rows = data.get("data", [])
+            count = data.get("count", len(rows))
+            count_field = template.get("count_field")
+            if rows and count_field and rows[0].get(count_field) is not None:
+                count = int(rows[0][count_field])
+            elif data.get("limit_reached"):
+                # Zeilenzahl ist nur das LIMIT, nicht die tatsächliche Anzahl
+                count = None
+
+            if count is None:
+                answer = None
+            elif not rows:
+                answer = template.get("empty")
+            elif "row" not in template:
+                # Aggregat-Muster: eine Ergebniszeile mit Kennzahlen
+                answer = template["summary"].format_map(_context_for_row(rows[0], count))
+            elif question_type in ("count", "list"):
+                answer = template["summary"].format_map(_context_for_row(rows[0], count))
+                if question_type == "list":
+                    max_rows = template.get("max_rows", DEFAULT_MAX_ROWS)
+                    lines = [template["row"].format_map(_context_for_row(row, count)) for row in rows[:max_rows]]
+                    answer += "\n\n" + "\n".join(lines)
+                    if count > max_rows:
+                        answer += f"\n\n… und {count - max_rows} weitere."
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        logger.warning(f"Answer-Template für {function_name} nicht anwendbar: {e}")
+        answer = None
+
+    _record(function_name, answer is not None)
+    return answer
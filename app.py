@@ -1,3 +1,5 @@
+# Als erstes importiert, damit der Startbericht auch die Importzeit enthält
+from service_registry import service_registry
 import os
 import json
 import re
@@ -8,14 +10,30 @@ from datetime import datetime, timedelta, date
 import calendar # Import für Monatsberechnungen
 from functools import wraps
 import uuid
+import random
+import itertools
 import tempfile
 import requests  # Added import for requests
 from datetime import datetime, timedelta
-import dateparser
-from conversation_manager import ConversationManager
+from conversation_manager import conversation_manager, count_message_tokens, digest_tool_result
+from result_compactor import compact_tool_result
+from answer_templates import render_template_answer, get_template_stats
+from decision_cache import decision_cache
+from wissensbasis_cache import wissensbasis_answer_cache
+from wissensbasis_store import ShardedWissensbasisStore, GCSBackend, LocalBackend, WissensbasisKonflikt
+from job_queue import JobQueue, JobAbbruch
+from kpi_rollup import KPIRollup
+from result_cache import result_cache
+from cache_warmer import CacheWarmer, dashboard_query_set, kpi_ranges, KPI_PREFETCH_TYPES
+from result_pages import (PageCursor, RESULT_FORMATS, MAX_PAGE_SIZE, pattern_parameters, page_size_from,
+                          result_columns, to_columnar, ndjson_lines)
+from result_export import EXPORT_FORMATS, EXPORT_PAGE_SIZE, csv_chunks, xlsx_chunks, xlsx_available
+from ingestion_pipeline import iter_pages, split_into_chunks, categorize_chunks, merge_entries
+from content_dedup import save_and_hash, UploadRegistry, near_duplicate_detector
+from themen_service import ThemenHierarchie
 
 from flask import (
-    Flask, render_template, request, redirect, url_for, flash, jsonify, session, Response
+    Flask, render_template, request, redirect, url_for, flash, jsonify, session, Response, has_request_context
 )
 from flask_wtf import CSRFProtect
 from flask_session import Session
@@ -25,8 +43,6 @@ from google.oauth2 import service_account
 from google.cloud import bigquery
 from werkzeug.utils import secure_filename
 import openai
-import tiktoken
-import yaml
 import re
 from sql_query_helper import apply_query_enhancements
 from query_router import determine_query_approach, determine_function_need, handle_conversational_clarification, process_user_query
@@ -54,6 +70,7 @@ except ImportError as e:
     USE_LLM_QUERY_SELECTOR = False
 from llm_manager import create_enhanced_system_prompt, generate_fallback_response, call_llm
 from utils import debug_print
+from query_costs import query_cost_tracker, AbfrageZuTeuer, AbfrageTimeout
 
 def load_tool_config():
     """Liefert die Standard-Tool-Konfiguration"""
@@ -64,18 +81,33 @@ def load_tool_config():
         "use_llm_selection": True
     }
 
-conversation_manager = ConversationManager(max_history=10)
+# Obergrenze für den Tool-Digest, den der Client nach einem Stream zurückschickt
+MAX_STREAM_DIGEST_CHARS = 2000
 
+def konversations_stand():
+    """Kopie von Historie und Zusammenfassung aus der Session (für Prompts und den Query-Router)."""
+    return {
+        "conversation_history": list(session.get("conversation_history", [])),
+        "conversation_summary": session.get("conversation_summary", "")
+    }
 
-###########################################
-# PINECONE: gRPC-Variante laut Quickstart
-###########################################
-from pinecone.grpc import PineconeGRPC as Pinecone
-from pinecone import ServerlessSpec
+def merke_konversation(user_message, antwort, function_call=None, stand=None):
+    """
+    Schreibt einen Turn in Historie und Zusammenfassung der Session.
+
+    Args:
+        user_message: Frage des Benutzers
+        antwort: Antwort des Assistenten
+        function_call: Optional {"name", "content"} oder {"name", "digest"} der ausgeführten Abfrage
+        stand: Bereits aktualisierter Stand (z.B. vom Query-Router); sonst wird der Turn hier ergänzt
+    """
+    if stand is None:
+        stand = konversations_stand()
+        conversation_manager.update_conversation(stand, user_message, antwort, function_call)
+    session["conversation_history"] = stand["conversation_history"]
+    session["conversation_summary"] = stand.get("conversation_summary", "")
+    session.modified = True
 
-# Zusätzliche Importe für Dateiverarbeitung
-from PyPDF2 import PdfReader
-import docx
 
 # Für Datum / Statistik
 from datetime import datetime
@@ -83,8 +115,18 @@ from datetime import datetime
 from bigquery_functions import (
     handle_function_call, 
     summarize_query_result, 
-    get_user_id_from_email
+    get_user_id_from_email,
+    customer_name_resolver,
+    get_kpi_daily_rollup,
+    seller_replicas,
+    run_query_pattern,
+    run_team_query,
+    team_query_stats,
+    load_query_patterns_cached,
+    read_query_page,
+    iter_query_pages
 )
+service_registry.mark("imports")
 
 # Laden der Umgebungsvariablen aus .env
 load_dotenv()
@@ -206,6 +248,9 @@ def configure_google_auth(app):
             
             session.modified = True
             
+            # Dashboard- und KPI-Daten im Hintergrund vorladen
+            starte_login_prefetch(session.get('seller_id'))
+            
             flash('Login erfolgreich!', 'success')
             return redirect(url_for('chat'))
         
@@ -262,12 +307,32 @@ UPLOAD_FOLDER = os.path.join(tempfile.gettempdir(), 'uploaded_files')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
+# Dokumentverarbeitung läuft in Hintergrund-Jobs; die Warteschlange liegt in SQLite
+job_queue = JobQueue(
+    os.getenv('JOB_QUEUE_DB', os.path.join(tempfile.gettempdir(), 'xora_jobs.sqlite3')),
+    num_workers=int(os.getenv('JOB_WORKERS', '2'))
+)
+# SHA-256 bereits verarbeiteter Uploads, damit dieselbe Datei nicht erneut kategorisiert wird
+upload_registry = UploadRegistry(os.getenv('UPLOAD_REGISTRY_DB', os.path.join(tempfile.gettempdir(), 'xora_uploads.sqlite3')))
+# Funnel-Tageswerte pro Verkäufer für /get_kpi_data (nächtlich inkrementell erneuert)
+kpi_rollup = KPIRollup(
+    os.getenv('KPI_ROLLUP_DB', os.path.join(tempfile.gettempdir(), 'xora_kpi_rollup.sqlite3')),
+    loader=get_kpi_daily_rollup
+)
+# Login-Prefetch und optionaler Warmer für den Result-Cache
+cache_warmer = CacheWarmer(
+    lambda pattern_name, parameters: run_query_pattern(pattern_name, parameters, route='prefetch'),
+    result_cache,
+    os.getenv('CACHE_WARMER_DB', os.path.join(tempfile.gettempdir(), 'xora_cache_warmer.sqlite3'))
+)
+
 # CSRF-Schutz
 csrf = CSRFProtect(app)
 
 openai.api_key = os.getenv('OPENAI_API_KEY')
 if not openai.api_key:
     raise ValueError("Der OpenAI API-Schlüssel ist nicht gesetzt.")
+service_registry.mark("flask_setup")
 
 ###########################################
 # Pinecone-Initialisierung (gRPC)
@@ -276,46 +341,63 @@ pinecone_api_key = os.getenv('PINECONE_API_KEY')
 pinecone_env = os.getenv('PINECONE_ENV')  # z.B. 'us-east-1'
 pinecone_index_name = os.getenv('PINECONE_INDEX_NAME')
 
-if not pinecone_api_key or not pinecone_index_name:
-    raise ValueError("Bitte Pinecone API-Key und INDEX_NAME in .env setzen.")
-
-# Pinecone-Client erstellen
-pc = Pinecone(api_key=pinecone_api_key)
-# Du kannst pinecone_env hier ggf. nicht explizit angeben – 
-# Pinecone gRPC nutzt 'us-west1-gcp' oder 'us-east-1' ggf. 
-# laut Projekt-Einstellungen.
-
-# Index ggf. anlegen (Dimension=1536 für text-embedding-ada-002)
-if not pc.has_index(pinecone_index_name):
-    pc.create_index(
-        name=pinecone_index_name,
-        dimension=3072,
-        metric="cosine",
-        spec=ServerlessSpec(
-            cloud="aws",
-            region=pinecone_env or "us-east-1"
+def init_pinecone_index(timeout=120):
+    """
+    Verbindet sich mit Pinecone, legt den Index bei Bedarf an und wartet, bis er bereit ist.
+    Wird erst beim ersten Zugriff auf `index` bzw. im Warm-up ausgeführt.
+    """
+    # Import dauert wegen gRPC mehrere Sekunden
+    from pinecone.grpc import PineconeGRPC as Pinecone
+    from pinecone import ServerlessSpec
+
+    if not pinecone_api_key or not pinecone_index_name:
+        raise ValueError("Bitte Pinecone API-Key und INDEX_NAME in .env setzen.")
+
+    pc = Pinecone(api_key=pinecone_api_key)
+    # Index ggf. anlegen (Dimension=3072)
+    if not pc.has_index(pinecone_index_name):
+        pc.create_index(
+            name=pinecone_index_name,
+            dimension=3072,
+            metric="cosine",
+            spec=ServerlessSpec(
+                cloud="aws",
+                region=pinecone_env or "us-east-1"
+            )
         )
-    )
-# Optional: Warten, bis Index ready
-while not pc.describe_index(pinecone_index_name).status["ready"]:
-    time.sleep(1)
-
-# Index-Handle holen
-index = pc.Index(pinecone_index_name)
+        # Nur ein neu angelegter Index muss abgewartet werden; mit Backoff statt Sekundentakt
+        deadline = time.time() + timeout
+        wait_time = 0.5
+        while not pc.describe_index(pinecone_index_name).status["ready"]:
+            if time.time() > deadline:
+                raise TimeoutError(f"Pinecone-Index {pinecone_index_name} nach {timeout}s nicht bereit")
+            time.sleep(wait_time)
+            wait_time = min(wait_time * 2, 5)
+    return pc.Index(pinecone_index_name)
+
+# Index-Handle (Proxy, verbindet beim ersten Zugriff)
+index = service_registry.register('pinecone_index', init_pinecone_index,
+                                  critical=os.getenv('PINECONE_CRITICAL', '0') == '1')
 
 ###########################################
 # Google Cloud Storage + Sonstige Einstellungen
 ###########################################
 service_account_path = '/home/PfS/service_account_key.json'
-if not os.path.exists(service_account_path):
-    raise FileNotFoundError(f"Service Account Datei nicht gefunden: {service_account_path}")
-
-credentials = service_account.Credentials.from_service_account_file(service_account_path)
-client = storage.Client(credentials=credentials)
 bucket_name = 'wissensbasis'
-bucket = client.bucket(bucket_name)
 wissensbasis_blob_name = 'wissensbasis.json'
 
+def init_gcs_client():
+    if not os.path.exists(service_account_path):
+        raise FileNotFoundError(f"Service Account Datei nicht gefunden: {service_account_path}")
+    credentials = service_account.Credentials.from_service_account_file(service_account_path)
+    return storage.Client(credentials=credentials)
+
+# Ein gemeinsamer Client für alle GCS-Zugriffe, erzeugt beim ersten Zugriff
+client = service_registry.register('gcs_client', init_gcs_client)
+bucket = service_registry.register('gcs_bucket', lambda: service_registry.get('gcs_client').bucket(bucket_name),
+                                   critical=os.getenv('WISSENSBASIS_STORAGE', 'gcs') != 'local')
+service_registry.mark("services_registered")
+
 DEBUG_CATEGORIES = {
     "API Calls": True,
     "Wissensbasis Download/Upload": True,
@@ -544,30 +626,53 @@ def calculate_chat_stats():
 ###########################################
 # Download/Upload Wissensbasis (JSON)
 ###########################################
-service_account_path = '/home/PfS/service_account_key.json'
-if not os.path.exists(service_account_path):
-    raise FileNotFoundError(f"Service Account Datei nicht gefunden: {service_account_path}")
-
-credentials = service_account.Credentials.from_service_account_file(service_account_path)
-client = storage.Client(credentials=credentials)
-bucket_name = 'wissensbasis'
-bucket = client.bucket(bucket_name)
-wissensbasis_blob_name = 'wissensbasis.json'
+# Wissensbasis liegt als Manifest + ein Objekt pro Thema im Bucket (bzw. lokal für Tests);
+# wissensbasis.json wird beim ersten Zugriff einmalig migriert
+if os.getenv('WISSENSBASIS_STORAGE', 'gcs') == 'local':
+    wissensbasis_backend = LocalBackend(os.getenv('WISSENSBASIS_LOCAL_DIR', os.path.join(tempfile.gettempdir(), 'wissensbasis')))
+else:
+    wissensbasis_backend = GCSBackend(bucket)
+# Lokaler Spiegel (gzip) für schnelle Kaltstarts; revalidiert im Hintergrund gegen den Bucket
+wissensbasis_mirror_dir = os.getenv('WISSENSBASIS_MIRROR_DIR', os.path.join(tempfile.gettempdir(), 'wissensbasis_mirror'))
+wissensbasis_store = ShardedWissensbasisStore(wissensbasis_backend, legacy_name=wissensbasis_blob_name,
+                                              mirror_dir=wissensbasis_mirror_dir or None)
+
+# Inhaltsversion der zuletzt geladenen Wissensbasis (Schlüssel für den Antwort-Cache)
+wissensbasis_version = None
+
+class WissensbasisSpeicherfehler(Exception):
+    """Die Wissensbasis konnte nach allen Versuchen nicht hochgeladen werden."""
+
+
+class WissensbasisAbbruch(Exception):
+    """Bricht einen Commit ab, ohne etwas hochzuladen (z.B. Eintrag nicht gefunden)."""
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+def _lade_wissensbasis(max_retries=5, backoff_factor=1, fresh=False):
+    """
+    Lädt die Wissensbasis mit Generation und Inhaltsversion ihres Manifests.
+    Generation 0 bedeutet, dass noch keine Wissensbasis existiert.
+    Nur Themen-Shards, die sich seit dem letzten Laden geändert haben, werden übertragen.
+    Ohne fresh darf der erste Zugriff nach einem Neustart aus dem lokalen Spiegel bedient werden.
 
-def download_wissensbasis(max_retries=5, backoff_factor=1):
-    debug_print("Wissensbasis Download/Upload", f"Versuche, Wissensbasis von '{wissensbasis_blob_name}' herunterzuladen.")
-    blob = bucket.blob(wissensbasis_blob_name)
+    Returns:
+        (wissensbasis, generation, version); version ist None, wenn das Laden fehlschlug
+    """
+    global wissensbasis_version
+    debug_print("Wissensbasis Download/Upload", f"Versuche, Wissensbasis aus '{wissensbasis_store.manifest_name}' zu laden.")
 
-    content = '{}'
+    wissensbasis = {}
+    generation = 0
+    version = None
     for attempt in range(1, max_retries + 1):
         try:
-            if blob.exists():
-                content = blob.download_as_text(encoding='utf-8')
-                debug_print("Wissensbasis Download/Upload", "Wissensbasis erfolgreich heruntergeladen.")
-                break
-            else:
-                debug_print("Wissensbasis Download/Upload", "Wissensbasis-Datei existiert nicht.")
-                break
+            wissensbasis, generation, version = wissensbasis_store.load(allow_stale=not fresh)
+            wissensbasis_version = version
+            debug_print("Wissensbasis Download/Upload", f"Wissensbasis erfolgreich geladen (Generation {generation}).")
+            break
         except Exception as e:
             debug_print("Wissensbasis Download/Upload", f"Fehler: {e}")
             if attempt < max_retries:
@@ -575,30 +680,62 @@ def download_wissensbasis(max_retries=5, backoff_factor=1):
                 debug_print("Wissensbasis Download/Upload", f"Retry {attempt}: Warte {wait_time}s.")
                 time.sleep(wait_time)
             else:
-                flash(f"Fehler beim Herunterladen der Wissensbasis: {e}", 'danger')
+                if has_request_context():
+                    flash(f"Fehler beim Herunterladen der Wissensbasis: {e}", 'danger')
                 break
 
-    wissensbasis = json.loads(content)
     for thema, unterthemen in wissensbasis.items():
         for unterthema, details in unterthemen.items():
             normalized_details = {key.lower(): value for key, value in details.items()}
             unterthemen[unterthema] = normalized_details
             normalized_details.setdefault('beschreibung', '')
             normalized_details.setdefault('inhalt', [])
+    return wissensbasis, generation, version
+
+def download_wissensbasis_mit_generation(max_retries=5, backoff_factor=1, fresh=False):
+    """
+    Lädt die Wissensbasis zusammen mit der Generation ihres Manifests.
+    Generation 0 bedeutet, dass noch keine Wissensbasis existiert.
+    """
+    wissensbasis, generation, _ = _lade_wissensbasis(max_retries, backoff_factor, fresh)
+    return wissensbasis, generation
+
+def download_wissensbasis_mit_version(max_retries=5, backoff_factor=1):
+    """
+    Lädt die Wissensbasis zusammen mit ihrer Inhaltsversion. Aufrufer verwenden diese
+    Version statt der globalen wissensbasis_version, die parallele Requests ändern können.
+    """
+    wissensbasis, _, version = _lade_wissensbasis(max_retries, backoff_factor)
+    return wissensbasis, version
+
+def download_wissensbasis(max_retries=5, backoff_factor=1):
+    wissensbasis, _, _ = _lade_wissensbasis(max_retries, backoff_factor)
     return wissensbasis
 
-def upload_wissensbasis(wissensbasis, max_retries=5, backoff_factor=1):
+def upload_wissensbasis(wissensbasis, max_retries=5, backoff_factor=1, if_generation_match=None):
+    """
+    Lädt die Wissensbasis hoch (nur geänderte Themen-Shards plus Manifest).
+    Mit if_generation_match wird nur geschrieben, wenn das Manifest seit dem Lesen
+    unverändert ist; sonst WissensbasisKonflikt.
+
+    Returns:
+        Die neue Generation
+
+    Raises:
+        WissensbasisKonflikt: Wenn sich das Manifest seit dem Lesen geändert hat
+        WissensbasisSpeicherfehler: Wenn alle Versuche fehlschlagen
+    """
+    global wissensbasis_version
     debug_print("Wissensbasis Download/Upload", "Versuche, Wissensbasis hochzuladen.")
-    blob = bucket.blob(wissensbasis_blob_name)
     for attempt in range(1, max_retries + 1):
         try:
-            blob.upload_from_string(
-                json.dumps(wissensbasis, ensure_ascii=False, indent=4),
-                content_type='application/json'
-            )
+            generation, wissensbasis_version = wissensbasis_store.save(wissensbasis, if_generation_match=if_generation_match)
             debug_print("Wissensbasis Download/Upload", "Wissensbasis hochgeladen.")
-            time.sleep(0.5)
-            return
+            wissensbasis_answer_cache.invalidate()
+            return generation
+        except WissensbasisKonflikt:
+            # Kein erneuter Versuch mit veralteten Daten
+            raise
         except Exception as e:
             debug_print("Wissensbasis Download/Upload", f"Fehler: {e}")
             if attempt < max_retries:
@@ -606,45 +743,57 @@ def upload_wissensbasis(wissensbasis, max_retries=5, backoff_factor=1):
                 debug_print("Wissensbasis Download/Upload", f"Retry {attempt}: Warte {wait_time}s.")
                 time.sleep(wait_time)
             else:
-                flash(f"Fehler beim Hochladen der Wissensbasis: {e}", 'danger')
+                if has_request_context():
+                    flash(f"Fehler beim Hochladen der Wissensbasis: {e}", 'danger')
+                raise WissensbasisSpeicherfehler(
+                    f"Wissensbasis nach {max_retries} Versuchen nicht hochgeladen: {e}") from e
+
+def commit_wissensbasis(aenderung, max_versuche=5):
+    """
+    Read-Modify-Write mit optimistischer Nebenläufigkeit: Die Änderung wird auf die
+    gelesene Version angewendet und nur hochgeladen, wenn sich die Generation in GCS
+    nicht geändert hat. Bei einem Konflikt wird neu gelesen und die Änderung erneut
+    angewendet (Rebase), ohne globale Sperre.
+
+    Args:
+        aenderung: Funktion, die die Wissensbasis in-place ändert; gibt sie False zurück,
+                   wird nichts hochgeladen. WissensbasisAbbruch bricht den Commit ab.
+        max_versuche: Maximale Anzahl Versuche bei Konflikten
+
+    Returns:
+        Rückgabewert der Änderungsfunktion
+
+    Raises:
+        WissensbasisKonflikt: Wenn nach max_versuche Rebases weiter Konflikte auftreten
+        WissensbasisSpeicherfehler: Wenn der Upload fehlschlägt (nichts wurde gespeichert)
+    """
+    for versuch in range(1, max_versuche + 1):
+        # Schreibzugriffe immer gegen den aktuellen Stand im Bucket
+        wissensbasis, generation = download_wissensbasis_mit_generation(fresh=True)
+        ergebnis = aenderung(wissensbasis)
+        if ergebnis is False:
+            return ergebnis
+        try:
+            upload_wissensbasis(wissensbasis, if_generation_match=generation)
+            if versuch > 1:
+                debug_print("Wissensbasis Download/Upload", f"Commit nach {versuch} Versuchen erfolgreich.")
+            return ergebnis
+        except WissensbasisKonflikt:
+            wait_time = random.uniform(0.05, 0.2) * versuch
+            debug_print("Wissensbasis Download/Upload",
+                        f"Konflikt bei Generation {generation} (Versuch {versuch}), Rebase in {wait_time:.2f}s.")
+            time.sleep(wait_time)
+    raise WissensbasisKonflikt(f"Commit nach {max_versuche} Versuchen nicht möglich")
 
 ###########################################
 # Themen (themen.txt) laden/aktualisieren
 ###########################################
 themen_datei = '/home/PfS/themen.txt'
-
-def lese_themenhierarchie(dateipfad):
-    if not os.path.exists(dateipfad):
-        return {}
-    with open(dateipfad, 'r', encoding='utf-8') as f:
-        zeilen = f.readlines()
-
-    themen_dict = {}
-    aktuelles_thema = None
-    for zeile in zeilen:
-        zeile = zeile.strip()
-        if not zeile:
-            continue
-        match_thema = re.match(r'Thema\s*\d+:\s*.*', zeile)
-        if match_thema:
-            thema_key = zeile
-            themen_dict[thema_key] = {}
-            aktuelles_thema = thema_key
-            continue
-        match_unterpunkt = re.match(r'(\d+[a-z]*)\)?\s*([^/]+)\s*(//\s*(.*))?$', zeile)
-        if match_unterpunkt:
-            punkt_nummer = match_unterpunkt.group(1)
-            punkt_titel = match_unterpunkt.group(2).strip()
-            punkt_beschreibung = match_unterpunkt.group(4).strip() if match_unterpunkt.group(4) else ""
-            if aktuelles_thema:
-                themen_dict[aktuelles_thema][punkt_nummer] = {
-                    "title": punkt_titel,
-                    "beschreibung": punkt_beschreibung
-                }
-    return themen_dict
+# Einmal geparst im Speicher; aktualisiere_themen schreibt durch, externe Änderungen per mtime
+themen_hierarchie_service = ThemenHierarchie(themen_datei)
 
 def lade_themen():
-    return lese_themenhierarchie(themen_datei)
+    return themen_hierarchie_service.get()
 
 def get_next_thema_number(themen_dict):
     numbers = []
@@ -655,25 +804,7 @@ def get_next_thema_number(themen_dict):
     return max(numbers) + 1 if numbers else 1
 
 def aktualisiere_themen(themen_dict):
-    def sort_key(k):
-        match = re.match(r'(\d+)([a-z]*)', k)
-        if match:
-            num = int(match.group(1))
-            suf = match.group(2)
-            return (num, suf)
-        return (0, k)
-    with open(themen_datei, 'w', encoding='utf-8') as file:
-        for thema, unterpunkte in themen_dict.items():
-            file.write(f"{thema}\n")
-            sorted_up = sorted(unterpunkte.items(), key=lambda x: sort_key(x[0]))
-            for punkt_nummer, punkt_info in sorted_up:
-                punkt_titel = punkt_info['title']
-                punkt_beschreibung = punkt_info.get('beschreibung', '')
-                if punkt_beschreibung:
-                    file.write(f"{punkt_nummer}) {punkt_titel}\t\t\t// {punkt_beschreibung}\n")
-                else:
-                    file.write(f"{punkt_nummer}) {punkt_titel}\n")
-            file.write("\n")
+    themen_hierarchie_service.update(themen_dict)
 
 
 ###########################################
@@ -701,43 +832,101 @@ def log_notfall_event(user_id, notfall_art, user_message):
 ###########################################
 # Wissenseintrag in JSON + Pinecone speichern
 ###########################################
-def speichere_wissensbasis(eintrag):
-    wissensbasis = download_wissensbasis()
+def wende_eintrag_an(wissensbasis, eintrag, statistik=None):
+    """
+    Wendet einen Wissenseintrag auf eine In-Memory-Kopie der Wissensbasis an.
+    "inhalt" ist ein Text oder eine Liste von Passagen; Passagen, die (nahezu) gleich
+    schon im Unterthema stehen, werden nicht erneut angehängt.
+
+    Returns:
+        bool: True, wenn der Eintrag übernommen wurde
+    """
     thema = eintrag.get("thema", "").strip()
     unterthema_full = eintrag.get("unterthema", "").strip()
     beschreibung = eintrag.get("beschreibung", "").strip()
-    inhalt = eintrag.get("inhalt", "").strip()
-
-    if thema and unterthema_full:
-        match_unterthema = re.match(r'(\d+[a-z]*)\)?\s*(.*)', unterthema_full)
-        if match_unterthema:
-            unterthema_key = match_unterthema.group(1)
-            unterthema_title = match_unterthema.group(2)
+    inhalt = eintrag.get("inhalt") or []
+    # merge_entries liefert die Passagen als Liste, damit jede einzeln geprüft wird
+    passagen = [str(p).strip() for p in (inhalt if isinstance(inhalt, list) else [inhalt])]
+    passagen = [p for p in passagen if p]
+
+    if not (thema and unterthema_full):
+        return False
+
+    match_unterthema = re.match(r'(\d+[a-z]*)\)?\s*(.*)', unterthema_full)
+    if match_unterthema:
+        unterthema_key = match_unterthema.group(1)
+        unterthema_title = match_unterthema.group(2)
+    else:
+        unterthema_key = unterthema_full
+        unterthema_title = ""
+
+    unterthema_full_key = f"{unterthema_key}) {unterthema_title}"
+
+    vorhandene_inhalte = wissensbasis.get(thema, {}).get(unterthema_full_key, {}).get("inhalt", [])
+    neue_passagen = []
+    for passage in passagen:
+        if near_duplicate_detector.find_duplicate(passage, vorhandene_inhalte + neue_passagen):
+            debug_print("Bearbeiten von Einträgen", f"Passage bereits vorhanden, übersprungen: {thema} / {unterthema_full_key}")
+            if statistik is not None:
+                statistik["duplicates"] = statistik.get("duplicates", 0) + 1
         else:
-            unterthema_key = unterthema_full
-            unterthema_title = ""
+            neue_passagen.append(passage)
+    if passagen and not neue_passagen:
+        return False
+
+    if thema not in wissensbasis:
+        wissensbasis[thema] = {}
+    if unterthema_full_key not in wissensbasis[thema]:
+        wissensbasis[thema][unterthema_full_key] = {
+            "beschreibung": beschreibung,
+            "inhalt": []
+        }
+    if beschreibung:
+        wissensbasis[thema][unterthema_full_key]["beschreibung"] = beschreibung
+    wissensbasis[thema][unterthema_full_key]["inhalt"].extend(neue_passagen)
 
-        unterthema_full_key = f"{unterthema_key}) {unterthema_title}"
+    debug_print("Bearbeiten von Einträgen", f"Eintrag hinzugefügt/aktualisiert: {eintrag}")
+    return True
 
-        if thema not in wissensbasis:
-            wissensbasis[thema] = {}
-        if unterthema_full_key not in wissensbasis[thema]:
-            wissensbasis[thema][unterthema_full_key] = {
-                "beschreibung": beschreibung,
-                "inhalt": []
-            }
-        if beschreibung:
-            wissensbasis[thema][unterthema_full_key]["beschreibung"] = beschreibung
-        if inhalt:
-            wissensbasis[thema][unterthema_full_key]["inhalt"].append(inhalt)
+def speichere_wissensbasis_batch(eintraege):
+    """
+    Speichert mehrere Wissenseinträge mit einem Download und einem Upload.
+    Alle Einträge werden auf dieselbe In-Memory-Kopie angewendet und gemeinsam
+    hochgeladen; ungültige Einträge (ohne Thema/Unterthema) und bereits vorhandene
+    Inhalte werden übersprungen.
 
-        debug_print("Bearbeiten von Einträgen", f"Eintrag hinzugefügt/aktualisiert: {eintrag}")
-        upload_wissensbasis(wissensbasis)
+    Returns:
+        dict: Anzahl übernommener/übersprungener/doppelter Einträge und eingesparte GCS-Roundtrips
+    """
+    eintraege = list(eintraege)
+    statistik = {}
+
+    def aenderung(wissensbasis):
+        # Bei einem Rebase wird die Änderung erneut angewendet
+        statistik.clear()
+        anzahl = sum(1 for eintrag in eintraege if wende_eintrag_an(wissensbasis, eintrag, statistik))
+        return anzahl if anzahl else False
+
+    uebernommen = commit_wissensbasis(aenderung) or 0
+
+    # Einzeln gespeichert kostet jeder Eintrag einen Download und einen Upload
+    roundtrips = 2 if uebernommen else 1
+    ergebnis = {
+        "applied": uebernommen,
+        "skipped": len(eintraege) - uebernommen,
+        "duplicates": statistik.get("duplicates", 0),
+        "roundtrips": roundtrips,
+        "roundtrips_saved": max(2 * uebernommen - roundtrips, 0)
+    }
+    debug_print("Wissensbasis Download/Upload",
+                f"Batch gespeichert: {uebernommen} Einträge, {ergebnis['roundtrips_saved']} Roundtrips eingespart")
+    return ergebnis
 
-        # Pinecone: Upsert
-        doc_id = f"{thema}-{unterthema_full_key}-{uuid.uuid4()}"
-       
-    else:
+def speichere_wissensbasis(eintrag):
+    ergebnis = speichere_wissensbasis_batch([eintrag])
+    if ergebnis["duplicates"]:
+        flash("Dieser Inhalt ist in der Wissensbasis bereits vorhanden.", 'info')
+    elif not ergebnis["applied"]:
         flash("Thema und Unterthema müssen angegeben werden.", 'warning')
 
 
@@ -782,21 +971,13 @@ def contact_openai(messages, model=None):
         
     except Exception as e:
         debug_print("API Calls", f"Fehler: {e}")
-        flash(f"Ein Fehler ist aufgetreten: {e}", 'danger')
+        if has_request_context():
+            flash(f"Ein Fehler ist aufgetreten: {e}", 'danger')
         return None, None
 
 def count_tokens(messages, model=None):
-    model = 'gpt-4o'
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        encoding = tiktoken.get_encoding("cl100k_base")
-    token_count = 0
-    for msg in messages:
-        token_count += len(encoding.encode(msg['content']))
-        token_count += 4
-    token_count += 2
-    return token_count
+    # Encoder wird im conversation_manager einmalig erzeugt und gecacht
+    return count_message_tokens(messages, 'gpt-4o')
 
 
 ###########################################
@@ -963,9 +1144,10 @@ def create_system_prompt(table_schema):
     
     return prompt
 
-def stream_text_response(response_text, user_message, session_data):
+def stream_text_response(response_text, user_message, session_data, chunk_delay=0.05):
     """
     Generiert einen Stream für direkte Textantworten (z.B. Wissensbasis-Antworten)
+    chunk_delay=0 liefert die Chunks ohne künstliche Verzögerung (z.B. aus dem Cache)
     """
     try:
         # Debug-Events für die Verbindungsdiagnose
@@ -981,7 +1163,8 @@ def stream_text_response(response_text, user_message, session_data):
         for i in range(0, len(words), chunk_size):
             chunk = " ".join(words[i:i+chunk_size])
             yield f"data: {json.dumps({'type': 'text', 'content': chunk + ' '})}\n\n"
-            time.sleep(0.05)  # Kleine Verzögerung für natürlichere Ausgabe
+            if chunk_delay:
+                time.sleep(chunk_delay)  # Kleine Verzögerung für natürlichere Ausgabe
         
         # Stream beenden
         yield f"data: {json.dumps({'type': 'complete', 'user': user_message, 'bot': response_text})}\n\n"
@@ -1031,7 +1214,7 @@ def generate_clarification_stream(human_in_loop_data):
     except Exception as e:
         yield f"data: {json.dumps({'type': 'error', 'content': f'Fehler bei Rückfrage: {str(e)}'})}\n\n"
 
-def stream_response(messages, tools, tool_choice, seller_id, extracted_args, user_message, session_data):
+def stream_response(messages, tools, tool_choice, seller_id, extracted_args, user_message, session_data, cached_args=None):
     """Stream the OpenAI response and handle function calls within the stream
     
     Args:
@@ -1042,6 +1225,7 @@ def stream_response(messages, tools, tool_choice, seller_id, extracted_args, use
         extracted_args: Any extracted date parameters
         user_message: The original user message
         session_data: A dictionary containing all needed session data
+        cached_args: Optional parameters from the decision cache; skips the first API call
     """
     # Extract session data - this avoids accessing session in the generator
     user_id = session_data["user_id"]
@@ -1054,19 +1238,30 @@ def stream_response(messages, tools, tool_choice, seller_id, extracted_args, use
         yield f"data: {json.dumps({'type': 'debug', 'message': 'Stream-Start'})}\n\n"
         #yield f"data: {json.dumps({'type': 'text', 'content': 'Test-Content vom Server'})}\n\n"
 
-        debug_print("API Calls", f"Streaming-Anfrage an OpenAI mit Function Calling")
-        response = openai.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-            tools=tools,
-            tool_choice=tool_choice,
-            stream=True  # Enable streaming
-        )
-        
         initial_response = ""
         function_calls_data = []
         has_function_calls = False
         
+        if cached_args is not None:
+            # Parameter-Slots aus dem Entscheidungs-Cache: erster API-Call entfällt
+            debug_print("API Calls", f"Verwende gecachte Parameter für {tool_choice['function']['name']}")
+            response = []
+            has_function_calls = True
+            function_calls_data.append({
+                "id": f"call_cached_{uuid.uuid4().hex[:16]}",
+                "name": tool_choice["function"]["name"],
+                "args": json.dumps(cached_args)
+            })
+        else:
+            debug_print("API Calls", f"Streaming-Anfrage an OpenAI mit Function Calling")
+            response = openai.chat.completions.create(
+                model="gpt-4o",
+                messages=messages,
+                tools=tools,
+                tool_choice=tool_choice,
+                stream=True  # Enable streaming
+            )
+        
         # Stream the initial response
         yield f"data: {json.dumps({'type': 'start'})}\n\n"
         
@@ -1100,12 +1295,17 @@ def stream_response(messages, tools, tool_choice, seller_id, extracted_args, use
             yield f"data: {json.dumps({'type': 'debug', 'message': f'Detected {len(function_calls_data)} function calls'})}\n\n"
             
             function_responses = []
+            raw_function_results = []
             for func_data in function_calls_data:
                 if func_data["name"] and func_data["args"]:
                     try:
                         function_name = func_data["name"]
                         function_args = json.loads(func_data["args"])
                         
+                        # Vom LLM ermittelte Parameter-Slots für Wiederholungen merken
+                        if cached_args is None:
+                            decision_cache.store_parameters(user_message, function_name, function_args)
+                        
                         # Add seller_id and extracted date parameters
                         if seller_id:
                             function_args["seller_id"] = seller_id
@@ -1120,12 +1320,13 @@ def stream_response(messages, tools, tool_choice, seller_id, extracted_args, use
                         
                         function_response = handle_function_call(function_name, function_args)
                         
-                        # Add to function responses
+                        # Add to function responses (verdichtet für den zweiten LLM-Aufruf)
                         function_responses.append({
                             "role": "tool",
                             "tool_call_id": func_data["id"],
-                            "content": function_response
+                            "content": compact_tool_result(function_name, function_response)
                         })
+                        raw_function_results.append((function_name, function_response))
                         
                         yield f"data: {json.dumps({'type': 'function_result', 'name': function_name})}\n\n"
                         yield f"data: {json.dumps({'type': 'debug', 'message': f'Function executed successfully'})}\n\n"
@@ -1134,8 +1335,28 @@ def stream_response(messages, tools, tool_choice, seller_id, extracted_args, use
                         debug_print("Function", f"Error executing function: {str(e)}")
                         yield f"data: {json.dumps({'type': 'error', 'content': f'Fehler bei Funktionsausführung: {str(e)}'})}\n\n"
             
+            # Digest der letzten Abfrage geht mit dem complete-Event an den Client, der den
+            # Turn über /update_stream_chat_history in der Session speichert
+            if raw_function_results:
+                letzter_name, letztes_ergebnis = raw_function_results[-1]
+                session_data["function_call"] = {"name": letzter_name,
+                                                 "digest": digest_tool_result(letzter_name, letztes_ergebnis)}
+            
+            # Einfache Anzahl-/Listenfragen direkt per Template beantworten
+            template_answer = None
+            if len(raw_function_results) == 1:
+                template_answer = render_template_answer(user_message, *raw_function_results[0])
+            
+            if template_answer:
+                yield f"data: {json.dumps({'type': 'final_response_start'})}\n\n"
+                yield f"data: {json.dumps({'type': 'text', 'content': template_answer})}\n\n"
+                full_response = initial_response + "\n\n" + template_answer if initial_response else template_answer
+                yield f"data: {json.dumps({'type': 'complete', 'user': user_message, 'bot': full_response, 'function_call': session_data.get('function_call')})}\n\n"
+                yield f"data: {json.dumps({'type': 'debug', 'message': 'Stream complete with template answer'})}\n\n"
+                yield f"data: {json.dumps({'type': 'end'})}\n\n"
+            
             # Second call to get final response
-            if function_responses:
+            elif function_responses:
                 # Properly format the tool_calls with the required 'type' field
                 formatted_tool_calls = []
                 for func_data in function_calls_data:
@@ -1184,7 +1405,7 @@ def stream_response(messages, tools, tool_choice, seller_id, extracted_args, use
                     full_response = initial_response + "\n\n" + final_text
                     
                     # Session aktualisieren und Stream beenden
-                    yield f"data: {json.dumps({'type': 'complete', 'user': user_message, 'bot': full_response})}\n\n"
+                    yield f"data: {json.dumps({'type': 'complete', 'user': user_message, 'bot': full_response, 'function_call': session_data.get('function_call')})}\n\n"
                     yield f"data: {json.dumps({'type': 'debug', 'message': 'Stream complete with function execution'})}\n\n"
                     yield f"data: {json.dumps({'type': 'end'})}\n\n"
                     
@@ -1306,15 +1527,7 @@ def handle_clarification():
         selected_option = options[selected_option_index]
         logging.info(f"Ausgewählte Option: {selected_option.get('text')} -> {selected_option.get('query')}")
         
-        # Verarbeiten von Parametern, speziell für den Kunden Küll
-        params = selected_option.get("params", {})
-        if params and "customer_name" in params:
-            customer_name = params["customer_name"]
-            if customer_name.lower() in ["küll", "kull", "kühl", "kuehl", "kuell"]:
-                logging.info("Normalisiere Kunden-Parameter 'Küll'")
-                params["customer_name"] = "Küll"
-                selected_option["params"] = params
-
+        # Schreibvarianten von Kundennamen löst der Namensindex in handle_function_call auf
         # Extrahiere die benötigten Informationen
         selected_query = selected_option.get("query")
         selected_params = selected_option.get("params", {})
@@ -1350,6 +1563,8 @@ def handle_clarification():
                     chat_history.append({"role": "user", "content": original_request})
                     chat_history.append({"role": "assistant", "content": formatted_result})
                     session[chat_key] = chat_history
+                    merke_konversation(original_request, formatted_result,
+                                       {"name": "get_customer_history", "content": result_data})
                     
                     # Erfolg zurückgeben
                     if is_ajax:
@@ -1484,7 +1699,7 @@ def chat():
                     url_for("chat")
                 )
 
-            wissensbasis = download_wissensbasis()
+            wissensbasis, wissensbasis_stand = download_wissensbasis_mit_version()
             if not wissensbasis:
                 flash("Die Wissensbasis konnte nicht geladen werden.", "danger")
                 return (
@@ -1524,10 +1739,14 @@ def chat():
             debug_print("API Setup", f"System prompt (gekürzt): {system_prompt[:200]}...")
             debug_print("API Setup", f"Anzahl definierter Tools: {len(tools)}")
 
-            messages = [
-                {"role": "developer", "content": system_prompt},
-                {"role": "user", "content": user_message},
-            ]
+            # Zusammenfassung älterer Turns und neueste Nachrichten im festen Token-Budget
+            konversation = konversations_stand()
+            kontext_fenster = conversation_manager.get_context_window(konversation)
+            messages = (
+                [{"role": "developer", "content": system_prompt}]
+                + kontext_fenster
+                + [{"role": "user", "content": user_message}]
+            )
 
             # Sammle alle relevanten Session-Daten für den mehrstufigen Prozess
             session_data = {
@@ -1536,8 +1755,11 @@ def chat():
                 "seller_id": seller_id,
                 "email": session.get("email"),
                 "chat_key": chat_key,
-                "chat_history": list(chat_history) if stream_mode else None  # Nur für Streaming benötigt
+                "chat_history": list(chat_history) if stream_mode else None,  # Nur für Streaming benötigt
+                "conversation_history": konversation["conversation_history"],
+                "conversation_summary": konversation["conversation_summary"]
             }
+            konversation_vorher = list(konversation["conversation_history"])
 
             # Debug-Modus: Direkte Erzwingung eines bestimmten Tools
             debug_force = request.args.get("force_function")
@@ -1578,8 +1800,18 @@ def chat():
                                 break
                         
                         if is_wissensbasis_query:
-                            # Lade Wissensbasis und beantworte direkt
-                            wissensbasis_data = download_wissensbasis()
+                            # Die Wissensbasis wurde für diese Anfrage bereits geladen;
+                            # gleiche Frage gegen unveränderte Wissensbasis kommt aus dem Cache.
+                            # Get und Put verwenden die Version dieses Ladevorgangs, nicht die globale
+                            # (die sich während des LLM-Aufrufs durch andere Requests ändern kann)
+                            wissensbasis_data = wissensbasis
+                            cached_answer = wissensbasis_answer_cache.get(user_message, wissensbasis_stand)
+                            if cached_answer:
+                                debug_print("Wissensbasis", "Antwort aus dem Cache")
+                                return Response(
+                                    stream_text_response(cached_answer, user_message, session_data, chunk_delay=0),
+                                    content_type="text/event-stream"
+                                )
                             
                             system_prompt = """
                             Du bist ein hilfreicher Assistent für ein Pflegevermittlungsunternehmen. 
@@ -1599,6 +1831,7 @@ def chat():
                             )
                             
                             wissensbasis_response = response.choices[0].message.content
+                            wissensbasis_answer_cache.put(user_message, wissensbasis_stand, wissensbasis_response)
                             return Response(
                                 stream_text_response(wissensbasis_response, user_message, session_data),
                                 content_type="text/event-stream"
@@ -1628,10 +1861,11 @@ def chat():
                         # Direkte Konversationsanfragen wie mathematische Berechnungen
                         elif selected_tool == "direct_conversation":
                             debug_print("Tool-Auswahl", "Direkter Konversationsmodus erkannt - Leite Anfrage direkt an LLM weiter")
-                            direct_messages = [
-                                {"role": "system", "content": "Du bist ein hilfreicher Assistent für ein Pflegevermittlungsunternehmen."},
-                                {"role": "user", "content": user_message}
-                            ]
+                            direct_messages = (
+                                [{"role": "system", "content": "Du bist ein hilfreicher Assistent für ein Pflegevermittlungsunternehmen."}]
+                                + kontext_fenster
+                                + [{"role": "user", "content": user_message}]
+                            )
                             
                             response = openai.chat.completions.create(
                                 model="gpt-4o",
@@ -1648,6 +1882,9 @@ def chat():
                         
                         # Korrektes Format für tool_choice erstellen
                         tool_choice = {"type": "function", "function": {"name": selected_tool}} if selected_tool else "auto"
+                        
+                        # Gecachte Parameter-Slots für wiederholte Anfragen
+                        cached_args = decision_cache.get_parameters(user_message, selected_tool) if selected_tool else None
                                                 
                         return Response(
                             stream_response(
@@ -1657,7 +1894,8 @@ def chat():
                                 seller_id, 
                                 extract_enhanced_date_params(user_message), 
                                 user_message, 
-                                session_data
+                                session_data,
+                                cached_args
                             ),
                             content_type="text/event-stream"
                         )
@@ -1665,6 +1903,7 @@ def chat():
                         
                 
                 # Nicht-Streaming-Modus
+                letzter_funktionsaufruf = None
                 if use_legacy_approach:
                     # Legacy-Ansatz (für Debug-Modus)
                     debug_print("API Calls", f"Legacy-Ansatz mit explizitem Function Calling: {debug_force}")
@@ -1703,6 +1942,7 @@ def chat():
 
                             debug_print("Function", f"Argumente nach Modifikation: {function_args}")
                             function_response = handle_function_call(function_name, function_args)
+                            letzter_funktionsaufruf = {"name": function_name, "content": function_response}
                             
                             # Parsen der Function Response für bessere Logging
                             try:
@@ -1717,16 +1957,24 @@ def chat():
                                 {
                                     "role": "tool",
                                     "tool_call_id": tool_call.id,
-                                    "content": function_response,
+                                    "content": compact_tool_result(function_name, function_response),
                                 }
                             )
 
-                        # Second call to OpenAI with function results
-                        second_messages = messages + [assistant_message.model_dump(exclude_unset=True)] + function_responses
-                        debug_print("API Calls", f"Zweiter Aufruf an OpenAI mit {len(function_responses)} Funktionsantworten")
-                        second_response = openai.chat.completions.create(model="gpt-4o", messages=second_messages)
-                        final_message = second_response.choices[0].message
-                        antwort = final_message.content
+                        # Einfache Anzahl-/Listenfragen direkt per Template beantworten
+                        template_answer = None
+                        if len(assistant_message.tool_calls) == 1:
+                            template_answer = render_template_answer(user_message, function_name, function_response)
+                        
+                        if template_answer:
+                            antwort = template_answer
+                        else:
+                            # Second call to OpenAI with function results
+                            second_messages = messages + [assistant_message.model_dump(exclude_unset=True)] + function_responses
+                            debug_print("API Calls", f"Zweiter Aufruf an OpenAI mit {len(function_responses)} Funktionsantworten")
+                            second_response = openai.chat.completions.create(model="gpt-4o", messages=second_messages)
+                            final_message = second_response.choices[0].message
+                            antwort = final_message.content
                         debug_print("API Calls", f"Finale Antwort: {antwort[:100]}...")
                         # Warnung ins Log schreiben, wenn keine Funktion aufgerufen wurde
                         if any(term in user_message.lower() for term in ["care", "pflege", "kunden", "verträge", "mai", "monat"]):
@@ -1742,6 +1990,11 @@ def chat():
                 if antwort:  # Check if antwort is defined
                     chat_history.append({"user": user_message, "bot": antwort})
                     session[chat_key] = chat_history
+                    if session_data["conversation_history"] != konversation_vorher:
+                        # Der Query-Router hat den Turn samt Tool-Digest bereits eingetragen
+                        merke_konversation(user_message, antwort, stand=session_data)
+                    else:
+                        merke_konversation(user_message, antwort, letzter_funktionsaufruf)
                     store_chatlog(user_name, chat_history)
 
                     return (
@@ -2667,7 +2920,8 @@ def get_active_care_stays_now():
         # Führe die Abfrage aus
         result = execute_bigquery_query(
             query_pattern['sql_template'],
-            parameters
+            parameters,
+            pattern_name=query_name
         )
         
         # Formatiere das Ergebnis
@@ -2729,7 +2983,8 @@ def get_dashboard_data():
             logging.info("Dashboard: Führe BigQuery-Abfrage für Active Customers aus")
             active_customers_result = execute_bigquery_query(
                 query_pattern['sql_template'],
-                parameters
+                parameters,
+                pattern_name=query_name
             )
             
             # Formatiere das Ergebnis
@@ -2767,7 +3022,8 @@ def get_dashboard_data():
                     logging.info("Dashboard Pause: Führe BigQuery-Abfrage aus")
                     paused_customers_result = execute_bigquery_query(
                         query_pattern['sql_template'],
-                        parameters
+                        parameters,
+                        pattern_name=query_name
                     )
                     
                     # Debug-Ausgabe der Abfrage selbst
@@ -2913,7 +3169,8 @@ def get_dashboard_data():
                 logging.info("Dashboard: Führe BigQuery-Abfrage für nur aktive neue Verträge aus")
                 active_new_contracts_result = execute_bigquery_query(
                     query_pattern['sql_template'],
-                    parameters
+                    parameters,
+                    pattern_name=query_name
                 )
                 
                 # Formatiere das Ergebnis
@@ -2940,7 +3197,8 @@ def get_dashboard_data():
             logging.info("Dashboard: Führe BigQuery-Abfrage für Abschlussquote aus")
             cvr_result = execute_bigquery_query(
                 query_pattern['sql_template'],
-                parameters
+                parameters,
+                pattern_name=query_name
             )
             
             # Formatiere das Ergebnis
@@ -2970,7 +3228,8 @@ def get_dashboard_data():
             logging.info("Dashboard: Führe BigQuery-Abfrage für Neue Verträge aus")
             contracts_result = execute_bigquery_query(
                 query_pattern['sql_template'],
-                parameters
+                parameters,
+                pattern_name=query_name
             )
             
             # Formatiere das Ergebnis
@@ -3000,7 +3259,8 @@ def get_dashboard_data():
             logging.info("Dashboard: Führe BigQuery-Abfrage für Kündigungen aus")
             terminations_result = execute_bigquery_query(
                 query_pattern['sql_template'],
-                parameters
+                parameters,
+                pattern_name=query_name
             )
             
             # Formatiere das Ergebnis
@@ -3046,7 +3306,8 @@ def get_dashboard_data():
 
             revenue_result = execute_bigquery_query(
                 query_pattern_revenue['sql_template'],
-                parameters_revenue
+                parameters_revenue,
+                pattern_name=query_name_revenue
             )
             formatted_revenue = format_query_result(revenue_result, query_pattern_revenue.get('result_structure'))
             logging.info(f"Dashboard: Umsatz Pro Rata Abfrage abgeschlossen")
@@ -3081,6 +3342,29 @@ def get_dashboard_data():
 
 # --- BEGINN: Code für /get_kpi_data ---
 
+# KPI-Typen, die aus dem Rollup berechnet werden können
+KPI_ROLLUP_TYPES = ('conversion_rate', 'lead_quality', 'lead_household_conversion', 'household_posting_conversion')
+# Abfragemuster pro KPI-Typ
+KPI_QUERY_PATTERNS = {
+    'conversion_rate': "get_cvr_lead_contract",
+    'lead_quality': "get_lead_quality",
+    'lead_household_conversion': "get_lead_household_conversion",
+    'household_posting_conversion': "get_household_posting_conversion",
+    'posting_contract_conversion': "get_posting_contract_conversion",
+    'termination_rate': "get_contract_terminations",
+    'contract_count': "get_active_care_stays_now"
+}
+
+def starte_kpi_rollup(seller_id):
+    """Reiht den Refresh der KPI-Tageswerte eines Verkäufers ein, sofern keiner wartet oder läuft (über alle Prozesse)."""
+    return job_queue.enqueue('kpi_rollup_refresh', {'seller_id': seller_id}, owner=seller_id, unique=True)
+
+def job_kpi_rollup_refresh(job):
+    """Hintergrund-Job: Funnel-Tageswerte eines Verkäufers laden bzw. inkrementell erneuern."""
+    seller_id = job.payload['seller_id']
+    job.progress(10, 'KPI-Tageswerte werden geladen')
+    return kpi_rollup.refresh(seller_id)
+
 @app.route('/get_kpi_data', methods=['GET'])
 def get_kpi_data():
     """
@@ -3130,21 +3414,8 @@ def get_kpi_data():
             logging.error("KPI Daten: Fehler beim Parsen von query_patterns.json")
             return jsonify({"error": "Fehler in Konfigurationsdatei", "status": "error"}), 500
 
-        # Wähle die richtige Abfrage basierend auf dem Abfragetyp
-        if query_type == 'lead_quality':
-            query_name = "get_lead_quality"
-        elif query_type == 'lead_household_conversion':
-            query_name = "get_lead_household_conversion"
-        elif query_type == 'household_posting_conversion':
-            query_name = "get_household_posting_conversion"
-        elif query_type == 'posting_contract_conversion':
-            query_name = "get_posting_contract_conversion"
-        elif query_type == 'termination_rate':
-            query_name = "get_contract_terminations"
-        elif query_type == 'contract_count':
-            query_name = "get_active_care_stays_now"
-        else:  # Standardfall: Abschlussquote
-            query_name = "get_cvr_lead_contract"
+        # Wähle die richtige Abfrage basierend auf dem Abfragetyp (Standardfall: Abschlussquote)
+        query_name = KPI_QUERY_PATTERNS.get(query_type, "get_cvr_lead_contract")
             
         if query_name not in query_patterns.get('common_queries', {}):
             logging.error(f"KPI Daten: Abfrage {query_name} nicht gefunden")
@@ -3152,6 +3423,19 @@ def get_kpi_data():
 
         query_pattern = query_patterns['common_queries'][query_name]
 
+        # Zeitraum aus den vorberechneten Tageswerten, wenn er vollständig abgedeckt ist
+        rollup_result = kpi_rollup.get_kpi(seller_id, query_type, start_date_str, end_date_str)
+        if rollup_result is not None:
+            rollup_result['query_type'] = query_type
+            logging.info(f"KPI Daten: {query_type} aus dem Rollup berechnet: {rollup_result}")
+            return jsonify({
+                "data": rollup_result,
+                "source": "rollup",
+                "status": "success"
+            })
+        if query_type in KPI_ROLLUP_TYPES and kpi_rollup.coverage(seller_id) is None:
+            starte_kpi_rollup(seller_id)
+
         # Parameter für die Abfrage vorbereiten (mit den übergebenen Daten)
         parameters = {
             'seller_id': seller_id,
@@ -3168,7 +3452,8 @@ def get_kpi_data():
 
         result = execute_bigquery_query(
             query_pattern['sql_template'],
-            parameters
+            parameters,
+            pattern_name=query_name
         )
 
         # Formatiere das Ergebnis (Stelle sicher, dass die Funktion existiert)
@@ -3201,6 +3486,153 @@ def get_kpi_data():
         }), 500
 # --- ENDE: Code für /get_kpi_data ---
 
+# --- Login-Prefetch und Cache-Warmer ---
+
+def prefetch_query_set(seller_id):
+    """
+    Abfragen, die nach dem Login bzw. morgens vorgewärmt werden: Dashboard,
+    Chat-Frage nach aktiven Kunden und die KPI-Karten für die letzten 30 Tage
+    und den laufenden Monat. KPI-Typen, die der Rollup bereits abdeckt, entfallen.
+    
+    Args:
+        seller_id (str): ID des Verkäufers
+        
+    Returns:
+        list: (Muster, Parameter) wie in /get_dashboard_data bzw. /get_kpi_data
+    """
+    queries = dashboard_query_set(seller_id, date.today())
+    for start_date, end_date in kpi_ranges(date.today()):
+        for query_type in KPI_PREFETCH_TYPES:
+            if query_type in KPI_ROLLUP_TYPES and kpi_rollup.get_kpi(seller_id, query_type, start_date, end_date) is not None:
+                continue
+            eintrag = (KPI_QUERY_PATTERNS[query_type],
+                       {'seller_id': seller_id, 'start_date': start_date, 'end_date': end_date, 'limit': 100})
+            if eintrag not in queries:
+                queries.append(eintrag)
+    return queries
+
+def starte_login_prefetch(seller_id):
+    """Lädt nach dem Login Dashboard- und KPI-Daten im Hintergrund in den Result-Cache."""
+    if not seller_id:
+        return
+    try:
+        cache_warmer.record_activity(seller_id)
+        cache_warmer.prefetch(seller_id, prefetch_query_set(seller_id))
+        if kpi_rollup.coverage(seller_id) is None:
+            starte_kpi_rollup(seller_id)
+        seller_replicas.refresh_in_background(seller_id)
+    except Exception as e:
+        # Der Login darf am Vorwärmen nie scheitern
+        logging.warning(f"Login-Prefetch für Seller {seller_id} nicht gestartet: {e}")
+
+# Seitenweise Auslieferung von Abfrageergebnissen (Dashboard-Tabellen, Leads-Listen)
+page_cursor = PageCursor(app.secret_key)
+
+@app.route('/query_pages/<pattern_name>', methods=['GET'])
+def query_pages(pattern_name):
+    """
+    Liefert das Ergebnis eines Abfragemusters seitenweise.
+
+    Request-Argumente: Parameter des Musters, page_size, page_token und
+    format ("rows", "columnar": Spaltennamen einmal und Wertelisten,
+    "ndjson": alle Seiten als Stream, eine Zeile pro Datensatz).
+    """
+    seller_id = session.get('seller_id')
+    if not seller_id:
+        return jsonify({"error": "Keine Seller ID gefunden", "status": "error"}), 401
+    query_pattern = load_query_patterns_cached().get(pattern_name)
+    if query_pattern is None:
+        return jsonify({"error": f"Abfrage {pattern_name} nicht gefunden", "status": "error"}), 404
+    result_format = request.args.get('format', 'rows')
+    if result_format not in RESULT_FORMATS:
+        return jsonify({"error": f"Unbekanntes Format {result_format}", "status": "error"}), 400
+
+    try:
+        parameters = pattern_parameters(query_pattern, request.args, seller_id)
+        parameters = apply_query_enhancements(pattern_name, parameters, resolver=customer_name_resolver)
+        page_size = page_size_from(request.args.get('page_size'))
+        cursor = None
+        if request.args.get('page_token'):
+            cursor = page_cursor.decode(request.args['page_token'], pattern_name, parameters)
+    except ValueError as e:
+        return jsonify({"error": str(e), "status": "error"}), 400
+
+    result_structure = query_pattern.get('result_structure')
+    try:
+        if result_format == 'ndjson':
+            # Erste Seite vor dem Stream holen, damit Fehler einen passenden Status erhalten
+            pages = iter_query_pages(pattern_name, parameters, page_size=MAX_PAGE_SIZE, route='query_pages')
+            first_page = next(pages, [])
+            formatted_pages = (format_query_result(page, result_structure)
+                               for page in itertools.chain([first_page], pages))
+            return Response(ndjson_lines(formatted_pages), content_type="application/x-ndjson")
+        rows, next_cursor, source = read_query_page(pattern_name, parameters, page_size, cursor=cursor)
+    except (AbfrageZuTeuer, AbfrageTimeout) as e:
+        return jsonify({"error": str(e), "status": "error"}), 503
+    except Exception as e:
+        logging.error(f"Seitenabfrage {pattern_name} fehlgeschlagen: {e}")
+        return jsonify({"error": "Fehler bei der Abfrage", "status": "error"}), 500
+
+    rows = format_query_result(rows, result_structure)
+    antwort = {
+        "next_page_token": page_cursor.encode(next_cursor, pattern_name, parameters),
+        "count": len(rows),
+        "source": source,
+        "status": "success"
+    }
+    if result_format == 'columnar':
+        antwort["columns"] = result_columns(rows, result_structure)
+        antwort["rows"] = to_columnar(rows, antwort["columns"])
+    else:
+        antwort["data"] = rows
+    return jsonify(antwort)
+
+@app.route('/export/<pattern_name>', methods=['GET'])
+def export_query(pattern_name):
+    """
+    Exportiert das Ergebnis eines Abfragemusters als CSV oder XLSX (format=csv|xlsx).
+
+    Die Zeilen werden seitenweise aus dem Result-Cache oder direkt aus den
+    BigQuery-Ergebnisseiten geschrieben und als Chunks ausgeliefert.
+    """
+    seller_id = session.get('seller_id')
+    if not seller_id:
+        return jsonify({"error": "Keine Seller ID gefunden", "status": "error"}), 401
+    query_pattern = load_query_patterns_cached().get(pattern_name)
+    if query_pattern is None:
+        return jsonify({"error": f"Abfrage {pattern_name} nicht gefunden", "status": "error"}), 404
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": f"Unbekanntes Format {export_format}", "status": "error"}), 400
+    if export_format == 'xlsx' and not xlsx_available():
+        return jsonify({"error": "XLSX-Export ist nicht verfügbar (openpyxl fehlt)", "status": "error"}), 501
+
+    try:
+        parameters = pattern_parameters(query_pattern, request.args, seller_id)
+        parameters = apply_query_enhancements(pattern_name, parameters, resolver=customer_name_resolver)
+    except ValueError as e:
+        return jsonify({"error": str(e), "status": "error"}), 400
+
+    try:
+        # Erste Seite vor dem Stream holen: Fehler erhalten einen Status, die Spalten stehen fest
+        pages = iter_query_pages(pattern_name, parameters, page_size=EXPORT_PAGE_SIZE, route='export')
+        first_page = next(pages, [])
+    except (AbfrageZuTeuer, AbfrageTimeout) as e:
+        return jsonify({"error": str(e), "status": "error"}), 503
+    except Exception as e:
+        logging.error(f"Export {pattern_name} fehlgeschlagen: {e}")
+        return jsonify({"error": "Fehler bei der Abfrage", "status": "error"}), 500
+
+    columns = result_columns(first_page, query_pattern.get('result_structure'))
+    all_pages = itertools.chain([first_page], pages)
+    if export_format == 'xlsx':
+        chunks = xlsx_chunks(all_pages, columns, sheet_title=pattern_name)
+    else:
+        chunks = csv_chunks(all_pages, columns)
+    filename = f"{pattern_name}_{date.today().isoformat()}.{export_format}"
+    return Response(chunks, content_type=EXPORT_FORMATS[export_format],
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
 @app.route('/update_stream_chat_history', methods=['POST'])
 def update_stream_chat_history():
     """Update chat history in the session from streaming responses"""
@@ -3225,6 +3657,15 @@ def update_stream_chat_history():
         
         # Add the new messages
         chat_history.append({"user": user_message, "bot": bot_response})
+        # Digest der Abfrage aus dem complete-Event des Streams (nur Name und gekürzter Digest)
+        function_call = data.get('function_call')
+        if not (isinstance(function_call, dict) and isinstance(function_call.get('name'), str)
+                and isinstance(function_call.get('digest'), str)):
+            function_call = None
+        else:
+            function_call = {"name": function_call['name'][:100],
+                             "digest": function_call['digest'][:MAX_STREAM_DIGEST_CHARS]}
+        merke_konversation(user_message, bot_response, function_call)
         
         # Update the session
         session[chat_key] = chat_history
@@ -3315,6 +3756,24 @@ def debug_dashboard():
         debug_info["query_patterns_loaded"] = False
         debug_info["query_patterns_error"] = str(e)
     
+    # Trefferquoten von Answer-Templates und Entscheidungs-Cache
+    debug_info["answer_templates"] = get_template_stats()
+    debug_info["decision_cache"] = decision_cache.get_stats()
+    debug_info["wissensbasis_answer_cache"] = wissensbasis_answer_cache.get_stats()
+    debug_info["wissensbasis_store"] = dict(wissensbasis_store.stats)
+    debug_info["job_queue"] = job_queue.get_stats()
+    debug_info["upload_registry"] = upload_registry.get_stats()
+    debug_info["near_duplicates"] = near_duplicate_detector.get_stats()
+    debug_info["themen_hierarchie"] = themen_hierarchie_service.get_stats()
+    debug_info["customer_name_index"] = customer_name_resolver.get_stats()
+    debug_info["bigquery_costs"] = query_cost_tracker.get_stats()
+    debug_info["kpi_rollup"] = kpi_rollup.get_stats()
+    debug_info["seller_replicas"] = seller_replicas.get_stats()
+    debug_info["result_cache"] = result_cache.get_stats()
+    debug_info["team_queries"] = dict(team_query_stats)
+    debug_info["cache_warmer"] = cache_warmer.get_stats()
+    debug_info["startup"] = service_registry.startup_report()
+    
     # HTML-Ausgabe für leichtere Lesbarkeit
     html_output = "<h1>Dashboard Debug-Informationen</h1>"
     html_output += "<pre>" + json.dumps(debug_info, indent=4) + "</pre>"
@@ -3440,6 +3899,8 @@ def inject_csrf_token():
 def ensure_user_id():
     if 'user_id' not in session:
         session['user_id'] = str(uuid.uuid4())
+    # Aktive Verkäufer für den täglichen Cache-Warmer merken (ein Schreibzugriff pro Tag)
+    cache_warmer.record_activity(session.get('seller_id'))
 
 ###########################################
 # Login-Decorator
@@ -3508,18 +3969,19 @@ def get_clarification_response():
             
             # Create enhanced system prompt for LLM response generation
             system_prompt = create_enhanced_system_prompt(selected_query)
+            compact_result = compact_tool_result(selected_query, tool_result)
             
             messages = [
                 {"role": "developer", "content": system_prompt},
                 {"role": "user", "content": pending_query},
-                {"role": "function", "name": selected_query, "content": tool_result}
+                {"role": "function", "name": selected_query, "content": compact_result}
             ]
             
             # Generate response with LLM
             # gpt-4o doesn't support function role, so we'll convert the function message to a user message
             adjusted_messages = [
                 {"role": "developer", "content": system_prompt},
-                {"role": "user", "content": f"User question: {pending_query}\n\nQuery result: {tool_result}"}
+                {"role": "user", "content": f"User question: {pending_query}\n\nQuery result: {compact_result}"}
             ]
             
             response = openai.chat.completions.create(
@@ -3535,6 +3997,7 @@ def get_clarification_response():
             chat_history.append({"role": "user", "content": pending_query})
             chat_history.append({"role": "assistant", "content": final_response})
             session[chat_key] = chat_history
+            merke_konversation(pending_query, final_response)
             session.modified = True
             
             # Return the response as JSON
@@ -3567,6 +4030,9 @@ def clear_chat_history():
             return redirect(url_for('chat'))
 
         chat_key = f'chat_history_{user_id}'
+        # Kontext für das LLM gemeinsam mit dem sichtbaren Verlauf verwerfen
+        session.pop('conversation_history', None)
+        session.pop('conversation_summary', None)
         if chat_key in session:
             session.pop(chat_key)
             flash('Chatverlauf wurde erfolgreich geleert.', 'success')
@@ -3628,6 +4094,50 @@ def login():
     # Render login template mit Google-Login-Option
     return render_template('login.html')
 
+###########################################
+# Team-KPIs (Teamleiter-Ansicht)
+###########################################
+@app.route('/admin/team_kpi_data', methods=['GET'])
+@login_required
+def team_kpi_data():
+    """
+    Liefert KPI-Daten für mehrere Verkäufer (seller_ids kommagetrennt).
+    Muster mit Team-Variante laufen für alle Verkäufer in einem BigQuery-Job;
+    die Ergebnisse landen pro Verkäufer im Result-Cache.
+    """
+    seller_ids = [s.strip() for s in request.args.get('seller_ids', '').split(',') if s.strip()]
+    start_date_str = request.args.get('start_date')
+    end_date_str = request.args.get('end_date')
+    query_type = request.args.get('query_type', 'conversion_rate')
+
+    if not seller_ids:
+        return jsonify({"error": "seller_ids sind erforderlich", "status": "error"}), 400
+    if query_type not in KPI_QUERY_PATTERNS:
+        return jsonify({"error": f"Unbekannter KPI-Typ {query_type}", "status": "error"}), 400
+    try:
+        datetime.strptime(start_date_str or '', '%Y-%m-%d')
+        datetime.strptime(end_date_str or '', '%Y-%m-%d')
+    except ValueError:
+        return jsonify({"error": "Ungültiges Datumsformat (erwartet YYYY-MM-DD)", "status": "error"}), 400
+    if start_date_str > end_date_str:
+        return jsonify({"error": "Startdatum darf nicht nach dem Enddatum liegen", "status": "error"}), 400
+
+    try:
+        ergebnis = run_team_query(KPI_QUERY_PATTERNS[query_type],
+                                  seller_ids,
+                                  {'start_date': start_date_str, 'end_date': end_date_str, 'limit': 100})
+    except (AbfrageZuTeuer, AbfrageTimeout) as e:
+        return jsonify({"error": str(e), "status": "error"}), 503
+    except Exception as e:
+        logging.error(f"Team-KPIs: Fehler bei {query_type}: {e}")
+        return jsonify({"error": "Fehler bei der Abfrage", "status": "error"}), 500
+
+    return jsonify({
+        "data": ergebnis,
+        "query_type": query_type,
+        "status": "success"
+    })
+
 ###########################################
 # Lade Themen
 ###########################################
@@ -3674,10 +4184,7 @@ def admin():
                     return redirect(url_for('admin'))
 
                 # Kategorisierung (Beispiel)
-                themen_hierarchie = ''
-                if os.path.exists(themen_datei):
-                    with open(themen_datei, 'r', encoding='utf-8') as f:
-                        themen_hierarchie = f.read()
+                themen_hierarchie = themen_hierarchie_service.get_prompt_text()
 
                 kategorisierung_messages = [
                     {"role": "user",
@@ -3700,19 +4207,20 @@ def admin():
                     else:
                         raise ValueError("Kein gültiger JSON-Inhalt gefunden")
 
-                    for eintrag_kat in kategorisierte_eintraege:
-                        thema = eintrag_kat.get('thema')
-                        unterthema = eintrag_kat.get('unterthema')
-                        beschreibung = eintrag_kat.get('beschreibung', '')
-                        inhalt = eintrag_kat.get('inhalt')
-                        if thema and unterthema and inhalt:
-                            speichere_wissensbasis({
-                                "thema": thema,
-                                "unterthema": unterthema,
-                                "beschreibung": beschreibung,
-                                "inhalt": inhalt
-                            })
-                    flash("Alle Einträge erfolgreich gespeichert.", 'success')
+                    batch_ergebnis = speichere_wissensbasis_batch(
+                        {
+                            "thema": eintrag_kat.get('thema'),
+                            "unterthema": eintrag_kat.get('unterthema'),
+                            "beschreibung": eintrag_kat.get('beschreibung', ''),
+                            "inhalt": eintrag_kat.get('inhalt')
+                        }
+                        for eintrag_kat in kategorisierte_eintraege
+                        if eintrag_kat.get('thema') and eintrag_kat.get('unterthema') and eintrag_kat.get('inhalt')
+                    )
+                    flash(f"Alle Einträge erfolgreich gespeichert ({batch_ergebnis['applied']} Einträge).", 'success')
+                except (WissensbasisSpeicherfehler, WissensbasisKonflikt) as e:
+                    logging.error(f"Einträge nicht gespeichert: {e}")
+                    flash("Die Einträge konnten nicht gespeichert werden. Bitte erneut versuchen.", 'danger')
                 except Exception as e:
                     debug_print("Bearbeiten von Einträgen", f"Parsing-Fehler: {e}")
                     flash("KI-Antwort konnte nicht geparst werden.", 'danger')
@@ -3796,21 +4304,23 @@ def update_entry():
         if not thema or not unterthema:
             return jsonify({'success': False, 'message': 'Ungültige Daten.'}), 400
 
-        wissensbasis = download_wissensbasis()
-        if thema in wissensbasis and unterthema in wissensbasis[thema]:
-            wissensbasis[thema][unterthema]['beschreibung'] = beschreibung
-            wissensbasis[thema][unterthema]['inhalt'] = inhalt.split('\n')
-            upload_wissensbasis(wissensbasis)
-            logging.debug(f"Eintrag '{unterthema}' in Thema '{thema}' aktualisiert.")
-            return jsonify({'success': True}), 200
-        else:
+        def aenderung(wissensbasis):
+            if thema in wissensbasis and unterthema in wissensbasis[thema]:
+                wissensbasis[thema][unterthema]['beschreibung'] = beschreibung
+                wissensbasis[thema][unterthema]['inhalt'] = inhalt.split('\n')
+                return "aktualisiert"
             wissensbasis.setdefault(thema, {})[unterthema] = {
                 'beschreibung': beschreibung,
                 'inhalt': inhalt.split('\n')
             }
-            upload_wissensbasis(wissensbasis)
-            logging.debug(f"Eintrag '{unterthema}' in Thema '{thema}' neu erstellt.")
-            return jsonify({'success': True}), 200
+            return "neu erstellt"
+
+        aktion = commit_wissensbasis(aenderung)
+        logging.debug(f"Eintrag '{unterthema}' in Thema '{thema}' {aktion}.")
+        return jsonify({'success': True}), 200
+    except WissensbasisKonflikt:
+        logging.exception("Konflikt beim Aktualisieren des Eintrags.")
+        return jsonify({'success': False, 'message': 'Die Wissensbasis wurde gleichzeitig geändert. Bitte erneut versuchen.'}), 409
     except Exception as e:
         logging.exception("Fehler beim Aktualisieren des Eintrags.")
         return jsonify({'success': False, 'message': 'Interner Fehler.'}), 500
@@ -3823,25 +4333,31 @@ def move_entry():
         thema = data.get('thema')
         unterthema = data.get('unterthema')
         direction = data.get('direction')
-        wissensbasis = download_wissensbasis()
 
-        if thema not in wissensbasis or unterthema not in wissensbasis[thema]:
-            return jsonify({'success': False, 'message': 'Eintrag nicht gefunden.'}), 404
+        def aenderung(wissensbasis):
+            if thema not in wissensbasis or unterthema not in wissensbasis[thema]:
+                raise WissensbasisAbbruch('Eintrag nicht gefunden.', 404)
 
-        unterthemen = list(wissensbasis[thema].keys())
-        idx = unterthemen.index(unterthema)
+            unterthemen = list(wissensbasis[thema].keys())
+            idx = unterthemen.index(unterthema)
 
-        if direction == 'up' and idx > 0:
-            unterthemen[idx], unterthemen[idx-1] = unterthemen[idx-1], unterthemen[idx]
-        elif direction == 'down' and idx < len(unterthemen) - 1:
-            unterthemen[idx], unterthemen[idx+1] = unterthemen[idx+1], unterthemen[idx]
-        else:
-            return jsonify({'success': False, 'message': 'Verschieben nicht möglich.'}), 400
+            if direction == 'up' and idx > 0:
+                unterthemen[idx], unterthemen[idx-1] = unterthemen[idx-1], unterthemen[idx]
+            elif direction == 'down' and idx < len(unterthemen) - 1:
+                unterthemen[idx], unterthemen[idx+1] = unterthemen[idx+1], unterthemen[idx]
+            else:
+                raise WissensbasisAbbruch('Verschieben nicht möglich.', 400)
 
-        wissensbasis[thema] = {k: wissensbasis[thema][k] for k in unterthemen}
-        upload_wissensbasis(wissensbasis)
+            wissensbasis[thema] = {k: wissensbasis[thema][k] for k in unterthemen}
+
+        commit_wissensbasis(aenderung)
         logging.debug(f"Eintrag '{unterthema}' verschoben -> {direction}.")
         return jsonify({'success': True}), 200
+    except WissensbasisAbbruch as e:
+        return jsonify({'success': False, 'message': e.message}), e.status_code
+    except WissensbasisKonflikt:
+        logging.exception("Konflikt beim Verschieben.")
+        return jsonify({'success': False, 'message': 'Die Wissensbasis wurde gleichzeitig geändert. Bitte erneut versuchen.'}), 409
     except Exception as e:
         logging.exception("Fehler beim Verschieben.")
         return jsonify({'success': False, 'message': 'Interner Fehler.'}), 500
@@ -3853,15 +4369,20 @@ def delete_entry():
         data = request.get_json()
         thema = data.get('thema')
         unterthema = data.get('unterthema')
-        wissensbasis = download_wissensbasis()
 
-        if thema in wissensbasis and unterthema in wissensbasis[thema]:
+        def aenderung(wissensbasis):
+            if thema not in wissensbasis or unterthema not in wissensbasis[thema]:
+                raise WissensbasisAbbruch('Eintrag nicht gefunden.', 404)
             del wissensbasis[thema][unterthema]
-            upload_wissensbasis(wissensbasis)
-            logging.debug(f"Eintrag '{unterthema}' gelöscht.")
-            return jsonify({'success': True}), 200
-        else:
-            return jsonify({'success': False, 'message': 'Eintrag nicht gefunden.'}), 404
+
+        commit_wissensbasis(aenderung)
+        logging.debug(f"Eintrag '{unterthema}' gelöscht.")
+        return jsonify({'success': True}), 200
+    except WissensbasisAbbruch as e:
+        return jsonify({'success': False, 'message': e.message}), e.status_code
+    except WissensbasisKonflikt:
+        logging.exception("Konflikt beim Löschen.")
+        return jsonify({'success': False, 'message': 'Die Wissensbasis wurde gleichzeitig geändert. Bitte erneut versuchen.'}), 409
     except Exception as e:
         logging.exception("Fehler beim Löschen.")
         return jsonify({'success': False, 'message': 'Interner Fehler.'}), 500
@@ -3870,7 +4391,6 @@ def delete_entry():
 @login_required
 def sort_entries():
     try:
-        wissensbasis = download_wissensbasis()
         def sort_key(k):
             match = re.match(r'(\d+)([a-z]*)', k)
             if match:
@@ -3879,12 +4399,17 @@ def sort_entries():
                 return (num, suf)
             return (0, k)
 
-        for thema, unterthemen in wissensbasis.items():
-            sorted_keys = sorted(unterthemen.keys(), key=sort_key)
-            wissensbasis[thema] = {k: wissensbasis[thema][k] for k in sorted_keys}
-        upload_wissensbasis(wissensbasis)
+        def aenderung(wissensbasis):
+            for thema, unterthemen in wissensbasis.items():
+                sorted_keys = sorted(unterthemen.keys(), key=sort_key)
+                wissensbasis[thema] = {k: wissensbasis[thema][k] for k in sorted_keys}
+
+        commit_wissensbasis(aenderung)
         logging.debug("Wissensbasis sortiert.")
         return jsonify({'success': True}), 200
+    except WissensbasisKonflikt:
+        logging.exception("Konflikt beim Sortieren.")
+        return jsonify({'success': False, 'message': 'Die Wissensbasis wurde gleichzeitig geändert. Bitte erneut versuchen.'}), 409
     except Exception as e:
         logging.exception("Fehler beim Sortieren.")
         return jsonify({'success': False, 'message': 'Interner Fehler.'}), 500
@@ -3972,6 +4497,9 @@ def upload_files():
 
         if 'uploaded_files' not in session:
             session['uploaded_files'] = []
+        # Admin-Override: bereits verarbeitete Dateien erneut zulassen, z.B. nachdem
+        # ihre Einträge aus der Wissensbasis entfernt wurden
+        erneut_verarbeiten = request.form.get('force') == '1'
         files_status = []
         for file in files:
             filename = secure_filename(file.filename)
@@ -3979,12 +4507,22 @@ def upload_files():
                 continue
             file_id = str(uuid.uuid4())
             temp_filepath = os.path.join(app.config['UPLOAD_FOLDER'], file_id + '_' + filename)
-            file.save(temp_filepath)
+            content_hash = save_and_hash(file, temp_filepath)
             file_status = {
                 'id': file_id,
                 'filename': filename,
-                'status': 'Hochgeladen'
+                'status': 'Hochgeladen',
+                'content_hash': content_hash
             }
+            # Gleiche Datei schon verarbeitet oder in dieser Sitzung bereits hochgeladen?
+            if erneut_verarbeiten:
+                upload_registry.forget(content_hash)
+            bekannt = upload_registry.lookup(content_hash)
+            offen = next((f for f in session['uploaded_files']
+                          if f.get('content_hash') == content_hash and f['status'] in ('Hochgeladen', 'In Warteschlange')), None)
+            if bekannt or offen:
+                os.remove(temp_filepath)
+                file_status['status'] = 'Bereits verarbeitet (Duplikat)' if bekannt else 'Duplikat von ' + offen['filename']
             session['uploaded_files'].append(file_status)
             files_status.append(file_status)
 
@@ -3994,92 +4532,174 @@ def upload_files():
         logging.exception("Fehler beim Hochladen von Dateien.")
         return jsonify({'success': False, 'message': 'Interner Fehler.'}), 500
 
-@app.route('/process_file_ai', methods=['POST'])
-@login_required
-def process_file_ai():
+def extrahiere_text(filepath, ext):
+    """Extrahiert den Text einer hochgeladenen TXT-, PDF- oder Word-Datei."""
     try:
-        data = request.get_json()
-        file_id = data.get('file_id')
-        uploaded_files = session.get('uploaded_files', [])
-        file_entry = next((f for f in uploaded_files if f['id'] == file_id), None)
-
-        if not file_entry:
-            return jsonify({'success': False, 'message': 'Datei nicht gefunden.'}), 404
-        if file_entry['status'] != 'Hochgeladen':
-            return jsonify({'success': False, 'message': 'Datei bereits verarbeitet.'}), 400
-
-        temp_filepath = os.path.join(app.config['UPLOAD_FOLDER'], file_id + '_' + file_entry['filename'])
-        if not os.path.exists(temp_filepath):
-            return jsonify({'success': False, 'message': 'Temporäre Datei nicht gefunden.'}), 404
-
-        ext = os.path.splitext(file_entry['filename'])[1].lower()
-        extracted_text = ""
-        if ext == '.txt':
-            with open(temp_filepath, 'r', encoding='utf-8') as f:
-                extracted_text = f.read()
-        elif ext == '.pdf':
-            with open(temp_filepath, 'rb') as f:
-                reader = PdfReader(f)
-                for page in reader.pages:
-                    extracted_text += page.extract_text() + "\n"
-        elif ext in ['.doc', '.docx']:
-            doc = docx.Document(temp_filepath)
-            for para in doc.paragraphs:
-                extracted_text += para.text + "\n"
-        else:
-            return jsonify({'success': False, 'message': 'Unsupported file type.'}), 400
-
-        if not extracted_text.strip():
-            file_entry['status'] = 'Fehler: Kein Text extrahiert'
-            session.modified = True
-            return jsonify({'success': False, 'message': 'Kein Text extrahiert.'}), 400
+        return "".join(iter_pages(filepath, ext))
+    except ValueError:
+        raise JobAbbruch('Unsupported file type.')
+
+def _bereits_verarbeitet(job):
+    """Gleiche Datei wurde inzwischen von einem anderen Job verarbeitet: Upload verwerfen."""
+    content_hash = job.payload.get('content_hash')
+    if not content_hash or not upload_registry.lookup(content_hash):
+        return False
+    if os.path.exists(job.payload['filepath']):
+        os.remove(job.payload['filepath'])
+    logging.info(f"Job {job.id}: Datei {job.payload.get('filename')} bereits verarbeitet, übersprungen.")
+    return True
+
+def job_process_file_ai(job):
+    """
+    Hintergrund-Job: Datei seitenweise extrahieren, in Abschnitte zerlegen, parallel
+    per KI kategorisieren und die zusammengeführten Einträge gesammelt speichern.
+    """
+    temp_filepath = job.payload['filepath']
+    if _bereits_verarbeitet(job):
+        return {'file_status': 'Bereits verarbeitet (Duplikat)', 'entries_saved': 0}
+    if not os.path.exists(temp_filepath):
+        raise JobAbbruch('Temporäre Datei nicht gefunden.')
 
-        themen_hierarchie = ''
-        if os.path.exists(themen_datei):
-            with open(themen_datei, 'r', encoding='utf-8') as f:
-                themen_hierarchie = f.read()
+    themen_hierarchie = themen_hierarchie_service.get_prompt_text()
 
+    def kategorisiere(chunk):
         kategorisierung_messages = [
             {"role": "user", "content": "Du bist ein Assistent, der Texte in vorgegebene Themen..."},
-            {"role": "user", "content": f"Hier die Themenhierarchie:\n\n{themen_hierarchie}\n\nText:\n{extracted_text}"}
+            {"role": "user", "content": f"Hier die Themenhierarchie:\n\n{themen_hierarchie}\n\nText:\n{chunk}"}
         ]
-        kategorisierung_response = contact_openai(kategorisierung_messages, model="gpt-4o")
-        if not kategorisierung_response:
-            file_entry['status'] = 'Fehler: Kategorisierung fehlgeschlagen'
-            session.modified = True
-            return jsonify({'success': False, 'message': 'Kategorisierung fehlgeschlagen.'}), 500
+        antwort, _ = contact_openai(kategorisierung_messages, model="gpt-4o")
+        return antwort
 
-        try:
-            kategorisierung_text = kategorisierung_response
-            json_match = re.search(r'\[\s*{.*}\s*\]', kategorisierung_text, re.DOTALL)
-            if json_match:
-                json_text = json_match.group(0)
-                json_text = re.sub(r'(\d+[a-z]*)\)\)', r'\1)', json_text)
-                kategorisierte_eintraege = json.loads(json_text)
-            else:
-                raise ValueError("Kein gültiger JSON-Inhalt gefunden")
-
-            for eintrag_kat in kategorisierte_eintraege:
-                thema = eintrag_kat.get('thema')
-                unterthema = eintrag_kat.get('unterthema')
-                beschreibung = eintrag_kat.get('beschreibung', '')
-                inhalt = eintrag_kat.get('inhalt')
-                if thema and unterthema and inhalt:
-                    speichere_wissensbasis({
-                        "thema": thema,
-                        "unterthema": unterthema,
-                        "beschreibung": beschreibung,
-                        "inhalt": inhalt
-                    })
+    def fortschritt(fertig, gelesen):
+        # 5-80 % für die Kategorisierung; die Gesamtzahl steht erst am Ende fest
+        job.progress(5 + int(75 * fertig / max(gelesen, 1)), f'{fertig} von {gelesen} Abschnitten kategorisiert')
 
-            file_entry['status'] = 'Erfolgreich verarbeitet (KI)'
-            session.modified = True
-            os.remove(temp_filepath)
-            return jsonify({'success': True, 'message': 'Datei erfolgreich verarbeitet.'}), 200
-        except (ValueError, json.JSONDecodeError):
-            file_entry['status'] = 'Fehler: Parsing-Fehler'
-            session.modified = True
-            return jsonify({'success': False, 'message': 'Parsing-Fehler bei der Kategorisierung.'}), 500
+    job.progress(5, 'Dokument wird zerlegt')
+    try:
+        chunks = split_into_chunks(iter_pages(temp_filepath, job.payload['ext']),
+                                   token_budget=int(os.getenv('INGESTION_CHUNK_TOKENS', '3000')))
+        kategorisierte_eintraege, stats = categorize_chunks(
+            chunks, kategorisiere, max_workers=int(os.getenv('INGESTION_MAX_WORKERS', '4')), on_progress=fortschritt
+        )
+    except ValueError:
+        raise JobAbbruch('Unsupported file type.')
+
+    if stats['chunks'] == 0:
+        raise JobAbbruch('Kein Text extrahiert.')
+    if stats['parse_errors'] == stats['chunks']:
+        raise JobAbbruch('Parsing-Fehler bei der Kategorisierung.')
+
+    job.progress(85, 'Wissensbasis wird gespeichert')
+    batch_ergebnis = speichere_wissensbasis_batch(merge_entries(kategorisierte_eintraege, lade_themen()))
+
+    os.remove(temp_filepath)
+    if job.payload.get('content_hash'):
+        upload_registry.register(job.payload['content_hash'], job.payload.get('filename'), 'ki')
+    return {
+        'file_status': 'Erfolgreich verarbeitet (KI)',
+        'entries_saved': batch_ergebnis['applied'],
+        'duplicates_skipped': batch_ergebnis['duplicates'],
+        'roundtrips_saved': batch_ergebnis['roundtrips_saved'],
+        'chunks': stats['chunks'],
+        'parse_errors': stats['parse_errors']
+    }
+
+def job_process_file_manual(job):
+    """Hintergrund-Job: Datei extrahieren und unter dem gewählten Thema speichern."""
+    temp_filepath = job.payload['filepath']
+    if _bereits_verarbeitet(job):
+        return {'file_status': 'Bereits verarbeitet (Duplikat)', 'entries_saved': 0}
+    if not os.path.exists(temp_filepath):
+        raise JobAbbruch('Temporäre Datei nicht gefunden.')
+
+    job.progress(20, 'Text wird extrahiert')
+    extracted_text = extrahiere_text(temp_filepath, job.payload['ext'])
+    if not extracted_text.strip():
+        raise JobAbbruch('Kein Text extrahiert.')
+
+    job.progress(60, 'Wissensbasis wird gespeichert')
+    batch_ergebnis = speichere_wissensbasis_batch([{
+        "thema": job.payload['thema'],
+        "unterthema": job.payload['unterthema'],
+        "beschreibung": job.payload['beschreibung'],
+        "inhalt": extracted_text
+    }])
+    if batch_ergebnis['duplicates']:
+        os.remove(temp_filepath)
+        return {'file_status': 'Inhalt bereits vorhanden', 'entries_saved': 0}
+    if not batch_ergebnis['applied']:
+        raise JobAbbruch('Thema und Unterthema müssen angegeben werden.')
+
+    os.remove(temp_filepath)
+    if job.payload.get('content_hash'):
+        upload_registry.register(job.payload['content_hash'], job.payload.get('filename'), 'manuell')
+    return {'file_status': 'Erfolgreich verarbeitet (Manuell)', 'entries_saved': batch_ergebnis['applied']}
+
+job_queue.register('process_file_ai', job_process_file_ai, max_attempts=3)
+job_queue.register('process_file_manual', job_process_file_manual, max_attempts=3)
+job_queue.register('kpi_rollup_refresh', job_kpi_rollup_refresh, max_attempts=3)
+job_queue.start()
+# Nächtlicher Refresh der KPI-Tageswerte aller bekannten Verkäufer
+if os.getenv('KPI_ROLLUP_SCHEDULER', '1') == '1':
+    kpi_rollup.start_scheduler(starte_kpi_rollup, hour=int(os.getenv('KPI_ROLLUP_HOUR', '3')))
+
+# Optional: morgens den Result-Cache für alle gestern aktiven Verkäufer vorwärmen
+if os.getenv('CACHE_WARMER', '0') == '1':
+    cache_warmer.start_scheduler(
+        prefetch_query_set,
+        hour=int(os.getenv('CACHE_WARMER_HOUR', '7')),
+        ttl=int(os.getenv('CACHE_WARMER_TTL', str(3 * 3600))),
+        max_sellers=int(os.getenv('CACHE_WARMER_MAX_SELLERS', '200'))
+    )
+
+def _hochgeladene_datei(file_id):
+    """
+    Sucht eine hochgeladene Datei in der Session und prüft, ob sie verarbeitet werden kann.
+
+    Returns:
+        (file_entry, temp_filepath, None) oder (None, None, Fehlerantwort)
+    """
+    uploaded_files = session.get('uploaded_files', [])
+    file_entry = next((f for f in uploaded_files if f['id'] == file_id), None)
+
+    if not file_entry:
+        return None, None, (jsonify({'success': False, 'message': 'Datei nicht gefunden.'}), 404)
+    if file_entry['status'] != 'Hochgeladen':
+        return None, None, (jsonify({'success': False, 'message': 'Datei bereits verarbeitet.'}), 400)
+
+    temp_filepath = os.path.join(app.config['UPLOAD_FOLDER'], file_id + '_' + file_entry['filename'])
+    if not os.path.exists(temp_filepath):
+        return None, None, (jsonify({'success': False, 'message': 'Temporäre Datei nicht gefunden.'}), 404)
+    if os.path.splitext(file_entry['filename'])[1].lower() not in ['.txt', '.pdf', '.doc', '.docx']:
+        return None, None, (jsonify({'success': False, 'message': 'Unsupported file type.'}), 400)
+    return file_entry, temp_filepath, None
+
+def _job_antwort(file_entry, job_id):
+    file_entry['status'] = 'In Warteschlange'
+    file_entry['job_id'] = job_id
+    session.modified = True
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status_url': url_for('job_status', job_id=job_id)
+    }), 202
+
+@app.route('/process_file_ai', methods=['POST'])
+@login_required
+def process_file_ai():
+    try:
+        data = request.get_json()
+        file_entry, temp_filepath, fehler = _hochgeladene_datei(data.get('file_id'))
+        if fehler:
+            return fehler
+
+        job_id = job_queue.enqueue('process_file_ai', {
+            'filepath': temp_filepath,
+            'filename': file_entry['filename'],
+            'content_hash': file_entry.get('content_hash'),
+            'ext': os.path.splitext(file_entry['filename'])[1].lower()
+        }, owner=session.get('user_id'))
+        return _job_antwort(file_entry, job_id)
 
     except Exception as e:
         logging.exception("Fehler bei der automatischen Verarbeitung der Datei.")
@@ -4090,61 +4710,68 @@ def process_file_ai():
 def process_file_manual():
     try:
         data = request.get_json()
-        file_id = data.get('file_id')
-        selected_thema = data.get('thema')
-        selected_unterthema = data.get('unterthema')
-        beschreibung = data.get('beschreibung', '').strip()
-
-        uploaded_files = session.get('uploaded_files', [])
-        file_entry = next((f for f in uploaded_files if f['id'] == file_id), None)
-
-        if not file_entry:
-            return jsonify({'success': False, 'message': 'Datei nicht gefunden.'}), 404
-        if file_entry['status'] != 'Hochgeladen':
-            return jsonify({'success': False, 'message': 'Datei bereits verarbeitet.'}), 400
-
-        temp_filepath = os.path.join(app.config['UPLOAD_FOLDER'], file_id + '_' + file_entry['filename'])
-        if not os.path.exists(temp_filepath):
-            return jsonify({'success': False, 'message': 'Temporäre Datei nicht gefunden.'}), 404
-
-        ext = os.path.splitext(file_entry['filename'])[1].lower()
-        extracted_text = ""
-        if ext == '.txt':
-            with open(temp_filepath, 'r', encoding='utf-8') as f:
-                extracted_text = f.read()
-        elif ext == '.pdf':
-            with open(temp_filepath, 'rb') as f:
-                reader = PdfReader(f)
-                for page in reader.pages:
-                    extracted_text += page.extract_text() + "\n"
-        elif ext in ['.doc', '.docx']:
-            doc = docx.Document(temp_filepath)
-            for para in doc.paragraphs:
-                extracted_text += para.text + "\n"
-        else:
-            return jsonify({'success': False, 'message': 'Unsupported file type.'}), 400
-
-        if not extracted_text.strip():
-            file_entry['status'] = 'Fehler: Kein Text extrahiert'
-            session.modified = True
-            return jsonify({'success': False, 'message': 'Kein Text extrahiert.'}), 400
-
-        speichere_wissensbasis({
-            "thema": selected_thema,
-            "unterthema": selected_unterthema,
-            "beschreibung": beschreibung,
-            "inhalt": extracted_text
-        })
-
-        file_entry['status'] = 'Erfolgreich verarbeitet (Manuell)'
-        session.modified = True
-        os.remove(temp_filepath)
-        return jsonify({'success': True, 'message': 'Datei erfolgreich manuell verarbeitet.'}), 200
+        file_entry, temp_filepath, fehler = _hochgeladene_datei(data.get('file_id'))
+        if fehler:
+            return fehler
+
+        job_id = job_queue.enqueue('process_file_manual', {
+            'filepath': temp_filepath,
+            'filename': file_entry['filename'],
+            'content_hash': file_entry.get('content_hash'),
+            'ext': os.path.splitext(file_entry['filename'])[1].lower(),
+            'thema': data.get('thema'),
+            'unterthema': data.get('unterthema'),
+            'beschreibung': data.get('beschreibung', '').strip()
+        }, owner=session.get('user_id'))
+        return _job_antwort(file_entry, job_id)
 
     except Exception as e:
         logging.exception("Fehler bei der manuellen Verarbeitung.")
         return jsonify({'success': False, 'message': 'Ein interner Fehler ist aufgetreten.'}), 500
 
+@app.route('/job_status/<job_id>', methods=['GET'])
+@login_required
+def job_status(job_id):
+    """Status eines Hintergrund-Jobs für das Polling der Admin-Oberfläche."""
+    job = job_queue.get(job_id)
+    if not job or job['owner'] != session.get('user_id'):
+        return jsonify({'success': False, 'message': 'Job nicht gefunden.'}), 404
+
+    # Dateistatus in der Session nachziehen, sobald der Job beendet ist
+    file_entry = next((f for f in session.get('uploaded_files', []) if f.get('job_id') == job_id), None)
+    if file_entry and job['status'] in ('done', 'failed'):
+        neuer_status = job['result']['file_status'] if job['status'] == 'done' else f"Fehler: {job['error']}"
+        if file_entry['status'] != neuer_status:
+            file_entry['status'] = neuer_status
+            session.modified = True
+
+    return jsonify({
+        'success': True,
+        'status': job['status'],
+        'progress': job['progress'],
+        'message': job['message'],
+        'result': job['result'],
+        'error': job['error'],
+        'attempts': job['attempts']
+    }), 200
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """
+    Readiness-Check: 200, sobald die kritischen Dienste vorgewärmt sind, sonst 503.
+    Fehlgeschlagene kritische Dienste werden dabei im Hintergrund erneut versucht.
+    """
+    retrying = service_registry.retry_failed()
+    report = service_registry.startup_report()
+    report["retrying"] = retrying
+    return jsonify(report), 200 if report["ready"] else 503
+
+service_registry.mark("routes")
+# Optionaler Warm-up im Hintergrund; /healthz meldet ready, wenn er abgeschlossen ist
+if os.getenv('STARTUP_WARMUP', '1') == '1':
+    service_registry.start_warmup()
+service_registry.log_report()
+
 ###########################################
 # App Start
 ###########################################
@@ -1,12 +1,22 @@
 import json
 import logging
+import threading
 import traceback
 import datetime
 from typing import Dict, List, Any, Optional, Union
-from flask import session
+from flask import session, request, has_request_context
 from google.cloud import bigquery
-from sql_query_helper import apply_query_enhancements
+from sql_query_helper import apply_query_enhancements, compile_query_variants, select_query_variant
+from customer_name_index import CustomerNameResolver
+from seller_replica import SellerReplicaManager, DEFAULT_PATTERNS
+from result_cache import result_cache
+from team_query import split_team_rows
+from kpi_rollup import KPI_ROLLUP_SQL
+from query_costs import (query_cost_tracker, AbfrageZuTeuer, AbfrageTimeout, max_bytes_for_pattern,
+                         timeout_for_pattern, build_job_labels, parameter_shape, DRY_RUN_ENABLED)
+import time
 import os
+import tempfile
 
 # Logging einrichten
 logging.basicConfig(level=logging.INFO)
@@ -15,6 +25,53 @@ logger = logging.getLogger(__name__)
 # Pfad zur Service-Account-Datei
 SERVICE_ACCOUNT_PATH = '/home/PfS/gcpxbixpflegehilfesenioren-a47c654480a8.json'
 
+# Pfad zur Pattern-Registry
+QUERY_PATTERNS_PATH = 'query_patterns.json'
+
+# Polling-Intervall für laufende BigQuery-Jobs (Sekunden, verdoppelt sich bis zum Maximum)
+JOB_POLL_INTERVAL_MIN = 0.1
+JOB_POLL_INTERVAL_MAX = 1.0
+
+# Cache für die Pattern-Registry (wird bei Änderung der Datei neu geladen)
+_query_patterns_cache = {"mtime": None, "patterns": {}, "variants": {}}
+_query_patterns_lock = threading.Lock()
+
+def load_query_patterns_cached() -> Dict[str, Any]:
+    """
+    Lädt die Abfragemuster aus query_patterns.json und cached sie anhand der
+    Änderungszeit der Datei. Aufrufer dürfen das Ergebnis nicht verändern.
+    
+    Returns:
+        dict: Die common_queries aus der Pattern-Registry
+    """
+    mtime = os.path.getmtime(QUERY_PATTERNS_PATH)
+    with _query_patterns_lock:
+        if _query_patterns_cache["mtime"] != mtime:
+            with open(QUERY_PATTERNS_PATH, 'r', encoding='utf-8') as f:
+                patterns = json.load(f).get('common_queries', {})
+            # SQL-Varianten einmalig pro Laden vorkompilieren
+            _query_patterns_cache["variants"] = {
+                name: compile_query_variants(pattern) for name, pattern in patterns.items()
+            }
+            _query_patterns_cache["patterns"] = patterns
+            _query_patterns_cache["mtime"] = mtime
+            logger.info("Pattern-Registry neu geladen")
+        return _query_patterns_cache["patterns"]
+
+def get_query_variants(function_name: str):
+    """
+    Liefert die vorkompilierten SQL-Varianten eines Abfragemusters.
+    
+    Args:
+        function_name (str): Name des Abfragemusters
+        
+    Returns:
+        Mapping[str, QueryVariant]: Unveränderliche Varianten oder None
+    """
+    load_query_patterns_cached()
+    with _query_patterns_lock:
+        return _query_patterns_cache["variants"].get(function_name)
+
 def handle_function_call(function_name: str, function_args: Dict[str, Any]) -> str:
     """
     Hauptfunktion zum Handling von Function-Calls vom LLM.
@@ -22,22 +79,18 @@ def handle_function_call(function_name: str, function_args: Dict[str, Any]) -> s
     try:
         logger.info(f"Function call received: {function_name} with args: {function_args}")
         
-        # Lade die Abfragemuster
-        with open('query_patterns.json', 'r', encoding='utf-8') as f:
-            query_patterns = json.load(f)
+        # Hole das Abfragemuster (nur lesend, SQL-Varianten sind vorkompiliert)
+        query_pattern = load_query_patterns_cached().get(function_name)
         
         # Prüfe, ob die Funktion existiert
-        if function_name not in query_patterns['common_queries']:
+        if query_pattern is None:
             return json.dumps({
                 "error": f"Funktion {function_name} nicht gefunden",
                 "status": "error"
             })
         
-        # Hole das Abfragemuster
-        query_pattern = query_patterns['common_queries'][function_name]
-        
-        # Wende SQL-Verbesserungen an
-        query_pattern, function_args = apply_query_enhancements(function_name, query_pattern, function_args)
+        # Wende Parameter-Verbesserungen an (Kundennamen werden lokal zu Lead-IDs aufgelöst)
+        function_args = apply_query_enhancements(function_name, function_args, resolver=customer_name_resolver)
         
         # Füge seller_id aus der Session hinzu, wenn nicht vorhanden
         if 'seller_id' in query_pattern.get('required_parameters', []) and 'seller_id' not in function_args:
@@ -88,19 +141,58 @@ def handle_function_call(function_name: str, function_args: Dict[str, Any]) -> s
         
         logger.info(f"Executing query with parameters (after type conversion): {function_args}")
         
-        # Führe die Abfrage aus
-        result = execute_bigquery_query(
-            query_pattern['sql_template'],
-            function_args
-        )
+        # Wähle die SQL-Variante passend zur Parameterform und führe sie aus
+        variant = select_query_variant(get_query_variants(function_name), function_args)
+        logger.info(f"SQL-Variante für {function_name}: {variant.name}")
+        
+        # Portable Muster zuerst aus dem lokalen Abbild des Verkäufers, sonst BigQuery
+        result = seller_replicas.query(function_name, variant, function_args,
+                                       max_staleness=query_pattern.get('replica_max_staleness'))
+        if result is None:
+            result = execute_bigquery_query(
+                variant.sql,
+                function_args,
+                used_params=variant.parameters,
+                pattern_name=function_name
+            )
         
         # Formatiere das Ergebnis
         formatted_result = format_query_result(result, query_pattern.get('result_structure'))
         
-        return json.dumps({
+        antwort = {
             "data": formatted_result,
             "count": len(formatted_result),
             "status": "success"
+        }
+        # Ergebnis durch LIMIT abgeschnitten: count ist dann keine Gesamtzahl
+        limit = function_args.get('limit')
+        if 'limit' in variant.parameters and isinstance(limit, int) and len(result) >= limit:
+            antwort["limit_reached"] = True
+        # Kundenname nur ähnlich gefunden: Kandidaten für Rückfrage bzw. Hinweis mitgeben
+        if function_args.get('name_match'):
+            antwort["name_match"] = function_args['name_match']
+        return json.dumps(antwort)
+    
+    except AbfrageTimeout as e:
+        # Strukturierter Fehler, den render_template_answer bzw. das LLM formulieren kann
+        return json.dumps({
+            "error": str(e),
+            "error_type": "timeout",
+            "pattern": function_name,
+            "timeout_seconds": e.timeout_seconds,
+            "job_id": e.job_id,
+            "cancelled": e.cancelled,
+            "status": "timeout"
+        })
+    
+    except AbfrageZuTeuer as e:
+        return json.dumps({
+            "error": str(e),
+            "error_type": "too_expensive",
+            "pattern": function_name,
+            "estimated_bytes": e.estimated_bytes,
+            "limit_bytes": e.limit_bytes,
+            "status": "error"
         })
     
     except Exception as e:
@@ -112,75 +204,449 @@ def handle_function_call(function_name: str, function_args: Dict[str, Any]) -> s
             "status": "error"
         })
 
-def execute_bigquery_query(sql_template: str, parameters: Dict[str, Any]) -> List[Dict[str, Any]]:
+def row_to_dict(row) -> Dict[str, Any]:
+    """
+    Wandelt eine BigQuery-Zeile in ein Dictionary mit serialisierbaren Werten um.
+    
+    Args:
+        row: bigquery.Row
+        
+    Returns:
+        dict: Spaltenname -> Wert (Datumswerte als ISO-String)
+    """
+    row_dict = {}
+    for key, value in row.items():
+        # Konvertiere nicht-serialisierbare Werte
+        if isinstance(value, (datetime.datetime, datetime.date)):
+            row_dict[key] = value.isoformat()
+        else:
+            row_dict[key] = value
+    return row_dict
+
+def run_query_job(sql_template: str, parameters: Dict[str, Any], used_params,
+                  pattern_name: Optional[str] = None, query_pattern: Optional[Dict[str, Any]] = None,
+                  route: Optional[str] = None, timeout_seconds: Optional[float] = None,
+                  page_size: Optional[int] = None):
+    """
+    Schickt einen BigQuery-Job mit Parametern, Kostenbremse, Labels und
+    Zeitlimit ab und wartet auf sein Ende (ohne den Result-Cache).
+    
+    Args:
+        sql_template (str): SQL-Abfragetemplate mit Platzhaltern
+        parameters (dict): Parameter für die Abfrage
+        used_params: Im SQL verwendete Parameter
+        pattern_name (str, optional): Name des Abfragemusters für Limit, Labels und Statistik
+        query_pattern (dict, optional): Das Abfragemuster aus der Registry
+        route (str, optional): Auslösende Route (Standard: aktueller Flask-Endpunkt)
+        timeout_seconds (float, optional): Überschreibt das Zeitlimit des Musters
+        page_size (int, optional): Zeilen pro Seite beim Lesen des Ergebnisses
+        
+    Returns:
+        tuple: (client, query_job, RowIterator)
+        
+    Raises:
+        AbfrageZuTeuer: Wenn der Dry-Run das Limit überschreitet
+        AbfrageTimeout: Wenn der Job das Zeitlimit überschreitet
+    """
+    # Initialisiere BigQuery-Client
+    client = bigquery.Client.from_service_account_json(SERVICE_ACCOUNT_PATH)
+
+    # Erstelle QueryJobConfig mit Parametern
+    job_config = bigquery.QueryJobConfig()
+    query_parameters = []
+
+    # WICHTIG: Suche alle in der SQL-Abfrage verwendeten Parameter
+    # Stellen Sie sicher, dass alle verwendeten Parameter übergeben werden
+    # Sortiert, damit gleiche Abfragen identische Jobs ergeben (BigQuery-Cache)
+    for param_name in sorted(used_params):
+        param_value = parameters.get(param_name)
+
+        # Listen (z.B. lead_ids) als ARRAY-Parameter übergeben
+        if isinstance(param_value, (list, tuple)):
+            element_type = "INT64" if param_value and all(isinstance(v, int) for v in param_value) else "STRING"
+            query_parameters.append(
+                bigquery.ArrayQueryParameter(param_name, element_type, list(param_value))
+            )
+            continue
+
+        # Parameter-Typ bestimmen
+        if isinstance(param_value, int):
+            param_type = "INT64"
+        elif isinstance(param_value, float):
+            param_type = "FLOAT64"
+        elif isinstance(param_value, bool):
+            param_type = "BOOL"
+        elif isinstance(param_value, datetime.date):
+            param_type = "DATE"
+        else:
+            param_type = "STRING"
+
+        # Auch NULL-Werte müssen korrekt typisiert werden
+        query_parameters.append(
+            bigquery.ScalarQueryParameter(param_name, param_type, param_value)
+        )
+
+    job_config.query_parameters = query_parameters
+
+    # Kostenbremse und Labels pro Abfragemuster
+    max_bytes = max_bytes_for_pattern(query_pattern)
+    if route is None and has_request_context():
+        route = request.endpoint
+    labels = build_job_labels(pattern_name, parameters.get('seller_id'), route)
+    job_config.maximum_bytes_billed = max_bytes
+    job_config.labels = labels
+
+    # Optionaler Dry-Run; die Schätzung wird pro (Muster, Parameterform) gecacht
+    if pattern_name and (DRY_RUN_ENABLED or (query_pattern or {}).get('dry_run')):
+        shape = parameter_shape(used_params, parameters)
+        estimated_bytes = query_cost_tracker.get_estimate(pattern_name, shape)
+        if estimated_bytes is None:
+            dry_run_config = bigquery.QueryJobConfig(
+                dry_run=True,
+                use_query_cache=False,
+                query_parameters=query_parameters,
+                labels=labels
+            )
+            dry_run_job = client.query(sql_template, job_config=dry_run_config)
+            estimated_bytes = dry_run_job.total_bytes_processed or 0
+            query_cost_tracker.store_estimate(pattern_name, shape, estimated_bytes)
+        if estimated_bytes > max_bytes:
+            query_cost_tracker.record_rejection(pattern_name)
+            raise AbfrageZuTeuer(pattern_name, estimated_bytes, max_bytes)
+
+    # Zeitlimit; BigQuery bricht den Job zusätzlich serverseitig ab, falls wir ausfallen
+    if timeout_seconds is None:
+        timeout_seconds = timeout_for_pattern(query_pattern)
+    if hasattr(bigquery.QueryJobConfig, 'job_timeout_ms'):
+        job_config.job_timeout_ms = int((timeout_seconds + 5) * 1000)
+
+    # Führe die Abfrage asynchron aus und warte höchstens bis zur Deadline
+    started = time.perf_counter()
+    deadline = time.monotonic() + timeout_seconds
+    query_job = client.query(sql_template, job_config=job_config)
+    wait_for_query_job(query_job, deadline, pattern_name, timeout_seconds)
+    results = query_job.result(page_size=page_size, timeout=max(deadline - time.monotonic(), 1.0))
+    query_cost_tracker.record_execution(pattern_name, query_job, labels, time.perf_counter() - started)
+    return client, query_job, results
+
+def execute_bigquery_query(sql_template: str, parameters: Dict[str, Any],
+                           used_params: Optional[frozenset] = None,
+                           pattern_name: Optional[str] = None,
+                           route: Optional[str] = None,
+                           timeout_seconds: Optional[float] = None) -> List[Dict[str, Any]]:
     """
     Führt eine BigQuery-Abfrage mit den angegebenen Parametern aus.
     
+    Jeder Job erhält maximum_bytes_billed (pro Muster über "maximum_bytes_billed"
+    in query_patterns.json, sonst BIGQUERY_MAX_BYTES_BILLED) und Labels für
+    Muster, Verkäufer und Route. Mit BIGQUERY_DRY_RUN=1 oder "dry_run": true im
+    Muster wird die Datenmenge vorab geschätzt und zu teure Abfragen werden
+    mit AbfrageZuTeuer abgelehnt.
+    
+    Der Job wird asynchron abgeschickt und bis zum Zeitlimit des Musters
+    ("timeout_seconds", sonst BIGQUERY_QUERY_TIMEOUT) abgefragt. Überfällige
+    Jobs werden abgebrochen und als AbfrageTimeout gemeldet.
+    
     Args:
         sql_template (str): SQL-Abfragetemplate mit Platzhaltern
         parameters (dict): Parameter für die Abfrage
+        used_params (frozenset, optional): Im SQL verwendete Parameter, falls
+            bereits bekannt (vorkompilierte Variante)
+        pattern_name (str, optional): Name des Abfragemusters für Limit, Labels und Statistik
+        route (str, optional): Auslösende Route (Standard: aktueller Flask-Endpunkt)
+        timeout_seconds (float, optional): Überschreibt das Zeitlimit des Musters
         
     Returns:
         list: Liste von Dictionaries mit den Abfrageergebnisse
     """
     import re
     try:
-        # Initialisiere BigQuery-Client
-        client = bigquery.Client.from_service_account_json(SERVICE_ACCOUNT_PATH)
+        if used_params is None:
+            used_params = set(re.findall(r'@(\w+)', sql_template))
+        query_pattern = load_query_patterns_cached().get(pattern_name) if pattern_name else None
         
-        # Erstelle QueryJobConfig mit Parametern
-        job_config = bigquery.QueryJobConfig()
-        query_parameters = []
-        
-        # WICHTIG: Suche alle in der SQL-Abfrage verwendeten Parameter
-        used_params = set(re.findall(r'@(\w+)', sql_template))
-        
-        # Stellen Sie sicher, dass alle verwendeten Parameter übergeben werden
-        for param_name in used_params:
-            param_value = parameters.get(param_name)
-            
-            # Parameter-Typ bestimmen
-            if isinstance(param_value, int):
-                param_type = "INT64"
-            elif isinstance(param_value, float):
-                param_type = "FLOAT64"
-            elif isinstance(param_value, bool):
-                param_type = "BOOL"
-            elif isinstance(param_value, datetime.date):
-                param_type = "DATE"
-            else:
-                param_type = "STRING"
-                
-            # Auch NULL-Werte müssen korrekt typisiert werden
-            query_parameters.append(
-                bigquery.ScalarQueryParameter(param_name, param_type, param_value)
-            )
-            
-        job_config.query_parameters = query_parameters
+        # Ergebnis-Cache für registrierte Muster ("cache_ttl_seconds": 0 im Muster schaltet ihn ab)
+        cache_key = None
+        if query_pattern is not None and query_pattern.get('cache_ttl_seconds', result_cache.ttl_seconds):
+            cache_key = result_cache.make_key(pattern_name, sql_template, used_params, parameters)
+            cached_rows = result_cache.get(cache_key)
+            if cached_rows is not None:
+                logger.info(f"Ergebnis für {pattern_name} aus dem Result-Cache")
+                return cached_rows
         
-        # Führe die Abfrage aus
-        query_job = client.query(sql_template, job_config=job_config)
-        results = query_job.result()
+        client, query_job, results = run_query_job(
+            sql_template, parameters, used_params,
+            pattern_name=pattern_name,
+            query_pattern=query_pattern,
+            route=route,
+            timeout_seconds=timeout_seconds
+        )
         
         # Konvertiere die Ergebnisse in eine Liste von Dictionaries
-        rows = []
-        for row in results:
-            row_dict = {}
-            for key, value in row.items():
-                # Konvertiere nicht-serialisierbare Werte
-                if isinstance(value, (datetime.datetime, datetime.date)):
-                    row_dict[key] = value.isoformat()
-                else:
-                    row_dict[key] = value
-            rows.append(row_dict)
+        rows = [row_to_dict(row) for row in results]
+        
+        if cache_key is not None:
+            result_cache.put(cache_key, rows, parameters.get('seller_id'), ttl=query_pattern.get('cache_ttl_seconds'))
         
         return rows
     
+    except (AbfrageZuTeuer, AbfrageTimeout) as e:
+        logger.warning(str(e))
+        raise
     except Exception as e:
         error_trace = traceback.format_exc()
         logger.error(f"Error executing BigQuery query: {e}\n{error_trace}")
         raise
 
+def run_query_pattern(pattern_name: str, parameters: Dict[str, Any],
+                      route: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Führt ein registriertes Abfragemuster mit seinem Standard-Template aus
+    (über den Result-Cache).
+    
+    Args:
+        pattern_name (str): Name des Abfragemusters
+        parameters (dict): Parameter für die Abfrage
+        route (str, optional): Auslösende Route für die Job-Labels
+        
+    Returns:
+        list: Liste von Dictionaries mit den Abfrageergebnissen
+        
+    Raises:
+        KeyError: Wenn das Muster nicht existiert
+    """
+    variants = get_query_variants(pattern_name)
+    if variants is None:
+        raise KeyError(f"Abfragemuster {pattern_name} nicht gefunden")
+    variant = variants["default"]
+    return execute_bigquery_query(
+        variant.sql,
+        parameters,
+        used_params=variant.parameters,
+        pattern_name=pattern_name,
+        route=route
+    )
+
+# Zähler für Team-Abfragen (mehrere Verkäufer in einem Job)
+TEAM_QUERY_MAX_SELLERS = int(os.getenv('TEAM_QUERY_MAX_SELLERS', '200'))
+team_query_stats = {"team_jobs": 0, "team_sellers": 0, "cached_sellers": 0, "fallback_queries": 0}
+
+def run_team_query(pattern_name: str, seller_ids: List[str], parameters: Dict[str, Any],
+                   route: Optional[str] = None) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Führt ein Abfragemuster für mehrere Verkäufer aus (Teamleiter-Ansichten).
+
+    Verkäufer, deren Einzelergebnis im Result-Cache liegt, werden übersprungen.
+    Für die übrigen läuft die "team"-Variante des Musters in einem Job
+    (höchstens TEAM_QUERY_MAX_SELLERS Verkäufer pro Job). Das Ergebnis wird
+    pro Verkäufer unter dem Schlüssel der Einzelabfrage im Result-Cache
+    abgelegt, sodass Dashboard und KPI-Tab der Verkäufer es direkt nutzen.
+    Muster ohne Team-Variante werden pro Verkäufer einzeln ausgeführt.
+
+    Args:
+        pattern_name (str): Name des Abfragemusters
+        seller_ids (list): Verkäufer
+        parameters (dict): Parameter ohne seller_id
+        route (str, optional): Auslösende Route für die Job-Labels
+
+    Returns:
+        dict: seller_id -> Liste von Dictionaries (wie bei der Einzelabfrage)
+
+    Raises:
+        KeyError: Wenn das Muster nicht existiert
+    """
+    variants = get_query_variants(pattern_name)
+    if variants is None:
+        raise KeyError(f"Abfragemuster {pattern_name} nicht gefunden")
+    query_pattern = load_query_patterns_cached()[pattern_name]
+    default = variants["default"]
+    seller_ids = list(dict.fromkeys(seller_ids))
+
+    ergebnis = {}
+    offen = []
+    cache_aktiv = query_pattern.get('cache_ttl_seconds', result_cache.ttl_seconds)
+    for seller_id in seller_ids:
+        if cache_aktiv:
+            cached_rows = result_cache.get(result_cache.make_key(
+                pattern_name, default.sql, default.parameters, {**parameters, 'seller_id': seller_id}))
+            if cached_rows is not None:
+                ergebnis[seller_id] = cached_rows
+                continue
+        offen.append(seller_id)
+    team_query_stats["cached_sellers"] += len(seller_ids) - len(offen)
+
+    team = variants.get("team")
+    if team is None:
+        if offen:
+            logger.info(f"{pattern_name} hat keine Team-Variante, {len(offen)} Einzelabfragen")
+        for seller_id in offen:
+            ergebnis[seller_id] = run_query_pattern(pattern_name, {**parameters, 'seller_id': seller_id}, route=route)
+            team_query_stats["fallback_queries"] += 1
+        return {seller_id: ergebnis[seller_id] for seller_id in seller_ids}
+
+    for start in range(0, len(offen), TEAM_QUERY_MAX_SELLERS):
+        gruppe = offen[start:start + TEAM_QUERY_MAX_SELLERS]
+        rows = execute_bigquery_query(
+            team.sql,
+            {**parameters, 'seller_ids': gruppe},
+            used_params=team.parameters,
+            pattern_name=pattern_name,
+            route=route
+        )
+        team_query_stats["team_jobs"] += 1
+        team_query_stats["team_sellers"] += len(gruppe)
+        for seller_id, seller_rows in split_team_rows(rows, gruppe).items():
+            ergebnis[seller_id] = seller_rows
+            if cache_aktiv:
+                result_cache.put(
+                    result_cache.make_key(pattern_name, default.sql, default.parameters,
+                                          {**parameters, 'seller_id': seller_id}),
+                    seller_rows, seller_id, ttl=query_pattern.get('cache_ttl_seconds'))
+    logger.info(f"Team-Abfrage {pattern_name}: {len(offen)} Verkäufer in "
+                f"{-(-len(offen) // TEAM_QUERY_MAX_SELLERS)} Job(s), {len(seller_ids) - len(offen)} aus dem Cache")
+    return {seller_id: ergebnis[seller_id] for seller_id in seller_ids}
+
+def _pattern_variant(pattern_name: str, parameters: Dict[str, Any]):
+    variants = get_query_variants(pattern_name)
+    if variants is None:
+        raise KeyError(f"Abfragemuster {pattern_name} nicht gefunden")
+    return load_query_patterns_cached()[pattern_name], select_query_variant(variants, parameters)
+
+def _cached_pattern_rows(pattern_name: str, query_pattern: Dict[str, Any], variant,
+                         parameters: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+    if not query_pattern.get('cache_ttl_seconds', result_cache.ttl_seconds):
+        return None
+    return result_cache.get(result_cache.make_key(pattern_name, variant.sql, variant.parameters, parameters))
+
+def _first_page(iterator, query_job) -> tuple:
+    page = next(iterator.pages, None)
+    rows = [row_to_dict(row) for row in page] if page is not None else []
+    cursor = None
+    if iterator.next_page_token:
+        cursor = {"job_id": query_job.job_id, "location": query_job.location,
+                  "page_token": iterator.next_page_token}
+    return rows, cursor
+
+def read_query_page(pattern_name: str, parameters: Dict[str, Any], page_size: int,
+                    cursor: Optional[Dict[str, Any]] = None,
+                    route: Optional[str] = None) -> tuple:
+    """
+    Liest eine Seite eines registrierten Abfragemusters.
+    
+    Liegt das Ergebnis im Result-Cache, wird daraus geblättert (Cursor mit
+    offset). Sonst läuft der Job einmal und die weiteren Seiten werden über
+    BigQuery-Page-Tokens aus der Ergebnistabelle des Jobs gelesen, ohne das
+    ganze Ergebnis im Speicher zu halten.
+    
+    Args:
+        pattern_name (str): Name des Abfragemusters
+        parameters (dict): Parameter für die Abfrage
+        page_size (int): Zeilen pro Seite
+        cursor (dict, optional): Cursor der vorherigen Seite
+        route (str, optional): Auslösende Route für die Job-Labels
+        
+    Returns:
+        tuple: (Zeilen, Cursor der nächsten Seite oder None, Quelle "cache"/"bigquery")
+        
+    Raises:
+        KeyError: Wenn das Muster nicht existiert
+    """
+    query_pattern, variant = _pattern_variant(pattern_name, parameters)
+    
+    if cursor and cursor.get("job_id"):
+        client = bigquery.Client.from_service_account_json(SERVICE_ACCOUNT_PATH)
+        query_job = client.get_job(cursor["job_id"], location=cursor.get("location"))
+        iterator = client.list_rows(query_job.destination, page_token=cursor["page_token"], page_size=page_size)
+        rows, next_cursor = _first_page(iterator, query_job)
+        return rows, next_cursor, "bigquery"
+    
+    offset = cursor.get("offset", 0) if cursor else 0
+    cached_rows = _cached_pattern_rows(pattern_name, query_pattern, variant, parameters)
+    if cached_rows is None and cursor is not None:
+        # Cache-Eintrag ist beim Blättern abgelaufen: einmal neu laden (füllt den Cache)
+        cached_rows = execute_bigquery_query(variant.sql, parameters, used_params=variant.parameters,
+                                             pattern_name=pattern_name, route=route)
+    if cached_rows is not None:
+        ende = offset + page_size
+        return cached_rows[offset:ende], ({"offset": ende} if ende < len(cached_rows) else None), "cache"
+    
+    _, query_job, results = run_query_job(
+        variant.sql, parameters, variant.parameters,
+        pattern_name=pattern_name,
+        query_pattern=query_pattern,
+        route=route,
+        page_size=page_size
+    )
+    rows, next_cursor = _first_page(results, query_job)
+    return rows, next_cursor, "bigquery"
+
+def iter_query_pages(pattern_name: str, parameters: Dict[str, Any], page_size: int = 1000,
+                     route: Optional[str] = None):
+    """
+    Liefert das Ergebnis eines registrierten Abfragemusters Seite für Seite.
+    
+    Aus dem Result-Cache, wenn das Ergebnis dort liegt, sonst direkt aus den
+    Ergebnisseiten des BigQuery-Jobs. Es ist immer nur eine Seite im Speicher.
+    
+    Args:
+        pattern_name (str): Name des Abfragemusters
+        parameters (dict): Parameter für die Abfrage
+        page_size (int): Zeilen pro Seite
+        route (str, optional): Auslösende Route für die Job-Labels
+        
+    Yields:
+        list: Zeilen einer Seite als Dictionaries
+        
+    Raises:
+        KeyError: Wenn das Muster nicht existiert
+    """
+    query_pattern, variant = _pattern_variant(pattern_name, parameters)
+    cached_rows = _cached_pattern_rows(pattern_name, query_pattern, variant, parameters)
+    if cached_rows is not None:
+        for start in range(0, len(cached_rows), page_size):
+            yield cached_rows[start:start + page_size]
+        return
+    _, _, results = run_query_job(
+        variant.sql, parameters, variant.parameters,
+        pattern_name=pattern_name,
+        query_pattern=query_pattern,
+        route=route,
+        page_size=page_size
+    )
+    for page in results.pages:
+        yield [row_to_dict(row) for row in page]
+
+def wait_for_query_job(query_job, deadline: float, pattern_name: Optional[str] = None,
+                       timeout_seconds: Optional[float] = None) -> None:
+    """
+    Wartet auf einen BigQuery-Job, ohne den Thread unbegrenzt zu blockieren.
+    
+    Fragt den Job-Status mit wachsendem Intervall ab. Ist die Deadline erreicht,
+    wird der Job abgebrochen und AbfrageTimeout ausgelöst.
+    
+    Args:
+        query_job: Abgeschickter bigquery.QueryJob
+        deadline (float): Zeitpunkt (time.monotonic()), bis zu dem gewartet wird
+        pattern_name (str, optional): Name des Abfragemusters für Fehler und Statistik
+        timeout_seconds (float, optional): Zeitlimit für die Fehlermeldung
+        
+    Raises:
+        AbfrageTimeout: Wenn der Job bis zur Deadline nicht fertig ist
+    """
+    interval = JOB_POLL_INTERVAL_MIN
+    while not query_job.done():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            cancelled = False
+            try:
+                cancelled = bool(query_job.cancel())
+            except Exception as e:
+                logger.warning(f"Job {getattr(query_job, 'job_id', '?')} konnte nicht abgebrochen werden: {e}")
+            query_cost_tracker.record_timeout(pattern_name)
+            raise AbfrageTimeout(pattern_name, timeout_seconds or 0, getattr(query_job, 'job_id', None), cancelled)
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, JOB_POLL_INTERVAL_MAX)
+
 def format_query_result(result: List[Dict[str, Any]], result_structure: Optional[Dict[str, str]] = None) -> List[Dict[str, Any]]:
     """
     Formatiert das Abfrageergebnis für die Rückgabe an das LLM.
@@ -836,6 +1302,94 @@ def get_bigquery_client():
         return None
     return bigquery.Client.from_service_account_json(service_account_path)
 
+def get_customer_names_for_seller(seller_id):
+    """
+    Lädt Lead-ID sowie Vor- und Nachname aller Leads eines Verkäufers
+    für den lokalen Namensindex.
+    
+    Args:
+        seller_id (str): ID des Verkäufers
+        
+    Returns:
+        list: Dictionaries mit lead_id, first_name und last_name
+        
+    Raises:
+        Exception: Wenn BigQuery nicht erreichbar ist (der Index wird dann nicht gebaut)
+    """
+    client = get_bigquery_client()
+    if client is None:
+        raise RuntimeError("BigQuery-Client nicht verfügbar")
+    
+    query = """
+    SELECT l._id AS lead_id, la.first_name, la.last_name
+    FROM `gcpxbixpflegehilfesenioren.PflegehilfeSeniore_BI.leads` AS l
+    JOIN `gcpxbixpflegehilfesenioren.dataform_staging.leads_and_seller_and_source_with_address` AS la
+      ON l._id = la._id
+    WHERE l.seller_id = @seller_id
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("seller_id", "STRING", seller_id)
+        ]
+    )
+    rows = client.query(query, job_config=job_config).result()
+    return [{"lead_id": row["lead_id"], "first_name": row["first_name"], "last_name": row["last_name"]}
+            for row in rows]
+
+def get_kpi_daily_rollup(seller_id, since, until):
+    """
+    Lädt die Funnel-Tageswerte eines Verkäufers für den KPI-Rollup.
+    
+    Args:
+        seller_id (str): ID des Verkäufers
+        since (datetime.date): Erster Tag
+        until (datetime.date): Letzter Tag (inklusive)
+        
+    Returns:
+        list: Eine Zeile pro Tag mit Werten (Spalten wie KPI_ROLLUP_SQL)
+    """
+    return execute_bigquery_query(
+        KPI_ROLLUP_SQL,
+        {'seller_id': seller_id, 'since': since, 'until': until},
+        pattern_name='kpi_daily_rollup',
+        timeout_seconds=float(os.getenv('KPI_ROLLUP_TIMEOUT', '300'))
+    )
+
+# Namensindex pro Verkäufer für Kundenabfragen (get_customer_history & Co.)
+customer_name_resolver = CustomerNameResolver(
+    get_customer_names_for_seller,
+    refresh_seconds=int(os.getenv('CUSTOMER_NAME_INDEX_REFRESH', '900'))
+)
+
+def get_seller_replica_rows(sql, parameters):
+    """
+    Lädt Zeilen für das lokale Abbild eines Verkäufers aus BigQuery.
+    
+    Args:
+        sql (str): Abfrage aus seller_replica.replica_source_sql
+        parameters (dict): seller_id und ggf. since (Wasserstand)
+        
+    Returns:
+        list: Zeilen als Dictionaries
+    """
+    return execute_bigquery_query(
+        sql,
+        parameters,
+        pattern_name='seller_replica_refresh',
+        timeout_seconds=float(os.getenv('SELLER_REPLICA_TIMEOUT', '120'))
+    )
+
+# Lokale DuckDB-Abbilder pro Verkäufer für portable Muster (optional, SELLER_REPLICA=1)
+seller_replicas = SellerReplicaManager(
+    os.getenv('SELLER_REPLICA_DIR', os.path.join(tempfile.gettempdir(), 'xora_seller_replicas')),
+    get_seller_replica_rows,
+    enabled=os.getenv('SELLER_REPLICA', '0') == '1',
+    patterns=[name.strip() for name in os.getenv('SELLER_REPLICA_PATTERNS', ','.join(DEFAULT_PATTERNS)).split(',')
+              if name.strip()],
+    max_staleness=float(os.getenv('SELLER_REPLICA_MAX_STALENESS', '900')),
+    refresh_seconds=float(os.getenv('SELLER_REPLICA_REFRESH', '300'))
+)
+
 # Seller bezogene Funktionen
 def get_leads_for_seller(seller_id):
     """Ruft die Leads für einen bestimmten Verkäufer aus BigQuery ab."""
@@ -0,0 +1,256 @@
+"""
+Cache Warmer für XORA Chatbot.
+Füllt den Result-Cache, bevor der Verkäufer die Daten anfordert:
+- Login-Prefetch: nach google_callback werden Dashboard- und KPI-Abfragen
+  im Hintergrund ausgeführt
+- Optionaler Warmer: einmal täglich für alle Verkäufer, die am Vortag aktiv
+  waren (Aktivität wird in SQLite protokolliert)
+
+Beide laufen in eigenen Thread-Pools mit fester Größe, damit Vorwärmen nie
+mehr als PREFETCH_WORKERS bzw. WARMER_CONCURRENCY BigQuery-Jobs gleichzeitig
+belegt. Wie oft vorgewärmte Einträge genutzt werden, zählt der Result-Cache.
+"""
+import calendar
+import datetime
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, List, Callable, Tuple
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG,
+                   format='%(asctime)s %(levelname)s:%(name)s:%(message)s',
+                   datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+PREFETCH_WORKERS = int(os.getenv('PREFETCH_WORKERS', '4'))
+WARMER_CONCURRENCY = int(os.getenv('WARMER_CONCURRENCY', '2'))
+PREFETCH_MIN_INTERVAL = 300
+ACTIVITY_RETENTION_DAYS = 14
+
+# KPI-Typen, die der KPI-Tab beim Öffnen lädt
+KPI_PREFETCH_TYPES = ('conversion_rate', 'lead_quality', 'termination_rate', 'lead_household_conversion')
+
+QueryList = List[Tuple[str, Dict[str, Any]]]
+
+
+def dashboard_query_set(seller_id: str, today: datetime.date) -> QueryList:
+    """
+    Abfragen beim Öffnen des Dashboards (Parameter wie in /get_dashboard_data)
+    sowie die Chat-Frage nach aktiven Kunden (Standardwerte aus query_patterns.json).
+
+    Args:
+        seller_id: Verkäufer
+        today: Heutiges Datum
+
+    Returns:
+        Liste von (Muster, Parameter)
+    """
+    heute = today.isoformat()
+    _, days_in_month = calendar.monthrange(today.year, today.month)
+    return [
+        ("get_active_care_stays_now", {'seller_id': seller_id, 'limit': 100}),
+        ("get_cvr_lead_contract", {'seller_id': seller_id, 'start_date': (today - datetime.timedelta(days=90)).isoformat(),
+                                   'end_date': heute, 'limit': 100}),
+        ("get_contract_count", {'seller_id': seller_id, 'start_date': (today - datetime.timedelta(days=14)).isoformat(),
+                                'end_date': heute, 'limit': 100}),
+        ("get_contract_terminations", {'seller_id': seller_id, 'start_date': (today - datetime.timedelta(days=30)).isoformat(),
+                                       'end_date': heute, 'limit': 500}),
+        ("get_revenue_current_month_pro_rata", {'seller_id': seller_id, 'start_of_month': today.replace(day=1).isoformat(),
+                                                'end_of_month': heute, 'days_in_month': days_in_month}),
+        ("get_customers_on_pause", {'seller_id': seller_id}),
+        ("get_active_care_stays_now", {'seller_id': seller_id, 'limit': 1000}),
+    ]
+
+
+def kpi_ranges(today: datetime.date) -> List[Tuple[str, str]]:
+    """Zeiträume des KPI-Tabs: Standard (letzte 30 Tage) und laufender Monat."""
+    return [((today - datetime.timedelta(days=30)).isoformat(), today.isoformat()),
+            (today.replace(day=1).isoformat(), today.isoformat())]
+
+
+class CacheWarmer:
+    """Führt Abfragen im Hintergrund aus, damit ihre Ergebnisse im Result-Cache liegen."""
+
+    def __init__(self, runner: Callable[[str, Dict[str, Any]], Any], cache, db_path: str,
+                 prefetch_workers: int = PREFETCH_WORKERS, warmer_concurrency: int = WARMER_CONCURRENCY,
+                 min_interval: int = PREFETCH_MIN_INTERVAL):
+        """
+        Initialisiert den CacheWarmer.
+
+        Args:
+            runner: Funktion (Muster, Parameter) -> Ergebnis, führt die Abfrage über den Cache aus
+            cache: QueryResultCache, dessen Einträge markiert werden
+            db_path: SQLite-Datei für die Aktivität der Verkäufer
+            prefetch_workers: Gleichzeitige Abfragen beim Login-Prefetch
+            warmer_concurrency: Gleichzeitige Abfragen des täglichen Warmers
+            min_interval: Mindestabstand zweier Prefetches desselben Verkäufers in Sekunden
+        """
+        self.runner = runner
+        self.cache = cache
+        self.db_path = db_path
+        self.min_interval = min_interval
+        self._prefetch_pool = ThreadPoolExecutor(max_workers=prefetch_workers, thread_name_prefix="prefetch")
+        self._warmer_pool = ThreadPoolExecutor(max_workers=warmer_concurrency, thread_name_prefix="cache-warmer")
+        self._lock = threading.Lock()
+        self._letzter_prefetch = {}
+        self._aktiv_heute = set()
+        self._aktiv_tag = None
+        self._scheduler = None
+        self.stats = {"prefetches": 0, "prefetch_skipped": 0, "prefetch_queries": 0, "warmer_runs": 0,
+                      "warmer_sellers": 0, "warmer_queries": 0, "query_errors": 0, "last_warmer_run": None}
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def _init_db(self) -> None:
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS seller_activity (
+                    seller_id TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    PRIMARY KEY (seller_id, day)
+                )
+            """)
+
+    def record_activity(self, seller_id: Optional[str]) -> None:
+        """Merkt sich, dass ein Verkäufer heute aktiv war (ein Schreibzugriff pro Tag)."""
+        if not seller_id:
+            return
+        heute = datetime.date.today().isoformat()
+        with self._lock:
+            if self._aktiv_tag != heute:
+                self._aktiv_tag = heute
+                self._aktiv_heute = set()
+            if seller_id in self._aktiv_heute:
+                return
+            self._aktiv_heute.add(seller_id)
+        try:
+            with self._connect() as conn:
+                conn.execute("INSERT OR IGNORE INTO seller_activity (seller_id, day) VALUES (?, ?)",
+                             (seller_id, heute))
+                grenze = (datetime.date.today() - datetime.timedelta(days=ACTIVITY_RETENTION_DAYS)).isoformat()
+                conn.execute("DELETE FROM seller_activity WHERE day < ?", (grenze,))
+        except sqlite3.Error as e:
+            logger.warning(f"Aktivität von Seller {seller_id} nicht gespeichert: {e}")
+
+    def active_sellers(self, day: datetime.date) -> List[str]:
+        """Alle Verkäufer, die am angegebenen Tag aktiv waren."""
+        with self._connect() as conn:
+            return [row[0] for row in conn.execute(
+                "SELECT seller_id FROM seller_activity WHERE day = ? ORDER BY seller_id", (day.isoformat(),))]
+
+    def _run(self, pattern_name: str, parameters: Dict[str, Any], source: str, ttl: Optional[int]) -> None:
+        started = time.perf_counter()
+        try:
+            with self.cache.source(source, ttl=ttl):
+                self.runner(pattern_name, parameters)
+            logger.debug(f"{source}: {pattern_name} für Seller {parameters.get('seller_id')} "
+                         f"in {time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            self.stats["query_errors"] += 1
+            logger.warning(f"{source}: {pattern_name} für Seller {parameters.get('seller_id')} fehlgeschlagen: {e}")
+
+    def prefetch(self, seller_id: Optional[str], queries: QueryList) -> int:
+        """
+        Startet den Login-Prefetch eines Verkäufers (kehrt sofort zurück).
+
+        Args:
+            seller_id: Verkäufer
+            queries: Abfragen als (Muster, Parameter)
+
+        Returns:
+            Anzahl eingereihter Abfragen (0, wenn kürzlich schon vorgewärmt)
+        """
+        if not seller_id:
+            return 0
+        with self._lock:
+            zuletzt = self._letzter_prefetch.get(seller_id)
+            if zuletzt and time.time() - zuletzt < self.min_interval:
+                self.stats["prefetch_skipped"] += 1
+                return 0
+            self._letzter_prefetch[seller_id] = time.time()
+            self.stats["prefetches"] += 1
+            self.stats["prefetch_queries"] += len(queries)
+        for pattern_name, parameters in queries:
+            self._prefetch_pool.submit(self._run, pattern_name, parameters, "prefetch", None)
+        logger.info(f"Login-Prefetch für Seller {seller_id}: {len(queries)} Abfragen eingereiht")
+        return len(queries)
+
+    def warm(self, seller_ids: List[str], query_set: Callable[[str], QueryList],
+             ttl: Optional[int] = None) -> int:
+        """
+        Wärmt den Cache für mehrere Verkäufer mit begrenzter Parallelität.
+
+        Args:
+            seller_ids: Verkäufer
+            query_set: Funktion seller_id -> Abfragen
+            ttl: Gültigkeit der vorgewärmten Einträge (None = Standard des Caches)
+
+        Returns:
+            Anzahl eingereihter Abfragen
+        """
+        anzahl = 0
+        for seller_id in seller_ids:
+            try:
+                queries = query_set(seller_id)
+            except Exception as e:
+                logger.warning(f"Warmer: Abfragen für Seller {seller_id} nicht ermittelt: {e}")
+                continue
+            for pattern_name, parameters in queries:
+                self._warmer_pool.submit(self._run, pattern_name, parameters, "warmer", ttl)
+            anzahl += len(queries)
+        with self._lock:
+            self.stats["warmer_runs"] += 1
+            self.stats["warmer_sellers"] += len(seller_ids)
+            self.stats["warmer_queries"] += anzahl
+            self.stats["last_warmer_run"] = datetime.datetime.now().isoformat(timespec='seconds')
+        logger.info(f"Warmer: {anzahl} Abfragen für {len(seller_ids)} Verkäufer eingereiht")
+        return anzahl
+
+    def start_scheduler(self, query_set: Callable[[str], QueryList], hour: int = 7,
+                        ttl: Optional[int] = None, max_sellers: int = 200) -> None:
+        """
+        Wärmt jeden Morgen zur angegebenen Stunde den Cache für alle Verkäufer,
+        die am Vortag aktiv waren.
+
+        Args:
+            query_set: Funktion seller_id -> Abfragen
+            hour: Stunde (lokale Zeit)
+            ttl: Gültigkeit der vorgewärmten Einträge
+            max_sellers: Höchstzahl Verkäufer pro Lauf
+        """
+        if self._scheduler is not None:
+            return
+
+        def loop():
+            while True:
+                jetzt = datetime.datetime.now()
+                naechster = jetzt.replace(hour=hour, minute=0, second=0, microsecond=0)
+                if naechster <= jetzt:
+                    naechster += datetime.timedelta(days=1)
+                time.sleep((naechster - jetzt).total_seconds())
+                try:
+                    gestern = datetime.date.today() - datetime.timedelta(days=1)
+                    self.warm(self.active_sellers(gestern)[:max_sellers], query_set, ttl=ttl)
+                except Exception as e:
+                    logger.error(f"Warmer-Lauf fehlgeschlagen: {e}")
+
+        self._scheduler = threading.Thread(target=loop, name="cache-warmer-scheduler", daemon=True)
+        self._scheduler.start()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Liefert Zähler sowie die Anzahl gestern und heute aktiver Verkäufer."""
+        with self._lock:
+            stats = dict(self.stats)
+        heute = datetime.date.today()
+        try:
+            stats["active_today"] = len(self.active_sellers(heute))
+            stats["active_yesterday"] = len(self.active_sellers(heute - datetime.timedelta(days=1)))
+        except sqlite3.Error as e:
+            stats["activity_error"] = str(e)
+        return stats
@@ -0,0 +1,230 @@
+"""
+Content Dedup für XORA Chatbot.
+Erkennt doppelte Inhalte auf zwei Ebenen:
+- Uploads: SHA-256 wird beim Schreiben auf die Platte berechnet; bereits
+  verarbeitete Dateien werden in einer SQLite-Registry vermerkt und nicht
+  erneut extrahiert und kategorisiert.
+- Wissenseinträge: MinHash über Wort-Shingles schätzt die Jaccard-Ähnlichkeit,
+  damit nahezu gleiche Passagen nicht erneut an "inhalt" angehängt werden.
+"""
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Iterable, Tuple
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG,
+                   format='%(asctime)s %(levelname)s:%(name)s:%(message)s',
+                   datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+SHINGLE_SIZE = 5
+NUM_PERMUTATIONS = 64
+NEAR_DUPLICATE_THRESHOLD = 0.8
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+# Feste Koeffizienten, damit Signaturen prozessübergreifend vergleichbar sind
+_PERMUTATIONS = [
+    (int.from_bytes(hashlib.sha256(f"a{i}".encode()).digest()[:8], 'big') % (_MERSENNE_PRIME - 1) + 1,
+     int.from_bytes(hashlib.sha256(f"b{i}".encode()).digest()[:8], 'big') % _MERSENNE_PRIME)
+    for i in range(NUM_PERMUTATIONS)
+]
+
+
+def save_and_hash(file_storage, dest_path: str, chunk_size: int = UPLOAD_CHUNK_SIZE) -> str:
+    """
+    Schreibt einen Upload blockweise auf die Platte und berechnet dabei den SHA-256.
+
+    Args:
+        file_storage: werkzeug FileStorage aus request.files
+        dest_path: Zielpfad
+        chunk_size: Blockgröße in Bytes
+
+    Returns:
+        Hex-Digest des Dateiinhalts
+    """
+    digest = hashlib.sha256()
+    with open(dest_path, 'wb') as f:
+        while True:
+            block = file_storage.stream.read(chunk_size)
+            if not block:
+                break
+            digest.update(block)
+            f.write(block)
+    return digest.hexdigest()
+
+
+class UploadRegistry:
+    """SQLite-Registry der bereits verarbeiteten Upload-Hashes."""
+
+    def __init__(self, db_path: str):
+        """
+        Initialisiert die UploadRegistry.
+
+        Args:
+            db_path: Pfad der SQLite-Datenbank
+        """
+        self.db_path = db_path
+        self.stats = {"lookups": 0, "duplicates": 0, "registered": 0, "forgotten": 0}
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS processed_uploads ("
+                "content_hash TEXT PRIMARY KEY, filename TEXT, mode TEXT, processed REAL NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def lookup(self, content_hash: str) -> Optional[Dict[str, Any]]:
+        """
+        Prüft, ob eine Datei mit diesem Hash bereits verarbeitet wurde.
+
+        Returns:
+            Dictionary mit filename, mode und processed oder None
+        """
+        self.stats["lookups"] += 1
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM processed_uploads WHERE content_hash = ?", (content_hash,)).fetchone()
+        if row is None:
+            return None
+        self.stats["duplicates"] += 1
+        return {"filename": row["filename"], "mode": row["mode"], "processed": row["processed"]}
+
+    def register(self, content_hash: str, filename: str, mode: str) -> None:
+        """Vermerkt eine erfolgreich verarbeitete Datei."""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO processed_uploads (content_hash, filename, mode, processed) VALUES (?, ?, ?, ?)",
+                (content_hash, filename, mode, time.time())
+            )
+        self.stats["registered"] += 1
+
+    def forget(self, content_hash: str) -> bool:
+        """
+        Entfernt einen Hash aus der Registry, damit die Datei erneut verarbeitet werden kann.
+
+        Returns:
+            True, wenn ein Eintrag entfernt wurde
+        """
+        with self._connect() as conn:
+            entfernt = conn.execute("DELETE FROM processed_uploads WHERE content_hash = ?", (content_hash,)).rowcount
+        if entfernt:
+            self.stats["forgotten"] += 1
+        return bool(entfernt)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Liefert Zähler und die Anzahl registrierter Dateien."""
+        stats = dict(self.stats)
+        with self._connect() as conn:
+            stats["entries"] = conn.execute("SELECT COUNT(*) FROM processed_uploads").fetchone()[0]
+        return stats
+
+
+def _shingles(text: str, size: int = SHINGLE_SIZE) -> set:
+    words = re.findall(r'\w+', text.lower())
+    if len(words) < size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def minhash_signature(text: str) -> Tuple[int, ...]:
+    """
+    Berechnet die MinHash-Signatur eines Texts über Wort-Shingles.
+
+    Args:
+        text: Der Text
+
+    Returns:
+        Tupel mit NUM_PERMUTATIONS Minimalwerten (leer bei Text ohne Wörter)
+    """
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=4).digest(), 'big')
+              for s in _shingles(text)]
+    if not hashes:
+        return ()
+    return tuple(
+        min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+        for a, b in _PERMUTATIONS
+    )
+
+
+def estimate_similarity(sig_a: Tuple[int, ...], sig_b: Tuple[int, ...]) -> float:
+    """Schätzt die Jaccard-Ähnlichkeit zweier Signaturen."""
+    if not sig_a or not sig_b:
+        return 0.0
+    return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / len(sig_a)
+
+
+class NearDuplicateDetector:
+    """Findet nahezu gleiche Passagen; Signaturen werden pro Textinhalt gecacht."""
+
+    def __init__(self, threshold: float = NEAR_DUPLICATE_THRESHOLD, max_cached: int = 5000):
+        """
+        Initialisiert den NearDuplicateDetector.
+
+        Args:
+            threshold: Ab dieser geschätzten Jaccard-Ähnlichkeit gilt ein Text als Duplikat
+            max_cached: Maximale Anzahl gecachter Signaturen
+        """
+        self.threshold = threshold
+        self.max_cached = max_cached
+        self._signatures = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"checks": 0, "near_duplicates": 0, "signature_cache_hits": 0}
+
+    def signature(self, text: str) -> Tuple[int, ...]:
+        """Liefert die (gecachte) Signatur eines Texts."""
+        key = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        with self._lock:
+            if key in self._signatures:
+                self._signatures.move_to_end(key)
+                self.stats["signature_cache_hits"] += 1
+                return self._signatures[key]
+        sig = minhash_signature(text)
+        with self._lock:
+            self._signatures[key] = sig
+            while len(self._signatures) > self.max_cached:
+                self._signatures.popitem(last=False)
+        return sig
+
+    def find_duplicate(self, text: str, existing: Iterable[str]) -> Optional[str]:
+        """
+        Sucht in vorhandenen Passagen nach einem (nahezu) gleichen Text.
+
+        Args:
+            text: Neue Passage
+            existing: Vorhandene Passagen, z.B. "inhalt" eines Unterthemas
+
+        Returns:
+            Die gefundene Passage oder None
+        """
+        self.stats["checks"] += 1
+        sig = self.signature(text)
+        for candidate in existing:
+            if not isinstance(candidate, str) or not candidate.strip():
+                continue
+            if candidate.strip() == text.strip() or estimate_similarity(sig, self.signature(candidate)) >= self.threshold:
+                self.stats["near_duplicates"] += 1
+                return candidate
+        return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Liefert Zähler und Größe des Signatur-Caches."""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["cached_signatures"] = len(self._signatures)
+        return stats
+
+
+# Gemeinsame Instanz für Admin-Routen und Hintergrund-Jobs
+near_duplicate_detector = NearDuplicateDetector()
@@ -2,8 +2,10 @@
 Conversation Manager für XORA Chatbot.
 Verwaltet die Konversationshistorie und stellt Funktionen für Kontext-Handling bereit.
 """
+import json
 import logging
 import re
+from functools import lru_cache
 from typing import Dict, List, Any, Optional
 
 # Setup logging
@@ -12,30 +14,300 @@ logging.basicConfig(level=logging.DEBUG,
                    datefmt='%Y-%m-%d %H:%M:%S')
 logger = logging.getLogger(__name__)
 
+# Token-Budgets für das Kontextfenster
+DEFAULT_TOKEN_BUDGET = 2000
+DEFAULT_SUMMARY_BUDGET = 400
+# Anzahl der Beispielzeilen, die in einem Tool-Digest erhalten bleiben
+DIGEST_SAMPLE_ROWS = 3
+# Overhead pro Nachricht (Rolle, Trennzeichen) wie in count_tokens in app.py
+MESSAGE_TOKEN_OVERHEAD = 4
+
+
+@lru_cache(maxsize=4)
+def get_token_encoder(model: str = "gpt-4o"):
+    """
+    Liefert einen gecachten tiktoken-Encoder für das Modell.
+
+    Args:
+        model: Modellname für die Encoder-Auswahl
+
+    Returns:
+        tiktoken-Encoding oder None, falls tiktoken nicht verfügbar ist
+    """
+    try:
+        import tiktoken
+    except ImportError:
+        logger.warning("tiktoken nicht verfügbar, Token werden geschätzt")
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_text_tokens(text: str, model: str = "gpt-4o") -> int:
+    """
+    Zählt die Token eines Textes mit dem gecachten Encoder.
+
+    Args:
+        text: Der zu zählende Text
+        model: Modellname für die Encoder-Auswahl
+
+    Returns:
+        Anzahl der Token (Schätzung mit 4 Zeichen/Token ohne tiktoken)
+    """
+    if not text:
+        return 0
+    encoder = get_token_encoder(model)
+    if encoder is None:
+        return len(text) // 4 + 1
+    return len(encoder.encode(text))
+
+
+def count_message_tokens(messages: List[Dict], model: str = "gpt-4o") -> int:
+    """
+    Zählt die Token einer Nachrichtenliste inklusive Overhead pro Nachricht.
+
+    Args:
+        messages: Liste von Chat-Nachrichten
+        model: Modellname für die Encoder-Auswahl
+
+    Returns:
+        Gesamtanzahl der Token
+    """
+    total = 0
+    for msg in messages:
+        total += count_text_tokens(str(msg.get("content") or ""), model) + MESSAGE_TOKEN_OVERHEAD
+    return total + 2
+
+
+def fit_messages_to_budget(messages: List[Dict], token_budget: int, model: str = "gpt-4o") -> List[Dict]:
+    """
+    Wählt die neuesten Nachrichten aus, die zusammen in das Token-Budget passen.
+
+    Args:
+        messages: Chronologische Liste von Nachrichten
+        token_budget: Maximale Anzahl Token
+        model: Modellname für die Encoder-Auswahl
+
+    Returns:
+        Chronologische Teilliste der neuesten Nachrichten innerhalb des Budgets
+    """
+    selected = []
+    used = 2
+    for msg in reversed(messages):
+        cost = count_text_tokens(str(msg.get("content") or ""), model) + MESSAGE_TOKEN_OVERHEAD
+        if used + cost > token_budget:
+            break
+        selected.append(msg)
+        used += cost
+    selected.reverse()
+    return selected
+
+
+def digest_tool_result(function_name: str, content: Any, sample_rows: int = DIGEST_SAMPLE_ROWS) -> str:
+    """
+    Verdichtet ein Tool-Ergebnis auf einen kompakten Digest für die Historie.
+    Statt der vollständigen JSON-Antwort werden nur Status, Anzahl, Spalten
+    und einige Beispielzeilen gespeichert.
+
+    Args:
+        function_name: Name der ausgeführten Funktion
+        content: Das Tool-Ergebnis (JSON-String oder Dict)
+        sample_rows: Anzahl der Beispielzeilen im Digest
+
+    Returns:
+        Kompakter JSON-String
+    """
+    try:
+        data = json.loads(content) if isinstance(content, str) else content
+    except (TypeError, ValueError):
+        text = str(content)
+        return text[:300] + ("..." if len(text) > 300 else "")
+
+    if not isinstance(data, dict):
+        return json.dumps({"function": function_name, "value": str(data)[:300]}, ensure_ascii=False)
+
+    digest = {"function": function_name, "status": data.get("status", "unknown")}
+    if "error" in data:
+        digest["error"] = str(data["error"])[:200]
+
+    rows = data.get("data")
+    if isinstance(rows, list):
+        digest["count"] = data.get("count", len(rows))
+        if rows and isinstance(rows[0], dict):
+            digest["columns"] = list(rows[0].keys())
+            digest["sample"] = [list(row.values()) for row in rows[:sample_rows]]
+        elif rows:
+            digest["sample"] = rows[:sample_rows]
+    return json.dumps(digest, ensure_ascii=False, default=str)
+
+
+def render_context(messages: List[Dict]) -> str:
+    """
+    Gibt ein Kontextfenster als Text für Prompts aus, die Kontext als
+    einzelne Nachricht erwarten (Routing, Funktionsauswahl, Rückfragen).
+
+    Args:
+        messages: Ergebnis von get_context_window (ältere Einträge mit
+                  "user"/"assistant"/"bot" werden ebenfalls verstanden)
+
+    Returns:
+        Eine Zeile pro Nachricht
+    """
+    lines = []
+    for msg in messages:
+        if "role" not in msg:
+            if msg.get("user"):
+                lines.append(f"user: {msg['user']}")
+            if msg.get("assistant") or msg.get("bot"):
+                lines.append(f"assistant: {msg.get('assistant') or msg.get('bot')}")
+            continue
+        lines.append(f"{msg['role']}: {msg.get('content') or ''}")
+    return "\n".join(lines)
+
+
 class ConversationManager:
     """Verwaltet Konversationskontext und -historie für die Chatbot-Interaktionen."""
     
-    def __init__(self, max_history: int = 10):
+    def __init__(self, 
+                 max_history: int = 10, 
+                 token_budget: int = DEFAULT_TOKEN_BUDGET, 
+                 summary_budget: int = DEFAULT_SUMMARY_BUDGET):
         """
         Initialisiert den ConversationManager.
         
         Args:
             max_history: Maximale Anzahl der zu speichernden Konversationsnachrichten
+            token_budget: Token-Budget für die gespeicherte Historie
+            summary_budget: Token-Budget für die fortlaufende Zusammenfassung
         """
         self.max_history = max_history
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
         
-    def get_conversation_context(self, session_data: Dict) -> List[Dict]:
+    def get_conversation_context(self, session_data: Dict, token_budget: Optional[int] = None) -> List[Dict]:
         """
         Extrahiert relevante Konversationshistorie aus den Session-Daten.
         
         Args:
             session_data: Die Session-Daten des Benutzers
+            token_budget: Optionales Token-Budget (Standard: self.token_budget)
             
         Returns:
             Liste mit relevanten Konversationsnachrichten
         """
         history = session_data.get("conversation_history", [])
-        return history[-self.max_history:] if history else []
+        if not history:
+            return []
+        budget = token_budget if token_budget is not None else self.token_budget
+        return fit_messages_to_budget(history[-self.max_history:], budget)
+
+    def get_context_window(self, session_data: Dict, token_budget: Optional[int] = None) -> List[Dict]:
+        """
+        Baut das Kontextfenster für einen LLM-Aufruf: die fortlaufende
+        Zusammenfassung älterer Turns plus die neuesten Nachrichten, zusammen
+        innerhalb des Token-Budgets. Tool-Digests werden als System-Nachricht
+        ausgegeben, damit das Fenster direkt vor die aktuelle Frage passt.
+        
+        Args:
+            session_data: Die Session-Daten des Benutzers
+            token_budget: Optionales Token-Budget (Standard: self.token_budget)
+            
+        Returns:
+            Liste von Nachrichten für den Prompt
+        """
+        budget = token_budget if token_budget is not None else self.token_budget
+        window = []
+        summary = session_data.get("conversation_summary", "")
+        if summary:
+            summary_message = {
+                "role": "system",
+                "content": f"Zusammenfassung des bisherigen Gesprächs:\n{summary}"
+            }
+            budget -= count_message_tokens([summary_message])
+            window.append(summary_message)
+        recent = fit_messages_to_budget(session_data.get("conversation_history", []), max(budget, 0))
+        # Keine angeschnittenen Turns: Fenster beginnt immer mit einer Benutzer-Nachricht
+        while recent and recent[0].get("role") != "user":
+            recent.pop(0)
+        for msg in recent:
+            if msg.get("role") == "function":
+                window.append({
+                    "role": "system",
+                    "content": f"Ergebnis der Abfrage {msg.get('name', 'unknown_function')}: {msg.get('content', '')}"
+                })
+            else:
+                window.append({"role": msg.get("role"), "content": msg.get("content", "")})
+        return window
+
+    def _summarize_turn(self, turn: List[Dict]) -> str:
+        """
+        Erstellt eine einzeilige Zusammenfassung eines Konversations-Turns.
+        
+        Args:
+            turn: Nachrichten eines Turns (Benutzer, optional Funktion, Assistent)
+            
+        Returns:
+            Zusammenfassungszeile
+        """
+        parts = []
+        for msg in turn:
+            content = str(msg.get("content") or "").replace("\n", " ").strip()
+            if msg.get("role") == "user":
+                parts.append(f"Benutzer: {content[:120]}")
+            elif msg.get("role") == "function":
+                try:
+                    digest = json.loads(content)
+                    parts.append(f"Abfrage {digest.get('function', msg.get('name'))}: {digest.get('count', '-')} Treffer")
+                except ValueError:
+                    parts.append(f"Abfrage {msg.get('name', 'unknown_function')}")
+            elif msg.get("role") == "assistant":
+                parts.append(f"Assistent: {content[:160]}")
+        return " | ".join(parts)
+
+    def _fold_into_summary(self, session_data: Dict, turn: List[Dict]) -> None:
+        """
+        Faltet einen verdrängten Turn inkrementell in die Zusammenfassung ein.
+        Die Zusammenfassung wird zeilenweise fortgeschrieben und bei Überschreitung
+        des Budgets von vorne gekürzt, ohne sie komplett neu zu berechnen.
+        
+        Args:
+            session_data: Die Session-Daten des Benutzers
+            turn: Die aus der Historie entfernten Nachrichten
+        """
+        line = self._summarize_turn(turn)
+        if not line:
+            return
+        lines = [l for l in session_data.get("conversation_summary", "").split("\n") if l]
+        lines.append(f"- {line}")
+        while len(lines) > 1 and count_text_tokens("\n".join(lines)) > self.summary_budget:
+            lines.pop(0)
+        session_data["conversation_summary"] = "\n".join(lines)
+
+    def _trim_history(self, session_data: Dict, history: List[Dict]) -> List[Dict]:
+        """
+        Kürzt die Historie turnweise auf Nachrichtenanzahl und Token-Budget.
+        Entfernte Turns werden in die Zusammenfassung übernommen.
+        
+        Args:
+            session_data: Die Session-Daten des Benutzers
+            history: Die aktuelle Historie
+            
+        Returns:
+            Gekürzte Historie
+        """
+        while len(history) > 1 and (len(history) > self.max_history * 2 or
+                                    count_message_tokens(history) > self.token_budget):
+            # Einen vollständigen Turn entfernen (bis zur nächsten Benutzer-Nachricht)
+            end = 1
+            while end < len(history) and history[end].get("role") != "user":
+                end += 1
+            if end >= len(history):
+                break
+            self._fold_into_summary(session_data, history[:end])
+            history = history[end:]
+        return history
         
     def update_conversation(self, 
                            session_data: Dict, 
@@ -50,6 +322,7 @@ class ConversationManager:
             user_message: Die letzte Nachricht des Benutzers
             response: Die Antwort des Assistenten
             function_calls: Optional, Informationen über ausgeführte Funktionsaufrufe
+                ({"name", "content"} oder bereits verdichtet {"name", "digest"})
             
         Returns:
             Aktualisierte Session-Daten
@@ -59,20 +332,21 @@ class ConversationManager:
         # Benutzer-Nachricht hinzufügen
         history.append({"role": "user", "content": user_message})
         
-        # Funktionsaufrufe hinzufügen, falls vorhanden
+        # Funktionsaufrufe als kompakten Digest hinzufügen, falls vorhanden
         if function_calls:
+            function_name = function_calls.get("name", "unknown_function")
             history.append({
                 "role": "function", 
-                "name": function_calls.get("name", "unknown_function"), 
-                "content": function_calls.get("content", "{}")
+                "name": function_name, 
+                "content": function_calls.get("digest")
+                           or digest_tool_result(function_name, function_calls.get("content", "{}"))
             })
         
         # Assistenten-Antwort hinzufügen
         history.append({"role": "assistant", "content": response})
         
-        # Historie bei Bedarf kürzen
-        if len(history) > self.max_history * 2:
-            history = history[-self.max_history:]
+        # Historie bei Bedarf kürzen (ältere Turns wandern in die Zusammenfassung)
+        history = self._trim_history(session_data, history)
             
         session_data["conversation_history"] = history
         return session_data
@@ -152,3 +426,7 @@ Führe stattdessen die zuvor besprochene Aktion aus.
             context_note += f"\nDie aktuelle Konversation zeigt, dass der Benutzer sich für folgendes interessiert: {topic}"
         
         return base_prompt + context_note
+
+
+# Gemeinsame Instanz für Chat-Route und Query-Router
+conversation_manager = ConversationManager(max_history=10)
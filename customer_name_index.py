@@ -0,0 +1,420 @@
+"""
+Kundennamen-Index für XORA Chatbot.
+Löst Kundennamen pro Verkäufer lokal zu Lead-IDs auf, statt in BigQuery mit
+LIKE '%name%' über die verknüpften Lead-Tabellen zu suchen. Der Index wird aus
+den Leads des Verkäufers aufgebaut, periodisch im Hintergrund erneuert und
+findet Namen auch bei abweichender Schreibweise:
+- Umlaut-Faltung (Küll, Kuell, Kull -> "kull")
+- Kölner Phonetik (Küll, Kühl -> "45")
+- Trigramm-Ähnlichkeit für Tippfehler
+Nur Teilstring-Treffer eines aktuellen Index ersetzen die Namenssuche durch
+einen Filter auf Lead-IDs; phonetische und Trigramm-Treffer werden als
+Kandidaten für eine Rückfrage geliefert.
+"""
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Callable, Iterable, Tuple
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG,
+                   format='%(asctime)s %(levelname)s:%(name)s:%(message)s',
+                   datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+REFRESH_SECONDS = 900
+FAILURE_RETRY_SECONDS = 60
+TRIGRAM_THRESHOLD = 0.45
+MAX_LEAD_IDS = 200
+MAX_CANDIDATES = 5
+
+# Rangfolge der Trefferarten (kleiner = verlässlicher)
+MATCH_RANK = {"substring": 0, "phonetic": 1, "trigram": 2}
+
+_UMLAUTE = str.maketrans({'ä': 'a', 'ö': 'o', 'ü': 'u', 'ß': 'ss'})
+_UMSCHREIBUNG = re.compile(r'(?<=[a-z])(ae|oe|ue)')
+
+
+def fold_name(name: Optional[str]) -> str:
+    """
+    Normalisiert einen Namen für den Vergleich.
+
+    Kleinschreibung, Umlaute und ihre Umschreibungen (ä/ae -> a, ß -> ss),
+    Akzente entfernt, Satzzeichen und Klammern durch Leerzeichen ersetzt.
+
+    Args:
+        name: Der Name
+
+    Returns:
+        Gefalteter Name, z.B. "Küll (I)" -> "kull i"
+    """
+    if not name:
+        return ''
+    text = name.lower().translate(_UMLAUTE)
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    text = _UMSCHREIBUNG.sub(lambda m: m.group(1)[0], text)
+    return ' '.join(re.findall(r'[a-z0-9]+', text))
+
+
+def koelner_phonetik(wort: str) -> str:
+    """
+    Berechnet den Code der Kölner Phonetik für ein (gefaltetes) Wort.
+
+    Args:
+        wort: Wort aus fold_name
+
+    Returns:
+        Ziffernfolge, z.B. "kull" -> "45"
+    """
+    wort = re.sub(r'[^a-z]', '', wort.lower())
+    codes = []
+    for i, c in enumerate(wort):
+        vorher = wort[i - 1] if i > 0 else ''
+        nachher = wort[i + 1] if i + 1 < len(wort) else ''
+        if c in 'aeijouy':
+            code = '0'
+        elif c == 'h':
+            continue
+        elif c == 'b':
+            code = '1'
+        elif c == 'p':
+            code = '3' if nachher == 'h' else '1'
+        elif c in 'dt':
+            code = '8' if nachher in ('c', 's', 'z') else '2'
+        elif c in 'fvw':
+            code = '3'
+        elif c in 'gkq':
+            code = '4'
+        elif c == 'c':
+            if i == 0:
+                code = '4' if nachher in tuple('ahkloqrux') else '8'
+            elif vorher in ('s', 'z'):
+                code = '8'
+            else:
+                code = '4' if nachher in tuple('ahkoqux') else '8'
+        elif c == 'x':
+            code = '8' if vorher in ('c', 'k', 'q') else '48'
+        elif c == 'l':
+            code = '5'
+        elif c in 'mn':
+            code = '6'
+        elif c == 'r':
+            code = '7'
+        elif c in 'sz':
+            code = '8'
+        else:
+            continue
+        codes.append(code)
+
+    ergebnis = ''
+    for code in ''.join(codes):
+        if not ergebnis or ergebnis[-1] != code:
+            ergebnis += code
+    if not ergebnis:
+        return ''
+    return ergebnis[0] + ergebnis[1:].replace('0', '')
+
+
+def _trigramme(text: str, padded: bool = True) -> set:
+    if padded:
+        text = f"  {text} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class CustomerNameIndex:
+    """Unveränderlicher Namensindex der Leads eines Verkäufers."""
+
+    def __init__(self, leads: Iterable[Dict[str, Any]]):
+        """
+        Baut den Index auf.
+
+        Args:
+            leads: Dictionaries mit lead_id, first_name und last_name
+        """
+        self.entries = []
+        self._trigram_postings = {}
+        self._phonetic_postings = {}
+        for lead in leads:
+            lead_id = lead.get('lead_id')
+            if not lead_id:
+                continue
+            first = fold_name(lead.get('first_name'))
+            last = fold_name(lead.get('last_name'))
+            full = f"{first} {last}".strip()
+            if not full:
+                continue
+            pos = len(self.entries)
+            tokens = full.split()
+            self.entries.append({
+                "lead_id": str(lead_id),
+                "first_name": lead.get('first_name'),
+                "last_name": lead.get('last_name'),
+                "full": full,
+                "tokens": tokens
+            })
+            for tri in _trigramme(full, padded=False):
+                self._trigram_postings.setdefault(tri, set()).add(pos)
+            for token in tokens:
+                code = koelner_phonetik(token)
+                if code:
+                    self._phonetic_postings.setdefault(code, set()).add(pos)
+        self.built_at = time.time()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _substring_treffer(self, query: str) -> List[int]:
+        """Entspricht dem bisherigen LIKE '%name%' auf Vor- oder Nachname."""
+        if len(query) >= 3:
+            kandidaten = None
+            for tri in _trigramme(query, padded=False):
+                postings = self._trigram_postings.get(tri)
+                if not postings:
+                    return []
+                kandidaten = set(postings) if kandidaten is None else kandidaten & postings
+                if not kandidaten:
+                    return []
+        else:
+            kandidaten = range(len(self.entries))
+        return sorted(pos for pos in kandidaten if query in self.entries[pos]["full"])
+
+    def _phonetik_treffer(self, tokens: List[str]) -> List[int]:
+        """Alle Wörter der Anfrage müssen phonetisch in einem Namen vorkommen."""
+        treffer = None
+        for token in tokens:
+            code = koelner_phonetik(token)
+            if not code or len(code) < 2:
+                return []
+            postings = self._phonetic_postings.get(code, set())
+            treffer = set(postings) if treffer is None else treffer & postings
+            if not treffer:
+                return []
+        return sorted(treffer or [])
+
+    def _trigramm_treffer(self, tokens: List[str], threshold: float) -> List[Tuple[int, float]]:
+        """Bester Jaccard-Wert je Anfragewort, gemittelt über alle Wörter."""
+        query_tris = [_trigramme(token) for token in tokens]
+        kandidaten = set()
+        for token in tokens:
+            for tri in _trigramme(token, padded=False):
+                kandidaten |= self._trigram_postings.get(tri, set())
+        ergebnis = []
+        for pos in kandidaten:
+            name_tris = [_trigramme(token) for token in self.entries[pos]["tokens"]]
+            werte = []
+            for q in query_tris:
+                werte.append(max(len(q & n) / len(q | n) for n in name_tris))
+            score = sum(werte) / len(werte)
+            if score >= threshold:
+                ergebnis.append((pos, score))
+        ergebnis.sort(key=lambda x: -x[1])
+        return ergebnis
+
+    def resolve(self, name: str, threshold: float = TRIGRAM_THRESHOLD) -> Dict[str, Any]:
+        """
+        Sucht Leads zu einem Kundennamen.
+
+        Reihenfolge: Teilstring (wie bisher LIKE), Kölner Phonetik, Trigramme.
+        Die erste Stufe mit Treffern gewinnt.
+
+        Args:
+            name: Kundenname aus der Anfrage
+            threshold: Mindest-Ähnlichkeit für die Trigramm-Stufe
+
+        Returns:
+            Dictionary mit "match" (substring/phonetic/trigram/none) und "leads"
+        """
+        query = fold_name(name)
+        if not query:
+            return {"match": "none", "leads": []}
+        tokens = query.split()
+
+        positionen = self._substring_treffer(query)
+        match = "substring"
+        if not positionen:
+            positionen = self._phonetik_treffer(tokens)
+            match = "phonetic"
+        if not positionen:
+            positionen = [pos for pos, score in self._trigramm_treffer(tokens, threshold)]
+            match = "trigram"
+        if not positionen:
+            match = "none"
+
+        leads = [{key: self.entries[pos][key] for key in ("lead_id", "first_name", "last_name")}
+                 for pos in positionen]
+        return {"match": match, "leads": leads}
+
+
+class CustomerNameResolver:
+    """Hält einen CustomerNameIndex pro Verkäufer und erneuert ihn periodisch."""
+
+    def __init__(self, loader: Callable[[str], List[Dict[str, Any]]],
+                 refresh_seconds: int = REFRESH_SECONDS, max_sellers: int = 200,
+                 max_lead_ids: int = MAX_LEAD_IDS):
+        """
+        Initialisiert den CustomerNameResolver.
+
+        Args:
+            loader: Funktion seller_id -> Leads (lead_id, first_name, last_name)
+            refresh_seconds: Alter, ab dem ein Index im Hintergrund neu aufgebaut wird
+            max_sellers: Maximale Anzahl gehaltener Indizes (LRU)
+            max_lead_ids: Mehr Treffer gelten als nicht eindeutig auflösbar
+        """
+        self.loader = loader
+        self.refresh_seconds = refresh_seconds
+        self.max_sellers = max_sellers
+        self.max_lead_ids = max_lead_ids
+        self._indizes = OrderedDict()
+        self._fehler = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._build_locks = {}
+        self.stats = {"lookups": 0, "resolved": 0, "unresolved": 0, "fuzzy": 0, "stale": 0, "builds": 0,
+                      "background_refreshes": 0, "build_errors": 0}
+
+    def _build(self, seller_id: str) -> CustomerNameIndex:
+        started = time.perf_counter()
+        index = CustomerNameIndex(self.loader(seller_id))
+        with self._lock:
+            self._indizes[seller_id] = index
+            self._indizes.move_to_end(seller_id)
+            while len(self._indizes) > self.max_sellers:
+                self._indizes.popitem(last=False)
+            self._fehler.pop(seller_id, None)
+            self.stats["builds"] += 1
+        logger.info(f"Namensindex für Seller {seller_id} aufgebaut: {len(index)} Leads "
+                    f"in {time.perf_counter() - started:.2f}s")
+        return index
+
+    def _refresh_im_hintergrund(self, seller_id: str) -> None:
+        with self._lock:
+            if seller_id in self._refreshing:
+                return
+            self._refreshing.add(seller_id)
+            self.stats["background_refreshes"] += 1
+
+        def refresh():
+            try:
+                self._build(seller_id)
+            except Exception as e:
+                logger.warning(f"Namensindex für Seller {seller_id} konnte nicht erneuert werden: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(seller_id)
+
+        threading.Thread(target=refresh, name=f"name-index-{seller_id}", daemon=True).start()
+
+    def get_index(self, seller_id: str) -> Optional[CustomerNameIndex]:
+        """
+        Liefert den Index eines Verkäufers.
+
+        Der erste Zugriff baut ihn synchron auf; ein veralteter Index wird weiter
+        verwendet und im Hintergrund erneuert.
+
+        Returns:
+            Der Index oder None, wenn die Leads nicht geladen werden konnten
+        """
+        with self._lock:
+            index = self._indizes.get(seller_id)
+            if index is not None:
+                self._indizes.move_to_end(seller_id)
+            fehler_seit = self._fehler.get(seller_id)
+            build_lock = self._build_locks.setdefault(seller_id, threading.Lock())
+
+        if index is not None:
+            if time.time() - index.built_at > self.refresh_seconds:
+                self._refresh_im_hintergrund(seller_id)
+            return index
+        if fehler_seit and time.time() - fehler_seit < FAILURE_RETRY_SECONDS:
+            return None
+
+        with build_lock:
+            with self._lock:
+                index = self._indizes.get(seller_id)
+            if index is not None:
+                return index
+            try:
+                return self._build(seller_id)
+            except Exception as e:
+                logger.warning(f"Namensindex für Seller {seller_id} nicht verfügbar: {e}")
+                with self._lock:
+                    self._fehler[seller_id] = time.time()
+                    self.stats["build_errors"] += 1
+                return None
+
+    def resolve(self, seller_id: Optional[str], *names: Optional[str]) -> Optional[Dict[str, Any]]:
+        """
+        Löst einen oder mehrere Namensvarianten zu Lead-IDs auf.
+
+        Gewertet wird die verlässlichste Trefferart über alle Varianten. Nur
+        Teilstring-Treffer eines nicht veralteten Index liefern "lead_ids" (Filter
+        statt Namenssuche); sonst sucht BigQuery wie bisher über den Namen.
+
+        Args:
+            seller_id: Verkäufer, dessen Leads durchsucht werden
+            names: Namensvarianten, z.B. "ramm (i)" und "ramm"
+
+        Returns:
+            Dictionary mit "match" (substring/phonetic/trigram), "leads" (Kandidaten),
+            "stale" und "lead_ids" (None, wenn nicht per ID gefiltert werden darf),
+            oder None, wenn kein Index oder kein Treffer vorliegt
+        """
+        self.stats["lookups"] += 1
+        index = self.get_index(seller_id) if seller_id else None
+        if index is None:
+            self.stats["unresolved"] += 1
+            return None
+
+        match = None
+        leads = []
+        for name in names:
+            if not name:
+                continue
+            ergebnis = index.resolve(name)
+            if not ergebnis["leads"]:
+                continue
+            logger.info(f"Kundenname '{name}' lokal aufgelöst ({ergebnis['match']}): "
+                        f"{len(ergebnis['leads'])} Lead(s)")
+            if match is None or MATCH_RANK[ergebnis["match"]] < MATCH_RANK[match]:
+                match, leads = ergebnis["match"], []
+            if ergebnis["match"] == match:
+                bekannt = {lead["lead_id"] for lead in leads}
+                leads.extend(lead for lead in ergebnis["leads"] if lead["lead_id"] not in bekannt)
+
+        if match is None:
+            self.stats["unresolved"] += 1
+            return None
+
+        # Ein veralteter Index kennt neue Leads nicht: dann lieber über den Namen suchen
+        stale = time.time() - index.built_at > self.refresh_seconds
+        lead_ids = None
+        if match == "substring" and not stale and len(leads) <= self.max_lead_ids:
+            lead_ids = [lead["lead_id"] for lead in leads]
+            self.stats["resolved"] += 1
+        elif match != "substring":
+            self.stats["fuzzy"] += 1
+        elif stale:
+            self.stats["stale"] += 1
+        else:
+            self.stats["unresolved"] += 1
+        return {"match": match, "leads": leads, "stale": stale, "lead_ids": lead_ids}
+
+    def invalidate(self, seller_id: Optional[str] = None) -> None:
+        """Verwirft den Index eines Verkäufers (oder alle)."""
+        with self._lock:
+            if seller_id is None:
+                self._indizes.clear()
+            else:
+                self._indizes.pop(seller_id, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Liefert Zähler sowie Anzahl und Größe der gehaltenen Indizes."""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["sellers"] = len(self._indizes)
+            stats["leads"] = sum(len(index) for index in self._indizes.values())
+        return stats
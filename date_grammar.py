@@ -0,0 +1,323 @@
+"""
+Date Grammar für XORA Chatbot.
+Erkennt deutsche und englische Zeitangaben in Benutzeranfragen mit vorkompilierten
+Mustern und liefert direkt einen Datumsbereich (start_date/end_date):
+Monate, Monatsbereiche, Quartale, Halbjahre, Jahre, konkrete Daten,
+"letzte Woche", "seit März", "letzte 30 Tage" usw. Ergebnisse werden pro
+normalisierter Anfrage und Tag in einem LRU-Cache gehalten. dateparser wird
+nur noch als letzter Ausweg vom Aufrufer verwendet.
+"""
+import calendar
+import logging
+import re
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG,
+                   format='%(asctime)s %(levelname)s:%(name)s:%(message)s',
+                   datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+MONTHS = {
+    "januar": 1, "jänner": 1, "jaenner": 1, "january": 1, "jan": 1,
+    "februar": 2, "february": 2, "feb": 2,
+    "märz": 3, "maerz": 3, "march": 3, "mär": 3, "mar": 3,
+    "april": 4, "apr": 4,
+    "mai": 5, "may": 5,
+    "juni": 6, "june": 6, "jun": 6,
+    "juli": 7, "july": 7, "jul": 7,
+    "august": 8, "aug": 8,
+    "september": 9, "sept": 9, "sep": 9,
+    "oktober": 10, "october": 10, "okt": 10, "oct": 10,
+    "november": 11, "nov": 11,
+    "dezember": 12, "december": 12, "dez": 12, "dec": 12,
+}
+NUMBER_WORDS = {
+    "ein": 1, "einen": 1, "einem": 1, "eine": 1, "one": 1, "a": 1,
+    "zwei": 2, "two": 2, "drei": 3, "three": 3, "vier": 4, "four": 4, "fünf": 5, "five": 5,
+    "sechs": 6, "six": 6, "sieben": 7, "seven": 7, "acht": 8, "eight": 8, "neun": 9, "nine": 9,
+    "zehn": 10, "ten": 10, "zwölf": 12, "twelve": 12,
+}
+ORDINALS = {
+    "erste": 1, "ersten": 1, "erstes": 1, "first": 1, "1.": 1,
+    "zweite": 2, "zweiten": 2, "zweites": 2, "second": 2, "2.": 2,
+    "dritte": 3, "dritten": 3, "drittes": 3, "third": 3, "3.": 3,
+    "vierte": 4, "vierten": 4, "viertes": 4, "fourth": 4, "4.": 4,
+}
+
+_MONTH = r'(?P<{name}>' + '|'.join(sorted(map(re.escape, MONTHS), key=len, reverse=True)) + r')\.?'
+_YEAR = r'(?:\s*,?\s*(?P<{name}>20\d{{2}}))'
+_NUMBER = r'(?P<n>\d{1,3}|' + '|'.join(NUMBER_WORDS) + r')'
+_ORDINAL = r'(?P<ord>' + '|'.join(re.escape(o) for o in ORDINALS) + r')'
+_LAST = r'(?:letzte[nrms]?|vergangene[nrms]?|vorige[nrms]?|last|past|previous)'
+_THIS = r'(?:diese[nrms]?|aktuelle[nrms]?|laufende[nrms]?|this|current)'
+_DMY = r'(?P<{name}d>\d{{1,2}})\.\s?(?P<{name}m>\d{{1,2}})\.(?P<{name}y>(?:\d{{4}}|\d{{2}})\b)?'
+_ISO = r'(?P<{name}iy>\d{{4}})-(?P<{name}im>\d{{2}})-(?P<{name}id>\d{{2}})'
+
+
+def _date_pattern(name: str) -> str:
+    return '(?:' + _ISO.format(name=name) + '|' + _DMY.format(name=name) + ')'
+
+
+# Reihenfolge = Priorität: spezifischere Ausdrücke zuerst
+PATTERNS = [
+    ("date_range", re.compile(
+        r'(?:(?:vom|von|from)\s+)?' + _date_pattern('a') +
+        r'\s*(?:bis(?:\s+zum)?|-|–|to|until)\s*' + _date_pattern('b'))),
+    ("date_range", re.compile(
+        r'\b(?:zwischen|between)\s+(?:dem\s+)?' + _date_pattern('a') + r'\s+(?:und|and)\s+(?:dem\s+)?' + _date_pattern('b'))),
+    ("month_range", re.compile(
+        r'\b(?:(?:von|from)\s+)?' + _MONTH.format(name='m1') + _YEAR.format(name='y1') + r'?'
+        r'\s*(?:bis(?:\s+(?:ende|einschließlich))?|-|–|to|through|until)\s*' +
+        _MONTH.format(name='m2') + _YEAR.format(name='y2') + r'?\b')),
+    ("month_range", re.compile(
+        r'\b(?:zwischen|between)\s+' + _MONTH.format(name='m1') + _YEAR.format(name='y1') + r'?'
+        r'\s+(?:und|and)\s+' + _MONTH.format(name='m2') + _YEAR.format(name='y2') + r'?\b')),
+    ("since", re.compile(
+        r'\b(?:seit|ab|since|from)\s+(?:(?:anfang|beginn)\s+)?(?:dem\s+|des\s+)?(?:' + _date_pattern('s') + r'|' +
+        _MONTH.format(name='smon') + _YEAR.format(name='syr') + r'?|(?P<sonly>20\d{2})|(?P<syear>jahresbeginn|jahresanfang|anfang des jahres|beginning of the year))\b')),
+    ("quarter", re.compile(
+        r'\b(?:q(?P<q>[1-4])|' + _ORDINAL + r'\s*(?:quartal|quarter)|(?:quartal|quarter)\s*(?P<q2>[1-4]))'
+        r'(?:\s*(?:/|des jahres|of)?\s*(?P<y>20\d{2}))?\b')),
+    ("half", re.compile(
+        r'\b(?:h(?P<h>[12])|(?P<hord>erste[ns]?|zweite[ns]?|first|second)\s*(?:halbjahr|half(?: of the year)?))'
+        r'(?:\s*(?:/|des jahres|of)?\s*(?P<y>20\d{2}))?\b')),
+    ("last_n", re.compile(
+        r'\b(?:(?:in\s+den\s+)?' + _LAST + r'|in the last|in den letzten)\s+' + _NUMBER +
+        r'\s+(?P<unit>tage?n?|days?|wochen?|weeks?|monate?n?|months?|jahre?n?|years?)\b')),
+    ("relative", re.compile(
+        r'\b(?P<rel>' + _LAST + r'|' + _THIS + r')\s*(?P<unit>woche|week|monat|month|quartal|quarter|jahr(?:es)?|year)\b'
+        r'|\b(?P<word>vormonat|vorjahr(?:es)?|vorquartal|vorwoche|heute|today|gestern|yesterday|vorgestern)\b')),
+    ("month", re.compile(r'\b' + _MONTH.format(name='m') + _YEAR.format(name='y') + r'?\b')),
+    ("single_date", re.compile(_date_pattern('d'))),
+    ("year", re.compile(r'\b(?:im jahr(?:e)?\s+|jahr\s+|year\s+|in\s+)?(?P<y>20\d{2})\b')),
+]
+
+# "letzten Jahres", "des Vorjahres", "this year": Jahr für Monate, Quartale und Halbjahre
+YEAR_QUALIFIER = re.compile(
+    r'\b(?:(?P<rel>' + _LAST + r'|' + _THIS + r')\s*(?:jahr(?:es)?|year)|vorjahr(?:es)?)\b')
+# Jahresangabe direkt hinter einem Monatsnamen ("Mai letzten Jahres", "Mai des Vorjahres")
+FOLLOWING_YEAR = re.compile(r'\s*,?\s*(?:des\s+|of\s+)?' + YEAR_QUALIFIER.pattern)
+
+# Hinweise auf Zeitangaben, die die Grammatik nicht abdeckt (nur dann dateparser)
+DATE_HINT = re.compile(
+    r'\d|\b(morgen|übermorgen|tomorrow|ago|vor\s+\w+\s+(tagen|wochen|monaten|jahren)|nächste[nrms]?|next|'
+    r'montag|dienstag|mittwoch|donnerstag|freitag|samstag|sonntag|monday|tuesday|wednesday|thursday|friday|'
+    r'saturday|sunday|wochenende|weekend)\b',
+    re.IGNORECASE
+)
+
+
+def _month_end(year: int, month: int) -> date:
+    return date(year, month, calendar.monthrange(year, month)[1])
+
+
+def _add_months(d: date, months: int) -> date:
+    month_index = d.year * 12 + d.month - 1 + months
+    year, month = divmod(month_index, 12)
+    return date(year, month + 1, min(d.day, calendar.monthrange(year, month + 1)[1]))
+
+
+def _year_of(value: Optional[str], default: int) -> int:
+    if not value:
+        return default
+    year = int(value)
+    return year + 2000 if year < 100 else year
+
+
+def _date_from(match, name: str, today: date) -> Optional[date]:
+    try:
+        if match.group(f'{name}iy'):
+            return date(int(match.group(f'{name}iy')), int(match.group(f'{name}im')), int(match.group(f'{name}id')))
+        if match.group(f'{name}d'):
+            return date(_year_of(match.group(f'{name}y'), today.year),
+                        int(match.group(f'{name}m')), int(match.group(f'{name}d')))
+    except ValueError:
+        return None
+    return None
+
+
+def _number(value: str) -> int:
+    return int(value) if value.isdigit() else NUMBER_WORDS[value]
+
+
+def _quarter_range(year: int, quarter: int) -> Tuple[date, date]:
+    start = date(year, 3 * (quarter - 1) + 1, 1)
+    return start, _month_end(year, 3 * quarter)
+
+
+def _match_range(kind: str, m, today: date, year_hint: Optional[int]) -> Optional[Tuple[date, date]]:
+    """Wandelt einen Treffer eines Musters in (start, ende) um."""
+    default_year = year_hint or today.year
+    if kind == "date_range":
+        start, end = _date_from(m, 'a', today), _date_from(m, 'b', today)
+        if start and end and start <= end:
+            return start, end
+        return None
+
+    if kind == "month_range":
+        y2 = _year_of(m.group('y2'), default_year)
+        y1 = _year_of(m.group('y1'), y2)
+        m1, m2 = MONTHS[m.group('m1')], MONTHS[m.group('m2')]
+        if (y1, m1) > (y2, m2) and not m.group('y1'):
+            # "November bis Februar 2025" -> November des Vorjahres
+            y1 -= 1
+        if (y1, m1) > (y2, m2):
+            return None
+        return date(y1, m1, 1), _month_end(y2, m2)
+
+    if kind == "since":
+        start = _date_from(m, 's', today)
+        if start is None and m.group('smon'):
+            month = MONTHS[m.group('smon')]
+            year = _year_of(m.group('syr'), year_hint or today.year)
+            # "seit November" im März meint den November des Vorjahres
+            if not m.group('syr') and not year_hint and month > today.month:
+                year -= 1
+            start = date(year, month, 1)
+        elif start is None and m.group('sonly'):
+            start = date(int(m.group('sonly')), 1, 1)
+        elif start is None and m.group('syear'):
+            start = date(today.year, 1, 1)
+        if start and start <= today:
+            return start, today
+        return None
+
+    if kind == "quarter":
+        quarter = int(m.group('q') or m.group('q2') or ORDINALS[m.group('ord')])
+        return _quarter_range(_year_of(m.group('y'), default_year), quarter)
+
+    if kind == "half":
+        half = int(m.group('h')) if m.group('h') else (1 if m.group('hord').startswith(('erst', 'first')) else 2)
+        year = _year_of(m.group('y'), default_year)
+        return (date(year, 1, 1), date(year, 6, 30)) if half == 1 else (date(year, 7, 1), date(year, 12, 31))
+
+    if kind == "last_n":
+        n = _number(m.group('n'))
+        unit = m.group('unit')
+        if unit.startswith(('tag', 'day')):
+            start = today - timedelta(days=n)
+        elif unit.startswith(('woche', 'week')):
+            start = today - timedelta(weeks=n)
+        elif unit.startswith(('monat', 'month')):
+            start = _add_months(today, -n)
+        else:
+            start = _add_months(today, -12 * n)
+        return start, today
+
+    if kind == "relative":
+        word = m.group('word')
+        if word:
+            if word in ('heute', 'today'):
+                return today, today
+            if word in ('gestern', 'yesterday'):
+                return today - timedelta(days=1), today - timedelta(days=1)
+            if word == 'vorgestern':
+                return today - timedelta(days=2), today - timedelta(days=2)
+            rel = 'last'
+            unit = {'vormonat': 'monat', 'vorquartal': 'quartal', 'vorwoche': 'woche'}.get(word, 'jahr')
+        else:
+            rel = 'this' if re.match(_THIS, m.group('rel')) else 'last'
+            unit = m.group('unit')
+        offset = -1 if rel == 'last' else 0
+        if unit in ('woche', 'week'):
+            monday = today - timedelta(days=today.weekday()) + timedelta(weeks=offset)
+            return monday, monday + timedelta(days=6)
+        if unit in ('monat', 'month'):
+            first = _add_months(today.replace(day=1), offset)
+            return first, _month_end(first.year, first.month)
+        if unit in ('quartal', 'quarter'):
+            quarter_index = today.year * 4 + (today.month - 1) // 3 + offset
+            return _quarter_range(quarter_index // 4, quarter_index % 4 + 1)
+        year = today.year + offset
+        return date(year, 1, 1), date(year, 12, 31)
+
+    if kind == "month":
+        month = MONTHS[m.group('m')]
+        year = _year_of(m.group('y'), default_year)
+        return date(year, month, 1), _month_end(year, month)
+
+    if kind == "single_date":
+        day = _date_from(m, 'd', today)
+        return (day, day) if day else None
+
+    if kind == "year":
+        year = int(m.group('y'))
+        return date(year, 1, 1), date(year, 12, 31)
+    return None
+
+
+def normalize_date_text(text: str) -> str:
+    """Normalisiert eine Anfrage für den Cache-Schlüssel (Kleinschreibung, Leerzeichen)."""
+    return re.sub(r'\s+', ' ', text.lower()).strip()
+
+
+@lru_cache(maxsize=2048)
+def _year_hint(normalized: str, today: date) -> Tuple[Optional[int], bool]:
+    """Jahr für Monate/Quartale ohne Jahreszahl: explizit (2025) oder relativ ("letzten Jahres")."""
+    year_match = re.search(r'\b(20\d{2})\b', normalized)
+    if year_match:
+        return int(year_match.group(1)), False
+    qualifier = YEAR_QUALIFIER.search(normalized)
+    if qualifier:
+        last = not qualifier.group('rel') or not re.match(_THIS, qualifier.group('rel'))
+        return today.year - 1 if last else today.year, True
+    return None, False
+
+
+@lru_cache(maxsize=2048)
+def _parse_cached(normalized: str, today_iso: str) -> Optional[Tuple[str, str, str]]:
+    today = date.fromisoformat(today_iso)
+    year_hint, relative_year = _year_hint(normalized, today)
+    fallback = None
+    for kind, pattern in PATTERNS:
+        for m in pattern.finditer(normalized):
+            # "Juni letztes Jahr": die Jahresangabe qualifiziert nur den Monat,
+            # das ganze Jahr gilt nur, wenn sonst nichts passt
+            if relative_year and kind == "relative" and YEAR_QUALIFIER.fullmatch(m.group(0)):
+                fallback = fallback or _match_range(kind, m, today, year_hint)
+                continue
+            # Kurze Monatsnamen nur mit Kontext: Präposition davor oder Jahr dahinter
+            # ("mar" in "marketing", "Frau Mai" sind kein Monat)
+            if kind == "month" and len(m.group('m')) <= 3 and not (
+                    m.group('y') or FOLLOWING_YEAR.match(normalized, m.end()) or re.search(
+                        r'\b(im|in|ab|bis|seit|von|für|of)\s+' + re.escape(m.group('m')) + r'\b', normalized)):
+                continue
+            result = _match_range(kind, m, today, year_hint)
+            if result:
+                return result[0].isoformat(), result[1].isoformat(), kind
+    if fallback:
+        return fallback[0].isoformat(), fallback[1].isoformat(), "relative"
+    return None
+
+
+def parse_date_range(text: str, today: Optional[date] = None) -> Optional[Dict[str, str]]:
+    """
+    Erkennt die erste Zeitangabe in einer Anfrage und liefert den Datumsbereich.
+
+    Args:
+        text: Die Benutzeranfrage
+        today: Optional, Bezugsdatum (Standard: heute)
+
+    Returns:
+        Dictionary mit start_date, end_date (YYYY-MM-DD) und kind oder None
+    """
+    if not text:
+        return None
+    result = _parse_cached(normalize_date_text(text), (today or date.today()).isoformat())
+    if result is None:
+        return None
+    return {"start_date": result[0], "end_date": result[1], "kind": result[2]}
+
+
+def has_date_hint(text: str) -> bool:
+    """True, wenn die Anfrage Zeitangaben enthalten könnte, die die Grammatik nicht kennt."""
+    return bool(DATE_HINT.search(text or ""))
+
+
+def get_cache_stats() -> Dict[str, int]:
+    """Liefert die Statistik des LRU-Caches."""
+    info = _parse_cached.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "entries": info.currsize, "max_entries": info.maxsize}
@@ -0,0 +1,220 @@
+"""
+Decision Cache für XORA Chatbot.
+Speichert Routing-Entscheidungen (gewähltes Tool und Parameter-Slots) zu
+normalisierten Benutzeranfragen, damit wiederholte Fragen die LLM-basierte
+Tool-Auswahl überspringen. Datumsangaben werden beim Normalisieren durch
+Platzhalter ersetzt und bei einem Treffer neu aus der Anfrage extrahiert.
+Lassen sich dabei nicht alle benötigten Datumswerte gewinnen, gilt der
+Treffer als Fehlschlag und das LLM ermittelt die Parameter erneut.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Set
+
+from extract import extract_enhanced_date_params
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG,
+                   format='%(asctime)s %(levelname)s:%(name)s:%(message)s',
+                   datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+QUERY_PATTERNS_PATH = 'query_patterns.json'
+
+# Parameter, die nicht im Cache landen (pro Anfrage bzw. pro Benutzer neu gesetzt)
+DATE_SLOTS = {"start_date", "end_date", "year_month", "start_of_month", "end_of_month", "days_in_month"}
+NON_CACHED_SLOTS = DATE_SLOTS | {"seller_id"}
+
+UMLAUT_MAP = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss"})
+
+MONTH_NAMES = [
+    "januar", "jaenner", "februar", "maerz", "april", "mai", "juni", "juli", "august",
+    "september", "oktober", "november", "dezember",
+    "january", "february", "march", "may", "june", "july", "october", "december",
+    "jan", "feb", "mar", "apr", "jun", "jul", "aug", "sep", "sept", "okt", "oct", "nov", "dez", "dec"
+]
+
+# Reihenfolge ist wichtig: zuerst vollständige Datumsangaben, dann Teile
+DATE_PLACEHOLDERS = [
+    (re.compile(r'\b\d{4}-\d{2}-\d{2}\b'), '<datum>'),
+    (re.compile(r'\b\d{1,2}\.\d{1,2}\.(\d{4}|\d{2})?'), '<datum>'),
+    (re.compile(r'\bq[1-4]\b'), '<quartal>'),
+    (re.compile(r'\b(' + '|'.join(MONTH_NAMES) + r')\b'), '<monat>'),
+    (re.compile(r'\b(19|20)\d{2}\b'), '<jahr>'),
+]
+
+
+def normalize_message(message: str, replace_dates: bool = True) -> str:
+    """
+    Normalisiert eine Benutzeranfrage für den Cache-Schlüssel:
+    Kleinschreibung, Umlaute, Satzzeichen, Leerzeichen und Datumsangaben.
+
+    Args:
+        message: Die Benutzeranfrage
+        replace_dates: Datumsangaben durch Platzhalter ersetzen
+
+    Returns:
+        Normalisierter Schlüssel
+    """
+    text = message.lower().translate(UMLAUT_MAP)
+    if replace_dates:
+        for pattern, placeholder in DATE_PLACEHOLDERS:
+            text = pattern.sub(placeholder, text)
+    text = re.sub(r'[^\w<>\s]', ' ', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+class DecisionCache:
+    """LRU-Cache für Routing-Entscheidungen mit TTL und Invalidierung bei Pattern-Änderungen."""
+
+    def __init__(self, max_entries: int = 500, ttl_seconds: int = 24 * 3600):
+        """
+        Initialisiert den DecisionCache.
+
+        Args:
+            max_entries: Maximale Anzahl gespeicherter Entscheidungen
+            ttl_seconds: Lebensdauer eines Eintrags in Sekunden
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._patterns_mtime = None
+        # Pflicht-Datumsparameter je Abfragemuster (aus query_patterns.json)
+        self._required_dates: Dict[str, Set[str]] = {}
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0, "parameter_misses": 0}
+
+    def _check_patterns_changed(self) -> None:
+        """Leert den Cache, wenn sich query_patterns.json geändert hat (Lock muss gehalten werden)."""
+        try:
+            mtime = os.path.getmtime(QUERY_PATTERNS_PATH)
+        except OSError:
+            return
+        if mtime == self._patterns_mtime:
+            return
+        if self._patterns_mtime is not None:
+            logger.info("query_patterns.json geändert - Entscheidungs-Cache wird geleert")
+            self._entries.clear()
+            self.stats["invalidations"] += 1
+        self._patterns_mtime = mtime
+        try:
+            with open(QUERY_PATTERNS_PATH, 'r', encoding='utf-8') as f:
+                patterns = json.load(f).get('common_queries', {})
+            self._required_dates = {name: set(pattern.get('required_parameters', [])) & DATE_SLOTS
+                                    for name, pattern in patterns.items()}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Pflicht-Datumsparameter konnten nicht gelesen werden: {e}")
+
+    def get(self, message: str) -> Optional[Dict[str, Any]]:
+        """
+        Liefert die gespeicherte Entscheidung zu einer Anfrage.
+
+        Args:
+            message: Die Benutzeranfrage
+
+        Returns:
+            Dictionary mit tool, reasoning und optional parameters oder None
+        """
+        key = normalize_message(message)
+        with self._lock:
+            self._check_patterns_changed()
+            entry = self._entries.get(key)
+            if entry and time.time() - entry["created"] > self.ttl_seconds:
+                del self._entries[key]
+                entry = None
+            if not entry:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return dict(entry)
+
+    def put(self, message: str, tool: str, reasoning: str) -> None:
+        """
+        Speichert eine Routing-Entscheidung.
+
+        Args:
+            message: Die Benutzeranfrage
+            tool: Das gewählte Tool (oder direct_conversation)
+            reasoning: Begründung der ursprünglichen Auswahl
+        """
+        key = normalize_message(message)
+        with self._lock:
+            self._check_patterns_changed()
+            self._entries[key] = {"tool": tool, "reasoning": reasoning, "parameters": None, "created": time.time()}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def store_parameters(self, message: str, tool: str, parameters: Dict[str, Any]) -> None:
+        """
+        Ergänzt eine Entscheidung um die Parameter-Slots (ohne Datum und seller_id).
+
+        Args:
+            message: Die Benutzeranfrage
+            tool: Das ausgeführte Tool
+            parameters: Die vom LLM ermittelten Parameter
+        """
+        key = normalize_message(message)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry["tool"] == tool:
+                entry["parameters"] = {k: v for k, v in parameters.items() if k not in NON_CACHED_SLOTS}
+                # Datums-Slots, die bei einem Treffer wieder gefüllt werden müssen
+                entry["date_slots"] = {k for k in parameters if k in DATE_SLOTS}
+
+    def get_parameters(self, message: str, tool: str) -> Optional[Dict[str, Any]]:
+        """
+        Liefert die gespeicherten Parameter-Slots, mit neu extrahierten Datumswerten.
+
+        Fehlt danach ein Datumswert, den das Muster verlangt oder den das LLM beim
+        ersten Mal gesetzt hatte (z.B. start_of_month), gilt das als Fehlschlag.
+
+        Args:
+            message: Die aktuelle Benutzeranfrage
+            tool: Das gewählte Tool
+
+        Returns:
+            Parameter-Dictionary oder None, wenn keine Slots gespeichert sind oder
+            die Datumswerte nicht vollständig aus der Anfrage extrahiert werden können
+        """
+        key = normalize_message(message)
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry or entry["tool"] != tool or entry["parameters"] is None:
+                return None
+            parameters = dict(entry["parameters"])
+            benoetigt = self._required_dates.get(tool, set()) | entry.get("date_slots", set())
+        parameters.update(extract_enhanced_date_params(message))
+        fehlend = benoetigt - parameters.keys()
+        if fehlend:
+            logger.info(f"Entscheidungs-Cache für {tool}: Datumswerte {sorted(fehlend)} nicht extrahierbar, "
+                        f"Parameter werden neu ermittelt")
+            with self._lock:
+                self.stats["parameter_misses"] += 1
+            return None
+        return parameters
+
+    def clear(self) -> None:
+        """Leert den Cache vollständig."""
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Liefert Trefferstatistik und Größe des Caches."""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+        total = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / total, 3) if total else 0.0
+        return stats
+
+
+# Gemeinsame Instanz für Routing und Streaming
+decision_cache = DecisionCache()
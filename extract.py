@@ -1,84 +1,40 @@
 import re
 import json
 import logging
-import dateparser
 from datetime import datetime, timedelta
 from utils import debug_print
+from date_grammar import parse_date_range, has_date_hint
+
+def _dateparser():
+    """Importiert dateparser erst bei Bedarf (der Import dauert beim Start mehrere Sekunden)."""
+    import dateparser
+    return dateparser
 
 def extract_enhanced_date_params(user_message):
     """
     Erweiterte Version von extract_date_params mit mehr Robustheit:
     - Unterstützt mehrere Sprachen (DE, EN)
-    - Erweiterte Regex-Patterns für Monatsnamen
+    - Vorkompilierte Grammatik für Monate, Quartale und relative Zeiträume (date_grammar)
     - Bessere Fehlerbehandlung
     - Kontextbewusste Datumsergänzung
     """
     extracted_args = {}
     
-    # Deutsche und englische Monatsnamen
-    month_map = {
-        # Deutsche Monatsnamen (mit Variationen)
-        "januar": 1, "jan": 1, "jänner": 1,
-        "februar": 2, "feb": 2, 
-        "märz": 3, "mar": 3, "maerz": 3,
-        "april": 4, "apr": 4,
-        "mai": 5,
-        "juni": 6, "jun": 6,
-        "juli": 7, "jul": 7,
-        "august": 8, "aug": 8,
-        "september": 9, "sep": 9, "sept": 9,
-        "oktober": 10, "okt": 10, "oct": 10,
-        "november": 11, "nov": 11,
-        "dezember": 12, "dez": 12, "dec": 12,
-        
-        # Englische Monatsnamen
-        "january": 1, "february": 2, "march": 3, "april": 4, "may": 5, "june": 6,
-        "july": 7, "august": 8, "september": 9, "october": 10, "november": 11, "december": 12
-    }
-    
     user_message_lower = user_message.lower()
     current_date = datetime.now()
     current_year = current_date.year
-    
-    # 1. Erkennung von expliziten Jahren (z.B. "2025")
-    year_match = re.search(r'\b(20\d\d)\b', user_message)
-    extracted_year = int(year_match.group(1)) if year_match else current_year
-    
-    # 2. Prüfe auf Monatsnamen
-    for month_name, month_num in month_map.items():
-        # Suche nach "im [Monat]" oder "[Monat] 2023" Patterns mit Wortgrenzen
-        month_patterns = [
-            fr'\b{month_name}\b',  # Nur den Monatsnamen
-            fr'im\s+{month_name}\b',  # "im [Monat]"
-            fr'{month_name}\s+{extracted_year}\b',  # "[Monat] 2025"
-        ]
-        
-        if any(re.search(pattern, user_message_lower) for pattern in month_patterns):
-            # Bestimme Jahr basierend auf Kontext
-            year = extracted_year
-            
-            # Erstelle Start- und Enddaten für den Monat
-            try:
-                start_date = datetime(year, month_num, 1)
-                
-                # Bestimme den letzten Tag des Monats
-                if month_num == 12:
-                    end_date = datetime(year, 12, 31)
-                else:
-                    next_month_date = datetime(year, month_num + 1, 1)
-                    end_date = next_month_date - timedelta(days=1)
-                
-                extracted_args["start_date"] = start_date.strftime("%Y-%m-%d")
-                extracted_args["end_date"] = end_date.strftime("%Y-%m-%d")
-                debug_print("Datumsextraktion", f"Extrahierter Monat: {month_name}, Jahr: {year}, Start: {extracted_args['start_date']}, Ende: {extracted_args['end_date']}")
-                return extracted_args
-            except ValueError as e:
-                debug_print("Datumsextraktion", f"Fehler bei der Datumskonvertierung: {e}")
-                continue
-    
-    # 3. Dateparser als Fallback für komplexere Datumsausdrücke
+
+    # 1. Vorkompilierte Grammatik (Monate, Quartale, relative Zeiträume, ...)
+    bereich = parse_date_range(user_message)
+    if bereich:
+        extracted_args["start_date"] = bereich["start_date"]
+        extracted_args["end_date"] = bereich["end_date"]
+        debug_print("Datumsextraktion", f"Erkannter Zeitraum ({bereich['kind']}): Start: {extracted_args['start_date']}, Ende: {extracted_args['end_date']}")
+        return extracted_args
+
+    # 2. Dateparser nur noch als letzter Ausweg, wenn die Anfrage überhaupt nach Datum aussieht
     try:
-        parsed_date = dateparser.parse(
+        parsed_date = has_date_hint(user_message) and _dateparser().parse(
             user_message,
             languages=["de", "en"],
             settings={"PREFER_DATES_FROM": "future"}
@@ -105,7 +61,7 @@ def extract_enhanced_date_params(user_message):
     except Exception as e:
         debug_print("Datumsextraktion", f"Fehler bei dateparser: {e}")
     
-    # 4. Standardwerte für den aktuellen Monat als letzte Fallback-Option
+    # 3. Standardwerte für den aktuellen Monat als letzte Fallback-Option
     if not extracted_args and ("monat" in user_message_lower or "month" in user_message_lower):
         current_month = current_date.month
         start_date = datetime(current_year, current_month, 1)
@@ -194,44 +150,20 @@ def format_date(date_str):
 def extract_date_params(user_message):
     """Extract date parameters from user message for months like 'Mai'."""
     import datetime  # Local import to ensure we have the right module
-    import re
     extracted_args = {}
     
-    # Map German month names to numbers
-    month_map = {
-        "januar": 1, "februar": 2, "märz": 3, "april": 4, "mai": 5, "juni": 6,
-        "juli": 7, "august": 8, "september": 9, "oktober": 10, "november": 11, "dezember": 12
-    }
-    
-    user_message_lower = user_message.lower()
-    current_date = datetime.datetime.now()  # Using full namespace
-    current_year = current_date.year
-    
-    # Extract year if present
-    year_match = re.search(r'\b(20\d\d)\b', user_message)
-    extracted_year = int(year_match.group(1)) if year_match else current_year
-    
-    # Check for month mentions
-    for month_name, month_num in month_map.items():
-        if month_name in user_message_lower:
-            # Use extracted year or current year
-            year = extracted_year
-                
-            # Create start and end dates for the month
-            start_date = datetime.date(year, month_num, 1)  # Using datetime.date
-            if month_num == 12:
-                end_date = datetime.date(year, 12, 31)
-            else:
-                next_month_date = datetime.date(year, month_num + 1, 1)
-                end_date = next_month_date - datetime.timedelta(days=1)
-                
-            extracted_args["start_date"] = start_date.strftime("%Y-%m-%d")
-            extracted_args["end_date"] = end_date.strftime("%Y-%m-%d")
-            debug_print("Datumsextraktion", f"Erkannter Monat: {month_name}, Jahr: {year}, Start: {extracted_args['start_date']}, Ende: {extracted_args['end_date']}")
-            return extracted_args
-    
-    # Fall back to dateparser for more complex date expressions
-    parsed_date = dateparser.parse(
+    # Precompiled grammar first (months, quarters, relative spans)
+    bereich = parse_date_range(user_message)
+    if bereich:
+        extracted_args["start_date"] = bereich["start_date"]
+        extracted_args["end_date"] = bereich["end_date"]
+        debug_print("Datumsextraktion", f"Erkannter Zeitraum ({bereich['kind']}): Start: {extracted_args['start_date']}, Ende: {extracted_args['end_date']}")
+        return extracted_args
+
+    # Fall back to dateparser only if the message looks date-related
+    if not has_date_hint(user_message):
+        return extracted_args
+    parsed_date = _dateparser().parse(
         user_message,
         languages=["de"],
         settings={"PREFER_DATES_FROM": "future"},
@@ -360,28 +292,6 @@ def extract_customer_name(user_message):
     """
     user_message = user_message.lower()
     
-    # Spezielle Behandlung für Kunde "Küll" mit verschiedenen Schreibweisen
-    kull_variations = ["küll", "kull", "kühl", "kuehl", "kuell"]
-    for variation in kull_variations:
-        if variation in user_message:
-            logging.info(f"Spezialfall erkannt: Kunde 'Küll' (Variation '{variation}')")
-            return "Küll"
-    
-    # Spezieller Regex für Küll aufgrund der Häufigkeit dieses Kunden
-    kull_patterns = [
-        r'kunde[n]?[:\s]+(k[uü][eh]?ll)',
-        r'kunden[:\s]+(k[uü][eh]?ll)',
-        r'herr[n]?[:\s]+(k[uü][eh]?ll)',
-        r'zum kunden (k[uü][eh]?ll)',
-        r'über (k[uü][eh]?ll)'
-    ]
-    
-    for pattern in kull_patterns:
-        match = re.search(pattern, user_message)
-        if match:
-            logging.info(f"Kunde 'Küll' erkannt mit Muster: {pattern}")
-            return "Küll"
-    
     # Nach Mustern suchen wie "Kunde XYZ", "Herr XYZ", "Frau XYZ", "über XYZ"
     customer_patterns = [
         r'kunde[n]?[:\s]+([a-zäöüß0-9\s\(\)\[\]\-]+)',
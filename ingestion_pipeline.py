@@ -0,0 +1,300 @@
+"""
+Ingestion Pipeline für XORA Chatbot.
+Zerlegt hochgeladene Dokumente in Abschnitte und kategorisiert sie parallel:
+Seiten werden einzeln extrahiert, an Überschriften und einem Token-Budget
+geschnitten, mit begrenzter Parallelität an das LLM gegeben und die Ergebnisse
+gegen die Themenhierarchie (themen.txt) zusammengeführt und dedupliziert.
+Das Speichern übernimmt der Aufrufer mit einem einzigen Batch-Commit.
+"""
+import json
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, List, Any, Optional, Callable, Iterable, Iterator, Tuple
+
+from content_dedup import near_duplicate_detector
+from conversation_manager import count_text_tokens
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG,
+                   format='%(asctime)s %(levelname)s:%(name)s:%(message)s',
+                   datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_TOKENS = 3000
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_CHUNK_RETRIES = 2
+
+# Markdown-Überschriften, nummerierte Kapitel ("2.3 Titel", "Kapitel 4") und kurze Zeilen in Großbuchstaben
+HEADING_PATTERN = re.compile(
+    r'^\s*(#{1,6}\s+\S.*|(kapitel|abschnitt)\s+\d+.*|\d+(\.\d+)*[.)]?\s+[A-ZÄÖÜ].{0,80}|[A-ZÄÖÜ][A-ZÄÖÜ0-9 &\-]{3,60})\s*$',
+    re.IGNORECASE
+)
+CATEGORIZATION_JSON = re.compile(r'\[\s*{.*}\s*\]', re.DOTALL)
+UNTERTHEMA_PATTERN = re.compile(r'(\d+[a-z]*)\)?\s*(.*)')
+
+
+def iter_pages(filepath: str, ext: str) -> Iterator[str]:
+    """
+    Liefert den Text eines Dokuments seitenweise, ohne das ganze Dokument zu verketten.
+
+    Args:
+        filepath: Pfad der hochgeladenen Datei
+        ext: Dateiendung (.txt, .pdf, .doc, .docx)
+
+    Returns:
+        Iterator über Seiten- bzw. Absatztexte
+    """
+    if ext == '.txt':
+        with open(filepath, 'r', encoding='utf-8') as f:
+            block = []
+            for line in f:
+                block.append(line)
+                if len(block) >= 200:
+                    yield "".join(block)
+                    block = []
+            if block:
+                yield "".join(block)
+    elif ext == '.pdf':
+        from PyPDF2 import PdfReader
+        with open(filepath, 'rb') as f:
+            for page in PdfReader(f).pages:
+                yield (page.extract_text() or "") + "\n"
+    elif ext in ['.doc', '.docx']:
+        import docx
+        for para in docx.Document(filepath).paragraphs:
+            yield para.text + "\n"
+    else:
+        raise ValueError(f"Nicht unterstützter Dateityp: {ext}")
+
+
+def _split_oversized(section: str, token_budget: int) -> Iterator[str]:
+    """Teilt einen Abschnitt über dem Budget an Absätzen bzw. Zeilen."""
+    parts = re.split(r'\n\s*\n', section)
+    if len(parts) == 1:
+        parts = section.split('\n')
+    current, current_tokens = [], 0
+    for part in parts:
+        part_tokens = count_text_tokens(part)
+        if current and current_tokens + part_tokens > token_budget:
+            yield "\n\n".join(current)
+            current, current_tokens = [], 0
+        current.append(part)
+        current_tokens += part_tokens
+    if current:
+        yield "\n\n".join(current)
+
+
+def _iter_sections(pages: Iterable[str]) -> Iterator[str]:
+    """Schneidet den fortlaufenden Text an Überschriften."""
+    section = []
+    for page in pages:
+        for line in page.splitlines():
+            if section and HEADING_PATTERN.match(line) and any(l.strip() for l in section):
+                yield "\n".join(section)
+                section = []
+            section.append(line)
+    if section:
+        yield "\n".join(section)
+
+
+def split_into_chunks(pages: Iterable[str], token_budget: int = DEFAULT_CHUNK_TOKENS) -> Iterator[str]:
+    """
+    Fasst Abschnitte zu Chunks bis zum Token-Budget zusammen; Überschriften bleiben
+    am Anfang ihres Abschnitts, zu große Abschnitte werden an Absätzen geteilt.
+
+    Args:
+        pages: Seitentexte (z.B. aus iter_pages)
+        token_budget: Maximale Token pro Chunk
+
+    Returns:
+        Iterator über Chunk-Texte
+    """
+    current, current_tokens = [], 0
+    for section in _iter_sections(pages):
+        if not section.strip():
+            continue
+        section_tokens = count_text_tokens(section)
+        pieces = [(section, section_tokens)] if section_tokens <= token_budget else \
+            [(piece, count_text_tokens(piece)) for piece in _split_oversized(section, token_budget)]
+        for piece, piece_tokens in pieces:
+            if current and current_tokens + piece_tokens > token_budget:
+                yield "\n".join(current)
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += piece_tokens
+    if current:
+        yield "\n".join(current)
+
+
+def parse_categorization(text: str) -> List[Dict[str, Any]]:
+    """
+    Liest die JSON-Liste der Kategorisierung aus einer LLM-Antwort.
+
+    Raises:
+        ValueError: Wenn kein gültiges JSON enthalten ist
+    """
+    json_match = CATEGORIZATION_JSON.search(text or "")
+    if not json_match:
+        raise ValueError("Kein gültiger JSON-Inhalt gefunden")
+    json_text = re.sub(r'(\d+[a-z]*)\)\)', r'\1)', json_match.group(0))
+    eintraege = json.loads(json_text)
+    if not isinstance(eintraege, list):
+        raise ValueError("Kategorisierung ist keine Liste")
+    return [e for e in eintraege if isinstance(e, dict)]
+
+
+def categorize_chunks(chunks: Iterable[str], categorize: Callable[[str], Optional[str]],
+                      max_workers: int = DEFAULT_MAX_WORKERS, retries: int = DEFAULT_CHUNK_RETRIES,
+                      on_progress: Optional[Callable[[int, int], None]] = None) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Kategorisiert Chunks parallel mit begrenzter Anzahl gleichzeitiger LLM-Aufrufe.
+    Es werden höchstens 2 * max_workers Chunks gleichzeitig im Speicher gehalten.
+
+    Args:
+        chunks: Chunk-Texte (Iterator, wird schrittweise gelesen)
+        categorize: Funktion Chunk-Text -> LLM-Antwort (None bei Fehler)
+        max_workers: Maximale Anzahl paralleler Aufrufe
+        retries: Wiederholungen pro Chunk bei Fehlern der API
+        on_progress: Optional, erhält (fertige Chunks, bisher gelesene Chunks)
+
+    Returns:
+        (Einträge in Dokumentreihenfolge, Statistik)
+
+    Raises:
+        RuntimeError: Wenn ein Chunk auch nach allen Wiederholungen nicht kategorisiert wurde
+    """
+    def run(index: int, chunk: str):
+        for attempt in range(retries + 1):
+            antwort = categorize(chunk)
+            if antwort:
+                try:
+                    return index, parse_categorization(antwort), None
+                except ValueError as e:
+                    # Unbrauchbare Antwort: Chunk überspringen statt das Dokument zu verwerfen
+                    return index, [], str(e)
+            if attempt < retries:
+                time.sleep(2 ** attempt)
+        raise RuntimeError(f"Kategorisierung von Chunk {index + 1} fehlgeschlagen")
+
+    started = time.time()
+    ergebnisse = {}
+    stats = {"chunks": 0, "parse_errors": 0, "entries": 0}
+    chunk_iter = enumerate(chunks)
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="categorize") as executor:
+        pending = set()
+        erschoepft = False
+        while pending or not erschoepft:
+            while not erschoepft and len(pending) < 2 * max_workers:
+                try:
+                    index, chunk = next(chunk_iter)
+                except StopIteration:
+                    erschoepft = True
+                    break
+                stats["chunks"] += 1
+                pending.add(executor.submit(run, index, chunk))
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, eintraege, fehler = future.result()
+                if fehler:
+                    stats["parse_errors"] += 1
+                    logger.warning(f"Chunk {index + 1} nicht auswertbar: {fehler}")
+                ergebnisse[index] = eintraege
+            if on_progress:
+                on_progress(len(ergebnisse), stats["chunks"])
+
+    eintraege = [e for index in sorted(ergebnisse) for e in ergebnisse[index]]
+    stats["entries"] = len(eintraege)
+    stats["seconds"] = round(time.time() - started, 2)
+    stats["chunks_per_second"] = round(stats["chunks"] / stats["seconds"], 2) if stats["seconds"] else None
+    logger.info(f"Kategorisierung: {stats['chunks']} Chunks, {stats['entries']} Einträge in {stats['seconds']}s "
+                f"({stats['parse_errors']} nicht auswertbar)")
+    return eintraege, stats
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r'\s+', ' ', str(text)).strip().lower()
+
+
+def _resolve_thema(thema: str, themen_dict: Dict[str, Dict[str, Any]]) -> str:
+    """Ordnet eine Themenangabe dem Schlüssel aus themen.txt zu (Nummer oder Titel)."""
+    if thema in themen_dict:
+        return thema
+    gesucht = _normalize(thema)
+    nummer = re.match(r'thema\s*(\d+)', gesucht)
+    for key in themen_dict:
+        key_norm = _normalize(key)
+        titel = key_norm.split(':', 1)[-1].strip()
+        if gesucht in (key_norm, titel):
+            return key
+        if nummer and re.match(rf'thema\s*{nummer.group(1)}\s*:', key_norm):
+            return key
+    return thema
+
+
+def _resolve_unterthema(unterthema: str, unterpunkte: Dict[str, Dict[str, Any]]) -> str:
+    """Ergänzt bzw. korrigiert den Unterthema-Titel anhand der Nummer aus themen.txt."""
+    match = UNTERTHEMA_PATTERN.match(unterthema)
+    if match and match.group(1) in unterpunkte:
+        return f"{match.group(1)}) {unterpunkte[match.group(1)]['title']}"
+    gesucht = _normalize(unterthema)
+    for nummer, info in unterpunkte.items():
+        if _normalize(info['title']) == gesucht:
+            return f"{nummer}) {info['title']}"
+    return unterthema
+
+
+def merge_entries(eintraege: Iterable[Dict[str, Any]], themen_dict: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Führt die Einträge aller Chunks zusammen: Themen und Unterthemen werden auf die
+    Schlüssel aus themen.txt abgebildet, Einträge desselben Unterthemas zu einem
+    zusammengefasst und (nahezu) wiederholte Inhalte entfernt.
+
+    Args:
+        eintraege: Kategorisierte Einträge aller Chunks
+        themen_dict: Themenhierarchie (lade_themen)
+
+    Returns:
+        Liste von Einträgen für speichere_wissensbasis_batch; "inhalt" ist die Liste der Passagen
+    """
+    zusammengefasst = {}
+    for eintrag in eintraege:
+        thema = str(eintrag.get('thema') or '').strip()
+        unterthema = str(eintrag.get('unterthema') or '').strip()
+        inhalt = eintrag.get('inhalt')
+        if isinstance(inhalt, list):
+            inhalt = "\n".join(str(zeile) for zeile in inhalt)
+        inhalt = str(inhalt or '').strip()
+        if not (thema and unterthema and inhalt):
+            continue
+
+        thema = _resolve_thema(thema, themen_dict)
+        if thema in themen_dict:
+            unterthema = _resolve_unterthema(unterthema, themen_dict[thema])
+        else:
+            logger.warning(f"Thema '{thema}' nicht in der Themenhierarchie")
+
+        ziel = zusammengefasst.setdefault((thema, unterthema), {
+            "thema": thema,
+            "unterthema": unterthema,
+            "beschreibung": "",
+            "inhalte": []
+        })
+        if not ziel["beschreibung"]:
+            ziel["beschreibung"] = str(eintrag.get('beschreibung') or '').strip()
+        # Überlappende Chunks liefern oft dieselbe Passage mehrfach
+        if not near_duplicate_detector.find_duplicate(inhalt, ziel["inhalte"]):
+            ziel["inhalte"].append(inhalt)
+
+    return [
+        {
+            "thema": ziel["thema"],
+            "unterthema": ziel["unterthema"],
+            "beschreibung": ziel["beschreibung"],
+            "inhalt": ziel["inhalte"]
+        }
+        for ziel in zusammengefasst.values()
+    ]
@@ -0,0 +1,306 @@
+"""
+Job Queue für XORA Chatbot.
+Persistente Warteschlange (SQLite) für lang laufende Admin-Aufgaben wie die
+Verarbeitung hochgeladener Dokumente. Request-Threads legen nur Jobs an,
+Worker-Threads arbeiten sie ab, melden Fortschritt und wiederholen Jobs bei
+vorübergehenden Fehlern mit exponentiellem Backoff.
+
+Mehrere Prozesse können dieselbe Datenbank nutzen: Jobs werden atomar
+übernommen und über eine Lease gehalten. Läuft die Lease ab (z.B. weil der
+Prozess abgestürzt ist), wird der Job erneut eingeplant.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, Any, Optional, Callable
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG,
+                   format='%(asctime)s %(levelname)s:%(name)s:%(message)s',
+                   datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    owner TEXT,
+    status TEXT NOT NULL,
+    progress INTEGER NOT NULL DEFAULT 0,
+    message TEXT,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    run_after REAL NOT NULL,
+    lease_until REAL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_run_after ON jobs (status, run_after);
+CREATE INDEX IF NOT EXISTS jobs_kind_owner ON jobs (kind, owner, status);
+"""
+
+
+class JobAbbruch(Exception):
+    """Dauerhafter Fehler: der Job wird ohne weiteren Versuch als fehlgeschlagen markiert."""
+
+
+class JobHandle:
+    """Wird an den Handler übergeben, um Fortschritt zu melden."""
+
+    def __init__(self, queue: 'JobQueue', job_id: str, payload: Dict[str, Any], attempt: int):
+        self.queue = queue
+        self.id = job_id
+        self.payload = payload
+        self.attempt = attempt
+
+    def progress(self, percent: int, message: Optional[str] = None) -> None:
+        """
+        Meldet den Fortschritt und verlängert die Lease.
+
+        Args:
+            percent: Fortschritt in Prozent (0-100)
+            message: Optionaler Statustext für die Admin-Oberfläche
+        """
+        self.queue._update(self.id, progress=max(0, min(int(percent), 100)), message=message,
+                           lease_until=time.time() + self.queue.lease_seconds)
+
+
+class JobQueue:
+    """Persistente Job-Warteschlange mit Worker-Threads."""
+
+    def __init__(self, db_path: str, num_workers: int = 2, poll_interval: float = 1.0,
+                 lease_seconds: int = 600, backoff_seconds: float = 5.0):
+        """
+        Initialisiert die JobQueue.
+
+        Args:
+            db_path: Pfad der SQLite-Datenbank
+            num_workers: Anzahl Worker-Threads in diesem Prozess
+            poll_interval: Wartezeit in Sekunden, wenn keine Jobs anstehen
+            lease_seconds: Dauer, für die ein laufender Job einem Worker gehört
+            backoff_seconds: Basis für den exponentiellen Backoff bei Wiederholungen
+        """
+        self.db_path = db_path
+        self.num_workers = num_workers
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.backoff_seconds = backoff_seconds
+        self._handlers = {}
+        self._threads = []
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+        self.stats = {"enqueued": 0, "deduplicated": 0, "completed": 0, "failed": 0, "retried": 0}
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def register(self, kind: str, handler: Callable[[JobHandle], Any], max_attempts: int = 3) -> None:
+        """
+        Registriert einen Handler für eine Job-Art.
+
+        Args:
+            kind: Name der Job-Art
+            handler: Funktion, die einen JobHandle erhält und ein JSON-fähiges Ergebnis liefert
+            max_attempts: Maximale Anzahl Versuche bei vorübergehenden Fehlern
+        """
+        self._handlers[kind] = {"handler": handler, "max_attempts": max_attempts}
+
+    def enqueue(self, kind: str, payload: Dict[str, Any], owner: Optional[str] = None, unique: bool = False) -> str:
+        """
+        Legt einen Job an und weckt die Worker.
+
+        Args:
+            kind: Registrierte Job-Art
+            payload: JSON-fähige Parameter des Jobs
+            owner: Optional, Benutzer, dem der Job gehört
+            unique: Nur einen offenen (wartenden oder laufenden) Job dieser Art pro owner;
+                gibt es bereits einen, wird dessen ID geliefert (prozessübergreifend)
+
+        Returns:
+            Die Job-ID
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"Unbekannte Job-Art: {kind}")
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                offen = conn.execute(
+                    "SELECT id FROM jobs WHERE kind = ? AND owner IS ? AND status IN (?, ?) LIMIT 1",
+                    (kind, owner, STATUS_QUEUED, STATUS_RUNNING)
+                ).fetchone() if unique else None
+                if offen is None:
+                    conn.execute(
+                        "INSERT INTO jobs (id, kind, payload, owner, status, message, max_attempts, run_after, created, updated) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (job_id, kind, json.dumps(payload, ensure_ascii=False), owner, STATUS_QUEUED, 'In Warteschlange',
+                         self._handlers[kind]["max_attempts"], now, now, now)
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        if offen is not None:
+            self.stats["deduplicated"] += 1
+            return offen["id"]
+        self.stats["enqueued"] += 1
+        logger.info(f"Job {job_id} ({kind}) eingereiht")
+        self.start()
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Liefert den Status eines Jobs.
+
+        Args:
+            job_id: Die Job-ID
+
+        Returns:
+            Dictionary mit Status, Fortschritt, Ergebnis bzw. Fehler oder None
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row["id"],
+            "kind": row["kind"],
+            "owner": row["owner"],
+            "status": row["status"],
+            "progress": row["progress"],
+            "message": row["message"],
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "attempts": row["attempts"],
+            "max_attempts": row["max_attempts"],
+            "created": row["created"],
+            "updated": row["updated"]
+        }
+
+    def _update(self, job_id: str, **fields) -> None:
+        fields["updated"] = time.time()
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        """Übernimmt den ältesten fälligen Job (oder einen mit abgelaufener Lease)."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE (status = ? AND run_after <= ?) OR (status = ? AND lease_until < ?) "
+                    "ORDER BY run_after LIMIT 1",
+                    (STATUS_QUEUED, now, STATUS_RUNNING, now)
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                if row["status"] == STATUS_RUNNING:
+                    logger.warning(f"Lease von Job {row['id']} abgelaufen, Job wird erneut ausgeführt")
+                conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_until = ?, message = ?, updated = ? "
+                    "WHERE id = ?",
+                    (STATUS_RUNNING, now + self.lease_seconds, 'In Bearbeitung', now, row["id"])
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return row
+
+    def _run(self, row: sqlite3.Row) -> None:
+        job_id = row["id"]
+        attempt = row["attempts"] + 1
+        registration = self._handlers.get(row["kind"])
+        if registration is None:
+            self._update(job_id, status=STATUS_FAILED, error=f"Unbekannte Job-Art: {row['kind']}", lease_until=None)
+            return
+
+        handle = JobHandle(self, job_id, json.loads(row["payload"]), attempt)
+        try:
+            result = registration["handler"](handle)
+            self._update(job_id, status=STATUS_DONE, progress=100, message='Abgeschlossen', error=None,
+                         result=json.dumps(result, ensure_ascii=False, default=str), lease_until=None)
+            self.stats["completed"] += 1
+            logger.info(f"Job {job_id} ({row['kind']}) abgeschlossen")
+        except JobAbbruch as e:
+            self._update(job_id, status=STATUS_FAILED, message='Fehlgeschlagen', error=str(e), lease_until=None)
+            self.stats["failed"] += 1
+            logger.warning(f"Job {job_id} ({row['kind']}) abgebrochen: {e}")
+        except Exception as e:
+            if attempt < row["max_attempts"]:
+                wait_time = self.backoff_seconds * (2 ** (attempt - 1))
+                self._update(job_id, status=STATUS_QUEUED, message=f'Erneuter Versuch in {wait_time:.0f}s',
+                             error=str(e), run_after=time.time() + wait_time, lease_until=None)
+                self.stats["retried"] += 1
+                logger.warning(f"Job {job_id} ({row['kind']}) Versuch {attempt} fehlgeschlagen, Retry in {wait_time:.0f}s: {e}")
+            else:
+                self._update(job_id, status=STATUS_FAILED, message='Fehlgeschlagen', error=str(e), lease_until=None)
+                self.stats["failed"] += 1
+                logger.exception(f"Job {job_id} ({row['kind']}) nach {attempt} Versuchen fehlgeschlagen")
+
+    def _worker(self) -> None:
+        while not self._stop.is_set():
+            try:
+                row = self._claim()
+            except Exception as e:
+                logger.error(f"Fehler beim Abrufen eines Jobs: {e}")
+                row = None
+            if row is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self._run(row)
+
+    def start(self) -> None:
+        """Startet die Worker-Threads (idempotent)."""
+        with self._start_lock:
+            if self._threads or self.num_workers <= 0:
+                return
+            self._stop.clear()
+            for i in range(self.num_workers):
+                thread = threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        logger.info(f"Job-Queue gestartet mit {self.num_workers} Worker(n)")
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Stoppt die Worker-Threads nach dem aktuellen Job."""
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Liefert Zähler und die Anzahl Jobs pro Status."""
+        stats = dict(self.stats)
+        with self._connect() as conn:
+            for row in conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status"):
+                stats[row["status"]] = row["n"]
+        stats["workers"] = len(self._threads)
+        return stats
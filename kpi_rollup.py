@@ -0,0 +1,351 @@
+"""
+KPI Rollup für XORA Chatbot.
+Hält die Funnel-Zählwerte (Leads, Haushalte, Postings, Verträge) pro Verkäufer
+und Tag in SQLite vor. /get_kpi_data berechnet daraus beliebige Zeiträume über
+Präfixsummen, statt für jeden Zeitraum die Rohtabellen in BigQuery zu scannen.
+
+Die Tageswerte werden einmal pro Verkäufer rückwirkend geladen und danach
+nächtlich inkrementell erneuert (die letzten TRAILING_DAYS Tage werden neu
+berechnet, da Verträge und Haushalte zu älteren Leads nachlaufen).
+
+Wie in den BigQuery-Mustern gilt: created_at >= start_date und
+created_at <= TIMESTAMP(end_date), d.h. der Endtag selbst zählt nicht mit
+(TIMESTAMP('YYYY-MM-DD') ist Mitternacht). Ein Zeitraum braucht daher
+Tageswerte von start_date bis einschließlich end_date - 1 Tag.
+"""
+import datetime
+import logging
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, Any, Optional, List, Callable
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG,
+                   format='%(asctime)s %(levelname)s:%(name)s:%(message)s',
+                   datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+HISTORY_DAYS = 730
+TRAILING_DAYS = 120
+
+METRICS = [
+    "total_leads", "net_leads", "total_households", "household_posting_rows",
+    "households_with_postings", "new_contracts", "agency_switches",
+    "quality_new_contracts", "quality_agency_switches"
+]
+
+_DS = "gcpxbixpflegehilfesenioren.PflegehilfeSeniore_BI"
+
+# Tageswerte eines Verkäufers für [@since, @until]; Definitionen wie in
+# get_cvr_lead_contract, get_lead_quality, get_lead_household_conversion und
+# get_household_posting_conversion
+KPI_ROLLUP_SQL = f"""
+WITH seller_leads AS (
+  SELECT _id AS lead_id, reclaimed, DATE(TIMESTAMP(created_at)) AS day
+  FROM `{_DS}.leads` WHERE seller_id = @seller_id
+),
+lead_days AS (
+  SELECT day, COUNT(*) AS total_leads, COUNTIF(reclaimed = 'false') AS net_leads
+  FROM seller_leads WHERE day BETWEEN @since AND @until GROUP BY day
+),
+seller_households AS (
+  SELECT h._id AS household_id, DATE(TIMESTAMP(h.created_at)) AS day
+  FROM `{_DS}.households` AS h JOIN seller_leads AS sl ON h.lead_id = sl.lead_id
+),
+household_days AS (
+  SELECT day, COUNT(DISTINCT household_id) AS total_households
+  FROM seller_households WHERE day BETWEEN @since AND @until GROUP BY day
+),
+posting_days AS (
+  SELECT sh.day, COUNT(sh.household_id) AS household_posting_rows,
+         COUNTIF(p._id IS NOT NULL) AS households_with_postings
+  FROM seller_households AS sh
+  LEFT JOIN `{_DS}.postings` AS p ON sh.household_id = p.household_id
+  WHERE sh.day BETWEEN @since AND @until GROUP BY sh.day
+),
+typed_contracts AS (
+  SELECT c._id AS contract_id, h.lead_id, DATE(TIMESTAMP(c.created_at)) AS day,
+         h.lead_id IN (SELECT _id FROM `gcpxbixpflegehilfesenioren.dataform_staging.leads_and_seller_and_source_with_address`) AS has_address,
+         CASE WHEN EXISTS (
+           SELECT 1 FROM `{_DS}.contracts` AS other_c
+           JOIN `{_DS}.care_stays` AS other_cs ON other_c._id = other_cs.contract_id AND other_cs.stage = 'Bestätigt'
+           WHERE other_c.household_id = c.household_id AND other_c._id != c._id AND other_c.created_at < c.created_at
+         ) THEN 'Agenturwechsel' ELSE 'Neuer Vertrag' END AS contract_type
+  FROM `{_DS}.contracts` AS c
+  JOIN `{_DS}.households` AS h ON c.household_id = h._id
+  JOIN seller_leads AS sl ON h.lead_id = sl.lead_id
+  JOIN (SELECT DISTINCT contract_id FROM `{_DS}.care_stays` WHERE stage = 'Bestätigt') AS confirmed_cs
+    ON c._id = confirmed_cs.contract_id
+),
+contract_days AS (
+  SELECT day, COUNTIF(contract_type = 'Neuer Vertrag') AS new_contracts,
+         COUNTIF(contract_type = 'Agenturwechsel') AS agency_switches
+  FROM typed_contracts WHERE has_address AND day BETWEEN @since AND @until GROUP BY day
+),
+quality_days AS (
+  SELECT sl.day,
+         COUNT(DISTINCT CASE WHEN tc.contract_type = 'Neuer Vertrag' THEN sl.lead_id END) AS quality_new_contracts,
+         COUNT(DISTINCT CASE WHEN tc.contract_type = 'Agenturwechsel' THEN sl.lead_id END) AS quality_agency_switches
+  FROM seller_leads AS sl JOIN typed_contracts AS tc ON tc.lead_id = sl.lead_id
+  WHERE sl.day BETWEEN @since AND @until GROUP BY sl.day
+),
+days AS (
+  SELECT day FROM lead_days UNION DISTINCT SELECT day FROM household_days
+  UNION DISTINCT SELECT day FROM posting_days UNION DISTINCT SELECT day FROM contract_days
+  UNION DISTINCT SELECT day FROM quality_days
+)
+SELECT FORMAT_DATE('%Y-%m-%d', d.day) AS day,
+       IFNULL(ld.total_leads, 0) AS total_leads, IFNULL(ld.net_leads, 0) AS net_leads,
+       IFNULL(hd.total_households, 0) AS total_households,
+       IFNULL(pd.household_posting_rows, 0) AS household_posting_rows,
+       IFNULL(pd.households_with_postings, 0) AS households_with_postings,
+       IFNULL(cd.new_contracts, 0) AS new_contracts, IFNULL(cd.agency_switches, 0) AS agency_switches,
+       IFNULL(qd.quality_new_contracts, 0) AS quality_new_contracts,
+       IFNULL(qd.quality_agency_switches, 0) AS quality_agency_switches
+FROM days AS d
+LEFT JOIN lead_days AS ld USING (day)
+LEFT JOIN household_days AS hd USING (day)
+LEFT JOIN posting_days AS pd USING (day)
+LEFT JOIN contract_days AS cd USING (day)
+LEFT JOIN quality_days AS qd USING (day)
+ORDER BY day
+"""
+
+
+def _rate(numerator: int, denominator: int) -> float:
+    """Prozentwert wie ROUND(x * 100.0 / y, 2) in BigQuery (0 bei Nenner 0)."""
+    if denominator <= 0:
+        return 0
+    quote = Decimal(numerator * 100) / Decimal(denominator)
+    return float(quote.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
+
+
+# query_type aus /get_kpi_data -> Ergebnis im Format des jeweiligen BigQuery-Musters
+KPI_FORMULAS = {
+    "conversion_rate": lambda s: {
+        "total_leads": s["total_leads"], "net_leads": s["net_leads"],
+        "total_contracts": s["new_contracts"], "agency_switches": s["agency_switches"],
+        "conversion_rate": _rate(s["new_contracts"], s["net_leads"])
+    },
+    "lead_quality": lambda s: {
+        "total_leads": s["total_leads"], "net_leads": s["net_leads"],
+        "new_contracts": s["quality_new_contracts"], "agency_switches": s["quality_agency_switches"],
+        "quality_rate": _rate(s["quality_new_contracts"], s["net_leads"])
+    },
+    "lead_household_conversion": lambda s: {
+        "total_leads": s["total_leads"], "net_leads": s["net_leads"],
+        "total_households": s["total_households"],
+        "household_conversion_rate": _rate(s["total_households"], s["net_leads"])
+    },
+    "household_posting_conversion": lambda s: {
+        "total_households": s["household_posting_rows"],
+        "households_with_postings": s["households_with_postings"],
+        "household_to_posting_conversion_rate": _rate(s["households_with_postings"], s["household_posting_rows"])
+    },
+}
+
+
+class _PrefixSums:
+    """Kumulierte Tageswerte eines Verkäufers; Zeitraumsummen in O(log Tage)."""
+
+    def __init__(self, rows: List[sqlite3.Row]):
+        self.days = [row["day"] for row in rows]
+        self.prefix = [[0] * len(METRICS)]
+        for row in rows:
+            vorher = self.prefix[-1]
+            self.prefix.append([vorher[i] + (row[metric] or 0) for i, metric in enumerate(METRICS)])
+
+    def sum(self, start_day: str, end_day_exclusive: str) -> Dict[str, int]:
+        i = bisect_left(self.days, start_day)
+        j = bisect_left(self.days, end_day_exclusive)
+        return {metric: self.prefix[j][k] - self.prefix[i][k] for k, metric in enumerate(METRICS)}
+
+
+class KPIRollup:
+    """Tageswerte der Funnel-KPIs pro Verkäufer in SQLite mit Präfixsummen im Speicher."""
+
+    def __init__(self, db_path: str, loader: Callable[[str, datetime.date, datetime.date], List[Dict[str, Any]]],
+                 history_days: int = HISTORY_DAYS, trailing_days: int = TRAILING_DAYS):
+        """
+        Initialisiert den KPIRollup.
+
+        Args:
+            db_path: Pfad der SQLite-Datenbank
+            loader: Funktion (seller_id, since, until) -> Tageswerte (Spalten wie KPI_ROLLUP_SQL)
+            history_days: Tage, die beim ersten Laden rückwirkend geholt werden
+            trailing_days: Tage, die bei jedem Refresh neu berechnet werden
+        """
+        self.db_path = db_path
+        self.loader = loader
+        self.history_days = history_days
+        self.trailing_days = trailing_days
+        # seller_id -> (kpi_coverage.refreshed, _PrefixSums)
+        self._prefix_cache = {}
+        self._lock = threading.Lock()
+        self._scheduler = None
+        self.stats = {"hits": 0, "not_covered": 0, "unsupported": 0, "refreshes": 0, "refresh_skipped": 0,
+                      "prefix_rebuilds": 0}
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            spalten = ", ".join(f"{metric} INTEGER NOT NULL DEFAULT 0" for metric in METRICS)
+            conn.execute(f"CREATE TABLE IF NOT EXISTS kpi_daily (seller_id TEXT NOT NULL, day TEXT NOT NULL, "
+                         f"{spalten}, PRIMARY KEY (seller_id, day))")
+            conn.execute("CREATE TABLE IF NOT EXISTS kpi_coverage (seller_id TEXT PRIMARY KEY, "
+                         "first_day TEXT NOT NULL, last_day TEXT NOT NULL, refreshed REAL NOT NULL)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def coverage(self, seller_id: str) -> Optional[Dict[str, Any]]:
+        """Liefert first_day, last_day und refreshed eines Verkäufers oder None."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM kpi_coverage WHERE seller_id = ?", (seller_id,)).fetchone()
+        return dict(row) if row else None
+
+    def known_sellers(self) -> List[str]:
+        """Alle Verkäufer, für die Tageswerte vorliegen."""
+        with self._connect() as conn:
+            return [row["seller_id"] for row in conn.execute("SELECT seller_id FROM kpi_coverage")]
+
+    def _prefix_sums(self, seller_id: str, refreshed: float) -> _PrefixSums:
+        """
+        Präfixsummen eines Verkäufers. Der Cache ist an kpi_coverage.refreshed gebunden,
+        damit auch Refreshes aus anderen Prozessen (Scheduler, Worker) sichtbar werden.
+
+        Args:
+            seller_id: Verkäufer
+            refreshed: refreshed aus coverage() zum Zeitpunkt der Anfrage
+        """
+        with self._lock:
+            eintrag = self._prefix_cache.get(seller_id)
+        if eintrag is not None and eintrag[0] == refreshed:
+            return eintrag[1]
+        with self._connect() as conn:
+            # Tageswerte und Stand in einer Lesetransaktion, damit beide zusammenpassen
+            conn.execute("BEGIN")
+            stand = conn.execute("SELECT refreshed FROM kpi_coverage WHERE seller_id = ?", (seller_id,)).fetchone()
+            rows = conn.execute("SELECT * FROM kpi_daily WHERE seller_id = ? ORDER BY day", (seller_id,)).fetchall()
+            conn.execute("COMMIT")
+        prefix = _PrefixSums(rows)
+        with self._lock:
+            self._prefix_cache[seller_id] = (stand["refreshed"] if stand else None, prefix)
+            self.stats["prefix_rebuilds"] += 1
+        return prefix
+
+    def get_kpi(self, seller_id: str, query_type: str, start_date: str, end_date: str) -> Optional[Dict[str, Any]]:
+        """
+        Berechnet eine KPI aus den Tageswerten, wenn der Zeitraum abgedeckt ist.
+
+        Args:
+            seller_id: Verkäufer
+            query_type: query_type aus /get_kpi_data
+            start_date: Startdatum (YYYY-MM-DD)
+            end_date: Enddatum (YYYY-MM-DD, exklusiv wie in den BigQuery-Mustern)
+
+        Returns:
+            Ergebnis im Format des BigQuery-Musters oder None (dann BigQuery verwenden)
+        """
+        formel = KPI_FORMULAS.get(query_type)
+        if formel is None:
+            self.stats["unsupported"] += 1
+            return None
+        abdeckung = self.coverage(seller_id)
+        benoetigt_bis = (datetime.date.fromisoformat(end_date) - datetime.timedelta(days=1)).isoformat()
+        if (abdeckung is None or start_date < abdeckung["first_day"]
+                or max(benoetigt_bis, start_date) > abdeckung["last_day"]):
+            self.stats["not_covered"] += 1
+            return None
+        self.stats["hits"] += 1
+        summen = self._prefix_sums(seller_id, abdeckung["refreshed"]).sum(start_date, end_date)
+        return formel(summen)
+
+    def refresh(self, seller_id: str, today: Optional[datetime.date] = None) -> Dict[str, Any]:
+        """
+        Lädt die Tageswerte eines Verkäufers (erstmalig rückwirkend, sonst inkrementell).
+
+        Args:
+            seller_id: Verkäufer
+            today: Optional, Stichtag (Standard: heute); geladen wird bis gestern
+
+        Returns:
+            Dictionary mit since, until, days und skipped
+        """
+        today = today or datetime.date.today()
+        until = today - datetime.timedelta(days=1)
+        abdeckung = self.coverage(seller_id)
+        if abdeckung and abdeckung["last_day"] >= until.isoformat() \
+                and datetime.date.fromtimestamp(abdeckung["refreshed"]) >= today:
+            self.stats["refresh_skipped"] += 1
+            return {"since": None, "until": until.isoformat(), "days": 0, "skipped": True}
+
+        if abdeckung:
+            since = min(datetime.date.fromisoformat(abdeckung["last_day"]) + datetime.timedelta(days=1),
+                        until - datetime.timedelta(days=self.trailing_days - 1))
+            since = max(since, datetime.date.fromisoformat(abdeckung["first_day"]))
+            first_day = abdeckung["first_day"]
+        else:
+            since = until - datetime.timedelta(days=self.history_days - 1)
+            first_day = since.isoformat()
+
+        started = time.perf_counter()
+        rows = self.loader(seller_id, since, until)
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM kpi_daily WHERE seller_id = ? AND day BETWEEN ? AND ?",
+                         (seller_id, since.isoformat(), until.isoformat()))
+            conn.executemany(
+                f"INSERT INTO kpi_daily (seller_id, day, {', '.join(METRICS)}) "
+                f"VALUES (?, ?, {', '.join('?' for _ in METRICS)})",
+                [(seller_id, row["day"], *[int(row.get(metric) or 0) for metric in METRICS]) for row in rows]
+            )
+            conn.execute("INSERT OR REPLACE INTO kpi_coverage (seller_id, first_day, last_day, refreshed) "
+                         "VALUES (?, ?, ?, ?)", (seller_id, first_day, until.isoformat(), time.time()))
+            conn.execute("COMMIT")
+        with self._lock:
+            self._prefix_cache.pop(seller_id, None)
+            self.stats["refreshes"] += 1
+        logger.info(f"KPI-Rollup für Seller {seller_id}: {since} bis {until} ({len(rows)} Tage mit Werten) "
+                    f"in {time.perf_counter() - started:.2f}s")
+        return {"since": since.isoformat(), "until": until.isoformat(), "days": len(rows), "skipped": False}
+
+    def start_scheduler(self, callback: Callable[[str], Any], hour: int = 3) -> None:
+        """
+        Ruft jede Nacht zur angegebenen Stunde callback(seller_id) für alle bekannten Verkäufer auf.
+
+        Args:
+            callback: z.B. Einreihen eines Refresh-Jobs
+            hour: Stunde (lokale Zeit)
+        """
+        if self._scheduler is not None:
+            return
+
+        def loop():
+            while True:
+                jetzt = datetime.datetime.now()
+                naechster = jetzt.replace(hour=hour, minute=0, second=0, microsecond=0)
+                if naechster <= jetzt:
+                    naechster += datetime.timedelta(days=1)
+                time.sleep((naechster - jetzt).total_seconds())
+                for seller_id in self.known_sellers():
+                    try:
+                        callback(seller_id)
+                    except Exception as e:
+                        logger.error(f"KPI-Rollup-Refresh für Seller {seller_id} nicht gestartet: {e}")
+
+        self._scheduler = threading.Thread(target=loop, name="kpi-rollup-scheduler", daemon=True)
+        self._scheduler.start()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Liefert Zähler sowie Anzahl Verkäufer und Tageszeilen."""
+        stats = dict(self.stats)
+        with self._connect() as conn:
+            stats["sellers"] = conn.execute("SELECT COUNT(*) FROM kpi_coverage").fetchone()[0]
+            stats["days"] = conn.execute("SELECT COUNT(*) FROM kpi_daily").fetchone()[0]
+        return stats
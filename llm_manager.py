@@ -5,6 +5,8 @@ import re
 import random
 import os
 
+from conversation_manager import fit_messages_to_budget, render_context
+
 # Logger konfigurieren
 logging.basicConfig(
     level=logging.INFO,
@@ -18,6 +20,9 @@ logging.basicConfig(
 # Detailliertes Logging für Entwicklungszwecke
 DEBUG_MODE = False
 
+# Token-Budget für die Konversationshistorie in call_llm
+HISTORY_TOKEN_BUDGET = 1500
+
 def debug_print(section, message):
     """Debug-Ausgaben nur im DEBUG_MODE"""
     if DEBUG_MODE:
@@ -114,17 +119,16 @@ def call_llm(messages, model="gpt-4o", conversation_history=None):
             
     # Wenn Konversationshistorie vorhanden ist, integriere sie mit den aktuellen Nachrichten
     if conversation_history:
-        # Verwende nur die neuesten Nachrichten, um Token-Limits zu vermeiden
-        relevant_history = conversation_history[-5:]  # Anzahl nach Bedarf anpassen
+        # Verwende nur so viele neueste Nachrichten, wie in das Token-Budget passen
+        relevant_history = fit_messages_to_budget(conversation_history, HISTORY_TOKEN_BUDGET)
         
         # Füge History am Anfang der messages hinzu, erhalte die Reihenfolge
-        context_messages = []
-        for msg in relevant_history:
-            # Vermeide Duplikate
-            if all(not (m.get('content') == msg.get('content') and 
-                        m.get('role') == msg.get('role')) 
-                  for m in messages):
-                context_messages.append(msg)
+        # Duplikate über ein Set aus (Rolle, Inhalt) erkennen statt paarweise zu vergleichen
+        existing = {(m.get('role'), m.get('content')) for m in messages}
+        context_messages = [
+            msg for msg in relevant_history
+            if (msg.get('role'), msg.get('content')) not in existing
+        ]
         
         messages = context_messages + messages
     
@@ -190,6 +194,9 @@ def create_enhanced_system_prompt(selected_tool, conversation_history=None):
     3. Strukturiere komplexe Informationen mit Aufzählungspunkten
     4. Bei leeren Ergebnissen erkläre kurz und präzise, warum möglicherweise keine Daten gefunden wurden
     5. Benutze eine knappe, aber vollständige Ausdrucksweise
+    6. Abfrageergebnisse kommen tabellarisch ("columns" + "rows") mit "count" und "stats".
+       Übernimm Anzahlen und Summen aus "count" und "stats" statt selbst zu zählen;
+       "rows" kann bei großen Ergebnissen gekürzt sein ("truncated").
     
     FACHBEGRIFFE:
     - "Carestay/Care Stay": Ein Pflegeeinsatz bei einem Kunden
@@ -201,14 +208,9 @@ def create_enhanced_system_prompt(selected_tool, conversation_history=None):
     # Füge Konversationskontext hinzu, wenn verfügbar
     conversation_context = ""
     if conversation_history and len(conversation_history) > 0:
-        # Beschränke auf die letzten 3 Einträge für Relevanz
-        recent_history = conversation_history[-3:] if len(conversation_history) > 3 else conversation_history
+        # Kontextfenster aus get_context_window (bereits im Token-Budget)
         conversation_context = "\n\nKONVERSATIONSKONTEXT (berücksichtige diesen für kontextuelle Antworten):\n"
-        for entry in recent_history:
-            if "user" in entry:
-                conversation_context += f"Benutzer: {entry['user']}\n"
-            if "assistant" in entry:
-                conversation_context += f"Assistent: {entry['assistant']}\n"
+        conversation_context += render_context(conversation_history) + "\n"
     
     # Spezialisierte Prompts je nach Tool-Typ
     tool_specific_prompts = {
@@ -0,0 +1,265 @@
+"""
+Query Costs für XORA Chatbot.
+Kostenbremsen und Transparenz für BigQuery-Abfragen:
+- maximum_bytes_billed pro Abfragemuster (Standard über BIGQUERY_MAX_BYTES_BILLED)
+- Zeitlimit pro Abfragemuster (Standard über BIGQUERY_QUERY_TIMEOUT); überfällige
+  Jobs werden abgebrochen und als AbfrageTimeout gemeldet
+- optionaler Dry-Run, dessen Byte-Schätzung pro (Muster, Parameterform) gecacht wird
+- Job-Labels (Muster, Verkäufer, Route) für die Abrechnung in BigQuery
+- Bytes und Slot-Millisekunden pro Ausführung, aggregiert pro Muster
+"""
+import datetime
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG,
+                   format='%(asctime)s %(levelname)s:%(name)s:%(message)s',
+                   datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES_BILLED = int(os.getenv('BIGQUERY_MAX_BYTES_BILLED', str(20 * 1024 ** 3)))
+DRY_RUN_ENABLED = os.getenv('BIGQUERY_DRY_RUN', '0') == '1'
+ESTIMATE_TTL_SECONDS = 6 * 3600
+DEFAULT_QUERY_TIMEOUT = float(os.getenv('BIGQUERY_QUERY_TIMEOUT', '30'))
+
+_LABEL_PATTERN = re.compile(r'[^a-z0-9_-]')
+
+
+class AbfrageZuTeuer(Exception):
+    """Die geschätzte Datenmenge einer Abfrage überschreitet das Limit ihres Musters."""
+
+    def __init__(self, pattern_name: str, estimated_bytes: int, limit_bytes: int):
+        self.pattern_name = pattern_name
+        self.estimated_bytes = estimated_bytes
+        self.limit_bytes = limit_bytes
+        super().__init__(
+            f"Abfrage {pattern_name} würde ca. {format_bytes(estimated_bytes)} verarbeiten "
+            f"(Limit {format_bytes(limit_bytes)}). Bitte den Zeitraum oder das Limit eingrenzen."
+        )
+
+
+class AbfrageTimeout(Exception):
+    """Ein BigQuery-Job hat das Zeitlimit seines Musters überschritten."""
+
+    def __init__(self, pattern_name: Optional[str], timeout_seconds: float,
+                 job_id: Optional[str] = None, cancelled: bool = False):
+        self.pattern_name = pattern_name
+        self.timeout_seconds = timeout_seconds
+        self.job_id = job_id
+        self.cancelled = cancelled
+        super().__init__(
+            f"Abfrage {pattern_name or 'ad_hoc'} hat das Zeitlimit von {timeout_seconds:g}s überschritten"
+            f"{' und wurde abgebrochen' if cancelled else ''}."
+        )
+
+
+def format_bytes(num_bytes: Optional[int]) -> str:
+    """Formatiert eine Byte-Zahl lesbar (z.B. "1.5 GB")."""
+    if num_bytes is None:
+        return "?"
+    for einheit in ("B", "KB", "MB", "GB"):
+        if abs(num_bytes) < 1024:
+            return f"{num_bytes:.1f} {einheit}" if einheit != "B" else f"{num_bytes} B"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} TB"
+
+
+def max_bytes_for_pattern(query_pattern: Optional[Dict[str, Any]]) -> int:
+    """
+    Liefert das Byte-Limit eines Abfragemusters.
+
+    Args:
+        query_pattern: Muster aus query_patterns.json (Schlüssel "maximum_bytes_billed")
+
+    Returns:
+        Limit in Bytes
+    """
+    if query_pattern and query_pattern.get("maximum_bytes_billed"):
+        return int(query_pattern["maximum_bytes_billed"])
+    return DEFAULT_MAX_BYTES_BILLED
+
+
+def timeout_for_pattern(query_pattern: Optional[Dict[str, Any]]) -> float:
+    """
+    Liefert das Zeitlimit eines Abfragemusters in Sekunden.
+
+    Args:
+        query_pattern: Muster aus query_patterns.json (Schlüssel "timeout_seconds")
+
+    Returns:
+        Zeitlimit in Sekunden
+    """
+    if query_pattern and query_pattern.get("timeout_seconds"):
+        return float(query_pattern["timeout_seconds"])
+    return DEFAULT_QUERY_TIMEOUT
+
+
+def build_job_labels(pattern_name: Optional[str] = None, seller_id: Optional[str] = None,
+                     route: Optional[str] = None) -> Dict[str, str]:
+    """
+    Erzeugt BigQuery-Job-Labels (Kleinbuchstaben, Ziffern, _ und -, max. 63 Zeichen).
+
+    Args:
+        pattern_name: Name des Abfragemusters
+        seller_id: Verkäufer
+        route: Flask-Endpunkt, der die Abfrage ausgelöst hat
+
+    Returns:
+        Dictionary mit den gesetzten Labels
+    """
+    labels = {"app": "xora"}
+    for key, value in (("pattern", pattern_name), ("seller", seller_id), ("route", route)):
+        if value:
+            labels[key] = _LABEL_PATTERN.sub('_', str(value).lower())[:63]
+    return labels
+
+
+def _bucket(value: float) -> int:
+    """Rundet auf die nächste Zweierpotenz, damit ähnliche Werte eine Form teilen."""
+    if value <= 1:
+        return 1
+    return 2 ** math.ceil(math.log2(value))
+
+
+def _as_date(value: Any) -> Optional[datetime.date]:
+    if isinstance(value, datetime.date):
+        return value
+    if isinstance(value, str):
+        try:
+            return datetime.date.fromisoformat(value[:10])
+        except ValueError:
+            return None
+    return None
+
+
+def parameter_shape(used_params, parameters: Dict[str, Any]) -> Tuple:
+    """
+    Beschreibt die Form einer Parameterbelegung für den Schätzungs-Cache.
+
+    Berücksichtigt werden die im SQL verwendeten und gesetzten Parameter sowie
+    Zeitraum in Tagen und Limit (auf Zweierpotenzen gerundet), aber keine
+    konkreten Namen oder IDs.
+
+    Args:
+        used_params: Im SQL verwendete Parameter
+        parameters: Parameter der Abfrage
+
+    Returns:
+        Hashbares Tupel
+    """
+    gesetzt = tuple(sorted(name for name in used_params if parameters.get(name) not in (None, '', [])))
+    start = _as_date(parameters.get("start_date"))
+    end = _as_date(parameters.get("end_date"))
+    span = _bucket((end - start).days + 1) if start and end else None
+    limit = parameters.get("limit")
+    limit_bucket = _bucket(limit) if isinstance(limit, int) else None
+    return (gesetzt, span, limit_bucket)
+
+
+class QueryCostTracker:
+    """Cacht Dry-Run-Schätzungen und sammelt Byte- und Slot-Statistiken pro Muster."""
+
+    def __init__(self, estimate_ttl: int = ESTIMATE_TTL_SECONDS, max_estimates: int = 2000):
+        """
+        Initialisiert den QueryCostTracker.
+
+        Args:
+            estimate_ttl: Gültigkeit einer Dry-Run-Schätzung in Sekunden
+            max_estimates: Maximale Anzahl gecachter Schätzungen
+        """
+        self.estimate_ttl = estimate_ttl
+        self.max_estimates = max_estimates
+        self._estimates = OrderedDict()
+        self._patterns = {}
+        self._lock = threading.Lock()
+        self.stats = {"dry_runs": 0, "estimate_hits": 0, "rejected": 0, "timeouts": 0, "executions": 0}
+
+    def get_estimate(self, pattern_name: str, shape: Tuple) -> Optional[int]:
+        """Liefert eine gecachte Byte-Schätzung oder None."""
+        with self._lock:
+            eintrag = self._estimates.get((pattern_name, shape))
+            if eintrag is None or time.time() - eintrag[1] > self.estimate_ttl:
+                return None
+            self._estimates.move_to_end((pattern_name, shape))
+            self.stats["estimate_hits"] += 1
+            return eintrag[0]
+
+    def store_estimate(self, pattern_name: str, shape: Tuple, estimated_bytes: int) -> None:
+        """Speichert das Ergebnis eines Dry-Runs."""
+        with self._lock:
+            self._estimates[(pattern_name, shape)] = (estimated_bytes, time.time())
+            self._estimates.move_to_end((pattern_name, shape))
+            while len(self._estimates) > self.max_estimates:
+                self._estimates.popitem(last=False)
+            self.stats["dry_runs"] += 1
+
+    def record_rejection(self, pattern_name: str) -> None:
+        """Zählt eine wegen des Limits nicht ausgeführte Abfrage."""
+        with self._lock:
+            self.stats["rejected"] += 1
+            self._pattern_stats(pattern_name)["rejected"] += 1
+
+    def record_timeout(self, pattern_name: Optional[str]) -> None:
+        """Zählt einen wegen Zeitüberschreitung abgebrochenen Job."""
+        with self._lock:
+            self.stats["timeouts"] += 1
+            self._pattern_stats(pattern_name or "ad_hoc")["timeouts"] += 1
+
+    def _pattern_stats(self, pattern_name: str) -> Dict[str, Any]:
+        return self._patterns.setdefault(pattern_name, {
+            "executions": 0, "cache_hits": 0, "bytes_processed": 0, "bytes_billed": 0,
+            "slot_ms": 0, "max_bytes_processed": 0, "rejected": 0, "timeouts": 0
+        })
+
+    def record_execution(self, pattern_name: Optional[str], query_job, labels: Dict[str, str],
+                         duration: float) -> None:
+        """
+        Protokolliert Bytes und Slot-Zeit eines abgeschlossenen Jobs.
+
+        Args:
+            pattern_name: Name des Abfragemusters (None = ad-hoc)
+            query_job: Abgeschlossener bigquery.QueryJob
+            labels: Verwendete Job-Labels
+            duration: Laufzeit in Sekunden
+        """
+        name = pattern_name or "ad_hoc"
+        processed = getattr(query_job, "total_bytes_processed", None) or 0
+        billed = getattr(query_job, "total_bytes_billed", None) or 0
+        slot_ms = getattr(query_job, "slot_millis", None) or 0
+        cache_hit = bool(getattr(query_job, "cache_hit", False))
+        with self._lock:
+            self.stats["executions"] += 1
+            stats = self._pattern_stats(name)
+            stats["executions"] += 1
+            stats["cache_hits"] += int(cache_hit)
+            stats["bytes_processed"] += processed
+            stats["bytes_billed"] += billed
+            stats["slot_ms"] += slot_ms
+            stats["max_bytes_processed"] = max(stats["max_bytes_processed"], processed)
+        logger.info(
+            f"BigQuery {name}: {format_bytes(processed)} verarbeitet, {format_bytes(billed)} abgerechnet, "
+            f"{slot_ms} Slot-ms, Cache {'ja' if cache_hit else 'nein'}, {duration:.2f}s, "
+            f"Job {getattr(query_job, 'job_id', '?')}, Labels {labels}"
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Liefert Zähler und die Muster sortiert nach abgerechneten Bytes."""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["cached_estimates"] = len(self._estimates)
+            stats["patterns"] = dict(sorted(
+                ((name, dict(werte)) for name, werte in self._patterns.items()),
+                key=lambda item: -item[1]["bytes_billed"]
+            ))
+        return stats
+
+
+# Gemeinsame Instanz für alle BigQuery-Ausführungen
+query_cost_tracker = QueryCostTracker()
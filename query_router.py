@@ -16,6 +16,13 @@ import re
 from datetime import datetime, timedelta
 from typing import Dict, List, Tuple, Optional, Any
 from utils import debug_print
+from result_compactor import compact_tool_result
+from answer_templates import render_template_answer
+from conversation_manager import conversation_manager, render_context
+from llm_manager import create_enhanced_system_prompt, generate_fallback_response
+from flask import session
+from extract import format_customer_details
+import openai
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, 
@@ -146,11 +153,8 @@ def determine_query_approach(user_message, conversation_history=None) -> Tuple[s
     
     # Add relevant conversation history if available
     if conversation_history:
-        context_message = "Previous conversation context:\n"
-        for i, message in enumerate(conversation_history[-3:]):  # Last 3 messages
-            role = message.get("role", "")
-            content = message.get("content", "")
-            context_message += f"{role}: {content}\n"
+        # Kontextfenster (Zusammenfassung + neueste Turns im Token-Budget)
+        context_message = "Previous conversation context:\n" + render_context(conversation_history)
         
         messages.insert(1, {"role": "developer", "content": context_message})
     
@@ -244,11 +248,8 @@ def determine_function_need(user_message, query_patterns, conversation_history=N
     
     # Add conversation history context if available
     if conversation_history:
-        context_message = "Previous conversation context:\n"
-        for i, message in enumerate(conversation_history[-3:]):
-            role = message.get("role", "")
-            content = message.get("content", "")
-            context_message += f"{role}: {content}\n"
+        # Kontextfenster (Zusammenfassung + neueste Turns im Token-Budget)
+        context_message = "Previous conversation context:\n" + render_context(conversation_history)
         
         messages.insert(1, {"role": "developer", "content": context_message})
     
@@ -368,11 +369,8 @@ def handle_conversational_clarification(user_message, previous_clarification_dat
     
     # Add conversation history for context if available
     if conversation_history:
-        context_message = "Relevant conversation history:\n"
-        for i, message in enumerate(conversation_history[-3:]):
-            role = message.get("role", "")
-            content = message.get("content", "")
-            context_message += f"{role}: {content}\n"
+        # Kontextfenster (Zusammenfassung + neueste Turns im Token-Budget)
+        context_message = "Relevant conversation history:\n" + render_context(conversation_history)
         
         messages.insert(1, {"role": "developer", "content": context_message})
     
@@ -461,7 +459,8 @@ def process_user_query(user_message, session_data):
     Diese sollte die bestehende process_user_query Funktion in app.py ersetzen.
     """
     
-    conversation_history = session_data.get("conversation_history", [])
+    # Zusammenfassung älterer Turns plus neueste Nachrichten, im festen Token-Budget
+    conversation_history = conversation_manager.get_context_window(session_data)
     
     # Check if there's an ongoing clarification dialog
     if session.get("clarification_in_progress"):
@@ -536,13 +535,24 @@ def process_user_query(user_message, session_data):
                     )
                     return formatted_result
                 
+                # Einfache Anzahl-/Listenfragen direkt per Template beantworten
+                template_answer = render_template_answer(user_message, function_name, tool_result)
+                if template_answer:
+                    session_data = conversation_manager.update_conversation(
+                        session_data, 
+                        user_message, 
+                        template_answer, 
+                        {"name": function_name, "content": tool_result}
+                    )
+                    return template_answer
+                
                 # Andernfalls erstelle einen angepassten System-Prompt für die LLM-Antwort
                 system_prompt = create_enhanced_system_prompt(function_name, conversation_history)
                 
                 messages = [
                     {"role": "developer", "content": system_prompt},
                     {"role": "user", "content": user_message},
-                    {"role": "function", "name": function_name, "content": tool_result}
+                    {"role": "function", "name": function_name, "content": compact_tool_result(function_name, tool_result)}
                 ]
                 
                 # Use conversation history for better context
@@ -608,10 +618,11 @@ def process_user_query(user_message, session_data):
         debug_print("Anfrage", "Konversationelle Anfrage erkannt")
         
         # Einfache LLM-Antwort generieren
-        messages = [
-            {"role": "system", "content": "Du bist ein hilfsbereiter Assistent für Pflege und Seniorenbetreuung."},
-            {"role": "user", "content": user_message}
-        ]
+        messages = (
+            [{"role": "system", "content": "Du bist ein hilfsbereiter Assistent für Pflege und Seniorenbetreuung."}]
+            + conversation_history
+            + [{"role": "user", "content": user_message}]
+        )
         
         try:
             response = openai.chat.completions.create(
@@ -701,13 +712,19 @@ def process_user_query(user_message, session_data):
         debug_print("Tool", f"Führe Tool aus: {selected_function} mit Parametern: {parameters}")
         tool_result = handle_function_call(selected_function, parameters)
         
+        # Simple count/list questions are answered directly from a template
+        template_answer = render_template_answer(user_message, selected_function, tool_result)
+        if template_answer:
+            logger.info("ROUTING: SZENARIO 3 - Antwort per Template erzeugt")
+            return template_answer
+        
         # Generate response with the function result
         system_prompt = create_enhanced_system_prompt(selected_function, conversation_history)
         
         messages = [
             {"role": "developer", "content": system_prompt},
             {"role": "user", "content": user_message},
-            {"role": "function", "name": selected_function, "content": tool_result}
+            {"role": "function", "name": selected_function, "content": compact_tool_result(selected_function, tool_result)}
         ]
         
         response = openai.chat.completions.create(
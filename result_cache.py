@@ -0,0 +1,201 @@
+"""
+Result Cache für XORA Chatbot.
+Hält Ergebnisse registrierter Abfragemuster im Speicher, Schlüssel ist
+(Muster, SQL, verwendete Parameter). execute_bigquery_query prüft den Cache
+vor jedem Job, sodass Dashboard, KPI-Tab und Chat dieselben Ergebnisse teilen.
+
+Einträge, die der Login-Prefetch oder der Warmer angelegt hat, werden mit
+ihrer Quelle markiert. So ist messbar, wie oft vorgewärmte Daten tatsächlich
+genutzt werden (warm_hits, warm_used, warm_unused).
+
+Der Speicher ist über die Gesamtzahl gecachter Zeilen begrenzt
+(RESULT_CACHE_MAX_ROWS), nicht nur über die Anzahl der Einträge; einzelne
+Ergebnisse über dem Limit werden gar nicht gecacht. Gecachte Antworten können
+bis zu RESULT_CACHE_TTL Sekunden alt sein.
+"""
+import datetime
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List, Tuple
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG,
+                   format='%(asctime)s %(levelname)s:%(name)s:%(message)s',
+                   datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SECONDS = int(os.getenv('RESULT_CACHE_TTL', '600'))
+MAX_ENTRIES = int(os.getenv('RESULT_CACHE_MAX_ENTRIES', '2000'))
+MAX_ROWS = int(os.getenv('RESULT_CACHE_MAX_ROWS', '200000'))
+
+
+def _freeze(value: Any) -> Any:
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+
+class QueryResultCache:
+    """LRU-Cache mit TTL für Abfrageergebnisse, mit Herkunft pro Eintrag."""
+
+    def __init__(self, ttl_seconds: int = DEFAULT_TTL_SECONDS, max_entries: int = MAX_ENTRIES,
+                 max_rows: int = MAX_ROWS):
+        """
+        Initialisiert den QueryResultCache.
+
+        Args:
+            ttl_seconds: Standard-Gültigkeit eines Ergebnisses in Sekunden
+            max_entries: Maximale Anzahl Einträge (LRU)
+            max_rows: Maximale Gesamtzahl gecachter Zeilen über alle Einträge (LRU)
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self._rows = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "too_large": 0,
+                      "warm_stores": 0, "warm_hits": 0, "warm_used": 0, "warm_unused": 0}
+
+    @staticmethod
+    def make_key(pattern_name: str, sql: str, used_params, parameters: Dict[str, Any]) -> Tuple:
+        """
+        Erzeugt den Cache-Schlüssel einer Abfrage.
+
+        Args:
+            pattern_name: Name des Abfragemusters
+            sql: Ausgeführtes SQL (Variante)
+            used_params: Im SQL verwendete Parameter
+            parameters: Parameter der Abfrage
+
+        Returns:
+            Hashbares Tupel
+        """
+        return (pattern_name, sql, tuple((name, _freeze(parameters.get(name))) for name in sorted(used_params)))
+
+    @contextmanager
+    def source(self, name: str, ttl: Optional[int] = None):
+        """
+        Markiert alle im Block gespeicherten Ergebnisse mit einer Herkunft.
+
+        Args:
+            name: Herkunft, z.B. "prefetch" oder "warmer"
+            ttl: Gültigkeit dieser Einträge, falls das Muster keine eigene vorgibt
+        """
+        vorher = (getattr(self._local, "source", None), getattr(self._local, "ttl", None))
+        self._local.source, self._local.ttl = name, ttl
+        try:
+            yield
+        finally:
+            self._local.source, self._local.ttl = vorher
+
+    def current_source(self) -> Optional[str]:
+        """Herkunft des aktuellen Threads (None = normale Anfrage)."""
+        return getattr(self._local, "source", None)
+
+    def _drop(self, eintrag: Dict[str, Any]) -> None:
+        self._rows -= len(eintrag["rows"])
+        if eintrag["source"] and not eintrag["hits"]:
+            self.stats["warm_unused"] += 1
+
+    def get(self, key: Tuple) -> Optional[List[Dict[str, Any]]]:
+        """
+        Liefert ein gültiges Ergebnis oder None.
+
+        Returns:
+            Kopie der Zeilen (Aufrufer dürfen sie verändern)
+        """
+        with self._lock:
+            eintrag = self._entries.get(key)
+            if eintrag is not None and eintrag["expires"] < time.time():
+                self._drop(self._entries.pop(key))
+                eintrag = None
+            if eintrag is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            # Zugriffe des Warmers selbst zählen nicht als Nutzung vorgewärmter Daten
+            if eintrag["source"] and self.current_source() is None:
+                self.stats["warm_hits"] += 1
+                if not eintrag["hits"]:
+                    self.stats["warm_used"] += 1
+                eintrag["hits"] += 1
+            rows = eintrag["rows"]
+        return [dict(row) for row in rows]
+
+    def put(self, key: Tuple, rows: List[Dict[str, Any]], seller_id: Optional[str] = None,
+            ttl: Optional[int] = None) -> None:
+        """
+        Speichert ein Ergebnis.
+
+        Args:
+            key: Schlüssel aus make_key
+            rows: Ergebniszeilen
+            seller_id: Verkäufer (für invalidate)
+            ttl: Gültigkeit in Sekunden (None = Standard)
+        """
+        source = self.current_source()
+        if ttl is None:
+            ttl = getattr(self._local, "ttl", None)
+        with self._lock:
+            alt = self._entries.pop(key, None)
+            if alt is not None:
+                self._drop(alt)
+            if len(rows) > self.max_rows:
+                # Größer als der ganze Cache: nicht speichern, statt alles zu verdrängen
+                self.stats["too_large"] += 1
+                return
+            self._entries[key] = {
+                "rows": [dict(row) for row in rows],
+                "expires": time.time() + (ttl if ttl is not None else self.ttl_seconds),
+                "seller_id": seller_id,
+                "source": source,
+                "hits": 0
+            }
+            self._rows += len(rows)
+            self.stats["stores"] += 1
+            if source:
+                self.stats["warm_stores"] += 1
+            while len(self._entries) > self.max_entries or self._rows > self.max_rows:
+                _, verdraengt = self._entries.popitem(last=False)
+                self._drop(verdraengt)
+                self.stats["evictions"] += 1
+
+    def invalidate(self, seller_id: Optional[str] = None) -> int:
+        """
+        Entfernt alle Einträge (oder nur die eines Verkäufers).
+
+        Returns:
+            Anzahl entfernter Einträge
+        """
+        with self._lock:
+            keys = [key for key, eintrag in self._entries.items()
+                    if seller_id is None or eintrag["seller_id"] == seller_id]
+            for key in keys:
+                self._drop(self._entries.pop(key))
+        return len(keys)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Liefert Zähler, Trefferquote und Anteil genutzter vorgewärmter Einträge."""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+            stats["rows"] = self._rows
+            stats["max_rows"] = self.max_rows
+            stats["warm_entries"] = sum(1 for eintrag in self._entries.values() if eintrag["source"])
+        anfragen = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / anfragen, 3) if anfragen else None
+        stats["warm_use_rate"] = round(stats["warm_used"] / stats["warm_stores"], 3) if stats["warm_stores"] else None
+        return stats
+
+
+# Gemeinsamer Cache für alle Abfragemuster
+result_cache = QueryResultCache()
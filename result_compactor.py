@@ -0,0 +1,175 @@
+"""
+Result Compactor für XORA Chatbot.
+Verdichtet BigQuery-Ergebnisse, bevor sie als Tool-Nachricht an das LLM gehen:
+tabellarische Kodierung ohne wiederholte Schlüssel, Spaltenstatistiken,
+Top-N-Zeilen und ein Token-Limit pro Abfragemuster.
+"""
+import json
+import logging
+import re
+from typing import Dict, List, Any, Optional
+
+from conversation_manager import count_text_tokens
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG,
+                   format='%(asctime)s %(levelname)s:%(name)s:%(message)s',
+                   datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+# Standardwerte, überschreibbar per "result_compaction" im Abfragemuster
+DEFAULT_MAX_ROWS = 50
+DEFAULT_MAX_TOKENS = 2000
+DEFAULT_MAX_CELL_CHARS = 80
+# Anzahl der häufigsten Werte je Textspalte
+TOP_VALUES = 5
+
+DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}')
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def compute_column_stats(columns: List[str], rows: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Berechnet Statistiken pro Spalte über alle Zeilen (nicht nur die gezeigten).
+    Zahlen: Summe, Min, Max, Durchschnitt. Datumswerte: Min, Max.
+    Text: Anzahl unterschiedlicher Werte und die häufigsten Werte.
+
+    Args:
+        columns: Spaltennamen
+        rows: Alle Ergebniszeilen
+
+    Returns:
+        Dictionary Spaltenname -> Statistik
+    """
+    stats = {}
+    for col in columns:
+        values = [row.get(col) for row in rows if row.get(col) is not None]
+        col_stats = {"non_null": len(values)}
+        if values and all(_is_number(v) for v in values):
+            total = sum(values)
+            col_stats.update({
+                "sum": round(total, 2),
+                "min": min(values),
+                "max": max(values),
+                "avg": round(total / len(values), 2)
+            })
+        elif values and all(isinstance(v, str) and DATE_PATTERN.match(v) for v in values):
+            col_stats.update({"min": min(values), "max": max(values)})
+        elif values:
+            counts = {}
+            for v in values:
+                key = str(v)
+                counts[key] = counts.get(key, 0) + 1
+            col_stats["distinct"] = len(counts)
+            # Häufigste Werte nur, wenn die Spalte tatsächlich kategorial ist
+            if len(counts) < len(values):
+                top = sorted(counts.items(), key=lambda item: item[1], reverse=True)[:TOP_VALUES]
+                col_stats["top"] = [[value, count] for value, count in top]
+        stats[col] = col_stats
+    return stats
+
+
+def _encode_rows(columns: List[str], rows: List[Dict[str, Any]], max_cell_chars: int) -> List[List[Any]]:
+    """Kodiert Zeilen als Listen in Spaltenreihenfolge und kürzt lange Texte."""
+    encoded = []
+    for row in rows:
+        values = []
+        for col in columns:
+            value = row.get(col)
+            if isinstance(value, str) and len(value) > max_cell_chars:
+                value = value[:max_cell_chars] + "…"
+            values.append(value)
+        encoded.append(values)
+    return encoded
+
+
+def _get_compaction_settings(function_name: str) -> Dict[str, Any]:
+    """Liest die Kompaktierungs-Einstellungen des Abfragemusters aus der Registry."""
+    settings = {
+        "max_rows": DEFAULT_MAX_ROWS,
+        "max_tokens": DEFAULT_MAX_TOKENS,
+        "max_cell_chars": DEFAULT_MAX_CELL_CHARS
+    }
+    try:
+        from bigquery_functions import load_query_patterns_cached
+        pattern = load_query_patterns_cached().get(function_name, {})
+        settings.update(pattern.get("result_compaction", {}))
+    except Exception as e:
+        logger.warning(f"Kompaktierungs-Einstellungen für {function_name} nicht ladbar: {e}")
+    return settings
+
+
+def compact_tool_result(function_name: str, tool_result: str,
+                        max_rows: Optional[int] = None,
+                        max_tokens: Optional[int] = None) -> str:
+    """
+    Verdichtet das Ergebnis von handle_function_call für die Übergabe an das LLM.
+
+    Args:
+        function_name: Name des ausgeführten Abfragemusters
+        tool_result: JSON-String aus handle_function_call
+        max_rows: Optional, überschreibt die maximale Zeilenanzahl des Musters
+        max_tokens: Optional, überschreibt das Token-Limit des Musters
+
+    Returns:
+        Kompakter JSON-String (unveränderter Input bei Fehlern oder ohne Daten)
+    """
+    try:
+        data = json.loads(tool_result)
+    except (TypeError, ValueError):
+        return tool_result
+
+    if not isinstance(data, dict):
+        return tool_result
+
+    rows = data.get("data")
+    if data.get("status") != "success" or not isinstance(rows, list) or not rows or not isinstance(rows[0], dict):
+        # Fehler und leere Ergebnisse sind bereits klein
+        data.pop("trace", None)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+    settings = _get_compaction_settings(function_name)
+    max_rows = max_rows if max_rows is not None else settings["max_rows"]
+    max_tokens = max_tokens if max_tokens is not None else settings["max_tokens"]
+
+    columns = list(rows[0].keys())
+    for row in rows[1:]:
+        for key in row:
+            if key not in columns:
+                columns.append(key)
+
+    compact = {
+        "status": "success",
+        "count": data.get("count", len(rows)),
+        "columns": columns,
+        "stats": compute_column_stats(columns, rows),
+        "rows": [],
+        "rows_shown": 0,
+        "truncated": False
+    }
+    # Hinweis auf nur ähnlich gefundene Kundennamen bleibt für das LLM erhalten
+    if data.get("name_match"):
+        compact["name_match"] = data["name_match"]
+
+    # Top-N-Zeilen (Reihenfolge der SQL-Abfrage), bei Bedarf weiter kürzen,
+    # bis das Token-Limit des Musters eingehalten wird
+    shown = min(len(rows), max_rows)
+    while True:
+        compact["rows"] = _encode_rows(columns, rows[:shown], settings["max_cell_chars"])
+        compact["rows_shown"] = shown
+        compact["truncated"] = shown < len(rows)
+        encoded = json.dumps(compact, ensure_ascii=False, default=str)
+        if shown == 0 or count_text_tokens(encoded) <= max_tokens:
+            break
+        shown //= 2
+
+    if compact["truncated"]:
+        compact["note"] = (f"Nur die ersten {shown} von {compact['count']} Zeilen enthalten. "
+                           "Anzahl und Statistiken beziehen sich auf alle Zeilen.")
+        encoded = json.dumps(compact, ensure_ascii=False, default=str)
+
+    logger.info(f"Tool-Ergebnis {function_name} verdichtet: {len(tool_result)} -> {len(encoded)} Zeichen")
+    return encoded
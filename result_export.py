@@ -0,0 +1,122 @@
+"""
+Result Export für XORA Chatbot.
+Schreibt Abfrageergebnisse seitenweise als CSV oder XLSX, sodass ein Export
+unabhängig von der Ergebnisgröße nur eine Seite im Speicher hält:
+- CSV wird direkt als Chunks ausgegeben (UTF-8 mit BOM und Semikolon,
+  damit Excel die Datei ohne Import-Dialog korrekt öffnet)
+- Texte, die mit =, +, - oder @ beginnen, erhalten ein führendes ', damit
+  Tabellenprogramme sie nicht als Formel ausführen (CSV-/Formel-Injection)
+- XLSX wird mit openpyxl (optional) im write-only-Modus in eine temporäre
+  Datei geschrieben und anschließend in Blöcken ausgeliefert
+"""
+import csv
+import io
+import logging
+import os
+import tempfile
+from typing import Dict, Any, List, Iterable, Iterator
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG,
+                   format='%(asctime)s %(levelname)s:%(name)s:%(message)s',
+                   datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+EXPORT_PAGE_SIZE = int(os.getenv('EXPORT_PAGE_SIZE', '5000'))
+FILE_CHUNK_SIZE = 64 * 1024
+XLSX_MAX_ROWS = 1048575  # Excel-Grenze ohne Kopfzeile
+FORMULA_PREFIXES = ('=', '+', '-', '@')
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+}
+
+
+def _openpyxl():
+    """Importiert openpyxl erst bei Bedarf (optionale Abhängigkeit)."""
+    import openpyxl
+    return openpyxl
+
+
+def xlsx_available() -> bool:
+    """Prüft, ob das openpyxl-Paket installiert ist."""
+    try:
+        _openpyxl()
+        return True
+    except ImportError:
+        return False
+
+
+def _cell(value: Any) -> Any:
+    """Zellwert für den Export; Texte, die als Formel gelesen würden, werden entschärft."""
+    if isinstance(value, (dict, list, tuple)):
+        value = str(value)
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def csv_chunks(pages: Iterable[List[Dict[str, Any]]], columns: List[str]) -> Iterator[str]:
+    """
+    Erzeugt eine CSV-Datei Seite für Seite.
+
+    Args:
+        pages: Ergebnisseiten (Listen von Dictionaries)
+        columns: Spalten in Ausgabereihenfolge
+
+    Yields:
+        Text-Chunks (Kopfzeile, dann ein Chunk pro Seite)
+    """
+    puffer = io.StringIO()
+    writer = csv.writer(puffer, delimiter=';', lineterminator='\r\n')
+    writer.writerow([_cell(column) for column in columns])
+    yield '\ufeff' + puffer.getvalue()
+    for page in pages:
+        puffer.seek(0)
+        puffer.truncate()
+        writer.writerows([_cell(row.get(column)) for column in columns] for row in page)
+        if puffer.tell():
+            yield puffer.getvalue()
+
+
+def xlsx_chunks(pages: Iterable[List[Dict[str, Any]]], columns: List[str],
+                sheet_title: str = "Export") -> Iterator[bytes]:
+    """
+    Erzeugt eine XLSX-Datei im write-only-Modus und liefert sie in Blöcken.
+
+    Args:
+        pages: Ergebnisseiten (Listen von Dictionaries)
+        columns: Spalten in Ausgabereihenfolge
+        sheet_title: Name des Tabellenblatts
+
+    Yields:
+        Byte-Blöcke der fertigen Datei
+
+    Raises:
+        ImportError: Wenn openpyxl nicht installiert ist
+    """
+    openpyxl = _openpyxl()
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=sheet_title[:31])
+    sheet.append([_cell(column) for column in columns])
+    anzahl = 0
+    for page in pages:
+        # Keine weiteren Seiten anfordern, sobald das Blatt voll ist
+        if anzahl + len(page) > XLSX_MAX_ROWS:
+            page = page[:XLSX_MAX_ROWS - anzahl]
+            logger.warning(f"XLSX-Export bei {XLSX_MAX_ROWS} Zeilen abgeschnitten")
+        for row in page:
+            sheet.append([_cell(row.get(column)) for column in columns])
+        anzahl += len(page)
+        if anzahl >= XLSX_MAX_ROWS:
+            break
+
+    with tempfile.NamedTemporaryFile(suffix='.xlsx') as datei:
+        workbook.save(datei.name)
+        datei.seek(0)
+        while True:
+            block = datei.read(FILE_CHUNK_SIZE)
+            if not block:
+                break
+            yield block
@@ -0,0 +1,174 @@
+"""
+Result Pages für XORA Chatbot.
+Hilfsfunktionen für seitenweise ausgelieferte Abfrageergebnisse:
+- Parameter eines Abfragemusters aus den Request-Argumenten aufbauen
+- Seiten-Cursor signieren, damit ein Verkäufer nur die eigenen Jobs weiterblättert
+- Kompaktes Spaltenformat (Spaltennamen einmal, danach Wertelisten) und NDJSON
+"""
+import datetime
+import hashlib
+import json
+import logging
+import re
+from typing import Dict, Any, Optional, List, Iterable, Iterator
+from itsdangerous import URLSafeSerializer, BadSignature
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG,
+                   format='%(asctime)s %(levelname)s:%(name)s:%(message)s',
+                   datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+RESULT_FORMATS = ('rows', 'columnar', 'ndjson')
+
+# Request-Argumente, die das Blättern steuern und keine Abfrageparameter sind
+PAGE_ARGUMENTS = ('page_token', 'page_size', 'format')
+
+
+def _resolve_default(value: Any, today: datetime.date) -> Any:
+    """Setzt SQL-Standardwerte der Registry (CURRENT_DATE(), DATE_SUB(...)) in Daten um."""
+    if not isinstance(value, str):
+        return value
+    if value.strip().upper() == 'CURRENT_DATE()':
+        return today.isoformat()
+    treffer = re.fullmatch(r'\s*DATE_SUB\(\s*CURRENT_DATE\(\)\s*,\s*INTERVAL\s+(\d+)\s+DAY\s*\)\s*', value,
+                           re.IGNORECASE)
+    if treffer:
+        return (today - datetime.timedelta(days=int(treffer.group(1)))).isoformat()
+    return value
+
+
+def pattern_parameters(query_pattern: Dict[str, Any], args, seller_id: str,
+                       ignore: Iterable[str] = PAGE_ARGUMENTS) -> Dict[str, Any]:
+    """
+    Baut die Parameter eines Abfragemusters aus Request-Argumenten auf.
+
+    Die seller_id kommt immer aus der Session, nie aus dem Request.
+
+    Args:
+        query_pattern: Abfragemuster aus query_patterns.json
+        args: Request-Argumente (z.B. request.args)
+        seller_id: Verkäufer aus der Session
+        ignore: Argumente, die keine Abfrageparameter sind
+
+    Returns:
+        Dictionary mit den Parametern
+
+    Raises:
+        ValueError: Wenn ein Pflichtparameter fehlt oder einen falschen Typ hat
+    """
+    erlaubt = set(query_pattern.get('required_parameters', [])) | set(query_pattern.get('optional_parameters', []))
+    erlaubt.discard('seller_id')
+    today = datetime.date.today()
+    parameters = {name: value for name, value in args.items() if name in erlaubt and name not in ignore}
+    for name, value in query_pattern.get('default_values', {}).items():
+        if name not in parameters:
+            parameters[name] = _resolve_default(value, today)
+    parameters['seller_id'] = seller_id
+
+    fehlend = [name for name in query_pattern.get('required_parameters', []) if name not in parameters]
+    if fehlend:
+        raise ValueError(f"Fehlende Parameter: {', '.join(fehlend)}")
+
+    param_types = dict(query_pattern.get('parameter_types', {}))
+    param_types.setdefault('limit', 'int')
+    for name, typ in param_types.items():
+        if name not in parameters or parameters[name] is None:
+            continue
+        try:
+            if typ == 'int':
+                parameters[name] = int(parameters[name])
+            elif typ == 'float':
+                parameters[name] = float(parameters[name])
+            elif typ == 'date':
+                datetime.date.fromisoformat(str(parameters[name])[:10])
+        except ValueError:
+            raise ValueError(f"Ungültiger Wert für {name}: {parameters[name]}")
+    return parameters
+
+
+def page_size_from(value: Optional[str], default: int = DEFAULT_PAGE_SIZE, maximum: int = MAX_PAGE_SIZE) -> int:
+    """Seitengröße aus dem Request (begrenzt auf 1..maximum)."""
+    try:
+        return max(1, min(int(value), maximum)) if value else default
+    except ValueError:
+        return default
+
+
+def _parameter_digest(parameters: Dict[str, Any]) -> str:
+    daten = json.dumps(parameters, sort_keys=True, default=str)
+    return hashlib.sha256(daten.encode('utf-8')).hexdigest()[:16]
+
+
+class PageCursor:
+    """Signiert Seiten-Cursor und bindet sie an Muster, Verkäufer und Parameter."""
+
+    def __init__(self, secret_key: str):
+        """
+        Initialisiert den PageCursor.
+
+        Args:
+            secret_key: Schlüssel der Flask-App
+        """
+        self._serializer = URLSafeSerializer(secret_key, salt='result-pages')
+
+    def encode(self, cursor: Optional[Dict[str, Any]], pattern_name: str,
+               parameters: Dict[str, Any]) -> Optional[str]:
+        """
+        Erzeugt den page_token für die nächste Seite.
+
+        Args:
+            cursor: Cursor aus read_query_page (None = keine weitere Seite)
+            pattern_name: Name des Abfragemusters
+            parameters: Parameter der Abfrage (inkl. seller_id)
+
+        Returns:
+            Signierter Token oder None
+        """
+        if cursor is None:
+            return None
+        return self._serializer.dumps({"c": cursor, "p": pattern_name, "q": _parameter_digest(parameters)})
+
+    def decode(self, token: str, pattern_name: str, parameters: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Prüft einen page_token und liefert den Cursor.
+
+        Raises:
+            ValueError: Wenn der Token ungültig ist oder zu einer anderen Abfrage gehört
+        """
+        try:
+            daten = self._serializer.loads(token)
+        except BadSignature:
+            raise ValueError("Ungültiger page_token")
+        if daten.get("p") != pattern_name or daten.get("q") != _parameter_digest(parameters):
+            raise ValueError("page_token gehört zu einer anderen Abfrage")
+        return daten["c"]
+
+
+def result_columns(rows: List[Dict[str, Any]], result_structure: Optional[Dict[str, str]] = None) -> List[str]:
+    """Spaltenreihenfolge: wie in result_structure, sonst wie in der ersten Zeile."""
+    if result_structure:
+        return list(result_structure)
+    return list(rows[0]) if rows else []
+
+
+def to_columnar(rows: List[Dict[str, Any]], columns: List[str]) -> List[List[Any]]:
+    """Wandelt Zeilen in Wertelisten in der Reihenfolge von columns um."""
+    return [[row.get(column) for column in columns] for row in rows]
+
+
+def ndjson_lines(pages: Iterable[List[Dict[str, Any]]]) -> Iterator[str]:
+    """
+    Erzeugt NDJSON (eine Zeile pro Ergebniszeile) seitenweise.
+
+    Bricht die Abfrage ab, folgt als letzte Zeile {"status": "error", ...}.
+    """
+    try:
+        for page in pages:
+            if page:
+                yield "".join(json.dumps(row, ensure_ascii=False, default=str) + "\n" for row in page)
+    except Exception as e:
+        logger.error(f"NDJSON-Ausgabe abgebrochen: {e}")
+        yield json.dumps({"error": "Abfrage abgebrochen", "status": "error"}) + "\n"
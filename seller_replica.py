@@ -0,0 +1,621 @@
+"""
+Seller Replica für XORA Chatbot.
+Optionales lokales Abbild der Daten eines Verkäufers in DuckDB (eingebetteter
+Spaltenspeicher, eine Datei pro Verkäufer und Prozess). Die meisten Chat-Fragen betreffen
+nur einige hundert bis tausend Zeilen eines Verkäufers; portable Abfragemuster
+laufen dann lokal in Millisekunden statt als BigQuery-Job.
+
+- Aktiv mit SELLER_REPLICA=1 und installiertem duckdb-Paket
+- Erster Zugriff legt das Abbild im Hintergrund an (bis dahin BigQuery)
+- DuckDB erlaubt pro Datei nur einen schreibenden Prozess: jeder Prozess
+  (z.B. gunicorn-Worker) hat ein eigenes Unterverzeichnis pid_<pid>;
+  Verzeichnisse beendeter Prozesse werden beim ersten Zugriff entfernt
+- Erneuerung inkrementell über updated_at, regelmäßig vollständig (Löschungen,
+  Verkäuferwechsel von Leads)
+- Ist das Abbild älter als die Staleness-Grenze, beantwortet BigQuery die Frage
+- Fehler im lokalen Lauf fallen transparent auf BigQuery zurück; Muster, die
+  DuckDB nicht übersetzen kann, werden dauerhaft als nicht portabel markiert
+"""
+import datetime
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Dict, Any, Optional, List, Callable, NamedTuple, Tuple
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG,
+                   format='%(asctime)s %(levelname)s:%(name)s:%(message)s',
+                   datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+MAX_STALENESS_SECONDS = 900
+REFRESH_SECONDS = 300
+FULL_SYNC_SECONDS = 24 * 3600
+FAILURE_RETRY_SECONDS = 60
+SCHEMA_VERSION = 1
+
+# Muster, die standardmäßig lokal beantwortet werden (SELLER_REPLICA_PATTERNS)
+DEFAULT_PATTERNS = [
+    "get_care_stays_by_date_range", "get_contract_terminations", "get_customers_on_pause",
+    "get_leads", "get_leads_count", "get_active_care_stays_now"
+]
+
+_BI = "gcpxbixpflegehilfesenioren.PflegehilfeSeniore_BI"
+_STAGING = "gcpxbixpflegehilfesenioren.dataform_staging"
+
+
+class ReplicaTable(NamedTuple):
+    """Eine lokal gespiegelte Tabelle (alle Spalten als VARCHAR wie in BigQuery)."""
+    name: str
+    columns: Tuple[str, ...]
+    source: str
+    watermark: str
+
+
+REPLICA_SCHEMA = [
+    ReplicaTable(
+        "leads",
+        ("_id", "seller_id", "created_at", "updated_at", "price", "cost", "purchased", "assigned_at",
+         "seller_touched_at", "contacted", "auto_assigned", "assign_pooled", "archived", "reclaimed",
+         "reclaim_reason", "reclaimed_at", "reclaim_confirmed", "reclaim_bill_id", "discount_level",
+         "discount_seller", "prov_seller", "prov_pfs", "multiplier", "rating_requested",
+         "rating_auto_request", "notes", "hot_notes", "source_data", "tracks", "logs",
+         "google_contact", "google_etag"),
+        f"FROM `{_BI}.leads` AS t WHERE t.seller_id = @seller_id",
+        "t.updated_at"
+    ),
+    ReplicaTable(
+        "leads_and_seller_and_source_with_address",
+        ("_id", "first_name", "last_name", "email"),
+        f"FROM `{_STAGING}.leads_and_seller_and_source_with_address` AS t "
+        f"JOIN `{_BI}.leads` AS l ON t._id = l._id WHERE l.seller_id = @seller_id",
+        "l.updated_at"
+    ),
+    ReplicaTable(
+        "households",
+        ("_id", "lead_id", "created_at", "updated_at"),
+        f"FROM `{_BI}.households` AS t JOIN `{_BI}.leads` AS l ON t.lead_id = l._id "
+        f"WHERE l.seller_id = @seller_id",
+        "t.updated_at"
+    ),
+    ReplicaTable(
+        "contracts",
+        ("_id", "household_id", "agency_id", "archived", "termination_reason", "created_at", "updated_at"),
+        f"FROM `{_BI}.contracts` AS t JOIN `{_BI}.households` AS h ON t.household_id = h._id "
+        f"JOIN `{_BI}.leads` AS l ON h.lead_id = l._id WHERE l.seller_id = @seller_id",
+        "t.updated_at"
+    ),
+    ReplicaTable(
+        "care_stays",
+        ("_id", "contract_id", "care_giver_instance_id", "bill_start", "bill_end", "arrival",
+         "departure", "stage", "prov_seller", "created_at", "updated_at"),
+        f"FROM `{_BI}.care_stays` AS t JOIN `{_BI}.contracts` AS c ON t.contract_id = c._id "
+        f"JOIN `{_BI}.households` AS h ON c.household_id = h._id "
+        f"JOIN `{_BI}.leads` AS l ON h.lead_id = l._id WHERE l.seller_id = @seller_id",
+        "t.updated_at"
+    ),
+    ReplicaTable(
+        "agencies",
+        ("_id", "name", "updated_at"),
+        f"FROM `{_BI}.agencies` AS t WHERE TRUE",
+        "t.updated_at"
+    ),
+]
+
+REPLICA_TABLE_NAMES = frozenset(table.name for table in REPLICA_SCHEMA)
+
+# BigQuery-Funktionen nachgebildet als DuckDB-Makros (Zeitstempel in UTC wie in BigQuery)
+_MACROS = [
+    "CREATE OR REPLACE MACRO bq_timestamp(x) AS CAST(CAST(x AS TIMESTAMPTZ) AS TIMESTAMP)",
+    "CREATE OR REPLACE MACRO bq_date(x) AS CAST(bq_timestamp(x) AS DATE)",
+]
+
+_TABLE_PATTERN = re.compile(r'`[\w-]+\.[\w-]+\.(\w+)`')
+# Konstrukte mit abweichender Semantik oder ohne Gegenstück in DuckDB
+_UNPORTABLE_PATTERN = re.compile(
+    r'\b(UNNEST|SAFE_\w+|FORMAT\w*|STRING_AGG|ARRAY\w*|CONCAT|INTERVAL|INT64|FLOAT64|NUMERIC|'
+    r'STRUCT|DATE_SUB|DATE_ADD|DATE_TRUNC|EXTRACT|GENERATE_\w+|IFNULL|REGEXP_\w+)\b',
+    re.IGNORECASE
+)
+
+
+def _duckdb():
+    """Importiert duckdb erst bei Bedarf (optionale Abhängigkeit)."""
+    import duckdb
+    return duckdb
+
+
+def duckdb_available() -> bool:
+    """Prüft, ob das duckdb-Paket installiert ist."""
+    try:
+        _duckdb()
+        return True
+    except ImportError:
+        return False
+
+
+def _split_arguments(text: str) -> List[str]:
+    """Teilt eine Argumentliste an Kommas der obersten Klammerebene."""
+    argumente, tiefe, start = [], 0, 0
+    for i, zeichen in enumerate(text):
+        if zeichen == '(':
+            tiefe += 1
+        elif zeichen == ')':
+            tiefe -= 1
+        elif zeichen == ',' and tiefe == 0:
+            argumente.append(text[start:i].strip())
+            start = i + 1
+    argumente.append(text[start:].strip())
+    return argumente
+
+
+def _translate_date_diff(sql: str) -> Optional[str]:
+    """Ersetzt DATE_DIFF(a, b, DAY) durch date_diff('day', b, a)."""
+    ergebnis = []
+    position = 0
+    for treffer in re.finditer(r'\bDATE_DIFF\s*\(', sql, re.IGNORECASE):
+        if treffer.start() < position:
+            return None
+        tiefe, ende = 1, treffer.end()
+        while ende < len(sql) and tiefe:
+            tiefe += {'(': 1, ')': -1}.get(sql[ende], 0)
+            ende += 1
+        if tiefe:
+            return None
+        argumente = _split_arguments(sql[treffer.end():ende - 1])
+        if len(argumente) != 3 or argumente[2].upper() != 'DAY':
+            return None
+        innen_a = _translate_date_diff(argumente[0])
+        innen_b = _translate_date_diff(argumente[1])
+        if innen_a is None or innen_b is None:
+            return None
+        ergebnis.append(sql[position:treffer.start()])
+        ergebnis.append(f"date_diff('day', {innen_b}, {innen_a})")
+        position = ende
+    ergebnis.append(sql[position:])
+    return ''.join(ergebnis)
+
+
+def to_replica_sql(sql: str) -> Optional[str]:
+    """
+    Übersetzt ein BigQuery-Template in den DuckDB-Dialekt des Abbilds.
+
+    Unterstützt werden die in den portablen Mustern verwendeten Konstrukte
+    (TIMESTAMP(), DATE(), DATE_DIFF(..., DAY), CURRENT_DATE(), @-Parameter).
+
+    Args:
+        sql: SQL-Template aus query_patterns.json
+
+    Returns:
+        DuckDB-SQL oder None, wenn das Template nicht portabel ist
+    """
+    tabellen = set(_TABLE_PATTERN.findall(sql))
+    if not tabellen or not tabellen <= REPLICA_TABLE_NAMES:
+        return None
+    if _UNPORTABLE_PATTERN.search(sql):
+        return None
+    sql = _translate_date_diff(_TABLE_PATTERN.sub(r'\1', sql))
+    if sql is None:
+        return None
+    sql = re.sub(r'\bCURRENT_DATE\(\)', 'current_date', sql)
+    sql = re.sub(r'\bTIMESTAMP\(', 'bq_timestamp(', sql)
+    sql = re.sub(r'\bDATE\(', 'bq_date(', sql)
+    return re.sub(r'@(\w+)', r'$\1', sql)
+
+
+def replica_source_sql(table: ReplicaTable, incremental: bool) -> str:
+    """
+    Erzeugt die BigQuery-Abfrage, die eine Tabelle des Abbilds befüllt.
+
+    Args:
+        table: Zu ladende Tabelle
+        incremental: Nur Zeilen ab dem Wasserstand @since laden
+
+    Returns:
+        SQL mit den Parametern @seller_id (außer agencies) und ggf. @since
+    """
+    spalten = ", ".join(f"t.{spalte}" for spalte in table.columns)
+    sql = f"SELECT {spalten}, {table.watermark} AS _watermark {table.source}"
+    if incremental:
+        # >= statt >, damit Zeilen mit gleichem Zeitstempel nicht verloren gehen (Upsert ist idempotent)
+        sql += f" AND TIMESTAMP({table.watermark}) >= TIMESTAMP(@since)"
+    return sql
+
+
+def _text(value: Any) -> Optional[str]:
+    """Normalisiert einen BigQuery-Wert auf die String-Darstellung der Quelltabelle."""
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
+
+
+def _json_value(value: Any) -> Any:
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+class SellerReplica:
+    """DuckDB-Abbild der Daten eines Verkäufers."""
+
+    def __init__(self, seller_id: str, path: str):
+        """
+        Öffnet (bzw. erstellt) das Abbild eines Verkäufers.
+
+        Args:
+            seller_id: Verkäufer
+            path: Pfad der DuckDB-Datei
+        """
+        duckdb = _duckdb()
+        self.seller_id = seller_id
+        self.path = path
+        self._con = duckdb.connect(path)
+        self._write_lock = threading.Lock()
+        self._con.execute("SET GLOBAL TimeZone = 'UTC'")
+        for macro in _MACROS:
+            self._con.execute(macro)
+        for table in REPLICA_SCHEMA:
+            spalten = ", ".join(f'"{spalte}" VARCHAR' for spalte in table.columns)
+            self._con.execute(f'CREATE TABLE IF NOT EXISTS "{table.name}" ({spalten})')
+        self._con.execute("""
+            CREATE TABLE IF NOT EXISTS replica_meta (
+                table_name VARCHAR PRIMARY KEY,
+                watermark VARCHAR,
+                refreshed_at DOUBLE,
+                full_sync_at DOUBLE
+            )
+        """)
+
+    def _meta(self) -> Dict[str, Tuple]:
+        cur = self._con.cursor()
+        try:
+            rows = cur.execute("SELECT table_name, watermark, refreshed_at, full_sync_at FROM replica_meta").fetchall()
+        finally:
+            cur.close()
+        return {row[0]: row[1:] for row in rows}
+
+    def age(self) -> Optional[float]:
+        """Sekunden seit der ältesten Tabellen-Erneuerung, None wenn nie vollständig geladen."""
+        meta = self._meta()
+        if any(table.name not in meta for table in REPLICA_SCHEMA):
+            return None
+        return time.time() - min(meta[table.name][1] for table in REPLICA_SCHEMA)
+
+    def needs_full_sync(self, full_sync_seconds: float) -> bool:
+        """Prüft, ob der letzte vollständige Abgleich zu alt ist."""
+        meta = self._meta()
+        if any(table.name not in meta for table in REPLICA_SCHEMA):
+            return True
+        return time.time() - min(meta[table.name][2] for table in REPLICA_SCHEMA) > full_sync_seconds
+
+    def refresh(self, loader: Callable[[str, Dict[str, Any]], List[Dict[str, Any]]],
+                full: bool = False) -> Dict[str, int]:
+        """
+        Lädt geänderte Zeilen aus BigQuery und übernimmt sie in einer Transaktion.
+
+        Args:
+            loader: Funktion (sql, parameters) -> Zeilen, führt die BigQuery-Abfrage aus
+            full: Alle Zeilen neu laden und den Bestand ersetzen
+
+        Returns:
+            Anzahl geladener Zeilen pro Tabelle
+        """
+        with self._write_lock:
+            meta = self._meta()
+            geladen = {}
+            for table in REPLICA_SCHEMA:
+                watermark = None if full or table.name not in meta else meta[table.name][0]
+                parameters = {"seller_id": self.seller_id}
+                if watermark:
+                    parameters["since"] = watermark
+                geladen[table.name] = loader(replica_source_sql(table, bool(watermark)), parameters)
+
+            jetzt = time.time()
+            cur = self._con.cursor()
+            try:
+                cur.begin()
+                for table in REPLICA_SCHEMA:
+                    ersetzen = full or table.name not in meta or not meta[table.name][0]
+                    neuer_watermark = self._apply(cur, table, geladen[table.name], ersetzen)
+                    alt = meta.get(table.name, (None, None, None))
+                    cur.execute("DELETE FROM replica_meta WHERE table_name = ?", [table.name])
+                    cur.execute(
+                        "INSERT INTO replica_meta VALUES (?, ?, ?, ?)",
+                        [table.name, neuer_watermark or alt[0], jetzt, jetzt if ersetzen else alt[2]]
+                    )
+                cur.commit()
+            except Exception:
+                cur.rollback()
+                raise
+            finally:
+                cur.close()
+        return {name: len(rows) for name, rows in geladen.items()}
+
+    def _apply(self, cur, table: ReplicaTable, rows: List[Dict[str, Any]], ersetzen: bool) -> Optional[str]:
+        """Schreibt Zeilen per NDJSON-Zwischendatei (schneller als einzelne INSERTs)."""
+        if ersetzen:
+            cur.execute(f'DELETE FROM "{table.name}"')
+        if not rows:
+            return None
+        spalten = list(table.columns) + ["_watermark"]
+        fd, staging_path = tempfile.mkstemp(suffix='.ndjson', prefix='replica_')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                for row in rows:
+                    f.write(json.dumps({spalte: _text(row.get(spalte)) for spalte in spalten}) + "\n")
+            typen = ", ".join(f"'{spalte}': 'VARCHAR'" for spalte in spalten)
+            cur.execute(
+                f"CREATE OR REPLACE TEMP TABLE replica_staging AS SELECT * FROM "
+                f"read_json(?, format = 'newline_delimited', columns = {{{typen}}})",
+                [staging_path]
+            )
+        finally:
+            os.remove(staging_path)
+        if not ersetzen:
+            cur.execute(f'DELETE FROM "{table.name}" WHERE _id IN (SELECT _id FROM replica_staging)')
+        spaltenliste = ", ".join(f'"{spalte}"' for spalte in table.columns)
+        cur.execute(f'INSERT INTO "{table.name}" ({spaltenliste}) '
+                    f'SELECT {spaltenliste} FROM replica_staging QUALIFY '
+                    f'ROW_NUMBER() OVER (PARTITION BY _id ORDER BY bq_timestamp(_watermark) DESC) = 1')
+        watermark = cur.execute(
+            "SELECT _watermark FROM replica_staging WHERE _watermark IS NOT NULL "
+            "ORDER BY bq_timestamp(_watermark) DESC LIMIT 1"
+        ).fetchone()
+        cur.execute("DROP TABLE replica_staging")
+        return watermark[0] if watermark else None
+
+    def query(self, sql: str, parameters: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Führt übersetztes SQL auf dem Abbild aus.
+
+        Args:
+            sql: DuckDB-SQL aus to_replica_sql
+            parameters: Benannte Parameter (genau die im SQL verwendeten)
+
+        Returns:
+            Zeilen als Dictionaries (Datumswerte als ISO-Strings wie bei BigQuery)
+        """
+        cur = self._con.cursor()
+        try:
+            cur.execute(sql, parameters)
+            namen = [spalte[0] for spalte in cur.description]
+            return [dict(zip(namen, map(_json_value, row))) for row in cur.fetchall()]
+        finally:
+            cur.close()
+
+    def close(self) -> None:
+        """Schließt die DuckDB-Verbindung."""
+        self._con.close()
+
+
+class SellerReplicaManager:
+    """Verwaltet die Abbilder aktiver Verkäufer und beantwortet portable Muster lokal."""
+
+    def __init__(self, directory: str, loader: Callable[[str, Dict[str, Any]], List[Dict[str, Any]]],
+                 enabled: bool = True, patterns: Optional[List[str]] = None,
+                 max_staleness: float = MAX_STALENESS_SECONDS, refresh_seconds: float = REFRESH_SECONDS,
+                 full_sync_seconds: float = FULL_SYNC_SECONDS, max_sellers: int = 50):
+        """
+        Initialisiert den SellerReplicaManager.
+
+        Args:
+            directory: Basisverzeichnis der DuckDB-Dateien (darunter ein Verzeichnis pro Prozess)
+            loader: Funktion (sql, parameters) -> Zeilen für BigQuery-Abfragen
+            enabled: Lokale Abbilder verwenden (zusätzlich muss duckdb installiert sein)
+            patterns: Muster, die lokal beantwortet werden dürfen
+            max_staleness: Maximales Alter eines Abbilds in Sekunden, sonst BigQuery
+            refresh_seconds: Alter, ab dem im Hintergrund inkrementell erneuert wird
+            full_sync_seconds: Abstand vollständiger Abgleiche
+            max_sellers: Maximale Anzahl gleichzeitig geöffneter Abbilder (LRU)
+        """
+        self.directory = directory
+        self.loader = loader
+        self.patterns = frozenset(patterns if patterns is not None else DEFAULT_PATTERNS)
+        self.max_staleness = max_staleness
+        self.refresh_seconds = refresh_seconds
+        self.full_sync_seconds = full_sync_seconds
+        self.max_sellers = max_sellers
+        self.enabled = enabled and duckdb_available()
+        if enabled and not self.enabled:
+            logger.warning("SELLER_REPLICA aktiv, aber duckdb ist nicht installiert – verwende BigQuery")
+        self._replicas = OrderedDict()
+        self._sql = {}
+        self._nicht_portabel = set()
+        self._fehler = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        # Prozess, dem die geöffneten Abbilder gehören (None = noch keins geöffnet)
+        self._pid = None
+        self.stats = {"local_queries": 0, "fallback_missing": 0, "fallback_stale": 0, "fallback_errors": 0,
+                      "refreshes": 0, "full_syncs": 0, "refresh_errors": 0, "local_ms_total": 0.0}
+
+    def _process_directory(self) -> str:
+        return os.path.join(self.directory, f"pid_{os.getpid()}")
+
+    def _path(self, seller_id: str) -> str:
+        name = re.sub(r'[^\w-]', '_', str(seller_id))
+        return os.path.join(self._process_directory(), f"seller_{name}.v{SCHEMA_VERSION}.duckdb")
+
+    def _remove_stale_directories(self) -> None:
+        """Entfernt die Verzeichnisse beendeter Prozesse."""
+        try:
+            eintraege = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for eintrag in eintraege:
+            match = re.fullmatch(r'pid_(\d+)', eintrag)
+            if not match or int(match.group(1)) == os.getpid():
+                continue
+            try:
+                os.kill(int(match.group(1)), 0)
+                continue
+            except ProcessLookupError:
+                pass
+            except PermissionError:
+                continue
+            shutil.rmtree(os.path.join(self.directory, eintrag), ignore_errors=True)
+            logger.info(f"Replica-Verzeichnis {eintrag} eines beendeten Prozesses entfernt")
+
+    def _replica(self, seller_id: str) -> SellerReplica:
+        with self._lock:
+            if self._pid != os.getpid():
+                # Erster Zugriff in diesem Prozess (auch nach einem Fork): geerbte Verbindungen verwerfen
+                self._replicas.clear()
+                self._pid = os.getpid()
+                self._remove_stale_directories()
+            replica = self._replicas.get(seller_id)
+            if replica is not None:
+                self._replicas.move_to_end(seller_id)
+                return replica
+            os.makedirs(self._process_directory(), exist_ok=True)
+            replica = SellerReplica(seller_id, self._path(seller_id))
+            self._replicas[seller_id] = replica
+            while len(self._replicas) > self.max_sellers:
+                # Laufende Abfragen halten eigene Cursor; die Verbindung schließt der GC
+                self._replicas.popitem(last=False)
+            return replica
+
+    def _portable_sql(self, pattern_name: str, sql: str) -> Optional[str]:
+        schluessel = (pattern_name, sql)
+        with self._lock:
+            if schluessel in self._nicht_portabel:
+                return None
+            if schluessel not in self._sql:
+                self._sql[schluessel] = to_replica_sql(sql)
+                if self._sql[schluessel] is None:
+                    logger.info(f"Muster {pattern_name} ist nicht portabel, bleibt bei BigQuery")
+            return self._sql[schluessel]
+
+    def refresh(self, seller_id: str, full: Optional[bool] = None) -> Dict[str, int]:
+        """
+        Erneuert das Abbild eines Verkäufers synchron.
+
+        Args:
+            seller_id: Verkäufer
+            full: Vollständig neu laden (None = automatisch nach full_sync_seconds)
+
+        Returns:
+            Anzahl geladener Zeilen pro Tabelle
+        """
+        replica = self._replica(seller_id)
+        if full is None:
+            full = replica.needs_full_sync(self.full_sync_seconds)
+        started = time.perf_counter()
+        geladen = replica.refresh(self.loader, full=full)
+        with self._lock:
+            self.stats["refreshes"] += 1
+            self.stats["full_syncs"] += int(full)
+            self._fehler.pop(seller_id, None)
+        logger.info(f"Abbild für Seller {seller_id} {'vollständig' if full else 'inkrementell'} erneuert "
+                    f"in {time.perf_counter() - started:.2f}s: {geladen}")
+        return geladen
+
+    def refresh_in_background(self, seller_id: str) -> None:
+        """Startet eine Erneuerung im Hintergrund (höchstens eine pro Verkäufer)."""
+        if not self.enabled:
+            return
+        with self._lock:
+            fehler_seit = self._fehler.get(seller_id)
+            if seller_id in self._refreshing or (fehler_seit and time.time() - fehler_seit < FAILURE_RETRY_SECONDS):
+                return
+            self._refreshing.add(seller_id)
+
+        def refresh():
+            try:
+                self.refresh(seller_id)
+            except Exception as e:
+                logger.warning(f"Abbild für Seller {seller_id} konnte nicht erneuert werden: {e}")
+                with self._lock:
+                    self._fehler[seller_id] = time.time()
+                    self.stats["refresh_errors"] += 1
+            finally:
+                with self._lock:
+                    self._refreshing.discard(seller_id)
+
+        threading.Thread(target=refresh, name=f"seller-replica-{seller_id}", daemon=True).start()
+
+    def query(self, pattern_name: str, variant, parameters: Dict[str, Any],
+              max_staleness: Optional[float] = None) -> Optional[List[Dict[str, Any]]]:
+        """
+        Beantwortet ein Abfragemuster aus dem lokalen Abbild, falls möglich.
+
+        Args:
+            pattern_name: Name des Abfragemusters
+            variant: Gewählte QueryVariant (sql, parameters)
+            parameters: Parameter der Abfrage (inkl. seller_id)
+            max_staleness: Staleness-Grenze des Musters (None = Standard)
+
+        Returns:
+            Zeilen wie bei execute_bigquery_query oder None, wenn BigQuery
+            antworten soll (deaktiviert, nicht portabel, kein/zu altes Abbild, Fehler)
+        """
+        if not self.enabled or pattern_name not in self.patterns:
+            return None
+        seller_id = parameters.get("seller_id")
+        if not seller_id:
+            return None
+        sql = self._portable_sql(pattern_name, variant.sql)
+        if sql is None:
+            return None
+
+        try:
+            replica = self._replica(seller_id)
+            alter = replica.age()
+        except Exception as e:
+            logger.warning(f"Abbild für Seller {seller_id} nicht verfügbar: {e}")
+            self.stats["fallback_errors"] += 1
+            return None
+        if alter is None or alter > self.refresh_seconds:
+            self.refresh_in_background(seller_id)
+        if alter is None:
+            self.stats["fallback_missing"] += 1
+            return None
+        if alter > (max_staleness if max_staleness is not None else self.max_staleness):
+            self.stats["fallback_stale"] += 1
+            logger.info(f"Abbild für Seller {seller_id} ist {alter:.0f}s alt, {pattern_name} über BigQuery")
+            return None
+
+        started = time.perf_counter()
+        try:
+            rows = replica.query(sql, {name: parameters.get(name) for name in variant.parameters})
+        except Exception as e:
+            duckdb = _duckdb()
+            if isinstance(e, (duckdb.ParserException, duckdb.BinderException, duckdb.CatalogException)):
+                # Übersetzung passt nicht zum Abbild: Muster künftig direkt an BigQuery
+                with self._lock:
+                    self._nicht_portabel.add((pattern_name, variant.sql))
+            logger.warning(f"Lokale Abfrage {pattern_name} fehlgeschlagen, verwende BigQuery: {e}")
+            self.stats["fallback_errors"] += 1
+            return None
+        dauer_ms = (time.perf_counter() - started) * 1000
+        self.stats["local_queries"] += 1
+        self.stats["local_ms_total"] += dauer_ms
+        logger.info(f"{pattern_name} lokal beantwortet: {len(rows)} Zeilen in {dauer_ms:.1f}ms "
+                    f"(Abbild {alter:.0f}s alt)")
+        return rows
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Liefert Zähler, Abbilder und nicht portable Muster."""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["enabled"] = self.enabled
+            stats["sellers"] = list(self._replicas)
+            stats["refreshing"] = sorted(self._refreshing)
+            stats["unportable_patterns"] = sorted({name for name, _ in self._nicht_portabel} |
+                                                  {name for (name, _), sql in self._sql.items() if sql is None})
+        stats["avg_local_ms"] = round(stats.pop("local_ms_total") / stats["local_queries"], 2) \
+            if stats["local_queries"] else None
+        return stats
@@ -0,0 +1,228 @@
+"""
+Service Registry für XORA Chatbot.
+Externe Dienste (GCS, Pinecone, ...) werden nicht mehr beim Import von app.py
+verbunden, sondern erst beim ersten Zugriff über einen Proxy. Zusätzlich misst
+die Registry die Dauer der einzelnen Startphasen und kann kritische Dienste im
+Hintergrund vorwärmen; /healthz meldet erst danach "ready". Schlägt ein
+kritischer Dienst fehl, startet /healthz in Abständen einen neuen Versuch im
+Hintergrund, sodass die Instanz nach einer Störung wieder "ready" wird.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Dict, Any, Optional, Callable, List
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG,
+                   format='%(asctime)s %(levelname)s:%(name)s:%(message)s',
+                   datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+# Mindestabstand zwischen zwei Versuchen für einen fehlgeschlagenen Dienst (Sekunden)
+RETRY_SECONDS = float(os.getenv('SERVICE_RETRY_SECONDS', '30'))
+
+
+class LazyService:
+    """Erzeugt einen Dienst einmalig beim ersten Zugriff (thread-sicher)."""
+
+    def __init__(self, name: str, factory: Callable[[], Any], critical: bool = False):
+        """
+        Initialisiert den LazyService.
+
+        Args:
+            name: Name für Logs und Startbericht
+            factory: Funktion, die den Dienst erzeugt
+            critical: Muss vor "ready" initialisiert sein
+        """
+        self.name = name
+        self.factory = factory
+        self.critical = critical
+        self._instance = None
+        self._initialized = False
+        self._lock = threading.Lock()
+        self.init_seconds = None
+        self.error = None
+        self.failed_at = None
+        self.attempts = 0
+
+    def get(self) -> Any:
+        """Liefert den Dienst und erzeugt ihn beim ersten Aufruf."""
+        if self._initialized:
+            return self._instance
+        with self._lock:
+            if not self._initialized:
+                started = time.perf_counter()
+                self.attempts += 1
+                try:
+                    self._instance = self.factory()
+                except Exception as e:
+                    self.error = str(e)
+                    self.failed_at = time.monotonic()
+                    logger.error(f"Dienst {self.name} konnte nicht initialisiert werden: {e}")
+                    raise
+                self.init_seconds = round(time.perf_counter() - started, 3)
+                self.error = None
+                self.failed_at = None
+                self._initialized = True
+                logger.info(f"Dienst {self.name} initialisiert in {self.init_seconds}s")
+        return self._instance
+
+    @property
+    def initialized(self) -> bool:
+        return self._initialized
+
+
+class LazyProxy:
+    """Leitet Attributzugriffe an den (lazy erzeugten) Dienst weiter."""
+
+    def __init__(self, service: LazyService):
+        object.__setattr__(self, '_service', service)
+
+    def __getattr__(self, name):
+        return getattr(self._service.get(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._service.get(), name, value)
+
+    def __repr__(self):
+        state = 'initialisiert' if self._service.initialized else 'noch nicht initialisiert'
+        return f"<LazyProxy {self._service.name} ({state})>"
+
+
+class ServiceRegistry:
+    """Verwaltet Lazy-Dienste, Startphasen und den Warm-up-Status."""
+
+    def __init__(self, retry_seconds: float = RETRY_SECONDS):
+        self.retry_seconds = retry_seconds
+        self._retry_thread = None
+        self._retry_lock = threading.Lock()
+        self._services = {}
+        self._phases = []
+        self._started = time.perf_counter()
+        self._last_mark = self._started
+        self._warmup_thread = None
+        self._warmup_done = threading.Event()
+        self._warmup_enabled = False
+
+    def register(self, name: str, factory: Callable[[], Any], critical: bool = False) -> LazyProxy:
+        """
+        Registriert einen Dienst.
+
+        Args:
+            name: Eindeutiger Name
+            factory: Funktion, die den Dienst erzeugt
+            critical: Muss vor "ready" vorgewärmt sein
+
+        Returns:
+            Proxy, der wie der Dienst selbst verwendet werden kann
+        """
+        service = LazyService(name, factory, critical)
+        self._services[name] = service
+        return LazyProxy(service)
+
+    def get(self, name: str) -> Any:
+        """Liefert den Dienst (und initialisiert ihn bei Bedarf)."""
+        return self._services[name].get()
+
+    def mark(self, phase: str) -> None:
+        """Schließt eine Startphase ab und misst die Zeit seit der vorherigen."""
+        now = time.perf_counter()
+        self._phases.append((phase, round(now - self._last_mark, 3)))
+        self._last_mark = now
+
+    def start_warmup(self, names: Optional[List[str]] = None) -> None:
+        """
+        Initialisiert die kritischen (bzw. angegebenen) Dienste in einem Hintergrund-Thread.
+
+        Args:
+            names: Optional, Dienste für den Warm-up (Standard: alle kritischen)
+        """
+        if self._warmup_thread is not None:
+            return
+        self._warmup_enabled = True
+        ziele = names or [name for name, service in self._services.items() if service.critical]
+
+        def warmup():
+            started = time.perf_counter()
+            for name in ziele:
+                try:
+                    self._services[name].get()
+                except Exception:
+                    pass
+            self._phases.append(("warmup (Hintergrund)", round(time.perf_counter() - started, 3)))
+            self._warmup_done.set()
+            logger.info(f"Warm-up abgeschlossen in {time.perf_counter() - started:.2f}s")
+
+        self._warmup_thread = threading.Thread(target=warmup, name="service-warmup", daemon=True)
+        self._warmup_thread.start()
+
+    def retry_failed(self) -> List[str]:
+        """
+        Startet für fehlgeschlagene kritische Dienste einen neuen Versuch im Hintergrund.
+
+        Pro Dienst höchstens alle retry_seconds und nie parallel zum Warm-up oder
+        zu einem laufenden Versuch; der Aufrufer (z.B. /healthz) wartet nicht darauf.
+
+        Returns:
+            Namen der Dienste, für die ein Versuch gestartet wurde
+        """
+        if self._warmup_enabled and not self._warmup_done.is_set():
+            return []
+        with self._retry_lock:
+            if self._retry_thread is not None and self._retry_thread.is_alive():
+                return []
+            jetzt = time.monotonic()
+            faellig = [name for name, service in self._services.items()
+                       if service.critical and not service.initialized and service.failed_at is not None
+                       and jetzt - service.failed_at >= self.retry_seconds]
+            if not faellig:
+                return []
+
+            def retry():
+                for name in faellig:
+                    try:
+                        self._services[name].get()
+                        logger.info(f"Dienst {name} nach erneutem Versuch verfügbar")
+                    except Exception:
+                        pass
+
+            self._retry_thread = threading.Thread(target=retry, name="service-retry", daemon=True)
+            self._retry_thread.start()
+        return faellig
+
+    def is_ready(self) -> bool:
+        """Ready, wenn der Warm-up beendet ist und alle kritischen Dienste laufen."""
+        if self._warmup_enabled and not self._warmup_done.is_set():
+            return False
+        return all(service.initialized for service in self._services.values()
+                   if service.critical and (self._warmup_enabled or service.error))
+
+    def startup_report(self) -> Dict[str, Any]:
+        """Liefert Dauer der Startphasen und den Zustand aller Dienste."""
+        return {
+            "phases": [{"phase": phase, "seconds": seconds} for phase, seconds in self._phases],
+            "startup_seconds": round(sum(seconds for phase, seconds in self._phases
+                                         if not phase.startswith("warmup")), 3),
+            "services": {
+                name: {
+                    "critical": service.critical,
+                    "initialized": service.initialized,
+                    "init_seconds": service.init_seconds,
+                    "error": service.error,
+                    "attempts": service.attempts
+                }
+                for name, service in self._services.items()
+            },
+            "ready": self.is_ready()
+        }
+
+    def log_report(self) -> None:
+        """Schreibt den Startbericht ins Log."""
+        report = self.startup_report()
+        phasen = ", ".join(f"{p['phase']}={p['seconds']}s" for p in report["phases"])
+        logger.info(f"Start in {report['startup_seconds']}s ({phasen})")
+
+
+# Gemeinsame Instanz für app.py
+service_registry = ServiceRegistry()
@@ -1,90 +1,170 @@
 import re
 import json
 import logging
+from types import MappingProxyType
+from typing import NamedTuple, FrozenSet, Mapping
 from prepare_sql_name import prepare_customer_name_for_sql
+from team_query import compile_team_sql
+from customer_name_index import MAX_CANDIDATES
 
-def enhance_customer_query(query_data, params):
+# Namensbedingung der Kundenabfragen in query_patterns.json
+NAME_CONDITION = (
+    "(LOWER(la.first_name) LIKE CONCAT('%', LOWER(@customer_name), '%') OR "
+    "LOWER(la.last_name) LIKE CONCAT('%', LOWER(@customer_name), '%'))"
+)
+
+# Ersatz für Namen mit Verkäufer-Identifier, z.B. "Ramm (I)" und "Ramm"
+NAME_IDENTIFIER_CONDITION = (
+    "(" +
+    "LOWER(la.first_name) LIKE CONCAT('%', LOWER(@customer_name), '%') OR " +
+    "LOWER(la.last_name) LIKE CONCAT('%', LOWER(@customer_name), '%') OR " +
+    "LOWER(la.first_name) LIKE CONCAT('%', LOWER(@secondary_name), '%') OR " +
+    "LOWER(la.last_name) LIKE CONCAT('%', LOWER(@secondary_name), '%')" +
+    ")"
+)
+
+# Ersatz, wenn der Namensindex den Kunden zu Lead-IDs aufgelöst hat
+LEAD_ID_CONDITION = "(l._id IN UNNEST(@lead_ids))"
+
+CUSTOMER_QUERIES = ["get_customer_history", "get_customer_tickets", "get_care_givers_for_customer"]
+
+
+class QueryVariant(NamedTuple):
+    """Vorkompilierte SQL-Variante eines Abfragemusters."""
+    name: str
+    sql: str
+    parameters: FrozenSet[str]
+
+
+def _variant(name, sql):
+    return QueryVariant(name, sql, frozenset(re.findall(r'@(\w+)', sql)))
+
+
+def compile_query_variants(query_data) -> Mapping[str, QueryVariant]:
     """
-    Verbessert SQL-Abfragen für Kundennamen, indem sowohl der originale Name
-    (z.B. mit Verkäufer-Identifier wie "(I)") als auch ein bereinigter Name
+    Erzeugt beim Laden der Pattern-Registry alle SQL-Varianten eines Musters.
+
+    Jedes Muster hat die Variante "default" (das Template unverändert). Muster
+    mit der Namensbedingung für Kunden erhalten zusätzlich:
+    - "name_identifier": Suche nach @customer_name und @secondary_name
+    - "lead_ids": Filter auf die vom Namensindex aufgelösten Lead-IDs
+    Muster, die sich für mehrere Verkäufer in einem Job rechnen lassen, erhalten
+    "team" (@seller_ids, Ergebnisspalte team_seller_id, siehe team_query.py).
+
+    Args:
+        query_data (dict): Ein Abfragemuster aus query_patterns.json
+
+    Returns:
+        Mapping[str, QueryVariant]: Unveränderliche Varianten nach Name
+    """
+    sql_template = query_data.get("sql_template", "")
+    variants = {"default": _variant("default", sql_template)}
+    if NAME_CONDITION in sql_template:
+        variants["name_identifier"] = _variant(
+            "name_identifier", sql_template.replace(NAME_CONDITION, NAME_IDENTIFIER_CONDITION))
+        variants["lead_ids"] = _variant(
+            "lead_ids", sql_template.replace(NAME_CONDITION, LEAD_ID_CONDITION))
+    team_sql = compile_team_sql(sql_template) if sql_template else None
+    if team_sql:
+        variants["team"] = _variant("team", team_sql)
+    return MappingProxyType(variants)
+
+
+def select_query_variant(variants, params) -> QueryVariant:
+    """
+    Wählt die SQL-Variante anhand der vorhandenen Parameter.
+
+    Args:
+        variants (Mapping[str, QueryVariant]): Ergebnis von compile_query_variants
+        params (dict): Die Parameter für die Abfrage
+
+    Returns:
+        QueryVariant: Variante für genau diese Parameterform
+    """
+    if params.get("lead_ids") and "lead_ids" in variants:
+        return variants["lead_ids"]
+    if params.get("secondary_name") and "name_identifier" in variants:
+        return variants["name_identifier"]
+    return variants["default"]
+
+
+def enhance_customer_query(params, resolver=None):
+    """
+    Bereitet die Parameter von Kundenabfragen vor, sodass sowohl der originale
+    Name (z.B. mit Verkäufer-Identifier wie "(I)") als auch ein bereinigter Name
     berücksichtigt werden.
-    
+
+    Ist ein CustomerNameResolver angegeben, werden die Namen lokal zu Lead-IDs
+    aufgelöst (Parameter lead_ids), aber nur bei Teilstring-Treffern eines aktuellen
+    Index. Phonetische und Trigramm-Treffer ändern die Suche nicht, sondern landen
+    als Kandidaten in name_match (für Rückfrage bzw. Hinweis in der Antwort).
+    Die passende SQL-Variante wählt danach select_query_variant; das Template
+    selbst wird nicht verändert.
+
     Args:
-        query_data (dict): Die Query-Daten aus query_patterns.json
         params (dict): Die Parameter für die Abfrage
-        
+        resolver (CustomerNameResolver, optional): Namensindex pro Verkäufer
+
     Returns:
-        Tuple[dict, dict]: Aktualisierte query_data und params
+        dict: Aktualisierte params
     """
     # Nur für Abfragen mit Kundennamen relevant
     if "customer_name" not in params:
-        return query_data, params
-    
+        return params
+
     customer_name = params["customer_name"]
     logging.info(f"Verarbeite Kundenanfrage für: '{customer_name}'")
-    
+
     # Bereite den Kundennamen für die SQL-Suche vor
     primary_name, secondary_name = prepare_customer_name_for_sql(customer_name)
-    
+
     # Aktualisiere den primären Namen in den Parametern
     params["customer_name"] = primary_name
-    
+
+    # Lokale Auflösung zu Lead-IDs
+    aufloesung = None
+    if resolver is not None:
+        aufloesung = resolver.resolve(params.get("seller_id"), primary_name, secondary_name)
+    if aufloesung and aufloesung["lead_ids"]:
+        logging.info(f"Kundenname über Namensindex aufgelöst: {len(aufloesung['lead_ids'])} Lead-ID(s)")
+        params["lead_ids"] = aufloesung["lead_ids"]
+        return params
+    if aufloesung and aufloesung["match"] != "substring":
+        # Nur ähnlich geschriebene Namen: nicht danach filtern, sondern nachfragen
+        params["name_match"] = {
+            "name": customer_name,
+            "match": aufloesung["match"],
+            "candidates": [" ".join(filter(None, (lead.get("first_name"), lead.get("last_name"))))
+                           for lead in aufloesung["leads"][:MAX_CANDIDATES]]
+        }
+        logging.info(f"Kundenname '{customer_name}' nur ähnlich gefunden ({aufloesung['match']}): "
+                     f"{params['name_match']['candidates']}")
+
     # Wenn wir einen sekundären Namen haben (z.B. "Ramm" für "Ramm (I)")
     if secondary_name:
         logging.info(f"Zusätzlicher Suchname gefunden: '{secondary_name}'")
-        
-        # Hole das SQL-Template
-        sql_template = query_data.get("sql_template", "")
-        
-        # Es gibt zwei Möglichkeiten:
-        # 1. Wir fügen einen neuen Parameter hinzu und modifizieren die Abfrage
-        # 2. Wir erstellen eine komplexere Abfrage mit ODER-Bedingungen
-        
-        # Option 1: Füge sekundären Namen als Parameter hinzu
         params["secondary_name"] = secondary_name
-        
-        # Suche nach der WHERE-Bedingung für Kundennamen
-        name_condition_pattern = r'(LOWER\(la\.first_name\) LIKE CONCAT\(\'%\', LOWER\(@customer_name\), \'%\'\) OR LOWER\(la\.last_name\) LIKE CONCAT\(\'%\', LOWER\(@customer_name\), \'%\'\))'
-        
-        if re.search(name_condition_pattern, sql_template):
-            # Erstelle die neue Bedingung mit beiden Namen
-            new_condition = (
-                "(" + 
-                "LOWER(la.first_name) LIKE CONCAT('%', LOWER(@customer_name), '%') OR " +
-                "LOWER(la.last_name) LIKE CONCAT('%', LOWER(@customer_name), '%') OR " +
-                "LOWER(la.first_name) LIKE CONCAT('%', LOWER(@secondary_name), '%') OR " +
-                "LOWER(la.last_name) LIKE CONCAT('%', LOWER(@secondary_name), '%')" +
-                ")"
-            )
-            
-            # Ersetze die alte Bedingung mit der neuen
-            modified_sql = re.sub(name_condition_pattern, new_condition, sql_template)
-            
-            if modified_sql != sql_template:
-                logging.info("SQL-Abfrage für mehrere Namensvarianten modifiziert")
-                query_data["sql_template"] = modified_sql
-            else:
-                logging.warning("Konnte die SQL-Abfrage nicht modifizieren")
-    
-    return query_data, params
-
-def apply_query_enhancements(function_name, query_data, params):
+
+    return params
+
+def apply_query_enhancements(function_name, params, resolver=None):
     """
-    Wendet verschiedene Verbesserungen auf SQL-Abfragen an, basierend auf dem Funktionsnamen
-    und den Parametern.
-    
+    Wendet verschiedene Verbesserungen auf die Parameter von SQL-Abfragen an,
+    basierend auf dem Funktionsnamen. Die SQL-Varianten selbst sind bereits
+    beim Laden der Pattern-Registry vorkompiliert (compile_query_variants).
+
     Args:
         function_name (str): Name der Funktion/Abfrage
-        query_data (dict): Die Query-Daten aus query_patterns.json
         params (dict): Die Parameter für die Abfrage
-        
+        resolver (CustomerNameResolver, optional): Namensindex für Kundenabfragen
+
     Returns:
-        Tuple[dict, dict]: Aktualisierte query_data und params
+        dict: Aktualisierte params
     """
     # Verbesserungen für kundenspezifische Abfragen
-    if function_name in ["get_customer_history", "get_care_givers_for_customer"]:
-        query_data, params = enhance_customer_query(query_data, params)
-    
+    if function_name in CUSTOMER_QUERIES:
+        params = enhance_customer_query(params, resolver)
+
     # Hier könnten weitere abfragespezifische Verbesserungen hinzugefügt werden
-    
-    return query_data, params
+
+    return params
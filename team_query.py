@@ -0,0 +1,378 @@
+"""
+Team Query für XORA Chatbot.
+Schreibt ein Abfragemuster für einen Verkäufer (l.seller_id = @seller_id) in
+eine Team-Form um, die in einem einzigen BigQuery-Job für mehrere Verkäufer
+(l.seller_id IN UNNEST(@seller_ids)) rechnet und pro Zeile die Spalte
+team_seller_id liefert:
+
+- Blöcke mit dem Verkäuferfilter erhalten team_seller_id und, falls sie
+  aggregieren, GROUP BY team_seller_id
+- Blöcke, die solche CTEs lesen, reichen team_seller_id durch
+- Blöcke, die mehrere dieser CTEs per CROSS JOIN kombinieren, werden von der
+  Verkäuferliste aus per LEFT JOIN aufgebaut; COUNT-Spalten fehlender
+  Verkäufer werden wie im Einzelfall zu 0
+- Aggregiert die äußerste Abfrage, liefert die Team-Form für jeden Verkäufer
+  genau eine Zeile (auch ohne Daten)
+
+Nicht umschreibbar (Ergebnis None, das Muster bleibt Einzelabfrage) sind
+Muster mit LIMIT, UNION, Fensterfunktionen, OR-Verknüpfung des Filters oder
+Unterabfragen auf Verkäuferdaten.
+"""
+import logging
+import re
+from typing import Dict, List, Optional, Tuple, NamedTuple
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG,
+                   format='%(asctime)s %(levelname)s:%(name)s:%(message)s',
+                   datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+TEAM_COLUMN = "team_seller_id"
+TEAM_SELLERS_CTE = "team_sellers AS (SELECT seller_id FROM UNNEST(@seller_ids) AS seller_id)"
+
+_SELLER_FILTER = re.compile(r'\b(\w+)\.seller_id\s*=\s*@seller_id\b')
+_AGGREGATE = re.compile(r'\b(COUNT|COUNTIF|SUM|AVG|MIN|MAX|ARRAY_AGG|STRING_AGG|LOGICAL_AND|LOGICAL_OR)\s*\(',
+                        re.IGNORECASE)
+_COUNT_ITEM = re.compile(r'^(COUNT|COUNTIF)\s*\(', re.IGNORECASE)
+_CLAUSES = ["SELECT", "FROM", "WHERE", "GROUP BY", "HAVING", "QUALIFY", "WINDOW", "ORDER BY", "LIMIT"]
+_KEYWORDS = {"JOIN", "CROSS", "LEFT", "RIGHT", "INNER", "FULL", "OUTER", "ON", "USING", "WHERE", "GROUP",
+             "ORDER", "LIMIT", "HAVING", "AS"}
+
+
+def _mask(sql: str) -> str:
+    """Ersetzt Inhalte in Klammern und String-Literalen durch '#' (Positionen bleiben erhalten)."""
+    ergebnis = []
+    tiefe = 0
+    quote = None
+    for zeichen in sql:
+        if quote:
+            ergebnis.append('#')
+            if zeichen == quote:
+                quote = None
+            continue
+        if zeichen in ("'", '"'):
+            quote = zeichen
+            ergebnis.append('#' if tiefe else zeichen)
+            continue
+        if zeichen == '(':
+            ergebnis.append('(' if tiefe == 0 else '#')
+            tiefe += 1
+        elif zeichen == ')':
+            tiefe -= 1
+            ergebnis.append(')' if tiefe == 0 else '#')
+        else:
+            ergebnis.append('#' if tiefe else zeichen)
+    return ''.join(ergebnis)
+
+
+def _closing_paren(sql: str, start: int) -> int:
+    """Index der zur Klammer bei start passenden schließenden Klammer."""
+    tiefe = 0
+    quote = None
+    for i in range(start, len(sql)):
+        zeichen = sql[i]
+        if quote:
+            if zeichen == quote:
+                quote = None
+        elif zeichen in ("'", '"'):
+            quote = zeichen
+        elif zeichen == '(':
+            tiefe += 1
+        elif zeichen == ')':
+            tiefe -= 1
+            if tiefe == 0:
+                return i
+    raise ValueError("Unbalancierte Klammern")
+
+
+def _split_top_level(text: str, separator: str = ',') -> List[str]:
+    maske = _mask(text)
+    teile, start = [], 0
+    for i, zeichen in enumerate(maske):
+        if zeichen == separator:
+            teile.append(text[start:i].strip())
+            start = i + 1
+    teile.append(text[start:].strip())
+    return teile
+
+
+def _subqueries(text: str) -> List[str]:
+    """Alle Unterabfragen "(SELECT ...)" eines Textes (beliebige Tiefe, äußerste zuerst)."""
+    gefunden = []
+    for treffer in re.finditer(r'\(\s*(SELECT|WITH)\b', text, re.IGNORECASE):
+        ende = _closing_paren(text, treffer.start())
+        if not any(start <= treffer.start() < stop for start, stop, _ in gefunden):
+            gefunden.append((treffer.start(), ende, text[treffer.start():ende + 1]))
+    return [sub for _, _, sub in gefunden]
+
+
+def _without_subqueries(text: str) -> str:
+    for sub in _subqueries(text):
+        text = text.replace(sub, "(#)")
+    return text
+
+
+def split_with(sql: str) -> Tuple[List[Tuple[str, str]], str]:
+    """
+    Zerlegt ein Template in CTEs und äußerste Abfrage.
+
+    Returns:
+        ([(name, body), ...], final_query)
+    """
+    sql = sql.strip()
+    if not re.match(r'WITH\b', sql, re.IGNORECASE):
+        return [], sql
+    ctes = []
+    position = 4
+    while True:
+        treffer = re.compile(r'\s*,?\s*(\w+)\s+AS\s*\(', re.IGNORECASE).match(sql, position)
+        if not treffer:
+            break
+        ende = _closing_paren(sql, treffer.end() - 1)
+        ctes.append((treffer.group(1), sql[treffer.end():ende].strip()))
+        position = ende + 1
+    return ctes, sql[position:].strip()
+
+
+class _Block(NamedTuple):
+    distinct: bool
+    items: List[str]
+    clauses: Dict[str, str]
+
+
+def _parse_block(sql: str) -> Optional[_Block]:
+    """Zerlegt einen einfachen SELECT-Block in seine Klauseln (None bei UNION & Co.)."""
+    maske = _mask(sql)
+    if re.search(r'\b(UNION|INTERSECT|EXCEPT)\b', maske, re.IGNORECASE):
+        return None
+    positionen = []
+    for klausel in _CLAUSES:
+        muster = r'\b' + klausel.replace(' ', r'\s+') + r'\b'
+        treffer = list(re.finditer(muster, maske, re.IGNORECASE))
+        if len(treffer) > 1:
+            return None
+        if treffer:
+            positionen.append((treffer[0].start(), treffer[0].end(), klausel))
+    positionen.sort()
+    if not positionen or positionen[0][2] != "SELECT" or positionen[0][0] != 0:
+        return None
+    clauses = {}
+    for i, (start, ende, klausel) in enumerate(positionen):
+        stop = positionen[i + 1][0] if i + 1 < len(positionen) else len(sql)
+        clauses[klausel] = sql[ende:stop].strip()
+    select = clauses.pop("SELECT")
+    distinct = bool(re.match(r'DISTINCT\b', select, re.IGNORECASE))
+    if distinct:
+        select = select[8:].strip()
+    return _Block(distinct, _split_top_level(select), clauses)
+
+
+def _render_block(block: _Block) -> str:
+    teile = ["SELECT " + ("DISTINCT " if block.distinct else "") + ", ".join(block.items)]
+    for klausel in _CLAUSES[1:]:
+        if klausel in block.clauses:
+            teile.append(f"{klausel} {block.clauses[klausel]}")
+    return " ".join(teile)
+
+
+def _item_name(item: str) -> Optional[str]:
+    treffer = re.search(r'\bAS\s+(\w+)\s*$', _mask(item), re.IGNORECASE)
+    if treffer:
+        return treffer.group(1)
+    treffer = re.fullmatch(r'(?:\w+\.)?(\w+)', item.strip())
+    return treffer.group(1) if treffer else None
+
+
+def _item_expression(item: str) -> str:
+    treffer = re.search(r'\bAS\s+\w+\s*$', _mask(item), re.IGNORECASE)
+    return item[:treffer.start()].strip() if treffer else item.strip()
+
+
+def _is_count(expression: str) -> bool:
+    """Prüft, ob ein Ausdruck genau ein COUNT(...) bzw. COUNTIF(...) ist (bei 0 Zeilen = 0)."""
+    if not _COUNT_ITEM.match(expression):
+        return False
+    return _closing_paren(expression, expression.index('(')) == len(expression) - 1
+
+
+def _from_references(from_clause: str, threaded: Dict[str, set]) -> List[Tuple[str, str]]:
+    """Findet Verweise auf durchgereichte CTEs im FROM: [(cte_name, alias)]."""
+    maske = _mask(from_clause)
+    verweise = []
+    for treffer in re.finditer(r'\b(\w+)\b(?:\s+(?:AS\s+)?(\w+))?', maske, re.IGNORECASE):
+        name = treffer.group(1)
+        if name not in threaded:
+            continue
+        vorher = maske[:treffer.start()].rstrip()
+        if vorher.endswith('.'):
+            continue
+        alias = treffer.group(2)
+        if not alias or alias.upper() in _KEYWORDS:
+            alias = name
+        verweise.append((name, alias))
+    return verweise
+
+
+def _rewrite_block(sql: str, threaded: Dict[str, set], final: bool) -> Optional[Tuple[str, set, bool, List[str]]]:
+    """
+    Schreibt einen Block um.
+
+    Returns:
+        None (nicht umschreibbar), oder (sql, count_spalten, aggregiert, ausgabespalten);
+        sql ist unverändert und count_spalten None, wenn der Block keine Verkäuferdaten liest
+    """
+    block = _parse_block(sql)
+    if block is None:
+        return None
+    von = block.clauses.get("FROM", "")
+    wo = block.clauses.get("WHERE", "")
+
+    # Unterabfragen dürfen weder den Filter noch durchgereichte CTEs verwenden
+    for sub in _subqueries(sql):
+        if '@seller_id' in sub or any(re.search(rf'\b{name}\b', sub) for name in threaded):
+            return None
+
+    filter_treffer = list(_SELLER_FILTER.finditer(wo))
+    if sql.count('@seller_id') != len(filter_treffer):
+        return None
+    verweise = _from_references(von, threaded)
+    if not filter_treffer and not verweise:
+        return (sql, None, False, [])
+
+    items_ohne_sub = [_without_subqueries(item) for item in block.items]
+    aggregiert = any(_AGGREGATE.search(item) for item in items_ohne_sub)
+    if "LIMIT" in block.clauses or "QUALIFY" in block.clauses or "WINDOW" in block.clauses:
+        return None
+    if any(re.search(r'\bOVER\b', item, re.IGNORECASE) for item in items_ohne_sub):
+        return None
+    if filter_treffer:
+        if len({t.group(1) for t in filter_treffer}) != 1 or re.search(r'\bOR\b', _mask(wo), re.IGNORECASE):
+            return None
+        schluessel = f"{filter_treffer[0].group(1)}.seller_id"
+        wo = _SELLER_FILTER.sub(lambda t: f"{t.group(1)}.seller_id IN UNNEST(@seller_ids)", wo)
+        block.clauses["WHERE"] = wo
+
+    count_spalten = set()
+    items = list(block.items)
+    if len(verweise) > 1:
+        # Kombination mehrerer Aggregate: von der Verkäuferliste aus aufbauen
+        if filter_treffer or aggregiert:
+            return None
+        maske = _mask(von)
+        referenz = r'\w+(?:\s+(?:AS\s+)?\w+)?'
+        if not re.fullmatch(rf'\s*{referenz}(\s*(,|CROSS\s+JOIN)\s*{referenz})*\s*', maske, re.IGNORECASE):
+            return None
+        joins = " ".join(f"LEFT JOIN {name} AS {alias} ON {alias}.{TEAM_COLUMN} = team_sellers.seller_id"
+                         for name, alias in verweise)
+        block.clauses["FROM"] = f"team_sellers {joins}"
+        schluessel = "team_sellers.seller_id"
+        # Spaltennamen festhalten, bevor Verweise in COALESCE eingepackt werden
+        items = [item if re.search(r'\bAS\s+\w+\s*$', _mask(item), re.IGNORECASE) or not _item_name(item)
+                 else f"{item} AS {_item_name(item)}" for item in items]
+        for name, alias in verweise:
+            for spalte in threaded[name]:
+                muster = re.compile(rf'\b{alias}\.{spalte}\b')
+                items = [muster.sub(f"COALESCE({alias}.{spalte}, 0)", item) for item in items]
+                for klausel in ("WHERE", "ORDER BY"):
+                    if klausel in block.clauses:
+                        block.clauses[klausel] = muster.sub(f"COALESCE({alias}.{spalte}, 0)",
+                                                            block.clauses[klausel])
+    elif not filter_treffer:
+        name, alias = verweise[0]
+        schluessel = f"{alias}.{TEAM_COLUMN}"
+
+    ausgabe = []
+    for item in items:
+        name = _item_name(item)
+        ausdruck = _item_expression(item)
+        if ausdruck.startswith("COALESCE(") or _is_count(ausdruck):
+            if name:
+                count_spalten.add(name)
+        ausgabe.append(name)
+
+    if items == ["*"] and verweise and len(verweise) == 1 and not filter_treffer:
+        ausgabe = [None]
+    else:
+        items.insert(0, f"{schluessel} AS {TEAM_COLUMN}")
+    if aggregiert:
+        group_by = block.clauses.get("GROUP BY")
+        block.clauses["GROUP BY"] = f"{group_by}, {TEAM_COLUMN}" if group_by else TEAM_COLUMN
+    if final and aggregiert and (None in ausgabe or "ORDER BY" in block.clauses):
+        return None
+    return (_render_block(_Block(block.distinct, items, block.clauses)), count_spalten, aggregiert, ausgabe)
+
+
+def compile_team_sql(sql_template: str) -> Optional[str]:
+    """
+    Erzeugt die Team-Form eines Abfragemusters.
+
+    Args:
+        sql_template: SQL-Template mit l.seller_id = @seller_id
+
+    Returns:
+        SQL mit @seller_ids und Ergebnisspalte team_seller_id, oder None,
+        wenn das Muster nicht sicher umgeschrieben werden kann
+    """
+    if '@seller_id' not in sql_template or '@seller_ids' in sql_template:
+        return None
+    try:
+        ctes, final = split_with(sql_template)
+        threaded = {}
+        neue_ctes = []
+        team_sellers_noetig = False
+        for name, body in ctes:
+            ergebnis = _rewrite_block(body, threaded, final=False)
+            if ergebnis is None:
+                return None
+            body_neu, count_spalten, _, _ = ergebnis
+            if count_spalten is not None:
+                threaded[name] = count_spalten
+                team_sellers_noetig |= "team_sellers" in body_neu
+            neue_ctes.append(f"{name} AS ({body_neu})")
+
+        ergebnis = _rewrite_block(final, threaded, final=True)
+        if ergebnis is None or ergebnis[1] is None:
+            return None
+        final_neu, count_spalten, aggregiert, ausgabe = ergebnis
+        team_sellers_noetig |= "team_sellers" in final_neu
+
+        if aggregiert:
+            # Eine Zeile pro Verkäufer, auch wenn er im Zeitraum keine Daten hat
+            neue_ctes.append(f"team_result AS ({final_neu})")
+            spalten = ", ".join(
+                f"COALESCE(team_result.{spalte}, 0) AS {spalte}" if spalte in count_spalten
+                else f"team_result.{spalte}"
+                for spalte in ausgabe
+            )
+            final_neu = (f"SELECT team_sellers.seller_id AS {TEAM_COLUMN}, {spalten} FROM team_sellers "
+                         f"LEFT JOIN team_result ON team_result.{TEAM_COLUMN} = team_sellers.seller_id")
+            team_sellers_noetig = True
+    except ValueError:
+        return None
+
+    if team_sellers_noetig:
+        neue_ctes.insert(0, TEAM_SELLERS_CTE)
+    if neue_ctes:
+        return "WITH " + ", ".join(neue_ctes) + " " + final_neu
+    return final_neu
+
+
+def split_team_rows(rows: List[Dict], seller_ids: List[str]) -> Dict[str, List[Dict]]:
+    """
+    Verteilt die Zeilen einer Team-Abfrage auf die Verkäufer.
+
+    Args:
+        rows: Ergebnis der Team-Form (mit team_seller_id)
+        seller_ids: Angefragte Verkäufer
+
+    Returns:
+        Dictionary seller_id -> Zeilen (ohne team_seller_id), in der Reihenfolge der Abfrage
+    """
+    ergebnis = {seller_id: [] for seller_id in seller_ids}
+    for row in rows:
+        row = dict(row)
+        seller_id = row.pop(TEAM_COLUMN, None)
+        if seller_id in ergebnis:
+            ergebnis[seller_id].append(row)
+    return ergebnis
@@ -0,0 +1,114 @@
+"""
+Korpus und Benchmark für date_grammar.
+
+Der Korpus kombiniert 10 Fragen-Vorlagen aus den Tool-Beschreibungen mit
+20 Zeitangaben (200 Fragen, Bezugsdatum 2026-10-19). Jede Zeitangabe muss in
+jeder Vorlage denselben Bereich ergeben; Zeitangaben mit erwartetem None
+dürfen nicht als Datum erkannt werden.
+
+Direkt ausführbar für die Laufzeit pro Aufruf (kalt und mit LRU-Treffer):
+    python tests/test_date_grammar.py --rounds 20
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import date_grammar
+from date_grammar import parse_date_range
+
+TODAY = date(2026, 10, 19)
+
+TEMPLATES = [
+    "Wie viele Leads hatte ich {zeit}?",
+    "Zeig mir meine Care Stays {zeit}",
+    "Welche Verträge wurden {zeit} gekündigt?",
+    "Wie viele Kunden waren {zeit} in Pause?",
+    "Liste alle neuen Kunden {zeit}",
+    "Wie hoch war mein Umsatz {zeit}?",
+    "Welche Agenturwechsel gab es {zeit}?",
+    "Wie viele Betreuungen sind {zeit} gestartet?",
+    "Gib mir die Kündigungsquote {zeit}",
+    "Welche Pflegekräfte waren {zeit} im Einsatz?",
+]
+
+# Zeitangabe -> (start_date, end_date) oder None
+EXPRESSIONS = {
+    "im Mai": ("2026-05-01", "2026-05-31"),
+    "im Juni letzten Jahres": ("2025-06-01", "2025-06-30"),
+    "im Mai des Vorjahres": ("2025-05-01", "2025-05-31"),
+    "im März 2025": ("2025-03-01", "2025-03-31"),
+    "von März bis Mai": ("2026-03-01", "2026-05-31"),
+    "seit Mai": ("2026-05-01", "2026-10-19"),
+    "seit Jahresbeginn": ("2026-01-01", "2026-10-19"),
+    "im 2. Quartal 2025": ("2025-04-01", "2025-06-30"),
+    "in Q1 letzten Jahres": ("2025-01-01", "2025-03-31"),
+    "im ersten Halbjahr": ("2026-01-01", "2026-06-30"),
+    "in den letzten 3 Monaten": ("2026-07-19", "2026-10-19"),
+    "in den letzten 14 Tagen": ("2026-10-05", "2026-10-19"),
+    "im letzten Quartal": ("2026-07-01", "2026-09-30"),
+    "letzten Monat": ("2026-09-01", "2026-09-30"),
+    "diese Woche": ("2026-10-19", "2026-10-25"),
+    "gestern": ("2026-10-18", "2026-10-18"),
+    "vom 01.03.2026 bis 15.03.2026": ("2026-03-01", "2026-03-15"),
+    "im Jahr 2025": ("2025-01-01", "2025-12-31"),
+    "bei Frau Mai": None,
+    "im E-Mail-Marketing": None,
+}
+
+CORPUS = [(vorlage.format(zeit=zeit), erwartet) for vorlage in TEMPLATES for zeit, erwartet in EXPRESSIONS.items()]
+
+
+@pytest.mark.parametrize("frage,erwartet", CORPUS)
+def test_corpus(frage, erwartet):
+    bereich = parse_date_range(frage, today=TODAY)
+
+    if erwartet is None:
+        assert bereich is None
+    else:
+        assert bereich is not None
+        assert (bereich["start_date"], bereich["end_date"]) == erwartet
+
+
+def test_corpus_size():
+    assert len(CORPUS) == 200
+
+
+def benchmark(rounds: int = 20):
+    """
+    Misst die mittlere Laufzeit pro Aufruf über den Korpus.
+
+    Returns:
+        (Mikrosekunden kalt, Mikrosekunden mit LRU-Treffer)
+    """
+    kalt = warm = 0.0
+    for _ in range(rounds):
+        date_grammar._parse_cached.cache_clear()
+        date_grammar._year_hint.cache_clear()
+        start = time.perf_counter()
+        for frage, _ in CORPUS:
+            parse_date_range(frage, today=TODAY)
+        kalt += time.perf_counter() - start
+        start = time.perf_counter()
+        for frage, _ in CORPUS:
+            parse_date_range(frage, today=TODAY)
+        warm += time.perf_counter() - start
+    aufrufe = rounds * len(CORPUS)
+    return kalt / aufrufe * 1e6, warm / aufrufe * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+    kalt, warm = benchmark(args.rounds)
+    print(f"{len(CORPUS)} Fragen x {args.rounds} Runden: kalt {kalt:.1f} us, warm {warm:.1f} us pro Aufruf")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Durchsatz-Benchmark für categorize_chunks mit einem LLM-Stub.
+
+Erzeugt ein synthetisches Dokument mit 200 Seiten, zerlegt es mit
+split_into_chunks und kategorisiert die Chunks mit einem Stub, der eine feste
+Latenz simuliert. Gemessen werden Seiten/s für 1, 4 und 8 Worker.
+
+Direkt ausführbar für andere Latenzen oder Seitenzahlen:
+    python tests/test_ingestion_throughput.py --pages 200 --latency 0.2
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ingestion_pipeline import categorize_chunks, split_into_chunks
+
+PAGES = 200
+LATENCY_SECONDS = 0.02
+
+
+def generate_pages(count: int = PAGES):
+    """Seiten mit je zwei nummerierten Kapiteln und mehreren Absätzen."""
+    for seite in range(1, count + 1):
+        abschnitte = []
+        for kapitel in (1, 2):
+            absaetze = "\n\n".join(
+                f"Absatz {absatz} auf Seite {seite}: Die Pflegekraft unterstützt den Kunden im Alltag, "
+                f"bei der Grundpflege und im Haushalt. Einsatz {seite}-{kapitel}-{absatz} wird dokumentiert."
+                for absatz in range(1, 5)
+            )
+            abschnitte.append(f"{seite}.{kapitel} Kapitel {seite}-{kapitel}\n{absaetze}")
+        yield "\n".join(abschnitte)
+
+
+class StubLLM:
+    """Antwortet nach fester Latenz mit einem Eintrag pro Chunk und zählt parallele Aufrufe."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, chunk: str) -> str:
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.latency)
+            return json.dumps([{
+                "thema": "Pflege",
+                "unterthema": "1) Alltag",
+                "beschreibung": "",
+                "inhalt": chunk.splitlines()[0]
+            }])
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def run_benchmark(pages: int = PAGES, latency: float = LATENCY_SECONDS, max_workers: int = 4):
+    """
+    Kategorisiert das synthetische Dokument einmal.
+
+    Returns:
+        (Einträge, Statistik von categorize_chunks ergänzt um pages_per_second, Stub)
+    """
+    llm = StubLLM(latency)
+    started = time.perf_counter()
+    eintraege, stats = categorize_chunks(split_into_chunks(generate_pages(pages)), llm, max_workers=max_workers)
+    elapsed = time.perf_counter() - started
+    stats["pages"] = pages
+    stats["pages_per_second"] = round(pages / elapsed, 1)
+    return eintraege, stats, llm
+
+
+def test_categorize_chunks_throughput_scales_with_workers():
+    _, seriell, _ = run_benchmark(max_workers=1)
+    eintraege, parallel, llm = run_benchmark(max_workers=4)
+    print(f"\n{PAGES} Seiten, {parallel['chunks']} Chunks, Latenz {LATENCY_SECONDS * 1000:.0f} ms: "
+          f"1 Worker {seriell['pages_per_second']} Seiten/s, 4 Worker {parallel['pages_per_second']} Seiten/s")
+
+    assert parallel["chunks"] == seriell["chunks"] == llm.calls
+    assert parallel["chunks"] > 8
+    assert llm.max_in_flight <= 4
+    # Ergebnisse bleiben in Dokumentreihenfolge
+    assert [e["inhalt"] for e in eintraege] == sorted((e["inhalt"] for e in eintraege),
+                                                     key=lambda s: tuple(int(x) for x in s.split()[0].split('.')))
+    assert parallel["pages_per_second"] >= 2 * seriell["pages_per_second"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=PAGES)
+    parser.add_argument("--latency", type=float, default=0.2, help="simulierte LLM-Latenz in Sekunden")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+    args = parser.parse_args()
+    for workers in args.workers:
+        _, stats, _ = run_benchmark(args.pages, args.latency, workers)
+        print(f"{workers} Worker: {stats['chunks']} Chunks in {stats['seconds']}s, "
+              f"{stats['pages_per_second']} Seiten/s, {stats['chunks_per_second']} Chunks/s")
+
+
+if __name__ == "__main__":
+    main()
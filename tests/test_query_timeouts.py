@@ -0,0 +1,214 @@
+"""
+Tests für die Zeitlimits von BigQuery-Jobs (wait_for_query_job, AbfrageTimeout,
+status "timeout" aus handle_function_call und die Template-Antwort darauf).
+
+Die Fälle mit bigquery_functions werden übersprungen, wenn flask oder
+google-cloud-bigquery nicht installiert sind.
+"""
+import json
+import types
+
+import pytest
+
+import answer_templates
+from query_costs import AbfrageTimeout, query_cost_tracker
+
+
+class FakeClock:
+    """Ersetzt time in bigquery_functions: sleep() rückt die Uhr vor, statt zu warten."""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def perf_counter(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeQueryJob:
+    """QueryJob, der nach polls_until_done Aufrufen von done() fertig ist (None = nie)."""
+
+    def __init__(self, polls_until_done=None, rows=None, job_id="job_fake"):
+        self.polls_until_done = polls_until_done
+        self.rows = rows or []
+        self.job_id = job_id
+        self.polls = 0
+        self.cancelled = False
+        self.result_timeout = None
+
+    def done(self) -> bool:
+        self.polls += 1
+        if self.cancelled:
+            return True
+        return self.polls_until_done is not None and self.polls > self.polls_until_done
+
+    def cancel(self) -> bool:
+        self.cancelled = True
+        return True
+
+    def result(self, page_size=None, timeout=None):
+        self.result_timeout = timeout
+        return iter(self.rows)
+
+
+class FakeRow(dict):
+    """Ersatz für bigquery.Row (row_to_dict benötigt nur items())."""
+
+
+class FakeClient:
+    def __init__(self, job: FakeQueryJob):
+        self.job = job
+        self.queries = []
+
+    def query(self, sql, job_config=None):
+        self.queries.append(sql)
+        return self.job
+
+
+@pytest.fixture
+def bf():
+    return pytest.importorskip("bigquery_functions")
+
+
+@pytest.fixture
+def clock(bf, monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(bf, "time", types.SimpleNamespace(
+        monotonic=fake.monotonic, perf_counter=fake.perf_counter, sleep=fake.sleep))
+    return fake
+
+
+def _timeouts(pattern_name: str) -> int:
+    return query_cost_tracker.get_stats()["patterns"].get(pattern_name, {}).get("timeouts", 0)
+
+
+def test_wait_for_query_job_returns_when_done_before_deadline(bf, clock):
+    job = FakeQueryJob(polls_until_done=3)
+
+    bf.wait_for_query_job(job, clock.now + 5, "test_fertig", 5)
+
+    assert not job.cancelled
+    assert job.polls == 4
+    # Polling-Intervall verdoppelt sich bis zum Maximum
+    assert clock.sleeps == [bf.JOB_POLL_INTERVAL_MIN, bf.JOB_POLL_INTERVAL_MIN * 2, bf.JOB_POLL_INTERVAL_MIN * 4]
+
+
+def test_wait_for_query_job_cancels_and_raises_on_overrun(bf, clock):
+    job = FakeQueryJob(polls_until_done=None, job_id="job_langsam")
+    start = clock.now
+    vorher = _timeouts("test_langsam")
+
+    with pytest.raises(AbfrageTimeout) as excinfo:
+        bf.wait_for_query_job(job, start + 2, "test_langsam", 2)
+
+    assert job.cancelled
+    assert clock.now == pytest.approx(start + 2)
+    assert max(clock.sleeps) <= bf.JOB_POLL_INTERVAL_MAX
+    fehler = excinfo.value
+    assert (fehler.pattern_name, fehler.timeout_seconds, fehler.job_id, fehler.cancelled) == \
+        ("test_langsam", 2, "job_langsam", True)
+    assert _timeouts("test_langsam") == vorher + 1
+
+
+def test_wait_for_query_job_raises_even_if_cancel_fails(bf, clock):
+    job = FakeQueryJob(polls_until_done=None)
+
+    def cancel_fehlgeschlagen():
+        raise RuntimeError("cancel nicht erlaubt")
+
+    job.cancel = cancel_fehlgeschlagen
+
+    with pytest.raises(AbfrageTimeout) as excinfo:
+        bf.wait_for_query_job(job, clock.now + 1, "test_cancel", 1)
+
+    assert excinfo.value.cancelled is False
+
+
+def _patch_pattern(bf, monkeypatch, job: FakeQueryJob, timeout_seconds: float) -> FakeClient:
+    from sql_query_helper import QueryVariant
+
+    pattern = {
+        "description": "Testmuster",
+        "required_parameters": ["seller_id"],
+        "timeout_seconds": timeout_seconds,
+        "cache_ttl_seconds": 0,
+        "result_structure": {"anzahl": "Anzahl"}
+    }
+    variant = QueryVariant("default", "SELECT 1 AS anzahl WHERE @seller_id IS NOT NULL", frozenset({"seller_id"}))
+    client = FakeClient(job)
+    monkeypatch.setattr(bf, "load_query_patterns_cached", lambda: {"test_muster": pattern})
+    monkeypatch.setattr(bf, "get_query_variants", lambda name: {"default": variant})
+    monkeypatch.setattr(bf, "select_query_variant", lambda variants, args: variants["default"])
+    monkeypatch.setattr(bf, "apply_query_enhancements", lambda name, args, resolver=None: args)
+    monkeypatch.setattr(bf.seller_replicas, "query", lambda *args, **kwargs: None)
+    monkeypatch.setattr(bf.bigquery.Client, "from_service_account_json", lambda path: client)
+    return client
+
+
+def test_handle_function_call_returns_timeout_payload(bf, clock, monkeypatch):
+    job = FakeQueryJob(polls_until_done=None, job_id="job_timeout")
+    client = _patch_pattern(bf, monkeypatch, job, timeout_seconds=3)
+
+    payload = json.loads(bf.handle_function_call("test_muster", {"seller_id": "s1"}))
+
+    assert len(client.queries) == 1
+    assert job.cancelled
+    assert payload["status"] == "timeout"
+    assert payload["error_type"] == "timeout"
+    assert payload["pattern"] == "test_muster"
+    assert payload["timeout_seconds"] == 3
+    assert payload["job_id"] == "job_timeout"
+    assert payload["cancelled"] is True
+
+
+def test_handle_function_call_reads_result_within_remaining_time(bf, clock, monkeypatch):
+    job = FakeQueryJob(polls_until_done=2, rows=[FakeRow(anzahl=7)])
+    _patch_pattern(bf, monkeypatch, job, timeout_seconds=10)
+
+    payload = json.loads(bf.handle_function_call("test_muster", {"seller_id": "s1"}))
+
+    assert payload == {"data": [{"anzahl": 7}], "count": 1, "status": "success"}
+    assert not job.cancelled
+    assert 1.0 <= job.result_timeout <= 10
+
+
+def test_timeout_answer_formats_seconds():
+    tool_result = json.dumps({"status": "timeout", "timeout_seconds": 30.0, "error": "..."})
+
+    antwort = answer_templates._timeout_answer(tool_result)
+
+    assert antwort == answer_templates.TIMEOUT_ANSWER.format(seconds="30")
+    assert "30 Sekunden" in antwort
+
+
+@pytest.mark.parametrize("tool_result", [
+    json.dumps({"status": "success", "data": [], "count": 0}),
+    json.dumps({"status": "error", "error": "kaputt"}),
+    json.dumps([1, 2, 3]),
+    "kein json",
+    None,
+])
+def test_timeout_answer_ignores_other_results(tool_result):
+    assert answer_templates._timeout_answer(tool_result) is None
+
+
+def test_render_template_answer_prefers_timeout_answer():
+    tool_result = json.dumps({"status": "timeout", "timeout_seconds": 12.5})
+
+    antwort = answer_templates.render_template_answer("Wie viele Leads habe ich?", "unbekanntes_muster", tool_result)
+
+    assert antwort == answer_templates.TIMEOUT_ANSWER.format(seconds="12.5")
+
+
+def test_abfrage_timeout_message():
+    fehler = AbfrageTimeout("get_leads", 30, job_id="job_1", cancelled=True)
+
+    assert str(fehler) == "Abfrage get_leads hat das Zeitlimit von 30s überschritten und wurde abgebrochen."
+    assert str(AbfrageTimeout(None, 7.5)) == "Abfrage ad_hoc hat das Zeitlimit von 7.5s überschritten."
@@ -0,0 +1,162 @@
+"""
+Themen-Service für XORA Chatbot.
+Hält die Themenhierarchie aus themen.txt geparst im Speicher und liefert sowohl
+das strukturierte Dictionary als auch den fertigen Text für Kategorisierungs-
+Prompts. Änderungen über aktualisiere_themen werden direkt übernommen
+(Write-Through), Änderungen an der Datei von außen über die mtime erkannt.
+"""
+import copy
+import logging
+import os
+import re
+import threading
+from typing import Dict, Any, Optional, Tuple
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG,
+                   format='%(asctime)s %(levelname)s:%(name)s:%(message)s',
+                   datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+THEMA_PATTERN = re.compile(r'Thema\s*\d+:\s*.*')
+UNTERPUNKT_PATTERN = re.compile(r'(\d+[a-z]*)\)?\s*([^/]+)\s*(//\s*(.*))?$')
+
+
+def parse_themenhierarchie(text: str) -> Dict[str, Dict[str, Dict[str, str]]]:
+    """
+    Parst den Inhalt von themen.txt.
+
+    Args:
+        text: Dateiinhalt
+
+    Returns:
+        Dictionary Thema -> Unterpunkt-Nummer -> {"title", "beschreibung"}
+    """
+    themen_dict = {}
+    aktuelles_thema = None
+    for zeile in text.splitlines():
+        zeile = zeile.strip()
+        if not zeile:
+            continue
+        if THEMA_PATTERN.match(zeile):
+            themen_dict[zeile] = {}
+            aktuelles_thema = zeile
+            continue
+        match_unterpunkt = UNTERPUNKT_PATTERN.match(zeile)
+        if match_unterpunkt and aktuelles_thema:
+            themen_dict[aktuelles_thema][match_unterpunkt.group(1)] = {
+                "title": match_unterpunkt.group(2).strip(),
+                "beschreibung": match_unterpunkt.group(4).strip() if match_unterpunkt.group(4) else ""
+            }
+    return themen_dict
+
+
+def _sort_key(k: str) -> Tuple[int, str]:
+    match = re.match(r'(\d+)([a-z]*)', k)
+    if match:
+        return (int(match.group(1)), match.group(2))
+    return (0, k)
+
+
+def render_themenhierarchie(themen_dict: Dict[str, Dict[str, Dict[str, str]]]) -> str:
+    """
+    Erzeugt den Text von themen.txt aus dem Dictionary (Unterpunkte sortiert).
+
+    Args:
+        themen_dict: Themenhierarchie
+
+    Returns:
+        Dateiinhalt im Format von themen.txt
+    """
+    zeilen = []
+    for thema, unterpunkte in themen_dict.items():
+        zeilen.append(f"{thema}\n")
+        for punkt_nummer, punkt_info in sorted(unterpunkte.items(), key=lambda x: _sort_key(x[0])):
+            punkt_titel = punkt_info['title']
+            punkt_beschreibung = punkt_info.get('beschreibung', '')
+            if punkt_beschreibung:
+                zeilen.append(f"{punkt_nummer}) {punkt_titel}\t\t\t// {punkt_beschreibung}\n")
+            else:
+                zeilen.append(f"{punkt_nummer}) {punkt_titel}\n")
+        zeilen.append("\n")
+    return "".join(zeilen)
+
+
+class ThemenHierarchie:
+    """Gecachte Themenhierarchie mit Write-Through und mtime-Invalidierung."""
+
+    def __init__(self, dateipfad: str):
+        """
+        Initialisiert den Service; die Datei wird beim ersten Zugriff gelesen.
+
+        Args:
+            dateipfad: Pfad zu themen.txt
+        """
+        self.dateipfad = dateipfad
+        self._lock = threading.Lock()
+        self._signatur = None
+        self._themen = {}
+        self._prompt_text = ''
+        self.stats = {"hits": 0, "reloads": 0, "writes": 0}
+
+    def _datei_signatur(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.dateipfad)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _aktualisieren(self) -> None:
+        """Liest die Datei neu, wenn sie sich geändert hat (Lock muss gehalten werden)."""
+        signatur = self._datei_signatur()
+        if signatur == self._signatur and self._signatur is not None:
+            self.stats["hits"] += 1
+            return
+        if signatur is None:
+            self._themen, self._prompt_text = {}, ''
+        else:
+            with open(self.dateipfad, 'r', encoding='utf-8') as f:
+                text = f.read()
+            self._themen = parse_themenhierarchie(text)
+            self._prompt_text = text
+            self.stats["reloads"] += 1
+            logger.info(f"Themenhierarchie aus {self.dateipfad} geladen ({len(self._themen)} Themen)")
+        self._signatur = signatur
+
+    def get(self) -> Dict[str, Dict[str, Dict[str, str]]]:
+        """Liefert eine Kopie der Themenhierarchie (Aufrufer dürfen sie verändern)."""
+        with self._lock:
+            self._aktualisieren()
+            return copy.deepcopy(self._themen)
+
+    def get_prompt_text(self) -> str:
+        """Liefert die Themenhierarchie als Text für Kategorisierungs-Prompts."""
+        with self._lock:
+            self._aktualisieren()
+            return self._prompt_text
+
+    def update(self, themen_dict: Dict[str, Dict[str, Dict[str, str]]]) -> None:
+        """
+        Schreibt die Themenhierarchie in die Datei und übernimmt sie in den Cache.
+
+        Args:
+            themen_dict: Neue Themenhierarchie
+        """
+        text = render_themenhierarchie(themen_dict)
+        with self._lock:
+            tmp_path = f"{self.dateipfad}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp_path, self.dateipfad)
+            # Geparst wie beim Lesen, damit Cache und Datei übereinstimmen
+            self._themen = parse_themenhierarchie(text)
+            self._prompt_text = text
+            self._signatur = self._datei_signatur()
+            self.stats["writes"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Liefert Zähler und die Anzahl Themen im Cache."""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["themen"] = len(self._themen)
+        return stats
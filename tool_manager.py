@@ -4,6 +4,7 @@ import logging
 import openai
 import re
 from extract import extract_enhanced_date_params
+from decision_cache import decision_cache
 
 
 def load_tool_descriptions():
@@ -101,6 +102,23 @@ def select_tool(user_message):
         }
 
 def select_optimal_tool_with_reasoning(user_message, tools, tool_config):
+    """
+    Wählt das optimale Tool anhand des semantischen Verständnisses der Anfrage.
+    Wiederholte Anfragen werden aus dem Entscheidungs-Cache beantwortet.
+    """
+    cached = decision_cache.get(user_message)
+    if cached:
+        debug_print("Tool-Auswahl", f"Entscheidung aus Cache: {cached['tool']}")
+        return cached["tool"], f"Aus Entscheidungs-Cache: {cached['reasoning']}"
+    
+    tool_name, reasoning = _select_optimal_tool_uncached(user_message, tools, tool_config)
+    
+    # Rückfragen und Fallbacks sind keine verlässlichen Entscheidungen
+    if tool_name != "human_in_loop_clarification" and not reasoning.startswith("Fallback"):
+        decision_cache.put(user_message, tool_name, reasoning)
+    return tool_name, reasoning
+
+def _select_optimal_tool_uncached(user_message, tools, tool_config):
     """
     Wählt das optimale Tool anhand des semantischen Verständnisses der Anfrage.
     Nutzt entweder die LLM-basierte Methode oder Pattern-Matching je nach Konfiguration.
@@ -0,0 +1,126 @@
+"""
+Wissensbasis-Antwort-Cache für XORA Chatbot.
+Speichert Antworten auf Wissensbasis-Fragen, geschlüsselt nach normalisierter
+Frage und Version (GCS-Generation bzw. Inhalts-Hash) der wissensbasis.json.
+Ändert sich die Wissensbasis, passen alte Einträge nicht mehr zum Schlüssel.
+
+Versionen werden in der Reihenfolge geordnet, in der der Cache sie zuerst
+sieht (Inhalts-Hashes haben keine eigene Ordnung). Speichern verdrängt nur
+Einträge älterer Versionen; eine langsame Anfrage, die noch gegen die alte
+Version beantwortet wurde, löscht also nicht die Antworten der neuen.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+from decision_cache import normalize_message
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG,
+                   format='%(asctime)s %(levelname)s:%(name)s:%(message)s',
+                   datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+# Anzahl Versionen, deren Reihenfolge gemerkt wird
+MAX_TRACKED_VERSIONS = 32
+
+
+class WissensbasisAnswerCache:
+    """LRU-Cache für Wissensbasis-Antworten, gebunden an die Version der Wissensbasis."""
+
+    def __init__(self, max_entries: int = 200):
+        """
+        Initialisiert den WissensbasisAnswerCache.
+
+        Args:
+            max_entries: Maximale Anzahl gespeicherter Antworten
+        """
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        # Version -> laufende Nummer der ersten Sichtung (höher = neuer)
+        self._versions = OrderedDict()
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0, "stale_evictions": 0}
+
+    @staticmethod
+    def _key(question: str, version: Any) -> tuple:
+        # Datumsangaben bleiben erhalten, sie können inhaltlich relevant sein
+        return (str(version), normalize_message(question, replace_dates=False))
+
+    def _version_rank(self, version: str) -> int:
+        """Rang einer Version; neue Versionen gelten als die neuesten (Aufruf unter _lock)."""
+        if version not in self._versions:
+            self._sequence += 1
+            self._versions[version] = self._sequence
+            while len(self._versions) > MAX_TRACKED_VERSIONS:
+                self._versions.popitem(last=False)
+        return self._versions[version]
+
+    def get(self, question: str, version: Any) -> Optional[str]:
+        """
+        Liefert eine gespeicherte Antwort.
+
+        Args:
+            question: Die Frage des Benutzers
+            version: Aktuelle Version der Wissensbasis (None deaktiviert den Cache)
+
+        Returns:
+            Die gespeicherte Antwort oder None
+        """
+        if version is None:
+            return None
+        key = self._key(question, version)
+        with self._lock:
+            self._version_rank(key[0])
+            answer = self._entries.get(key)
+            if answer is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return answer
+
+    def put(self, question: str, version: Any, answer: str) -> None:
+        """
+        Speichert eine Antwort zur aktuellen Version der Wissensbasis.
+
+        Args:
+            question: Die Frage des Benutzers
+            version: Version der Wissensbasis, gegen die beantwortet wurde
+            answer: Die generierte Antwort
+        """
+        if version is None or not answer:
+            return
+        key = self._key(question, version)
+        with self._lock:
+            # Nur Einträge älterer Versionen sind nicht mehr erreichbar; neuere bleiben erhalten
+            rang = self._version_rank(key[0])
+            stale = [k for k in self._entries if self._versions.get(k[0], 0) < rang]
+            for k in stale:
+                del self._entries[k]
+            self.stats["stale_evictions"] += len(stale)
+            self._entries[key] = answer
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self) -> None:
+        """Verwirft alle Antworten (z.B. nach einer Admin-Änderung)."""
+        with self._lock:
+            self._entries.clear()
+            self.stats["invalidations"] += 1
+        logger.info("Wissensbasis-Antwort-Cache invalidiert")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Liefert Trefferstatistik und Größe des Caches."""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+        total = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / total, 3) if total else 0.0
+        return stats
+
+
+wissensbasis_answer_cache = WissensbasisAnswerCache()
@@ -0,0 +1,510 @@
+"""
+Wissensbasis Store für XORA Chatbot.
+Speichert die Wissensbasis aufgeteilt in ein Objekt pro Thema (Shard) und ein
+kleines Manifest mit Hash und Generation je Shard. Leser laden nur Shards, deren
+Hash sich geändert hat; Schreiber laden nur geänderte Shards hoch und machen die
+Änderung über einen bedingten Schreibvorgang auf das Manifest sichtbar.
+
+Nicht mehr referenzierte Shards werden nicht sofort gelöscht: das Manifest führt
+sie mit Zeitpunkt unter "retired", gelöscht wird erst nach einer Karenzzeit, damit
+Leser mit dem vorherigen Manifest ihre Shards noch finden. Im selben Durchgang
+werden verwaiste Shards (z.B. von Schreibern, die den Manifest-Konflikt verloren
+haben) entfernt, sobald sie älter als die Karenzzeit sind.
+
+Objekte werden gzip-komprimiert gespeichert (in GCS mit Content-Encoding gzip)
+und in einen lokalen Spiegel auf der Platte geschrieben. Nach einem Neustart wird
+zunächst aus dem Spiegel geladen und im Hintergrund gegen den Bucket revalidiert.
+
+Backends:
+    GCSBackend   - Google Cloud Storage (Produktion)
+    LocalBackend - Verzeichnis im lokalen Dateisystem (Entwicklung/Tests)
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Any, Optional, Tuple, List
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG,
+                   format='%(asctime)s %(levelname)s:%(name)s:%(message)s',
+                   datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+GZIP_MAGIC = b'\x1f\x8b'
+# Wie lange nicht mehr referenzierte Shards liegen bleiben (Sekunden)
+SHARD_GRACE_SECONDS = float(os.getenv('WISSENSBASIS_SHARD_GRACE_SECONDS', '900'))
+
+
+class WissensbasisKonflikt(Exception):
+    """Die Wissensbasis wurde seit dem Lesen von einem anderen Prozess geändert."""
+
+
+###########################################
+# Storage-Backends
+###########################################
+class GCSBackend:
+    """Objektzugriff auf einen GCS-Bucket mit Generation-Preconditions."""
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def read(self, name: str) -> Tuple[Optional[bytes], int]:
+        """Liest ein Objekt. Liefert (None, 0), wenn es nicht existiert."""
+        blob = self.bucket.get_blob(name)
+        if blob is None:
+            return None, 0
+        # Komprimierte Bytes übertragen, entpackt wird im Store
+        data = blob.download_as_bytes(if_generation_match=blob.generation, raw_download=True)
+        return data, blob.generation
+
+    def write(self, name: str, data: bytes, if_generation_match: Optional[int] = None,
+              content_type: str = 'application/json', content_encoding: Optional[str] = None) -> int:
+        """Schreibt ein Objekt, optional nur bei passender Generation (0 = darf nicht existieren)."""
+        from google.api_core.exceptions import PreconditionFailed
+        blob = self.bucket.blob(name)
+        # Transcoding-Metadaten: andere Clients erhalten das Objekt weiterhin entpackt
+        blob.content_encoding = content_encoding
+        try:
+            blob.upload_from_string(data, content_type=content_type, if_generation_match=if_generation_match)
+        except PreconditionFailed:
+            raise WissensbasisKonflikt(f"{name}: Generation {if_generation_match} ist veraltet")
+        return blob.generation
+
+    def list(self, prefix: str) -> List[Tuple[str, int, float]]:
+        """Listet Objekte unter prefix als (Name, Generation, Änderungszeit in Sekunden)."""
+        return [(blob.name, blob.generation, blob.updated.timestamp() if blob.updated else 0.0)
+                for blob in self.bucket.list_blobs(prefix=prefix)]
+
+    def delete(self, name: str, if_generation_match: Optional[int] = None) -> None:
+        """Löscht ein Objekt, optional nur, wenn es seit dem Listen nicht neu geschrieben wurde."""
+        from google.api_core.exceptions import NotFound, PreconditionFailed
+        try:
+            self.bucket.blob(name).delete(if_generation_match=if_generation_match)
+        except NotFound:
+            pass
+        except PreconditionFailed:
+            raise WissensbasisKonflikt(f"{name}: Generation {if_generation_match} ist veraltet")
+
+
+class LocalBackend:
+    """
+    Lokaler Ersatz für GCS: Objekte sind Dateien unterhalb von root_dir,
+    die Generation ist der Änderungszeitstempel in Nanosekunden.
+    """
+
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+        self._lock = threading.Lock()
+        os.makedirs(root_dir, exist_ok=True)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root_dir, *name.split('/'))
+
+    def _generation(self, path: str) -> int:
+        return os.stat(path).st_mtime_ns if os.path.exists(path) else 0
+
+    def read(self, name: str) -> Tuple[Optional[bytes], int]:
+        path = self._path(name)
+        with self._lock:
+            if not os.path.exists(path):
+                return None, 0
+            with open(path, 'rb') as f:
+                return f.read(), self._generation(path)
+
+    def write(self, name: str, data: bytes, if_generation_match: Optional[int] = None,
+              content_type: str = 'application/json', content_encoding: Optional[str] = None) -> int:
+        path = self._path(name)
+        with self._lock:
+            if if_generation_match is not None and self._generation(path) != if_generation_match:
+                raise WissensbasisKonflikt(f"{name}: Generation {if_generation_match} ist veraltet")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            # Generation muss sich auch bei schnellen Folgeschreibvorgängen ändern
+            generation = self._generation(path)
+            if generation == if_generation_match:
+                os.utime(path, ns=(generation + 1, generation + 1))
+                generation += 1
+            return generation
+
+    def list(self, prefix: str) -> List[Tuple[str, int, float]]:
+        objekte = []
+        base = self._path(prefix)
+        with self._lock:
+            for verzeichnis, _, dateien in os.walk(base):
+                for dateiname in dateien:
+                    if dateiname.endswith('.tmp'):
+                        continue
+                    path = os.path.join(verzeichnis, dateiname)
+                    name = os.path.relpath(path, self.root_dir).replace(os.sep, '/')
+                    generation = self._generation(path)
+                    objekte.append((name, generation, generation / 1e9))
+        return objekte
+
+    def delete(self, name: str, if_generation_match: Optional[int] = None) -> None:
+        path = self._path(name)
+        with self._lock:
+            if not os.path.exists(path):
+                return
+            if if_generation_match is not None and self._generation(path) != if_generation_match:
+                raise WissensbasisKonflikt(f"{name}: Generation {if_generation_match} ist veraltet")
+            os.remove(path)
+
+
+###########################################
+# Geshardeter Store
+###########################################
+def _serialize(data: Any) -> bytes:
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _compress(data: bytes) -> bytes:
+    return gzip.compress(data, compresslevel=6)
+
+
+def _decompress(data: bytes) -> bytes:
+    # Objekte aus der Zeit vor der Komprimierung sind unkomprimiert
+    return gzip.decompress(data) if data[:2] == GZIP_MAGIC else data
+
+
+class LocalMirror:
+    """
+    Spiegel der Wissensbasis auf der lokalen Platte: Shards nach Inhalts-Hash
+    und das zuletzt gesehene Manifest. Übersteht Neustarts des Workers.
+    """
+
+    def __init__(self, mirror_dir: str):
+        self.mirror_dir = mirror_dir
+        os.makedirs(os.path.join(mirror_dir, 'shards'), exist_ok=True)
+
+    def _write_atomic(self, path: str, data: bytes) -> None:
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def read_shard(self, content_hash: str) -> Optional[bytes]:
+        path = os.path.join(self.mirror_dir, 'shards', f"{content_hash}.json.gz")
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            data = _decompress(f.read())
+        # Beschädigte Dateien werden ignoriert und neu geladen
+        return data if _hash(data) == content_hash else None
+
+    def write_shard(self, content_hash: str, data: bytes) -> None:
+        self._write_atomic(os.path.join(self.mirror_dir, 'shards', f"{content_hash}.json.gz"), _compress(data))
+
+    def read_manifest(self) -> Tuple[Optional[Dict[str, Any]], int]:
+        path = os.path.join(self.mirror_dir, 'manifest.json')
+        if not os.path.exists(path):
+            return None, 0
+        with open(path, 'r', encoding='utf-8') as f:
+            eintrag = json.load(f)
+        return eintrag["manifest"], eintrag["generation"]
+
+    def write_manifest(self, manifest: Dict[str, Any], generation: int) -> None:
+        self._write_atomic(os.path.join(self.mirror_dir, 'manifest.json'),
+                           _serialize({"generation": generation, "manifest": manifest}))
+
+    def prune(self, aktuelle_hashes) -> None:
+        """Entfernt gespiegelte Shards, die nicht mehr referenziert werden."""
+        shard_dir = os.path.join(self.mirror_dir, 'shards')
+        for dateiname in os.listdir(shard_dir):
+            if dateiname.endswith('.json.gz') and dateiname[:-len('.json.gz')] not in aktuelle_hashes:
+                try:
+                    os.remove(os.path.join(shard_dir, dateiname))
+                except OSError:
+                    pass
+
+
+class ShardedWissensbasisStore:
+    """Wissensbasis als Manifest plus ein Objekt pro Thema."""
+
+    def __init__(self, backend, prefix: str = 'wissensbasis', legacy_name: Optional[str] = 'wissensbasis.json',
+                 mirror_dir: Optional[str] = None, grace_seconds: float = SHARD_GRACE_SECONDS):
+        """
+        Initialisiert den Store.
+
+        Args:
+            backend: GCSBackend oder LocalBackend
+            prefix: Präfix für Manifest und Shard-Objekte
+            legacy_name: Name der bisherigen Einzeldatei für die einmalige Migration
+            mirror_dir: Optionales Verzeichnis für den lokalen Spiegel
+            grace_seconds: Karenzzeit, bevor nicht referenzierte Shards gelöscht werden
+        """
+        self.backend = backend
+        self.grace_seconds = grace_seconds
+        self.mirror = LocalMirror(mirror_dir) if mirror_dir else None
+        # True, sobald einmal gegen das Backend geladen wurde
+        self._validated = False
+        self._revalidating = False
+        self.prefix = prefix
+        self.legacy_name = legacy_name
+        self.manifest_name = f"{prefix}/manifest.json"
+        self._lock = threading.Lock()
+        # Shard-Cache: Hash -> deserialisierter Inhalt
+        self._shards: Dict[str, Dict[str, Any]] = {}
+        # Zuletzt gelesene Manifeste nach Generation (für Diffs beim Schreiben)
+        self._manifests: Dict[int, Dict[str, Any]] = {}
+        self.stats = {"shard_downloads": 0, "shard_cache_hits": 0, "shard_uploads": 0, "shards_unchanged": 0,
+                      "mirror_hits": 0, "bytes_downloaded": 0, "bytes_uploaded": 0, "shards_deleted": 0,
+                      "orphans_deleted": 0}
+
+    def _shard_name(self, thema: str, content_hash: str) -> str:
+        # Inhaltsadressiert: ein Shard-Objekt wird nie überschrieben
+        thema_id = hashlib.sha1(thema.encode('utf-8')).hexdigest()[:12]
+        return f"{self.prefix}/shards/{thema_id}-{content_hash[:16]}.json"
+
+    def _read_manifest(self) -> Tuple[Optional[Dict[str, Any]], int]:
+        data, generation = self.backend.read(self.manifest_name)
+        if data is None:
+            return None, 0
+        self.stats["bytes_downloaded"] += len(data)
+        manifest = json.loads(_decompress(data).decode('utf-8'))
+        with self._lock:
+            self._manifests = {generation: manifest}
+        return manifest, generation
+
+    def _load_shard(self, info: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            cached = self._shards.get(info["hash"])
+        if cached is not None:
+            self.stats["shard_cache_hits"] += 1
+            return cached
+        data = self.mirror.read_shard(info["hash"]) if self.mirror else None
+        if data is not None:
+            self.stats["mirror_hits"] += 1
+        else:
+            raw, _ = self.backend.read(info["object"])
+            if raw is None:
+                raise WissensbasisKonflikt(f"Shard {info['object']} fehlt")
+            self.stats["bytes_downloaded"] += len(raw)
+            data = _decompress(raw)
+            if _hash(data) != info["hash"]:
+                raise WissensbasisKonflikt(f"Shard {info['object']} passt nicht zum Manifest")
+            self.stats["shard_downloads"] += 1
+            if self.mirror:
+                self.mirror.write_shard(info["hash"], data)
+        shard = json.loads(data.decode('utf-8'))
+        with self._lock:
+            self._shards[info["hash"]] = shard
+        return shard
+
+    @staticmethod
+    def version_of(manifest: Optional[Dict[str, Any]]) -> str:
+        """Inhaltsversion aus den Shard-Hashes (unabhängig von Generationen)."""
+        if not manifest:
+            return _hash(b'{}')[:16]
+        combined = "|".join(f"{t}:{manifest['shards'][t]['hash']}" for t in manifest["order"])
+        return _hash(combined.encode('utf-8'))[:16]
+
+    def load(self, allow_stale: bool = False) -> Tuple[Dict[str, Any], int, str]:
+        """
+        Lädt die Wissensbasis; nur Shards mit geändertem Hash werden übertragen.
+
+        Args:
+            allow_stale: Vor der ersten Validierung (Kaltstart) aus dem lokalen Spiegel
+                         laden und im Hintergrund gegen das Backend revalidieren
+
+        Returns:
+            (wissensbasis, Manifest-Generation, Inhaltsversion)
+        """
+        if allow_stale and not self._validated and self.mirror:
+            manifest, generation = self.mirror.read_manifest()
+            if manifest is not None:
+                try:
+                    wissensbasis = self._assemble(manifest)
+                    self.start_revalidation()
+                    logger.info("Wissensbasis aus lokalem Spiegel geladen, Revalidierung läuft")
+                    return wissensbasis, generation, self.version_of(manifest)
+                except Exception as e:
+                    logger.warning(f"Lokaler Spiegel unbrauchbar, lade aus dem Backend: {e}")
+
+        manifest, generation = self._read_manifest()
+        if manifest is None:
+            if self.migrate_from_legacy():
+                manifest, generation = self._read_manifest()
+            else:
+                self._validated = True
+                return {}, 0, self.version_of(None)
+
+        wissensbasis = self._assemble(manifest)
+        self._validated = True
+        if self.mirror:
+            self.mirror.write_manifest(manifest, generation)
+        return wissensbasis, generation, self.version_of(manifest)
+
+    def start_revalidation(self) -> None:
+        """Startet einmalig einen Hintergrund-Thread, der gegen das Backend lädt."""
+        with self._lock:
+            if self._revalidating or self._validated:
+                return
+            self._revalidating = True
+
+        def revalidate():
+            try:
+                self.load()
+                logger.info("Wissensbasis im Hintergrund revalidiert")
+            except Exception as e:
+                logger.warning(f"Revalidierung der Wissensbasis fehlgeschlagen: {e}")
+            finally:
+                self._revalidating = False
+
+        threading.Thread(target=revalidate, name="wissensbasis-revalidate", daemon=True).start()
+
+    def _assemble(self, manifest: Dict[str, Any]) -> Dict[str, Any]:
+        """Setzt die Wissensbasis aus den Shards eines Manifests zusammen."""
+        wissensbasis = {}
+        for thema in manifest["order"]:
+            shard = self._load_shard(manifest["shards"][thema])
+            # Kopie, damit Änderungen der Aufrufer den Shard-Cache nicht verfälschen
+            wissensbasis[thema] = json.loads(json.dumps(shard["unterthemen"]))
+
+        with self._lock:
+            # Nicht mehr referenzierte Shards aus dem Cache entfernen
+            aktuelle_hashes = {info["hash"] for info in manifest["shards"].values()}
+            self._shards = {h: s for h, s in self._shards.items() if h in aktuelle_hashes}
+        if self.mirror:
+            self.mirror.prune(aktuelle_hashes)
+        return wissensbasis
+
+    def save(self, wissensbasis: Dict[str, Any], if_generation_match: Optional[int] = None) -> Tuple[int, str]:
+        """
+        Speichert die Wissensbasis. Nur geänderte Themen werden als neue Shards
+        hochgeladen; das Manifest wird bedingt auf die gelesene Generation geschrieben.
+        Ersetzte Shards kommen unter "retired" und werden erst nach der Karenzzeit gelöscht.
+
+        Args:
+            wissensbasis: Vollständige Wissensbasis
+            if_generation_match: Manifest-Generation, auf der die Änderung basiert
+
+        Returns:
+            (neue Manifest-Generation, neue Inhaltsversion)
+        """
+        with self._lock:
+            if if_generation_match is None:
+                # Unbedingtes Schreiben: Diff gegen das zuletzt bekannte Manifest
+                alt = next(iter(self._manifests.values()), None)
+            else:
+                alt = self._manifests.get(if_generation_match)
+        if alt is None and if_generation_match:
+            alt, aktuelle_generation = self._read_manifest()
+            if aktuelle_generation != if_generation_match:
+                raise WissensbasisKonflikt(f"Manifest-Generation {if_generation_match} ist veraltet")
+        alte_shards = (alt or {}).get("shards", {})
+
+        neue_shards = {}
+        hochgeladen = []
+        for thema, unterthemen in wissensbasis.items():
+            data = _serialize({"thema": thema, "unterthemen": unterthemen})
+            content_hash = _hash(data)
+            vorher = alte_shards.get(thema)
+            if vorher and vorher["hash"] == content_hash:
+                neue_shards[thema] = vorher
+                self.stats["shards_unchanged"] += 1
+                continue
+            name = self._shard_name(thema, content_hash)
+            payload = _compress(data)
+            shard_generation = self.backend.write(name, payload, content_encoding='gzip')
+            hochgeladen.append(name)
+            self.stats["shard_uploads"] += 1
+            self.stats["bytes_uploaded"] += len(payload)
+            if self.mirror:
+                self.mirror.write_shard(content_hash, data)
+            neue_shards[thema] = {"object": name, "hash": content_hash, "generation": shard_generation}
+            with self._lock:
+                self._shards[content_hash] = {"thema": thema, "unterthemen": json.loads(data.decode('utf-8'))["unterthemen"]}
+
+        # Nicht mehr referenzierte Shards erst nach der Karenzzeit löschen: Leser mit dem
+        # vorherigen Manifest laden sie eventuell gerade noch
+        jetzt = time.time()
+        referenziert = {info["object"] for info in neue_shards.values()}
+        retired, abgelaufen = {}, set()
+        for name, seit in (alt or {}).get("retired", {}).items():
+            if name in referenziert:
+                continue
+            if jetzt - seit < self.grace_seconds:
+                retired[name] = seit
+            else:
+                abgelaufen.add(name)
+        for info in alte_shards.values():
+            if info["object"] not in referenziert:
+                retired.setdefault(info["object"], jetzt)
+
+        manifest = {"version": MANIFEST_VERSION, "order": list(wissensbasis.keys()), "shards": neue_shards,
+                    "retired": retired}
+        # Bei einem Konflikt bleiben die neuen Shards liegen: gleiche Inhalte ergeben
+        # gleiche Objektnamen und können vom konkurrierenden Manifest referenziert sein.
+        # Andernfalls räumt sie ein späterer Durchgang als verwaiste Shards ab.
+        generation = self.backend.write(self.manifest_name, _compress(_serialize(manifest)),
+                                        if_generation_match=if_generation_match, content_encoding='gzip')
+        with self._lock:
+            self._manifests = {generation: manifest}
+        if self.mirror:
+            self.mirror.write_manifest(manifest, generation)
+
+        self._sweep(referenziert | set(retired), abgelaufen, jetzt)
+        logger.info(f"Wissensbasis gespeichert: {len(hochgeladen)} von {len(neue_shards)} Shards hochgeladen")
+        return generation, self.version_of(manifest)
+
+    def _sweep(self, behalten, abgelaufen, jetzt: float) -> None:
+        """
+        Löscht Shards, die weder referenziert noch in der Karenzzeit sind: abgelaufene
+        "retired"-Einträge und verwaiste Uploads, die älter als die Karenzzeit sind.
+
+        Args:
+            behalten: Objektnamen aus "shards" und "retired" des neuen Manifests
+            abgelaufen: "retired"-Einträge des alten Manifests, deren Karenzzeit vorbei ist
+            jetzt: Zeitpunkt des Speicherns
+        """
+        try:
+            objekte = self.backend.list(f"{self.prefix}/shards/")
+        except Exception as e:
+            logger.warning(f"Shards konnten nicht gelistet werden: {e}")
+            return
+        for name, generation, geaendert in objekte:
+            if name in behalten or jetzt - geaendert < self.grace_seconds:
+                continue
+            try:
+                # Nur löschen, wenn niemand den Shard seit dem Listen neu hochgeladen hat
+                self.backend.delete(name, if_generation_match=generation)
+            except Exception as e:
+                logger.warning(f"Shard {name} konnte nicht gelöscht werden: {e}")
+                continue
+            self.stats["shards_deleted"] += 1
+            if name not in abgelaufen:
+                self.stats["orphans_deleted"] += 1
+
+    def migrate_from_legacy(self) -> bool:
+        """
+        Einmalige Migration der bisherigen Einzeldatei in Manifest + Shards.
+        Läuft mehrfach parallel ohne Schaden: das Manifest darf nur angelegt werden,
+        wenn es noch nicht existiert.
+
+        Returns:
+            True, wenn danach ein Manifest existiert
+        """
+        if not self.legacy_name:
+            return False
+        data, _ = self.backend.read(self.legacy_name)
+        if data is None:
+            return False
+        wissensbasis = json.loads(_decompress(data).decode('utf-8'))
+        logger.info(f"Migriere {self.legacy_name} in {len(wissensbasis)} Shards")
+        try:
+            self.save(wissensbasis, if_generation_match=0)
+        except WissensbasisKonflikt:
+            logger.info("Migration bereits durch einen anderen Prozess erfolgt")
+        return True